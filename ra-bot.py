@@ -21,12 +21,16 @@ IP/ISP multi-fallback (curl/wget/uclient-fetch/urllib). Memory dari `free` (MB).
 
 
 import os, re, shlex, subprocess, glob, sqlite3, time, math, urllib.request, urllib.parse
-import sys, asyncio, tempfile, json, stat, contextlib
+import sys, asyncio, tempfile, json, ipaddress, stat, contextlib, csv, io, zipfile, signal, uuid, codecs, itertools, contextvars, threading, select, socket, struct, fnmatch, difflib, array, random
 from datetime import datetime, timezone, timedelta, time as dtime
 from typing import Any, Dict, List, Optional, Tuple
-from collections import defaultdict
+from collections import defaultdict, deque
 from pathlib import Path
 import shutil, errno  # — PATCH: untuk copy fallback EXDEV
+try:
+    import resource
+except ImportError:      # build python minimal tanpa modul resource
+    resource = None
 from dataclasses import dataclass, field
 
 
@@ -326,47 +330,333 @@ BOT_UPDATE_URL = os.getenv(
 
 # ------------------ UTIL CMD ---------------------
 
-def run_cmd(cmd: str, timeout: Optional[int] = None) -> str:
+# ---- Execution classes ----
+# interactive: perintah pendek dari menu; background: kerja rutin; heavy: speedtest/opkg upgrade/tar.
+# Limit memori/CPU via cgroup v2 bila tersedia, fallback ke rlimit + nice.
+EXEC_CGROUP_ROOT = os.getenv("RANET_EXEC_CGROUP_ROOT", "/sys/fs/cgroup/ranet")
+EXEC_HEAVY_GRACE = 60  # detik setelah job heavy selesai, alert CPU ditahan
+
+@dataclass(frozen=True)
+class ExecClass:
+    name: str
+    nice: int
+    ionice: Optional[Tuple[int, int]]   # (class, level) untuk util ionice; None = tidak diubah
+    mem_mb: int                         # 0 = tanpa batas
+    cpu_pct: int                        # persen satu core (cgroup cpu.max); 0 = tanpa batas
+    concurrency: int
+    timeout: int
+
+EXEC_CLASSES: Dict[str, ExecClass] = {
+    "interactive": ExecClass("interactive", 0, None, 0, 0, 8, CMD_TIMEOUT),
+    "background": ExecClass("background", 10, (2, 7), int(os.getenv("RANET_EXEC_BG_MEM_MB", "128")),
+                            int(os.getenv("RANET_EXEC_BG_CPU_PCT", "80")), 2, 300),
+    "heavy": ExecClass("heavy", 19, (3, 0), int(os.getenv("RANET_EXEC_HEAVY_MEM_MB", "192")),
+                       int(os.getenv("RANET_EXEC_HEAVY_CPU_PCT", "60")), 1, 900),
+}
+# satu limiter per kelas untuk jalur sync (run_cmd, thread executor) maupun async (run_streaming)
+_EXEC_SEMS: Dict[str, threading.BoundedSemaphore] = {k: threading.BoundedSemaphore(c.concurrency) for k, c in EXEC_CLASSES.items()}
+_EXEC_LOCK = threading.Lock()
+EXEC_SLOT_POLL = 0.1
+_EXEC_CGROUPS: Dict[str, Optional[str]] = {}
+EXEC_ACTIVE: Dict[str, int] = defaultdict(int)
+EXEC_LAST_END: Dict[str, float] = defaultdict(float)
+
+def exec_class(name: Optional[str]) -> ExecClass:
+    return EXEC_CLASSES.get(name or "interactive", EXEC_CLASSES["interactive"])
+
+def _exec_cgroup(ec: ExecClass) -> Optional[str]:
+    """Siapkan cgroup v2 untuk kelas (sekali); None bila tidak tersedia/tidak perlu."""
+    if ec.name in _EXEC_CGROUPS: return _EXEC_CGROUPS[ec.name]
+    path = None
+    if (ec.mem_mb or ec.cpu_pct) and os.path.exists("/sys/fs/cgroup/cgroup.controllers"):
+        try:
+            parent = os.path.dirname(EXEC_CGROUP_ROOT)
+            os.makedirs(EXEC_CGROUP_ROOT, exist_ok=True)
+            for base in (parent, EXEC_CGROUP_ROOT):
+                with contextlib.suppress(OSError), open(os.path.join(base, "cgroup.subtree_control"), "w") as fh:
+                    fh.write("+cpu +memory")
+            path = os.path.join(EXEC_CGROUP_ROOT, ec.name)
+            os.makedirs(path, exist_ok=True)
+            if ec.mem_mb:
+                with open(os.path.join(path, "memory.max"), "w") as fh: fh.write(str(ec.mem_mb * 1024 * 1024))
+            if ec.cpu_pct:
+                with open(os.path.join(path, "cpu.max"), "w") as fh: fh.write(f"{ec.cpu_pct * 1000} 100000")
+        except OSError:
+            path = None
+    _EXEC_CGROUPS[ec.name] = path
+    return path
+
+def exec_argv(argv: List[str], cls: Optional[str] = None) -> List[str]:
+    """Bungkus argv dengan nice/ionice kelas; tanpa preexec_fn supaya spawn tetap jalur cepat (vfork)."""
+    ec = exec_class(cls)
+    argv = list(argv)
+    if ec.ionice and which("ionice"):
+        prio = ["-n", str(ec.ionice[1])] if ec.ionice[0] != 3 else []  # kelas idle tidak punya level
+        argv = ["ionice", "-c", str(ec.ionice[0])] + prio + argv
+    if ec.nice and which("nice"):
+        argv = ["nice", "-n", str(ec.nice)] + argv
+    return argv
+
+def _exec_rlimits(ec: ExecClass) -> List[Tuple[int, Tuple[int, int]]]:
+    if resource is None: return []
+    limits = [(resource.RLIMIT_CPU, (ec.timeout, ec.timeout + 5))]
+    if ec.mem_mb:
+        # RLIMIT_AS menghitung memori virtual (stack thread dll), jadi diberi kelonggaran 4x
+        lim = ec.mem_mb * 4 * 1024 * 1024
+        limits.append((resource.RLIMIT_AS, (lim, lim)))
+    return limits
+
+_EXEC_RLIMITS: Dict[str, List[Tuple[int, Tuple[int, int]]]] = {k: _exec_rlimits(c) for k, c in EXEC_CLASSES.items()}
+
+def exec_attach(pid: int, cls: Optional[str] = None):
+    """Dari parent setelah spawn: masukkan pid ke cgroup kelas, atau pasang rlimit (prlimit) bila cgroup tidak ada.
+    Tidak ada kode Python di child antara fork dan exec (proses ini multi-thread)."""
+    ec = exec_class(cls)
+    if ec.name == "interactive": return
+    cg = _exec_cgroup(ec)
+    if cg:
+        try:
+            fd = os.open(os.path.join(cg, "cgroup.procs"), os.O_WRONLY)
+            try:
+                os.write(fd, str(pid).encode())
+                return
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+    for res_id, lim in _EXEC_RLIMITS[ec.name]:
+        with contextlib.suppress(OSError, ValueError): resource.prlimit(pid, res_id, lim)
+
+def _exec_enter(ec: ExecClass):
+    with _EXEC_LOCK: EXEC_ACTIVE[ec.name] += 1
+
+def _exec_leave(ec: ExecClass):
+    with _EXEC_LOCK:
+        EXEC_ACTIVE[ec.name] -= 1
+        EXEC_LAST_END[ec.name] = time.time()
+    _EXEC_SEMS[ec.name].release()
 
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+@contextlib.contextmanager
+def exec_slot(cls: Optional[str] = None):
+    ec = exec_class(cls)
+    # di thread event loop tidak boleh menunggu: slot mungkin dipegang job async yang butuh loop ini untuk selesai
+    if not _EXEC_SEMS[ec.name].acquire(blocking=not _in_event_loop()):
+        raise RuntimeError(f"slot {ec.name} penuh ({ec.concurrency} berjalan), coba lagi nanti")
+    _exec_enter(ec)
+    try:
+        yield ec
+    finally:
+        _exec_leave(ec)
+
+@contextlib.asynccontextmanager
+async def exec_slot_async(cls: Optional[str] = None):
+    ec = exec_class(cls)
+    # semaphore thread yang sama dengan exec_slot; polling non-blocking supaya batal (/jobs) tidak membocorkan slot
+    while not _EXEC_SEMS[ec.name].acquire(blocking=False):
+        await asyncio.sleep(EXEC_SLOT_POLL)
+    _exec_enter(ec)
+    try:
+        yield ec
+    finally:
+        _exec_leave(ec)
+
+def exec_heavy_recent() -> bool:
+    return EXEC_ACTIVE["heavy"] > 0 or time.time() - EXEC_LAST_END["heavy"] < EXEC_HEAVY_GRACE
+
+def call_in_class(cls: str, fn, *args):
+    """Jalankan fn (kerja Python, mis. tarfile) di thread executor dengan nice kelas; nice thread dikembalikan setelahnya."""
+    ec = exec_class(cls)
+    with exec_slot(cls):
+        tid = threading.get_native_id()
+        try:
+            before = os.getpriority(os.PRIO_PROCESS, tid)
+            os.setpriority(os.PRIO_PROCESS, tid, max(before, ec.nice))
+        except OSError:
+            before = None
+        try:
+            return fn(*args)
+        finally:
+            if before is not None:
+                with contextlib.suppress(OSError): os.setpriority(os.PRIO_PROCESS, tid, before)
+
+# ---- Bounded output ----
+# Output perintah disimpan di memori hanya sampai RUN_MEM_CAP; sisanya di-spill ke file tmpfs.
+RUN_MEM_CAP = int(os.getenv("RANET_RUN_MEM_CAP", str(256 * 1024)))   # byte
+RUN_TAIL_BYTES = 16 * 1024
+RUN_SPILL_DIR = os.getenv("RANET_RUN_SPILL_DIR", "/tmp")
+
+class CmdOutput:
+    """Hasil perintah dengan memori terbatas: head + tail di RAM, output penuh di file spill bila besar."""
+
+    def __init__(self, cmd: str):
+        self.cmd = cmd
+        self.returncode: Optional[int] = None
+        self.timed_out = False
+        self.error: Optional[str] = None
+        self.size = 0
+        self.spill_path: Optional[str] = None
+        self._mem = bytearray()
+        self._tail = bytearray()
+        self._spill = None
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+    def __del__(self): self.close()
+
+    @property
+    def spilled(self) -> bool:
+        return self.spill_path is not None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.timed_out and self.returncode == 0
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._spill is None and len(self._mem) + len(chunk) <= RUN_MEM_CAP:
+            self._mem.extend(chunk); return
+        if self._spill is None:
+            fd, self.spill_path = tempfile.mkstemp(prefix="ranet-out-", suffix=".txt", dir=RUN_SPILL_DIR)
+            self._spill = os.fdopen(fd, "wb")
+            self._spill.write(self._mem)
+            self._tail = bytearray(self._mem[-RUN_TAIL_BYTES:])
+            del self._mem[RUN_TAIL_BYTES:]  # cukup simpan head kecil di RAM
+        self._spill.write(chunk)
+        self._tail.extend(chunk)
+        if len(self._tail) > RUN_TAIL_BYTES:
+            del self._tail[:len(self._tail) - RUN_TAIL_BYTES]
+
+    def finish(self):
+        if self._spill is not None:
+            self._spill.close(); self._spill = None
+
+    def close(self):
+        self.finish()
+        if self.spill_path:
+            with contextlib.suppress(OSError): os.remove(self.spill_path)
+            self.spill_path = None
+
+    def iter_lines(self):
+        """Iterasi baris (tanpa newline) tanpa memuat seluruh output."""
+        if self.spilled:
+            with open(self.spill_path, "rb") as fh:
+                for raw in fh:
+                    yield raw.decode("utf-8", "replace").rstrip("\r\n")
+        else:
+            for raw in self._mem.splitlines():
+                yield raw.decode("utf-8", "replace")
+
+    def text(self) -> str:
+        """Output penuh bila kecil; bila di-spill: head + penanda + tail."""
+        if not self.spilled:
+            return self._mem.decode("utf-8", errors="replace").rstrip()
+        head = self._mem.decode("utf-8", "replace")
+        tail = self._tail.decode("utf-8", "replace")
+        skipped = self.size - len(self._mem) - len(self._tail)
+        return f"{head.rstrip()}\n... ({max(skipped, 0)} byte dilewati, total {self.size} byte) ...\n{tail.rstrip()}"
+
+def run_capture(cmd: str, timeout: Optional[int] = None, cls: str = "interactive", shell: bool = False) -> CmdOutput:
+    """Jalankan perintah dan baca stdout+stderr per potong ke CmdOutput (memori dibatasi RUN_MEM_CAP)."""
+    res = CmdOutput(cmd)
+    timeout = timeout or exec_class(cls).timeout
+    argv = ["/bin/sh", "-c", cmd] if shell else shlex.split(cmd)
     try:
+        with exec_slot(cls):
+            proc = subprocess.Popen(exec_argv(argv, cls), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, start_new_session=True)
+            exec_attach(proc.pid, cls)
+            fd = proc.stdout.fileno()
+            deadline = time.monotonic() + timeout
+            try:
+                while True:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        res.timed_out = True
+                        with contextlib.suppress(Exception): os.killpg(proc.pid, signal.SIGKILL)
+                        break
+                    ready, _, _ = select.select([fd], [], [], min(left, 1.0))
+                    if not ready: continue
+                    chunk = os.read(fd, 65536)
+                    if not chunk: break
+                    res.feed(chunk)
+                try:
+                    res.returncode = proc.wait(timeout=max(deadline - time.monotonic(), 0.1))
+                except subprocess.TimeoutExpired:
+                    res.timed_out = True
+            finally:
+                proc.stdout.close()
+                if proc.poll() is None:
+                    with contextlib.suppress(Exception): os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+    except Exception as e:
+        res.error = str(e)
+    res.finish()
+    return res
 
-        out = subprocess.check_output(shlex.split(cmd), stderr=subprocess.STDOUT, timeout=timeout or CMD_TIMEOUT)
+def run_cmd(cmd: str, timeout: Optional[int] = None, cls: str = "interactive") -> str:
 
-        return out.decode("utf-8", errors="replace").rstrip()
+    timeout = timeout or exec_class(cls).timeout
 
-    except subprocess.CalledProcessError as e:
+    with run_capture(cmd, timeout, cls) as res:
 
-        return f"[ERR] Command failed ({cmd}):\n{e.output.decode('utf-8', errors='replace')}"
+        if res.error: return f"[ERR] {res.error}"
 
-    except subprocess.TimeoutExpired:
+        if res.timed_out: return f"[ERR] Command timeout ({cmd}) after {timeout}s"
 
-        return f"[ERR] Command timeout ({cmd}) after {(timeout or CMD_TIMEOUT)}s"
+        if res.returncode != 0: return f"[ERR] Command failed ({cmd}):\n{res.text()}"
 
-    except Exception as e:
+        return res.text()
 
-        return f"[ERR] {e}"
 
 
+def run_shell(cmd: str, timeout: Optional[int] = None, cls: str = "interactive") -> str:
 
-def run_shell(cmd: str, timeout: Optional[int] = None) -> str:
+    timeout = timeout or exec_class(cls).timeout
 
-    try:
+    with run_capture(cmd, timeout, cls, shell=True) as res:
 
-        out = subprocess.check_output(["/bin/sh", "-c", cmd], stderr=subprocess.STDOUT, timeout=timeout or CMD_TIMEOUT)
+        if res.error: return f"[ERR] {res.error}"
 
-        return out.decode("utf-8", errors="replace").rstrip()
+        if res.timed_out: return f"[ERR] Shell command timeout after {timeout}s"
 
-    except subprocess.CalledProcessError as e:
+        if res.returncode != 0: return res.text() or f"[exit {res.returncode}]"
 
-        return e.output.decode("utf-8", errors="replace").rstrip() or f"[exit {e.returncode}]"
+        return res.text()
 
-    except subprocess.TimeoutExpired:
 
-        return f"[ERR] Shell command timeout after {(timeout or CMD_TIMEOUT)}s"
 
-    except Exception as e:
+def iter_cmd_lines(cmd: str, timeout: Optional[int] = None, cls: str = "interactive", shell: bool = False):
+    """Iterator baris output perintah (lewat run_capture, file spill dihapus setelah selesai)."""
+    with run_capture(cmd, timeout, cls, shell=shell) as res:
+        yield from res.iter_lines()
 
-        return f"[ERR] {e}"
+def cmd_filter_lines(cmd: str, match=None, limit: int = 200, keep: str = "tail", timeout: Optional[int] = None,
+                     cls: str = "interactive") -> str:
+    """Pengganti `cmd | grep | tail -n N` / `head -n N`: saring baris per baris, simpan hanya N baris."""
+    with run_capture(cmd, timeout, cls) as res:
+        if res.error: return f"[ERR] {res.error}"
+        if res.timed_out: return f"[ERR] Command timeout ({cmd}) after {timeout or exec_class(cls).timeout}s"
+        if res.returncode != 0: return f"[ERR] Command failed ({cmd}):\n{res.text()[-1000:]}"
+        lines = (ln for ln in res.iter_lines() if match is None or match(ln))
+        picked = deque(lines, maxlen=limit) if keep == "tail" else list(itertools.islice(lines, limit))
+    return "\n".join(picked)
+
+def split_line_chunks(lines, limit: int = 3800):
+    """Seperti split_chunks tapi dari iterator baris, tanpa menggabung seluruh teks dulu."""
+    buf: List[str] = []; size = 0
+    for ln in lines:
+        ln = ln[:limit] + "\n"
+        if size + len(ln) > limit and buf:
+            yield "".join(buf).rstrip("\n"); buf, size = [], 0
+        buf.append(ln); size += len(ln)
+    if buf: yield "".join(buf).rstrip("\n")
 
 
 async def telegram_call_with_retry(fn, *args, retries: int = 3, retry_delay: float = 3.0, **kwargs):
@@ -487,43 +777,106 @@ def parse_usb_watchdog_input(text: str) -> Tuple[bool, str, Dict[str, Optional[s
     return True, "", params
 
 
-def usb_watchdog_configure(params: Dict[str, Optional[str]]) -> str:
-
-    args = ["configure", "--interface", params["interface"] or "usb0"]
-
-    interval = params.get("interval")
-
-    if interval:
 
-        args.extend(["--interval", str(interval)])
-
-    attempts = params.get("attempts")
-
-    if attempts:
-
-        args.extend(["--max-attempts", str(attempts)])
-
-    log_file = params.get("log_file")
-
-    if log_file:
-
-        args.extend(["--log-file", log_file])
-
-    logging = params.get("logging")
-
-    if logging:
-
-        args.extend(["--logging", logging])
-
-    return run_usb_watchdog_cmd(*args)
+# ---- Capability registry ----
+# Scan sekali saat start: binary, path sysfs/proc, init script, objek ubus. Hasil positif & negatif
+# di-cache; rescan hanya lewat tombol Diagnostics atau setelah opkg install/remove/upgrade.
+CAP_BINARIES = ("curl", "wget", "uclient-fetch", "traceroute", "ping", "ubus", "uci", "sensors", "ionice",
+                "opkg", "netbird", "wg", "vnstat", "iwinfo", "logread", "fw4", "fw3", "speedtest", "speedtest-cli", "adb")
+CAP_PATHS = {
+    "proc_uptime": "/proc/uptime",
+    "cgroup2": "/sys/fs/cgroup/cgroup.controllers",
+    "ubus_sock": "/var/run/ubus/ubus.sock",
+    "uci_config": "/etc/config",
+}
+CAP_INIT_SCRIPTS = ("openclash", "nikki", "vnstat", "cron", "sysntpd", "netbird", "dnsmasq", "firewall")
+CAP_UBUS_OBJECTS = ("nlbwmon", "network.interface", "network.wireless", "hostapd", "system")
+
+class Capabilities:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.bins: Dict[str, Optional[str]] = {}
+        self.paths: Dict[str, bool] = {}
+        self.inits: Dict[str, bool] = {}
+        self.ubus: Optional[set] = None
+        self.thermal_zones: Optional[List[str]] = None
+        self.scanned_ts = 0.0
+
+    def scan(self):
+        with self.lock:
+            self.reset()
+        for b in CAP_BINARIES: self.bin_path(b)
+        for p in CAP_PATHS.values(): self.has_path(p)
+        for n in CAP_INIT_SCRIPTS: self.has_init(n)
+        self.thermal()
+        self.ubus_objects()
+        self.scanned_ts = time.time()
+
+    def bin_path(self, name: str) -> Optional[str]:
+        if name not in self.bins:
+            self.bins[name] = shutil.which(name)
+        return self.bins[name]
+
+    def has_bin(self, name: str) -> bool:
+        return self.bin_path(name) is not None
+
+    def has_path(self, path: str) -> bool:
+        path = CAP_PATHS.get(path, path)
+        if path not in self.paths:
+            self.paths[path] = os.path.exists(path)
+        return self.paths[path]
+
+    def has_init(self, name: str) -> bool:
+        if name not in self.inits:
+            self.inits[name] = os.access(f"/etc/init.d/{name}", os.X_OK)
+        return self.inits[name]
+
+    def thermal(self) -> List[str]:
+        if self.thermal_zones is None:
+            self.thermal_zones = sorted(glob.glob("/sys/class/thermal/thermal_zone*/temp"))
+        return self.thermal_zones
+
+    def ubus_objects(self) -> set:
+        if self.ubus is None:
+            objs = set()
+            with contextlib.suppress(Exception):
+                if os.path.exists(UBUS.path): objs = set(UBUS.list_objects())
+            if not objs and self.has_bin("ubus"):
+                out = run_cmd("ubus list", timeout=5)
+                if not out.startswith("[ERR]"):
+                    objs = {ln.strip() for ln in out.splitlines() if ln.strip()}
+            self.ubus = objs
+        return self.ubus
+
+    def has_ubus(self, obj: str) -> bool:
+        objs = self.ubus_objects()
+        return obj in objs or any(o.startswith(obj + ".") for o in objs)
+
+    def summary_text(self) -> str:
+        ts = datetime.fromtimestamp(self.scanned_ts, TZ).strftime("%Y-%m-%d %H:%M:%S") if self.scanned_ts else "-"
+        yes = lambda ok: "✅" if ok else "❌"
+        lines = [f"Scan terakhir: {ts}", "", "[Binary]"]
+        lines += [f"{yes(self.has_bin(b))} {b}" for b in CAP_BINARIES]
+        lines += ["", "[Init script]"] + [f"{yes(self.has_init(n))} {n}" for n in CAP_INIT_SCRIPTS]
+        lines += ["", "[Path]"] + [f"{yes(self.has_path(p))} {k} ({p})" for k, p in CAP_PATHS.items()]
+        lines.append(f"{yes(bool(self.thermal()))} thermal zones: {len(self.thermal())}")
+        lines += ["", "[ubus]"] + [f"{yes(self.has_ubus(o))} {o}" for o in CAP_UBUS_OBJECTS]
+        return "\n".join(lines)
 
+CAPS = Capabilities()
 
+def caps_rescan():
+    try:
+        CAPS.scan()
+    except Exception as e:
+        print(f"[WARN] capability scan gagal: {e}")
 
 def which(bin_name: str) -> bool:
 
-    out = run_cmd(f"which {shlex.quote(bin_name)}")
-
-    return (not out.startswith("[ERR]")) and bool(out.strip())
+    return CAPS.has_bin(bin_name)
 
 
 
@@ -575,6 +928,346 @@ def split_chunks(text: str, limit: int = 3800):
 
 
 
+# ---- Operations registry ----
+# Operasi panjang (speedtest, opkg, backup/restore, netbird) berjalan di background dengan job ID.
+# Satu operasi per kind; permintaan identik digabung ke job yang sedang jalan.
+OP_KIND_LABELS = {"speedtest": "Speedtest", "opkg": "opkg", "backup": "Backup/Restore", "netbird": "NetBird",
+                  "nettools": "Ping/Trace"}
+OP_HISTORY_SIZE = 20
+
+@dataclass
+class Operation:
+    id: int
+    kind: str
+    key: str
+    title: str
+    chat_id: Optional[int] = None
+    started: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    status: str = "running"   # running | done | failed | cancelled
+    note: str = ""
+    task: Optional[asyncio.Task] = None
+    pids: set = field(default_factory=set)   # process group leader milik job
+    waiters: list = field(default_factory=list)  # pesan dari permintaan yang digabung
+    cancellable: bool = True                     # False: tidak aman diputus di tengah (restore menghentikan vnstat)
+
+    @property
+    def running(self) -> bool:
+        return self.status == "running"
+
+    def elapsed(self) -> int:
+        return int((self.finished or time.time()) - self.started)
+
+    def kill_processes(self):
+        for pid in list(self.pids):
+            with contextlib.suppress(Exception):
+                os.killpg(pid, signal.SIGKILL)
+        self.pids.clear()
+
+OPERATIONS: Dict[int, Operation] = {}
+OP_HISTORY: deque = deque(maxlen=OP_HISTORY_SIZE)
+_OP_SEQ = itertools.count(1)
+CURRENT_OP: contextvars.ContextVar = contextvars.ContextVar("ranet_current_op", default=None)
+
+def op_find(kind: str) -> Optional[Operation]:
+    for op in OPERATIONS.values():
+        if op.kind == kind and op.running: return op
+    return None
+
+def op_cancel_keyboard(op: Operation) -> Optional[InlineKeyboardMarkup]:
+    if not op.cancellable: return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton(f"🛑 Batalkan job #{op.id}", callback_data=f"JOB_CANCEL:{op.id}")]])
+
+def op_launch(application, kind: str, key: str, title: str, chat_id: Optional[int], factory,
+              cancellable: bool = True) -> Tuple[Operation, str]:
+    """Jalankan factory(op) di background. Return (op, state); state: started | joined | busy."""
+    cur = op_find(kind)
+    if cur:
+        return cur, ("joined" if cur.key == key else "busy")
+    op = Operation(id=next(_OP_SEQ), kind=kind, key=key, title=title, chat_id=chat_id, cancellable=cancellable)
+    OPERATIONS[op.id] = op
+
+    async def _runner():
+        CURRENT_OP.set(op)
+        try:
+            note = await factory(op)
+            if op.running:
+                op.status, op.note = "done", (note or "")
+        except asyncio.CancelledError:
+            op.status = "cancelled"
+        except Exception as e:
+            op.status, op.note = "failed", str(e)
+            print(f"[WARN] job #{op.id} {op.title} gagal: {e}")
+        finally:
+            op.finished = time.time()
+            op.kill_processes()
+            OPERATIONS.pop(op.id, None)
+            OP_HISTORY.appendleft(op)
+            for msg in op.waiters:
+                with contextlib.suppress(Exception):
+                    await msg.reply_text(op_status_line(op))
+
+    op.task = application.create_task(_runner()) if application else asyncio.create_task(_runner())
+    return op, "started"
+
+async def op_start(message, application, kind: str, key: str, title: str, factory,
+                   cancellable: bool = True) -> Optional[Operation]:
+    """op_launch + balasan standar saat digabung/ditolak. Return op bila job baru dimulai."""
+    chat_id = getattr(message, "chat_id", None)
+    op, state = op_launch(application, kind, key, title, chat_id, factory, cancellable)
+    if state == "started":
+        return op
+    if state == "joined":
+        op.waiters.append(message)
+        await message.reply_text(f"⏳ {op.title} sudah berjalan (job #{op.id}, {op.elapsed()}s). "
+                                 "Permintaan digabung; hasil akan dikabari di sini.", reply_markup=op_cancel_keyboard(op))
+    else:
+        await message.reply_text(f"⛔ {OP_KIND_LABELS.get(kind, kind)} lain sedang berjalan: job #{op.id} {op.title} "
+                                 f"({op.elapsed()}s). Tunggu selesai atau batalkan lewat /jobs.", reply_markup=op_cancel_keyboard(op))
+    return None
+
+def op_cancel(op_id: int) -> str:
+    op = OPERATIONS.get(op_id)
+    if not op or not op.running:
+        return f"Job #{op_id} tidak ditemukan atau sudah selesai."
+    if not op.cancellable:
+        return f"⛔ Job #{op.id} {op.title} tidak bisa dibatalkan di tengah jalan; tunggu sampai selesai."
+    op.status = "cancelled"
+    op.kill_processes()
+    if op.task: op.task.cancel()
+    return f"🛑 Job #{op.id} {op.title} dibatalkan."
+
+def op_status_line(op: Operation) -> str:
+    icon = {"running": "⏳", "done": "✅", "failed": "❌", "cancelled": "🛑"}.get(op.status, "•")
+    note = f" — {op.note[:80]}" if op.note else ""
+    return f"{icon} #{op.id} {op.title} [{op.status}, {op.elapsed()}s]{note}"
+
+def jobs_text() -> str:
+    lines = ["🧵 Jobs", "", "Berjalan:"]
+    running = sorted(OPERATIONS.values(), key=lambda o: o.id)
+    lines += [op_status_line(op) for op in running] or ["(tidak ada)"]
+    if OP_HISTORY:
+        lines += ["", "Terakhir:"] + [op_status_line(op) for op in list(OP_HISTORY)[:10]]
+    return "\n".join(lines)
+
+def jobs_keyboard() -> InlineKeyboardMarkup:
+    rows = [[InlineKeyboardButton(f"🛑 Batalkan #{op.id} {op.title}"[:60], callback_data=f"JOB_CANCEL:{op.id}")]
+            for op in sorted(OPERATIONS.values(), key=lambda o: o.id) if op.running and op.cancellable]
+    rows.append([InlineKeyboardButton("🔄 Refresh", callback_data="JOBS"),
+                 InlineKeyboardButton("🔙 Menu Tools", callback_data="MENU_TOOLS_ROOT")])
+    return InlineKeyboardMarkup(rows)
+
+
+
+async def reply_line_chunks(message, lines, max_chunks: int = 15):
+    """Kirim iterator baris sebagai code block per ~3800 char; iterator ditarik di executor, tidak digabung di RAM."""
+    loop = asyncio.get_running_loop()
+    it = split_line_chunks(lines)
+    sent = 0
+    while True:
+        chunk = await loop.run_in_executor(None, next, it, None)
+        if chunk is None: break
+        if sent >= max_chunks:
+            await message.reply_text(f"... output dipotong setelah {max_chunks} pesan.")
+            with contextlib.suppress(Exception): it.close()
+            break
+        await message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+        sent += 1
+    if not sent:
+        await message.reply_text(code_block("(no output)"), parse_mode=ParseMode.MARKDOWN_V2)
+
+
+
+# ---- Streaming output ----
+STREAM_EDIT_INTERVAL = float(os.getenv("RANET_STREAM_EDIT_INTERVAL", "3"))   # detik antar edit
+STREAM_FLUSH_MIN = 1.0   # detik; jarak minimum edit paksa flush()/show(), sisanya diserahkan ke ticker
+STREAM_TAIL_LINES = int(os.getenv("RANET_STREAM_TAIL_LINES", "15"))
+STREAM_DOC_THRESHOLD = int(os.getenv("RANET_STREAM_DOC_THRESHOLD", "12000"))  # char; di atas ini kirim dokumen
+STREAM_KEEP_MAX = 2 * 1024 * 1024  # batas output yang disimpan di memori
+
+class LiveOutput:
+    """Satu pesan progres yang di-edit berkala dengan tail output."""
+
+    def __init__(self, message, title: str, interval: Optional[float] = None):
+        self.message = message
+        self.title = title
+        self.interval = interval or STREAM_EDIT_INTERVAL
+        self.parts: List[str] = []
+        self.size = 0
+        self.truncated = False
+        self.dirty = False
+        self.started = time.time()
+        self.msg = None
+        self.last_edit = 0.0
+        self._ticker: Optional[asyncio.Task] = None
+        op = CURRENT_OP.get()
+        self.reply_markup = op_cancel_keyboard(op) if op else None
+
+    @property
+    def text(self) -> str:
+        out = "".join(self.parts)
+        return out + ("\n... (output dipotong)" if self.truncated else "")
+
+    def feed(self, chunk: str):
+        if not chunk: return
+        if self.size + len(chunk) > STREAM_KEEP_MAX:
+            chunk = chunk[:max(0, STREAM_KEEP_MAX - self.size)]
+            self.truncated = True
+        self.parts.append(chunk); self.size += len(chunk); self.dirty = True
+
+    def _tail(self) -> str:
+        tail: List[str] = []
+        for part in reversed(self.parts):
+            tail[:0] = part.splitlines()
+            if len(tail) > STREAM_TAIL_LINES: break
+        tail = [ln[-200:] for ln in tail[-STREAM_TAIL_LINES:]]
+        return "\n".join(tail) or "(menunggu output...)"
+
+    async def _render(self, head: str, body: Optional[str] = None, reply_markup=None, final: bool = False):
+        if self.msg is None: return
+        tail = re.sub(r"([`\\])", r"\\\1", self._tail() if body is None else body)
+        self.last_edit = time.monotonic()
+        # edit progres boleh hilang; edit terakhir (final) ditunggu melewati RetryAfter supaya hasil tidak tertinggal
+        text = f"{mdv2_escape(head)}\n{code_block(tail)}"
+        with contextlib.suppress(Exception):
+            if final:
+                await telegram_call_with_retry(self.msg.edit_text, text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
+            else:
+                await self.msg.edit_text(text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.dirty: continue
+            self.dirty = False
+            await self._render(f"⏳ {self.title} ({int(time.time() - self.started)}s)", reply_markup=self.reply_markup)
+
+    async def flush(self):
+        """Edit sekarang juga (per balasan/hop), tanpa menunggu ticker; paling cepat sekali per STREAM_FLUSH_MIN."""
+        if time.monotonic() - self.last_edit < STREAM_FLUSH_MIN:
+            self.dirty = True; return
+        self.dirty = False
+        await self._render(f"⏳ {self.title} ({int(time.time() - self.started)}s)", reply_markup=self.reply_markup)
+
+    def set(self, body: str):
+        # ganti seluruh isi (tabel/progres yang diperbarui), bukan menambah baris; dirender oleh ticker
+        self.parts = [body]; self.size = len(body); self.dirty = True
+
+    async def show(self, body: str):
+        self.set(body)
+        await self.flush()
+
+    async def start(self):
+        self.msg = await self.message.reply_text(f"⏳ {self.title}...", reply_markup=self.reply_markup)
+        self._ticker = asyncio.create_task(self._tick())
+
+    async def finish(self, ok: bool = True, note: str = ""):
+        if self._ticker:
+            self._ticker.cancel()
+            with contextlib.suppress(asyncio.CancelledError): await self._ticker
+        icon = "✅" if ok else "⚠️"
+        head = f"{icon} {self.title} selesai ({int(time.time() - self.started)}s){(' ' + note) if note else ''}"
+        out = self.text.strip("\n").rstrip() or "(no output)"
+        lines = out.splitlines()
+        if len(lines) <= STREAM_TAIL_LINES and all(len(ln) <= 200 for ln in lines):
+            # output pendek sudah tampil utuh di pesan progres
+            await self._render(head, out, final=True); return
+        await self._render(head, final=True)
+        if len(out) > STREAM_DOC_THRESHOLD:
+            name = re.sub(r"[^A-Za-z0-9]+", "_", self.title).strip("_").lower() or "output"
+            bio = io.BytesIO(out.encode("utf-8")); bio.name = f"{name}.txt"
+            await self.message.reply_document(bio, filename=bio.name, caption=f"{self.title}: output lengkap")
+        else:
+            for chunk in split_chunks(out):
+                await self.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+
+async def run_streaming(argv: List[str], timeout: Optional[int] = None, on_output=None,
+                        cls: str = "interactive") -> Tuple[str, Optional[int]]:
+    """Jalankan argv di execution class cls, kirim potongan stdout+stderr ke on_output selagi jalan.
+    Return (output, returncode); returncode None bila gagal start/timeout. Output dibatasi seperti CmdOutput.text()."""
+    timeout = timeout or exec_class(cls).timeout
+    with await run_streaming_capture(argv, timeout, on_output, cls) as res:
+        if res.error: return f"[ERR] {res.error}", None
+        if res.timed_out: return f"{res.text()}\n[ERR] Command timeout after {timeout}s", None
+        return res.text(), res.returncode
+
+async def run_streaming_capture(argv: List[str], timeout: Optional[int] = None, on_output=None,
+                                cls: str = "interactive") -> CmdOutput:
+    """Seperti run_streaming tapi mengembalikan CmdOutput (RAM ≤ RUN_MEM_CAP, sisanya spill; iter_lines untuk output
+    panjang). Pemanggil wajib menutupnya (`with`)."""
+    res = CmdOutput(" ".join(argv))
+    try:
+        async with exec_slot_async(cls) as ec:
+            await _run_streaming(exec_argv(argv, cls), timeout or ec.timeout, on_output, cls, res)
+    except BaseException:
+        res.close()
+        raise
+    res.finish()
+    return res
+
+async def _run_streaming(argv: List[str], timeout: int, on_output, cls: str, res: CmdOutput):
+    try:
+        proc = await asyncio.create_subprocess_exec(*argv, stdin=asyncio.subprocess.DEVNULL,
+                                                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                                                    start_new_session=True)
+    except FileNotFoundError:
+        res.error = f"{argv[0]} tidak ditemukan"; return
+    except Exception as e:
+        res.error = str(e); return
+    exec_attach(proc.pid, cls)
+    op = CURRENT_OP.get()
+    if op: op.pids.add(proc.pid)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    async def _pump():
+        while True:
+            chunk = await proc.stdout.read(4096)
+            if chunk: res.feed(chunk)
+            if on_output:
+                text = decoder.decode(chunk, final=not chunk)
+                if text: on_output(text)
+            if not chunk: break
+        res.returncode = await proc.wait()
+
+    try:
+        await asyncio.wait_for(_pump(), timeout)
+    except asyncio.TimeoutError:
+        res.timed_out = True
+        with contextlib.suppress(Exception): os.killpg(proc.pid, signal.SIGKILL)
+        with contextlib.suppress(Exception): await proc.wait()
+        if on_output: on_output(f"\n[ERR] Command timeout after {timeout}s")
+    except asyncio.CancelledError:
+        with contextlib.suppress(Exception): os.killpg(proc.pid, signal.SIGKILL)
+        raise
+    finally:
+        if op: op.pids.discard(proc.pid)
+
+async def run_cmd_async(argv: List[str], timeout: Optional[int] = None, cls: str = "interactive") -> str:
+    """Versi async run_cmd (format error sama); proses ikut dibatalkan bersama job-nya."""
+    timeout = timeout or exec_class(cls).timeout
+    cmd = " ".join(argv)
+    out, code = await run_streaming(argv, timeout, cls=cls)
+    if code is None:
+        return out if out.startswith("[ERR]") and "\n" not in out else f"[ERR] Command timeout ({cmd}) after {timeout}s"
+    if code != 0:
+        return f"[ERR] Command failed ({cmd}):\n{out}"
+    return out
+
+async def stream_command(message, title: str, argv: List[str], timeout: Optional[int] = None,
+                         cls: str = "interactive") -> Tuple[str, Optional[int]]:
+    """Jalankan perintah panjang dengan progres live di satu pesan, lalu kirim output lengkap."""
+    live = LiveOutput(message, title)
+    await live.start()
+    try:
+        out, code = await run_streaming(argv, timeout, on_output=live.feed, cls=cls)
+    except asyncio.CancelledError:
+        await live.finish(ok=False, note="[dibatalkan]")
+        raise
+    await live.finish(ok=(code == 0), note=f"[exit {code}]" if code is not None else "[timeout]")
+    return out, code
+
+
+
 def allowed(update: Update) -> bool:
 
     uid = update.effective_user.id if update.effective_user else None
@@ -626,10 +1319,12 @@ ANDROID_SMS_DB_PATHS = [
 
 ]
 
+ANDROID_REPORT_DIR = os.getenv("ANDROID_REPORT_DIR", "reports")
+
 
 def android_adb_available() -> bool:
 
-    return shutil.which("adb") is not None
+    return CAPS.has_bin("adb")
 
 
 def android_exec(device: Optional[str], *args: str, timeout: Optional[int] = None) -> str:
@@ -1284,9 +1979,9 @@ def android_parse_content_sms(output: str, limit: Optional[int] = None) -> List[
 
         date_raw = rest.split()[0]
 
-        address = addr.strip()
+        address = addr.strip().rstrip(",")
 
-        body = body_part.replace("\\n", " ").replace("\\r", " ").strip()
+        body = body_part.replace("\\n", " ").replace("\\r", " ").strip().rstrip(",")
 
         raw_ts = date_raw.strip()
 
@@ -1389,7 +2084,7 @@ def android_device_has_sqlite(serial: str) -> bool:
 
 def android_sqlite_query_device(serial: str, path: str, limit: int) -> List[AndroidSMS]:
 
-    limit = max(1, int(limit))
+    limit = int(limit) if limit and limit > 0 else -1
 
     cmd = (
         f"sqlite3 '{path}' \"SELECT address, body, date FROM sms WHERE type=1 ORDER BY date DESC LIMIT {limit};\""
@@ -1397,7 +2092,7 @@ def android_sqlite_query_device(serial: str, path: str, limit: int) -> List[Andr
 
     out = android_shell_root(serial, cmd)
 
-    return android_parse_sqlite_sms(out, limit=limit)
+    return android_parse_sqlite_sms(out, limit=limit if limit > 0 else None)
 
 
 def android_sqlite_read_local(path: Path, limit: int) -> List[AndroidSMS]:
@@ -1416,7 +2111,7 @@ def android_sqlite_read_local(path: Path, limit: int) -> List[AndroidSMS]:
 
             "SELECT address, body, date FROM sms WHERE type=1 ORDER BY date DESC LIMIT ?;",
 
-            (max(1, int(limit)),),
+            (int(limit) if limit and limit > 0 else -1,),
 
         ).fetchall()
 
@@ -1521,10 +2216,11 @@ def android_sqlite_pull_and_query(serial: str, limit: int) -> List[AndroidSMS]:
 def android_fetch_sms_entries(
     serial: str,
     sdk_int: Optional[int],
-    limit: int = 5,
+    limit: Optional[int] = 5,
 ) -> Tuple[List[AndroidSMS], Optional[str]]:
 
-    limit = max(1, int(limit))
+    # limit None/0 = ambil seluruh inbox (dipakai export arsip)
+    limit = max(1, int(limit)) if limit else None
 
     out = android_content_query(serial, sort=True)
 
@@ -1747,88 +2443,444 @@ def android_toggle_airplane(serial: str, pause_seconds: float = 3.0) -> str:
     return "⚠️ Airplane Mode direfresh tanpa root (mungkin tidak persist)."
 
 
+# ---- Rotasi IP (async, tanpa sleep tetap) ----
+
+ANDROID_ROTATE_MAX_ATTEMPTS = int(os.getenv("ANDROID_ROTATE_MAX_ATTEMPTS", "3"))
+ANDROID_ROTATE_STATE_TIMEOUT = float(os.getenv("ANDROID_ROTATE_STATE_TIMEOUT", "20"))
+ANDROID_ROTATE_DATA_TIMEOUT = float(os.getenv("ANDROID_ROTATE_DATA_TIMEOUT", "60"))
+ANDROID_ROTATE_POLL = 0.5
+ANDROID_ROTATE_LOCKS: Dict[str, asyncio.Lock] = {}
+
+
+@dataclass
+class AndroidRotation:
+    serial: str
+    ts: int
+    ok: bool = False
+    old_ip: str = ""
+    new_ip: str = ""
+    attempts: int = 0
+    off_ms: int = 0
+    reconnect_ms: int = 0
+    total_ms: int = 0
+    note: str = ""
+
+
+async def android_exec_async(device: Optional[str], *args: str, timeout: Optional[float] = None) -> str:
+    cmd = ["adb"]
+    if device:
+        cmd.extend(["-s", device])
+    cmd.extend(args)
+    limit = timeout or CMD_TIMEOUT
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except FileNotFoundError:
+        return "[ERR] adb tidak ditemukan di PATH"
+    except Exception as exc:
+        return f"[ERR] {exc}"
+    try:
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout=limit)
+    except asyncio.TimeoutError:
+        with contextlib.suppress(ProcessLookupError):
+            proc.kill()
+        with contextlib.suppress(Exception):
+            await proc.wait()
+        return f"[ERR] adb timeout after {limit}s"
+    text = out.decode("utf-8", errors="replace").strip()
+    if proc.returncode != 0:
+        return f"[ERR] {text or f'exit {proc.returncode}'}"
+    return text
+
+
+async def android_shell_async(device: str, *cmd: str, timeout: Optional[float] = None) -> str:
+    return await android_exec_async(device, "shell", *cmd, timeout=timeout)
+
+
+async def android_airplane_state_async(serial: str) -> Optional[bool]:
+    out = await android_shell_async(serial, "settings", "get", "global", "airplane_mode_on", timeout=10)
+    if out.strip() == "1":
+        return True
+    if out.strip() == "0":
+        return False
+    out = await android_shell_async(serial, "cmd", "connectivity", "airplane-mode", timeout=10)
+    m = re.search(r"enabled:?\s*(\w+)", out) if not out.startswith("[ERR]") else None
+    if m and m.group(1).lower() in {"true", "false"}:
+        return m.group(1).lower() == "true"
+    return None
+
+
+async def android_data_connected_async(serial: str) -> Optional[bool]:
+    """True jika data seluler tersambung (mDataConnectionState=2), None jika tidak terbaca."""
+    raw = await android_shell_async(serial, "dumpsys", "telephony.registry", timeout=10)
+    if raw and not raw.startswith("[ERR]"):
+        states = re.findall(r"mDataConnectionState=(-?\d+)", raw)
+        if states:
+            return any(s == "2" for s in states)
+    res = await android_shell_async(serial, "ping", "-c", "1", "-W", "1", "8.8.8.8", timeout=5)
+    if res.startswith("[ERR]"):
+        return None if "not found" in res else False
+    return True
+
+
+async def android_set_airplane_async(serial: str, enabled: bool, mode: str, root: bool) -> str:
+    flag = "1" if enabled else "0"
+    if mode == "new":
+        return await android_shell_async(serial, "cmd", "connectivity", "airplane-mode",
+                                         "enable" if enabled else "disable", timeout=15)
+    if root:
+        state = "true" if enabled else "false"
+        command = (f"settings put global airplane_mode_on {flag}; "
+                   f"am broadcast -a android.intent.action.AIRPLANE_MODE --ez state {state}")
+        return await android_exec_async(serial, "shell", "su", "-c", command, timeout=15)
+    return await android_shell_async(serial, "settings", "put", "global", "airplane_mode_on", flag, timeout=15)
+
+
+async def _android_wait_until(check, expected: bool, timeout: float) -> bool:
+    deadline = time.monotonic() + max(0.0, timeout)
+    while True:
+        if await check() is expected:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(ANDROID_ROTATE_POLL)
+
+
+async def _android_public_ip_async(retries: int = 3) -> str:
+    loop = asyncio.get_running_loop()
+    ip = "Unknown"
+    for _ in range(max(1, retries)):
+        ip = await loop.run_in_executor(None, get_public_ip, True)
+        if ip != "Unknown":
+            break
+        await asyncio.sleep(1.0)
+    return ip
+
+
+async def android_rotate_ip(serial: str, max_attempts: Optional[int] = None, progress=None) -> AndroidRotation:
+    """
+    Toggle airplane mode sampai IP publik berubah.
+    Setiap fase menunggu status device (bukan sleep tetap); hasil selalu dicatat ke DB.
+    """
+    lock = ANDROID_ROTATE_LOCKS.setdefault(serial, asyncio.Lock())
+    result = AndroidRotation(serial=serial, ts=int(time.time()))
+    if lock.locked():
+        result.note = "Rotasi lain masih berjalan untuk device ini."
+        return result
+
+    async def _report(text: str) -> None:
+        if progress is not None:
+            with contextlib.suppress(Exception):
+                await progress(text)
+
+    async def _data_up() -> bool:
+        return (await android_data_connected_async(serial)) is True
+
+    async with lock:
+        started = time.monotonic()
+        mode, _, _ = await asyncio.get_running_loop().run_in_executor(None, android_airplane_status, serial)
+        if mode == "unknown":
+            result.note = "Tidak bisa membaca status Airplane Mode."
+            return result
+        root = False
+        if mode != "new":
+            res = await android_exec_async(serial, "shell", "su", "-c", "id", timeout=10)
+            root = "uid=0" in res
+        await _report("🌐 Mengecek IP publik saat ini…")
+        result.old_ip = await _android_public_ip_async()
+        attempts = max(1, max_attempts or ANDROID_ROTATE_MAX_ATTEMPTS)
+        for attempt in range(1, attempts + 1):
+            result.attempts = attempt
+            await _report(f"✈️ Percobaan {attempt}/{attempts}: mengaktifkan Airplane Mode…")
+            t_off = time.monotonic()
+            res = await android_set_airplane_async(serial, True, mode, root)
+            if res.startswith("[ERR]"):
+                result.note = f"Gagal mengaktifkan Airplane Mode: {res}"
+                break
+            await _android_wait_until(lambda: android_airplane_state_async(serial), True, ANDROID_ROTATE_STATE_TIMEOUT)
+            await _android_wait_until(_data_up, False, ANDROID_ROTATE_STATE_TIMEOUT)
+            res = await android_set_airplane_async(serial, False, mode, root)
+            if res.startswith("[ERR]"):
+                result.note = f"Gagal mematikan Airplane Mode: {res}"
+                break
+            result.off_ms = int((time.monotonic() - t_off) * 1000)
+            await _report(f"📶 Percobaan {attempt}/{attempts}: menunggu data seluler tersambung…")
+            t_on = time.monotonic()
+            if not await _android_wait_until(lambda: android_airplane_state_async(serial), False, ANDROID_ROTATE_STATE_TIMEOUT):
+                result.note = "Airplane Mode tetap aktif setelah refresh. Nonaktifkan manual."
+                break
+            if not await _android_wait_until(lambda: android_data_connected_async(serial), True, ANDROID_ROTATE_DATA_TIMEOUT):
+                result.note = f"Data seluler belum tersambung setelah {ANDROID_ROTATE_DATA_TIMEOUT:.0f}s."
+                continue
+            result.reconnect_ms = int((time.monotonic() - t_on) * 1000)
+            await _report(f"🔎 Percobaan {attempt}/{attempts}: verifikasi IP publik baru…")
+            result.new_ip = await _android_public_ip_async()
+            if result.new_ip != "Unknown" and result.new_ip != result.old_ip:
+                result.ok = True
+                result.note = ""
+                break
+            result.note = "IP publik tidak berubah." if result.new_ip == result.old_ip else "IP publik tidak terbaca."
+        result.total_ms = int((time.monotonic() - started) * 1000)
+    with contextlib.suppress(Exception):
+        db_insert_rotation(result)
+    return result
+
+
+def android_rotation_text(rot: AndroidRotation) -> str:
+    head = "✅ IP berhasil dirotasi." if rot.ok else "❌ Rotasi IP gagal."
+    lines = [
+        head,
+        f"Device   : {rot.serial}",
+        f"IP lama  : {rot.old_ip or '-'}",
+        f"IP baru  : {rot.new_ip or '-'}",
+        f"Percobaan: {rot.attempts}",
+        f"Durasi   : off {rot.off_ms / 1000:.1f}s | reconnect {rot.reconnect_ms / 1000:.1f}s | total {rot.total_ms / 1000:.1f}s",
+    ]
+    if rot.note:
+        lines.append(f"Catatan  : {rot.note}")
+    return "\n".join(lines)
+
+
+def android_rotation_history_text(serial: str, limit: int = 10) -> str:
+    rows = db_fetch_rotations(serial, limit)
+    if not rows:
+        return "(belum ada riwayat rotasi)"
+    lines = []
+    for ts, ok, old_ip, new_ip, attempts, off_ms, reconnect_ms, total_ms, note in rows:
+        dt = datetime.fromtimestamp(ts, TZ).strftime("%m-%d %H:%M")
+        icon = "✅" if ok else "❌"
+        lines.append(f"{icon} {dt}  {old_ip or '-'} → {new_ip or '-'}  x{attempts}  "
+                     f"{reconnect_ms / 1000:.1f}s/{total_ms / 1000:.1f}s")
+        if note:
+            lines.append(f"   {note}")
+    return "\n".join(lines)
+
+
+def android_rotate_schedule_load() -> Dict[str, int]:
+    try:
+        data = json.loads(settings_get("android_rotate_schedule", "{}") or "{}")
+    except Exception:
+        data = {}
+    return {str(k): int(v) for k, v in data.items() if str(v).isdigit() and int(v) > 0}
+
+
+def android_rotate_schedule_apply(job_queue, serial: str, minutes: int) -> None:
+    schedule = android_rotate_schedule_load()
+    if minutes > 0:
+        schedule[serial] = int(minutes)
+    else:
+        schedule.pop(serial, None)
+    settings_set("android_rotate_schedule", json.dumps(schedule))
+    if job_queue is None:
+        return
+    name = f"android_rotate:{serial}"
+    for job in job_queue.get_jobs_by_name(name):
+        job.schedule_removal()
+    if minutes > 0:
+        job_queue.run_repeating(job_android_rotate, interval=minutes * 60, first=minutes * 60,
+                                name=name, data={"serial": serial})
+
+
 
 def android_safe_serial(serial: str) -> str:
 
     return re.sub(r"[^A-Za-z0-9_.-]", "_", serial or "device")
 
 
-def android_export_report(serial: str, info: Dict[str, Any], sms_text: str) -> Path:
+def android_report_markdown(serial: str, info: Dict[str, Any], sms_text: str,
+                            sms_title: str = "Last 5 SMS (Inbox)") -> str:
 
-    reports_dir = Path("reports")
+    parts: List[str] = []
 
-    reports_dir.mkdir(parents=True, exist_ok=True)
+    parts.append("# ADB Device Report\n")
 
-    ts = datetime.now(tz=TZ).strftime("%Y%m%d-%H%M%S")
+    parts.append(f"- **Device**: `{serial}`\n")
 
-    filename = reports_dir / f"adbreport-{android_safe_serial(serial)}-{ts}.md"
+    parts.append(f"- **Model**: {info.get('model', '-') }\n")
 
-    with open(filename, "w", encoding="utf-8") as fh:
+    parts.append(f"- **Product**: {info.get('product', '-') }\n")
 
-        fh.write("# ADB Device Report\n")
+    parts.append(f"- **Android**: {info.get('android_version', '?')} (SDK {info.get('sdk_text', '?')})\n")
 
-        fh.write(f"- **Device**: `{serial}`\n")
+    parts.append(f"- **Generated**: {datetime.now(tz=TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}\n\n")
 
-        fh.write(f"- **Model**: {info.get('model', '-') }\n")
+    parts.append("## Summary\n")
 
-        fh.write(f"- **Product**: {info.get('product', '-') }\n")
+    parts.append(f"- Uptime: {info.get('uptime', '?')}\n")
 
-        fh.write(f"- **Android**: {info.get('android_version', '?')} (SDK {info.get('sdk_text', '?')})\n")
+    parts.append(f"- {info.get('battery_text', 'Battery: ?')}\n")
 
-        fh.write(f"- **Generated**: {datetime.now(tz=TZ).strftime('%Y-%m-%d %H:%M:%S %Z')}\n\n")
+    parts.append(f"- {info.get('airplane_text', 'Airplane Mode: unknown')}\n")
 
-        fh.write("## Summary\n")
+    parts.append(f"- {info.get('mobile_data_text', 'Mobile Data: unknown')}\n")
 
-        fh.write(f"- Uptime: {info.get('uptime', '?')}\n")
+    network_line = (info.get('network_text', 'Network: ?') or '').replace('\n', ' | ')
+    parts.append(f"- {network_line}\n\n")
 
-        fh.write(f"- {info.get('battery_text', 'Battery: ?')}\n")
+    parts.append("## Memory\n")
 
-        fh.write(f"- {info.get('airplane_text', 'Airplane Mode: unknown')}\n")
+    parts.append(f"{info.get('memory_text', '?')}\n\n")
 
-        fh.write(f"- {info.get('mobile_data_text', 'Mobile Data: unknown')}\n")
+    parts.append("## Storage\n")
 
-        network_line = (info.get('network_text', 'Network: ?') or '').replace('\n', ' | ')
-        fh.write(f"- {network_line}\n\n")
+    for ln in info.get("storage_lines", []):
 
-        fh.write("## Memory\n")
+        parts.append(f"    {ln}\n")
 
-        fh.write(f"{info.get('memory_text', '?')}\n\n")
+    if not info.get("storage_lines"):
 
-        fh.write("## Storage\n")
+        parts.append("    (tidak tersedia)\n")
 
-        for ln in info.get("storage_lines", []):
+    parts.append("\n## Top Processes\n")
 
-            fh.write(f"    {ln}\n")
+    for ln in info.get("process_lines", []):
 
-        if not info.get("storage_lines"):
+        parts.append(f"    {ln}\n")
 
-            fh.write("    (tidak tersedia)\n")
+    if not info.get("process_lines"):
 
-        fh.write("\n## Top Processes\n")
+        parts.append("    (tidak tersedia)\n")
 
-        for ln in info.get("process_lines", []):
+    parts.append(f"\n## {sms_title}\n")
 
-            fh.write(f"    {ln}\n")
+    if sms_text.strip():
 
-        if not info.get("process_lines"):
+        for ln in sms_text.splitlines():
 
-            fh.write("    (tidak tersedia)\n")
+            parts.append(f"    {ln}\n")
 
-        fh.write("\n## Last 5 SMS (Inbox)\n")
+    else:
 
-        if sms_text.strip():
+        parts.append("    (Tidak ada SMS)\n")
 
-            for ln in sms_text.splitlines():
+    return "".join(parts)
 
-                fh.write(f"    {ln}\n")
 
-        else:
+def android_export_report(serial: str, info: Dict[str, Any], sms_text: str) -> Path:
+
+    reports_dir = Path(ANDROID_REPORT_DIR)
+
+    reports_dir.mkdir(parents=True, exist_ok=True)
+
+    ts = datetime.now(tz=TZ).strftime("%Y%m%d-%H%M%S")
+
+    filename = reports_dir / f"adbreport-{android_safe_serial(serial)}-{ts}.md"
 
-            fh.write("    (Tidak ada SMS)\n")
+    with open(filename, "w", encoding="utf-8") as fh:
+
+        fh.write(android_report_markdown(serial, info, sms_text))
 
     return filename
 
 
+# ---- Export arsip (zip, di-stream per bagian) ----
+
+ANDROID_EXPORT_RUNNING: set = set()
+_ANDROID_SMS_QUERY = "content query --user 0 --uri content://sms/inbox --projection address,body,date"
+
+
+async def android_stream_shell_lines(serial: str, command: str, timeout: float = 300.0, root: bool = False):
+    """Async generator: baris output `adb shell` dibaca saat datang, tanpa menampung seluruh output."""
+    args = ["adb", "-s", serial, "shell"] + (["su", "-c", command] if root else [command])
+    try:
+        proc = await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except Exception:
+        return
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                raw = await asyncio.wait_for(proc.stdout.readline(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if not raw:
+                break
+            yield raw.decode("utf-8", errors="replace").rstrip("\r\n")
+    finally:
+        if proc.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                proc.kill()
+        with contextlib.suppress(Exception):
+            await proc.wait()
+
+
+def _android_sms_csv_row(sms: AndroidSMS) -> List[str]:
+    ts_text = ""
+    if sms.ts_ms:
+        with contextlib.suppress(Exception):
+            ts_text = datetime.fromtimestamp(sms.ts_ms / 1000, tz=timezone.utc).astimezone(TZ).isoformat()
+    return [ts_text, sms.raw_ts, sms.address, sms.body]
+
+
+async def android_export_archive(serial: str, label: Optional[str] = None, progress=None) -> Tuple[Path, Optional[str], Dict[str, int]]:
+    """
+    Bangun arsip zip berisi report.md, sms.csv (seluruh inbox), telemetry.csv dan rotations.csv.
+    Setiap bagian ditulis ke zip begitu terkumpul; pemanggilan adb berjalan async/executor.
+    """
+    loop = asyncio.get_running_loop()
+    counts = {"sms": 0, "telemetry": 0, "rotations": 0}
+    reports_dir = Path(ANDROID_REPORT_DIR)
+    reports_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now(tz=TZ).strftime("%Y%m%d-%H%M%S")
+    path = reports_dir / f"adbreport-{android_safe_serial(serial)}-{stamp}.zip"
+    sms_error: Optional[str] = None
+
+    async def _report(text: str) -> None:
+        if progress is not None:
+            with contextlib.suppress(Exception):
+                await progress(text)
+
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        await _report("📝 [1/4] Mengumpulkan info device…")
+        info = await loop.run_in_executor(None, android_collect_info, serial)
+        summary = android_summary_text(info, label)
+        zf.writestr("summary.txt", summary)
+
+        await _report("📨 [2/4] Mengambil arsip SMS…")
+        with zf.open("sms.csv", "w") as raw_fh, io.TextIOWrapper(raw_fh, encoding="utf-8", newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["time", "raw_ts", "address", "body"])
+            last_edit = time.monotonic()
+            async for line in android_stream_shell_lines(serial, _ANDROID_SMS_QUERY):
+                for sms in android_parse_content_sms(line):
+                    writer.writerow(_android_sms_csv_row(sms))
+                    counts["sms"] += 1
+                if time.monotonic() - last_edit >= 3:
+                    last_edit = time.monotonic()
+                    await _report(f"📨 [2/4] Mengambil arsip SMS… {counts['sms']} pesan")
+            if counts["sms"] == 0:
+                entries, sms_error = await loop.run_in_executor(
+                    None, android_fetch_sms_entries, serial, info.get("sdk_int"), None)
+                for sms in entries:
+                    writer.writerow(_android_sms_csv_row(sms))
+                counts["sms"] = len(entries)
+
+        await _report(f"📈 [3/4] Menulis histori telemetri… ({counts['sms']} SMS)")
+        with zf.open("telemetry.csv", "w") as raw_fh, io.TextIOWrapper(raw_fh, encoding="utf-8", newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["series", "ts", "time", "value"])
+            prefix = f"android:{serial}:"
+            for series, ts, value in metrics_iter(prefix):
+                writer.writerow([series[len(prefix):], ts, datetime.fromtimestamp(ts, TZ).isoformat(), value])
+                counts["telemetry"] += 1
+                if counts["telemetry"] % 2000 == 0:
+                    await asyncio.sleep(0)
+
+        await _report("🔁 [4/4] Menulis riwayat rotasi IP…")
+        with zf.open("rotations.csv", "w") as raw_fh, io.TextIOWrapper(raw_fh, encoding="utf-8", newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["ts", "ok", "old_ip", "new_ip", "attempts", "off_ms", "reconnect_ms", "total_ms", "note"])
+            for row in db_fetch_rotations(serial, 1000):
+                writer.writerow(row)
+                counts["rotations"] += 1
+
+        sms_note = f"{counts['sms']} pesan di sms.csv" + (f" ({sms_error})" if sms_error else "")
+        zf.writestr("report.md", android_report_markdown(serial, info, sms_note, sms_title="SMS Archive"))
+    return path, sms_error, counts
+
+
 def android_menu_message(devices: List[AndroidDevice], selected: Optional[str], label: Optional[str]) -> str:
 
     lines: List[str] = ["🤖 *Android Device Center*"]
@@ -1909,8 +2961,159 @@ async def android_signal_monitor_task(ctx: ContextTypes.DEFAULT_TYPE, chat_id: i
         pass
 
 
+# ---- Telemetri Android (sampler background + histori) ----
+
+ANDROID_TELEMETRY_INTERVAL = int(os.getenv("ANDROID_TELEMETRY_INTERVAL", "60"))
+ANDROID_RSRP_ALERT_DBM = float(os.getenv("ANDROID_RSRP_ALERT_DBM", "-110"))
+ANDROID_SIGNAL_ALERT_MINUTES = float(os.getenv("ANDROID_SIGNAL_ALERT_MINUTES", "10"))
+ANDROID_BATT_TEMP_ALERT_C = float(os.getenv("ANDROID_BATT_TEMP_ALERT_C", "45"))
+ANDROID_TELEMETRY_WINDOWS = {"1h": 3600, "24h": 86400, "7d": 7 * 86400}
+ANDROID_RAT_GENERATION = {
+    "GPRS": 2, "EDGE": 2, "GSM": 2, "CDMA": 2, "1xRTT": 2,
+    "UMTS": 3, "HSDPA": 3, "HSUPA": 3, "HSPA": 3, "HSPAP": 3, "HSPA+": 3, "EVDO": 3, "TD_SCDMA": 3,
+    "LTE": 4, "LTE_CA": 4, "IWLAN": 4, "NR": 5, "NR_NSA": 5,
+}
+_ANDROID_INVALID_SIGNAL = {2147483647, -2147483648}
+
+
+def android_parse_signal(raw: str) -> Dict[str, Optional[float]]:
+    """Ambil RSRP/RSRQ/SINR dari `dumpsys telephony.registry` (LTE atau NR/5G)."""
+    line = ""
+    for ln in (raw or "").splitlines():
+        if "mSignalStrength=SignalStrength" in ln:
+            line = ln
+            break
+    out: Dict[str, Optional[float]] = {"rsrp": None, "rsrq": None, "sinr": None}
+    if not line:
+        return out
+
+    def _grab(pattern: str) -> Optional[float]:
+        m = re.search(pattern, line)
+        if not m:
+            return None
+        val = int(m.group(1))
+        return None if val in _ANDROID_INVALID_SIGNAL else float(val)
+
+    for key, nr_pat, lte_pat in (("rsrp", r"ssRsrp\s*=\s*(-?\d+)", r"\brsrp=(-?\d+)"),
+                                 ("rsrq", r"ssRsrq\s*=\s*(-?\d+)", r"\brsrq=(-?\d+)"),
+                                 ("sinr", r"ssSinr\s*=\s*(-?\d+)", r"\brssnr=(-?\d+)")):
+        val = _grab(nr_pat)
+        out[key] = val if val is not None else _grab(lte_pat)
+    return out
+
+
+def android_parse_battery(raw: str) -> Dict[str, Optional[float]]:
+    out: Dict[str, Optional[float]] = {"level": None, "temp": None}
+    if not raw or raw.startswith("[ERR]"):
+        return out
+    m = re.search(r"\blevel:\s*(\d+)", raw)
+    if m:
+        out["level"] = float(m.group(1))
+    m = re.search(r"\btemperature:\s*(-?\d+)", raw)
+    if m:
+        val = int(m.group(1))
+        out["temp"] = val / 1000 if val > 1000 else val / 10
+    return out
+
+
+def android_parse_net_dev(raw: str) -> Dict[str, Tuple[int, int]]:
+    counters: Dict[str, Tuple[int, int]] = {}
+    for ln in (raw or "").splitlines():
+        if ":" not in ln or ln.strip().startswith(("Inter", "face")):
+            continue
+        name, rest = ln.split(":", 1)
+        name = name.strip()
+        parts = rest.split()
+        if name == "lo" or len(parts) < 9:
+            continue
+        try:
+            rx, tx = int(parts[0]), int(parts[8])
+        except ValueError:
+            continue
+        if rx or tx:
+            counters[name] = (rx, tx)
+    return counters
+
+
+async def android_telemetry_sample(serial: str) -> List[Tuple[str, int, float]]:
+    reg, batt, netdev, rat = await asyncio.gather(
+        android_shell_async(serial, "dumpsys", "telephony.registry", timeout=15),
+        android_shell_async(serial, "dumpsys", "battery", timeout=15),
+        android_shell_async(serial, "cat", "/proc/net/dev", timeout=15),
+        android_shell_async(serial, "getprop", "gsm.network.type", timeout=15),
+    )
+    ts = int(time.time())
+    prefix = f"android:{serial}:"
+    points: List[Tuple[str, int, float]] = []
+    if not reg.startswith("[ERR]"):
+        for key, val in android_parse_signal(reg).items():
+            points.append((prefix + key, ts, val))
+    for key, val in android_parse_battery(batt).items():
+        points.append((prefix + f"batt_{key}", ts, val))
+    if not rat.startswith("[ERR]"):
+        gens = [ANDROID_RAT_GENERATION.get(r.strip().upper(), 0) for r in rat.split(",") if r.strip()]
+        if gens:
+            points.append((prefix + "rat_gen", ts, float(max(gens))))
+    if not netdev.startswith("[ERR]"):
+        for iface, (rx, tx) in android_parse_net_dev(netdev).items():
+            points.append((prefix + f"if:{iface}:rx", ts, float(rx)))
+            points.append((prefix + f"if:{iface}:tx", ts, float(tx)))
+    return [p for p in points if p[2] is not None]
+
+
+def android_telemetry_text(serial: str, window: str = "1h") -> str:
+    span = ANDROID_TELEMETRY_WINDOWS.get(window, 3600)
+    since = int(time.time()) - span
+    prefix = f"android:{serial}:"
+    lines = [f"Telemetri {serial} — {window}", ""]
+    lines.append(metrics_summary_line("RSRP", prefix + "rsrp", since, " dBm"))
+    lines.append(metrics_summary_line("RSRQ", prefix + "rsrq", since, " dB"))
+    lines.append(metrics_summary_line("SINR", prefix + "sinr", since, " dB"))
+    lines.append(metrics_summary_line("RAT (G)", prefix + "rat_gen", since))
+    lines.append(metrics_summary_line("Baterai", prefix + "batt_level", since, "%"))
+    lines.append(metrics_summary_line("Suhu bat", prefix + "batt_temp", since, "°C"))
+    ifaces = sorted({s[len(prefix) + 3:].rsplit(":", 1)[0] for s in metrics_series(prefix + "if:")})
+    usage = []
+    for iface in ifaces:
+        rx = metrics_counter_delta(prefix + f"if:{iface}:rx", since)
+        tx = metrics_counter_delta(prefix + f"if:{iface}:tx", since)
+        if rx or tx:
+            usage.append(f"  {iface:<12} ⬇️ {human_bytes(rx)}  ⬆️ {human_bytes(tx)}")
+    lines.append("")
+    lines.append("Pemakaian data:")
+    lines.extend(usage or ["  (no data)"])
+    return "\n".join(lines)
+
+
+async def android_telemetry_alerts(ctx: ContextTypes.DEFAULT_TYPE, serial: str) -> None:
+    prefix = f"android:{serial}:"
+    checks = [
+        (f"android_signal_{serial}", prefix + "rsrp", lambda v: v < ANDROID_RSRP_ALERT_DBM,
+         f"📶 *Sinyal Android lemah*\nDevice: `{serial}`\n"
+         f"RSRP < `{ANDROID_RSRP_ALERT_DBM:.0f} dBm` selama {ANDROID_SIGNAL_ALERT_MINUTES:.0f} menit"),
+        (f"android_batt_temp_{serial}", prefix + "batt_temp", lambda v: v >= ANDROID_BATT_TEMP_ALERT_C,
+         f"🔥 *Baterai Android panas*\nDevice: `{serial}`\n"
+         f"Suhu ≥ `{ANDROID_BATT_TEMP_ALERT_C:.0f}°C` selama {ANDROID_SIGNAL_ALERT_MINUTES:.0f} menit"),
+    ]
+    for key, series, predicate, msg in checks:
+        state = "ALERT" if metrics_sustained(series, ANDROID_SIGNAL_ALERT_MINUTES, predicate) else "OK"
+        if state == (alert_get(key) or "OK"):
+            continue
+        alert_set(key, state)
+        if state == "ALERT":
+            try:
+                await ctx.bot.send_message(chat_id=REPORT_CHAT_ID, text=msg, parse_mode="Markdown")
+            except Exception:
+                pass
+
+
 # ------------------ DB (Speedtest + Settings + Alerts) -----
 
+# kolom tambahan hasil speedtest (output JSON); ditambahkan ke DB lama lewat ALTER TABLE
+RESULTS_EXTRA_COLUMNS = (("server_id", "TEXT"), ("server_name", "TEXT"), ("isp", "TEXT"), ("bytes_down", "INTEGER"),
+                         ("bytes_up", "INTEGER"), ("latency_down_ms", "REAL"), ("latency_up_ms", "REAL"),
+                         ("source", "TEXT"))
+
 def db_connect():
 
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
@@ -1947,10 +3150,49 @@ def db_init():
 
     """)
 
+    have = {row[1] for row in cur.execute("PRAGMA table_info(results)")}
+    for col, ctype in RESULTS_EXTRA_COLUMNS:
+        if col not in have:
+            cur.execute(f"ALTER TABLE results ADD COLUMN {col} {ctype}")
+
     cur.execute("""CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)""")
 
     cur.execute("""CREATE TABLE IF NOT EXISTS alerts (key TEXT PRIMARY KEY, value TEXT)""")
 
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS android_rotations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            serial TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            ok INTEGER,
+            old_ip TEXT,
+            new_ip TEXT,
+            attempts INTEGER,
+            off_ms INTEGER,
+            reconnect_ms INTEGER,
+            total_ms INTEGER,
+            note TEXT
+        )
+    """)
+
+    # nama series disimpan sekali; titik hanya (sid, ts, value) supaya baris kecil di flash
+    cur.execute("CREATE TABLE IF NOT EXISTS metric_series (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS metric_points (
+            sid INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            value REAL,
+            PRIMARY KEY (sid, ts)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='metrics'")
+    if cur.fetchone():
+        # skema lama (series TEXT per baris) → pindahkan sekali lalu hapus
+        cur.execute("INSERT OR IGNORE INTO metric_series (name) SELECT DISTINCT series FROM metrics")
+        cur.execute("""INSERT OR REPLACE INTO metric_points (sid, ts, value)
+                       SELECT s.id, m.ts, m.value FROM metrics m JOIN metric_series s ON s.name = m.series""")
+        cur.execute("DROP TABLE metrics")
+
     conn.commit(); conn.close()
 
 
@@ -2047,13 +3289,19 @@ def alert_set(key: str, value: str):
 
 
 
-def db_insert_result(ts:int, latency:float, jitter:float, down:float, up:float, loss:float, url:str):
+def db_insert_result(ts:int, latency:float, jitter:float, down:float, up:float, loss:float, url:str,
+                     server_id:str="", server_name:str="", isp:str="", bytes_down:Optional[int]=None,
+                     bytes_up:Optional[int]=None, latency_down:Optional[float]=None, latency_up:Optional[float]=None,
+                     source:str="manual"):
 
     conn = db_connect(); cur = conn.cursor()
 
-    cur.execute("""INSERT INTO results (ts,latency_ms,jitter_ms,download_mbps,upload_mbps,loss_pct,url)
+    cur.execute("""INSERT INTO results (ts,latency_ms,jitter_ms,download_mbps,upload_mbps,loss_pct,url,
+                                        server_id,server_name,isp,bytes_down,bytes_up,latency_down_ms,latency_up_ms,source)
 
-                   VALUES (?,?,?,?,?,?,?)""", (ts, latency, jitter, down, up, loss, url))
+                   VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+                (ts, latency, jitter, down, up, loss, url, server_id, server_name, isp, bytes_down, bytes_up,
+                 latency_down, latency_up, source))
 
     conn.commit(); conn.close()
 
@@ -2083,35 +3331,224 @@ def db_fetch_latest(limit:int=5):
 
     conn = db_connect(); cur = conn.cursor()
 
-    cur.execute("SELECT ts,latency_ms,jitter_ms,download_mbps,upload_mbps,loss_pct,url FROM results ORDER BY id DESC LIMIT ?", (limit,))
+    cur.execute("""SELECT ts,latency_ms,jitter_ms,download_mbps,upload_mbps,loss_pct,url,server_name,latency_down_ms,latency_up_ms
+                   FROM results ORDER BY id DESC LIMIT ?""", (limit,))
 
     rows = cur.fetchall(); conn.close(); return rows
 
 
 
-# ------------------ SPEEDTEST BIN DETECTION -------
+def db_insert_rotation(rot: "AndroidRotation", keep: int = 200):
+    conn = db_connect(); cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1 FROM android_rotations LIMIT 1")
+    except sqlite3.OperationalError:
+        conn.close(); db_init()
+        conn = db_connect(); cur = conn.cursor()
+    cur.execute("""INSERT INTO android_rotations (serial,ts,ok,old_ip,new_ip,attempts,off_ms,reconnect_ms,total_ms,note)
+                   VALUES (?,?,?,?,?,?,?,?,?,?)""",
+                (rot.serial, rot.ts, int(rot.ok), rot.old_ip, rot.new_ip, rot.attempts,
+                 rot.off_ms, rot.reconnect_ms, rot.total_ms, rot.note))
+    cur.execute("""DELETE FROM android_rotations WHERE serial=? AND id NOT IN
+                   (SELECT id FROM android_rotations WHERE serial=? ORDER BY id DESC LIMIT ?)""",
+                (rot.serial, rot.serial, keep))
+    conn.commit(); conn.close()
 
-def find_speedtest_bin() -> Tuple[str, str]:
 
-    if SPEEDTEST_BIN_ENV:
 
-        base = os.path.basename(SPEEDTEST_BIN_ENV)
+def db_fetch_rotations(serial: str, limit: int = 10):
+    conn = db_connect(); cur = conn.cursor()
+    try:
+        cur.execute("""SELECT ts,ok,old_ip,new_ip,attempts,off_ms,reconnect_ms,total_ms,note
+                       FROM android_rotations WHERE serial=? ORDER BY id DESC LIMIT ?""", (serial, limit))
+        rows = cur.fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    conn.close(); return rows
 
-        return SPEEDTEST_BIN_ENV, ("ookla" if base == "speedtest" else "cli")
 
-    if which("speedtest"):     return "speedtest", "ookla"
 
-    if which("speedtest-cli"): return "speedtest-cli", "cli"
+# ---- Metrics (time-series ringkas: nama series di metric_series, titik (sid, ts, value) di metric_points) ----
+# metrics_add hanya menampung di memori; job_metrics_flush menulis batch ke DB (flash) dari executor tiap
+# METRICS_FLUSH_INTERVAL detik. Query menggabungkan titik DB dengan buffer sehingga alert tetap melihat data terbaru.
 
-    return "", ""
+METRICS_RETENTION_DAYS = int(os.getenv("RANET_METRICS_RETENTION_DAYS", "8"))
 
+METRICS_FLUSH_INTERVAL = int(os.getenv("RANET_METRICS_FLUSH_INTERVAL", "300"))
 
+METRICS_BUFFER: Dict[Tuple[str, int], float] = {}     # (series, ts) → value, belum ditulis
+_METRICS_BUF_LOCK = threading.Lock()
+_METRICS_DB_LOCK = threading.Lock()                    # flush & prune tidak boleh bersilang (cache id series)
+_METRIC_IDS: Dict[str, int] = {}
 
-# ------------------ VNSTAT HELPERS ----------------
 
-def autodetect_iface() -> str:
 
-    out = run_cmd("vnstat --iflist")
+def _metrics_conn():
+    conn = db_connect(); cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1 FROM metric_points LIMIT 1")
+    except sqlite3.OperationalError:
+        conn.close(); db_init()
+        conn = db_connect(); cur = conn.cursor()
+    return conn, cur
+
+
+
+def metrics_add(points: List[Tuple[str, int, float]]):
+    points = [(s, int(ts), float(v)) for s, ts, v in points if v is not None]
+    if not points:
+        return
+    with _METRICS_BUF_LOCK:
+        for s, ts, v in points:
+            METRICS_BUFFER[(s, ts)] = v
+
+
+
+def _metrics_buffered(series: str, since_ts: int) -> List[Tuple[int, float]]:
+    with _METRICS_BUF_LOCK:
+        return sorted((ts, v) for (s, ts), v in METRICS_BUFFER.items() if s == series and ts >= since_ts)
+
+
+
+def metrics_flush() -> int:
+    """Tulis buffer ke DB dalam satu transaksi (panggil dari executor). Return jumlah titik."""
+    with _METRICS_BUF_LOCK:
+        if not METRICS_BUFFER: return 0
+        batch = dict(METRICS_BUFFER)
+    with _METRICS_DB_LOCK:
+        conn, cur = _metrics_conn()
+        try:
+            for name in {s for s, _ in batch} - _METRIC_IDS.keys():
+                cur.execute("INSERT OR IGNORE INTO metric_series (name) VALUES (?)", (name,))
+                cur.execute("SELECT id FROM metric_series WHERE name=?", (name,))
+                _METRIC_IDS[name] = cur.fetchone()[0]
+            cur.executemany("INSERT OR REPLACE INTO metric_points (sid,ts,value) VALUES (?,?,?)",
+                            [(_METRIC_IDS[s], ts, v) for (s, ts), v in batch.items()])
+            conn.commit()
+        except Exception:
+            _METRIC_IDS.clear()        # id bisa tidak ikut ter-commit
+            raise
+        finally:
+            conn.close()
+    with _METRICS_BUF_LOCK:
+        for key, v in batch.items():
+            if METRICS_BUFFER.get(key) == v: del METRICS_BUFFER[key]
+    return len(batch)
+
+
+
+def metrics_query(series: str, since_ts: int, bucket: int = 0) -> List[Tuple[int, float]]:
+    """Ambil titik (ts, value) sejak since_ts; bucket>0 = rata-rata per bucket detik."""
+    conn, cur = _metrics_conn()
+    try:
+        cur.execute("""SELECT p.ts, p.value FROM metric_points p JOIN metric_series s ON s.id = p.sid
+                       WHERE s.name=? AND p.ts>=? ORDER BY p.ts""", (series, since_ts))
+        points = dict(cur.fetchall())
+    finally:
+        conn.close()
+    points.update(_metrics_buffered(series, since_ts))
+    rows = sorted(points.items())
+    if bucket <= 0:
+        return rows
+    sums: Dict[int, List[float]] = {}
+    for ts, v in rows:
+        acc = sums.setdefault(ts // bucket * bucket, [0.0, 0])
+        acc[0] += v; acc[1] += 1
+    return [(b, total / n) for b, (total, n) in sorted(sums.items())]
+
+
+
+def metrics_series(prefix: str) -> List[str]:
+    conn, cur = _metrics_conn()
+    cur.execute("SELECT name FROM metric_series WHERE name >= ? AND name < ?", (prefix, prefix + "\uffff"))
+    names = {r[0] for r in cur.fetchall()}; conn.close()
+    with _METRICS_BUF_LOCK:
+        names.update(s for s, _ in METRICS_BUFFER if s.startswith(prefix))
+    return sorted(names)
+
+
+
+def metrics_iter(prefix: str, since_ts: int = 0):
+    metrics_flush()
+    conn, cur = _metrics_conn()
+    try:
+        cur.execute("""SELECT s.name, p.ts, p.value FROM metric_points p JOIN metric_series s ON s.id = p.sid
+                       WHERE s.name >= ? AND s.name < ? AND p.ts >= ? ORDER BY s.name, p.ts""",
+                    (prefix, prefix + "\uffff", since_ts))
+        for row in cur:
+            yield row
+    finally:
+        conn.close()
+
+
+
+def metrics_prune(days: Optional[int] = None):
+    cutoff = int(time.time()) - int(days or METRICS_RETENTION_DAYS) * 86400
+    with _METRICS_DB_LOCK:
+        conn, cur = _metrics_conn()
+        cur.execute("DELETE FROM metric_points WHERE ts < ?", (cutoff,))
+        cur.execute("DELETE FROM metric_series WHERE id NOT IN (SELECT DISTINCT sid FROM metric_points)")
+        conn.commit(); conn.close()
+        _METRIC_IDS.clear()
+
+
+
+def metrics_sustained(series: str, minutes: float, predicate) -> bool:
+    """True jika semua sampel dalam `minutes` terakhir memenuhi predicate dan rentangnya cukup panjang."""
+    now = int(time.time())
+    window = int(minutes * 60)
+    rows = metrics_query(series, now - window)
+    if len(rows) < 2 or rows[-1][0] - rows[0][0] < window * 0.8:
+        return False
+    return all(predicate(v) for _, v in rows)
+
+
+
+def metrics_counter_delta(series: str, since_ts: int) -> float:
+    """Total kenaikan counter kumulatif (reset counter dianggap mulai dari nol)."""
+    rows = metrics_query(series, since_ts)
+    total = 0.0
+    for (_, prev), (_, cur) in zip(rows, rows[1:]):
+        total += cur - prev if cur >= prev else cur
+    return total
+
+
+
+def metrics_summary_line(label: str, series: str, since_ts: int, unit: str = "", points: int = 30) -> str:
+    span = max(1, int(time.time()) - since_ts)
+    rows = metrics_query(series, since_ts, bucket=max(1, span // points))
+    vals = [v for _, v in rows]
+    if not vals:
+        return f"{label}: (no data)"
+    return (f"{label}: {sparkline(vals)}\n"
+            f"   min {min(vals):.1f}{unit}  avg {sum(vals) / len(vals):.1f}{unit}  "
+            f"max {max(vals):.1f}{unit}  last {vals[-1]:.1f}{unit}")
+
+
+
+# ------------------ SPEEDTEST BIN DETECTION -------
+
+def find_speedtest_bin() -> Tuple[str, str]:
+
+    if SPEEDTEST_BIN_ENV:
+
+        base = os.path.basename(SPEEDTEST_BIN_ENV)
+
+        return SPEEDTEST_BIN_ENV, ("ookla" if base == "speedtest" else "cli")
+
+    if which("speedtest"):     return "speedtest", "ookla"
+
+    if which("speedtest-cli"): return "speedtest-cli", "cli"
+
+    return "", ""
+
+
+
+# ------------------ VNSTAT HELPERS ----------------
+
+def autodetect_iface() -> str:
+
+    out = run_cmd("vnstat --iflist")
 
     m = re.search(r"interfaces:\s*(.+)$", out, re.IGNORECASE | re.MULTILINE)
 
@@ -2327,6 +3764,10 @@ def get_openclash_status() -> str:
 
 
 
+    if not CAPS.has_init("openclash"):
+
+        return "⚪ openclash: not installed"
+
     init_stat = run_cmd("/etc/init.d/openclash status", timeout=5).lower()
 
     if "running" in init_stat:
@@ -2375,21 +3816,13 @@ def get_cpu_model_from_proc() -> str:
 
 def get_openwrt_syscfg() -> Tuple[Optional[str], Optional[str]]:
 
-    txt = run_cmd("cat /etc/config/system")
-
-    if txt.startswith("[ERR]"): return None, None
-
-    hn = None; zn = None
-
-    m1 = re.search(r"option\s+hostname\s+'([^']+)'", txt)
+    pkg = uci_load("system")
 
-    if m1: hn = m1.group(1)
+    sec = pkg.by_type("system")[0] if pkg and pkg.by_type("system") else None
 
-    m2 = re.search(r"option\s+zonename\s+'([^']+)'", txt)
+    if sec is None: return None, None
 
-    if m2: zn = m2.group(1)
-
-    return hn, zn
+    return sec.get("hostname"), sec.get("zonename")
 
 
 
@@ -2409,9 +3842,7 @@ def get_kernel() -> str: return run_cmd("uname -r")
 
 def get_uptime() -> str:
 
-    up = run_cmd("uptime -p")
-
-    if up.startswith("[ERR]"):
+    if CAPS.has_path("proc_uptime"):
 
         try:
 
@@ -2427,11 +3858,19 @@ def get_uptime() -> str:
 
             return f"{days} days, {hours} hours, {mins} minutes"
 
-        except:
+        except Exception:
+
+            pass
+
+    if CAPS.has_bin("uptime"):
 
-            return "Unknown"
+        up = run_cmd("uptime -p")
 
-    return up.replace("up ", "")
+        if not up.startswith("[ERR]"):
+
+            return up.replace("up ", "")
+
+    return "Unknown"
 
 
 
@@ -2439,7 +3878,7 @@ def get_temperature() -> Optional[float]:
 
     try:
 
-        for path in glob.glob("/sys/class/thermal/thermal_zone*/temp"):
+        for path in CAPS.thermal():
 
             with open(path) as f:
 
@@ -2453,7 +3892,7 @@ def get_temperature() -> Optional[float]:
 
     except: pass
 
-    s = run_cmd("sensors")
+    s = run_cmd("sensors") if CAPS.has_bin("sensors") else "[ERR] sensors tidak ada"
 
     if not s.startswith("[ERR]"):
 
@@ -2547,6 +3986,10 @@ def get_rootfs_info() -> Tuple[str, str, str, int]:
 
 def get_service_status(name: str) -> str:
 
+    if not CAPS.has_init(name):
+
+        return f"⚪ {name}: not installed"
+
     out = run_cmd(f"/etc/init.d/{name} status", timeout=5).lower()
 
     if "running" in out:
@@ -2639,35 +4082,7 @@ def parse_float_from_text(text: str) -> Optional[float]:
 
 # --------- Fix Jam (NTP sync) ----------
 
-def fix_system_time() -> str:
-
-    """
-
-    Jalankan langkah NTP:
-
-    - lihat waktu sebelum,
-
-    - set uci ntp,
-
-    - enable+restart sysntpd,
-
-    - lihat waktu sesudah.
-
-    Return string log.
-
-    """
-
-    logs = []
-
-    before = run_cmd("date")
-
-    logs.append("[BEFORE]")
-
-    logs.append(before)
-
-
-
-    cmds = [
+FIX_TIME_STEPS = [
 
     # Step 1: Set zona waktu permanen ke WIB (Asia/Jakarta)
 
@@ -2709,15 +4124,43 @@ def fix_system_time() -> str:
 
     "/etc/init.d/sysntpd enable",
 
-    ]
+]
 
 
 
-    for c in cmds:
+def fix_system_time() -> str:
+
+    """
+
+    Jalankan langkah NTP:
+
+    - lihat waktu sebelum,
+
+    - set uci ntp,
+
+    - enable+restart sysntpd,
+
+    - lihat waktu sesudah.
+
+    Return string log.
+
+    """
+
+    logs = []
+
+    before = run_cmd("date")
+
+    logs.append("[BEFORE]")
+
+    logs.append(before)
+
+
+
+    for c in FIX_TIME_STEPS:
 
         logs.append(f"$ {c}")
 
-        logs.append(run_shell(c))
+        logs.append(run_shell(c, cls="background"))
 
 
 
@@ -2733,6 +4176,24 @@ def fix_system_time() -> str:
 
 
 
+def fix_system_time_script() -> str:
+
+    # langkah yang sama dengan fix_system_time(), sebagai satu script untuk output streaming
+
+    lines = ["echo '[BEFORE]'", "date"]
+
+    for c in FIX_TIME_STEPS:
+
+        lines.append(f"echo {shlex.quote('$ ' + c)}")
+
+        lines.append(f"{{ {c} ; }} 2>&1")
+
+    lines += ["echo '[AFTER]'", "date"]
+
+    return "\n".join(lines)
+
+
+
 # ------------- Bot Update Helpers -------------
 
 def format_temperature(value: Optional[float]) -> str:
@@ -3089,6 +4550,14 @@ def _move_with_overwrite(src: str, dst: str, logs: list):
 
 
 
+def _discard_backup_result(fut):
+    # callback untuk backup yang dibatalkan: arsip yang telanjur jadi dihapus
+    with contextlib.suppress(Exception):
+        if fut.exception() is None:
+            os.remove(fut.result()[0])
+
+
+
 async def restore_with_progress(ctx: ContextTypes.DEFAULT_TYPE, query_msg, tgz_path: str) -> str:
 
     """
@@ -3121,7 +4590,7 @@ async def restore_with_progress(ctx: ContextTypes.DEFAULT_TYPE, query_msg, tgz_p
 
     try:
 
-        listing = run_shell(f"tar -tzf {shlex.quote(tgz_path)} | head -n 50")
+        listing = run_shell(f"tar -tzf {shlex.quote(tgz_path)} | head -n 50", cls="background")
 
         await edit_progress(msg, "🔍 Memeriksa arsip…\n" + code_block(listing or "(kosong)"))
 
@@ -3313,9 +4782,11 @@ async def restore_with_progress(ctx: ContextTypes.DEFAULT_TYPE, query_msg, tgz_p
 
 def _http_get(url: str, timeout: int = 4) -> str:
 
-    out = run_cmd(f"curl -4 -m {timeout} -fsSL {shlex.quote(url)}", timeout=timeout+1)
+    if which("curl"):
 
-    if not out.startswith("[ERR]") and out.strip(): return out.strip()
+        out = run_cmd(f"curl -4 -m {timeout} -fsSL {shlex.quote(url)}", timeout=timeout+1)
+
+        if not out.startswith("[ERR]") and out.strip(): return out.strip()
 
     if which("wget"):
 
@@ -3341,7 +4812,23 @@ def _http_get(url: str, timeout: int = 4) -> str:
 
 
 
-def get_public_ip() -> str:
+PUBLIC_IP_TTL = int(os.getenv("RANET_PUBLIC_IP_TTL", "900"))   # detik; dibuang lebih awal saat link/alamat berubah
+
+PUBLIC_IP_CACHE: Dict[str, Any] = {"ip": None, "ts": 0.0}
+
+
+
+def public_ip_invalidate():
+
+    PUBLIC_IP_CACHE["ip"] = None
+
+
+
+def get_public_ip(fresh: bool = False) -> str:
+
+    cached = PUBLIC_IP_CACHE["ip"]
+
+    if cached and not fresh and time.time() - PUBLIC_IP_CACHE["ts"] < PUBLIC_IP_TTL: return cached
 
     for url in [
 
@@ -3353,7 +4840,11 @@ def get_public_ip() -> str:
 
         ip = _http_get(url, timeout=4)
 
-        if re.match(r"^\d{1,3}(\.\d{1,3}){3}$", ip): return ip
+        if re.match(r"^\d{1,3}(\.\d{1,3}){3}$", ip):
+
+            PUBLIC_IP_CACHE.update(ip=ip, ts=time.time())
+
+            return ip
 
     return "Unknown"
 
@@ -3371,45 +4862,3724 @@ def get_isp() -> str:
 
 
 
-# ------------------ NETBIRD CACHE -----------------
+# ------------------ NETBIRD -----------------------
+# State `netbird status --json` disimpan di memori. NETBIRD.get() langsung mengembalikan snapshot terakhir
+# (boleh basi) dan memicu refresh di thread background bila umurnya lewat TTL (stale-while-revalidate).
+# Per peer dicatat ke metrics store: latency, relayed (0/1), umur handshake; perubahan P2P/Relayed disimpan di memori.
+NETBIRD_TTL = int(os.getenv("RANET_NETBIRD_TTL", "60"))
+NETBIRD_TIMEOUT = 30
+NETBIRD_SAMPLE_INTERVAL = int(os.getenv("RANET_NETBIRD_SAMPLE_INTERVAL", "120"))   # job sampling per peer
+NETBIRD_EVENTS = 100
 
-def netbird_status_update(force: bool=False, timeout: int = 90) -> str:
+@dataclass
+class NetbirdPeer:
+    fqdn: str
+    ip: str
+    pubkey: str = ""
+    status: str = ""                        # Connected / Idle / Connecting / Disconnected
+    conn_type: str = ""                     # P2P / Relayed
+    latency_ms: Optional[float] = None
+    handshake: Optional[float] = None       # epoch handshake WireGuard terakhir
+    endpoint: str = ""
+    rx: int = 0
+    tx: int = 0
+
+    @property
+    def name(self) -> str:
+        return self.fqdn.split(".")[0] or self.ip
+
+    @property
+    def connected(self) -> bool:
+        return self.status.lower() == "connected"
+
+    @property
+    def relayed(self) -> bool:
+        return self.conn_type.lower() == "relayed"
 
-    now = int(time.time())
+@dataclass
+class NetbirdState:
+    ts: float
+    ip: str = ""                            # "100.x.y.z/16"
+    fqdn: str = ""
+    version: str = ""
+    management: Optional[bool] = None
+    signal: Optional[bool] = None
+    peers: List[NetbirdPeer] = field(default_factory=list)
+    error: str = ""
+
+    @property
+    def addr(self) -> str:
+        return self.ip.split("/")[0]
+
+def _nb_time(value: Any) -> Optional[float]:
+    # RFC 3339 dari Go (nanodetik, "Z"); zero time (tahun 1) = belum pernah
+    if not isinstance(value, str) or not value or value.startswith("0001-"): return None
+    value = re.sub(r"(\.\d{6})\d+", r"\1", value).replace("Z", "+00:00")
+    with contextlib.suppress(ValueError):
+        return datetime.fromisoformat(value).timestamp()
+    return None
 
-    ts_s = settings_get("netbird_ts")
+def _nb_duration_ms(value: Any) -> Optional[float]:
+    # time.Duration di JSON = integer nanodetik; versi lama/format lain bisa string "12.3ms"
+    if isinstance(value, (int, float)): return value / 1e6 if value > 0 else None
+    m = re.fullmatch(r"([\d.]+)(ns|µs|us|ms|s)", str(value or "").strip())
+    if not m: return None
+    ms = float(m.group(1)) * {"ns": 1e-6, "µs": 1e-3, "us": 1e-3, "ms": 1.0, "s": 1000.0}[m.group(2)]
+    return ms or None
 
-    cached = settings_get("netbird_status")
+def netbird_parse_json(out: str) -> NetbirdState:
+    start = out.find("{")
+    try:
+        data = json.loads(out[start:]) if start >= 0 else None
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return NetbirdState(ts=time.time(), error=(out.strip().splitlines() or ["output kosong"])[-1][:200])
+    peers = []
+    for p in (data.get("peers") or {}).get("details") or []:
+        remote = (p.get("iceCandidateEndpoint") or {}).get("remote", "")
+        peers.append(NetbirdPeer(
+            fqdn=p.get("fqdn", ""), ip=p.get("netbirdIp", ""), pubkey=p.get("publicKey", ""), status=p.get("status", ""),
+            conn_type=p.get("connectionType", ""), latency_ms=_nb_duration_ms(p.get("latency")),
+            handshake=_nb_time(p.get("lastWireguardHandshake")),
+            endpoint=p.get("relayAddress", "") if p.get("connectionType", "").lower() == "relayed" else remote,
+            rx=int(p.get("transferReceived") or 0), tx=int(p.get("transferSent") or 0)))
+    return NetbirdState(ts=time.time(), ip=data.get("netbirdIp", ""), fqdn=data.get("fqdn", ""),
+                        version=data.get("daemonVersion") or data.get("cliVersion", ""),
+                        management=(data.get("management") or {}).get("connected"),
+                        signal=(data.get("signal") or {}).get("connected"), peers=peers)
+
+def netbird_parse_text(out: str) -> NetbirdState:
+    # netbird lama tanpa --json: cukup IP & status management/signal
+    field_ = lambda key: (re.search(rf"^{key}:\s*(.+)$", out, re.M) or [None, ""])[1].strip()
+    state = NetbirdState(ts=time.time(), ip=(re.search(r"NetBird IP:\s*([0-9./]+)", out) or [None, ""])[1],
+                         fqdn=field_("FQDN"), version=field_("Daemon version"))
+    if field_("Management"): state.management = field_("Management").startswith("Connected")
+    if field_("Signal"): state.signal = field_("Signal").startswith("Connected")
+    if not state.ip and out.startswith("[ERR]"): state.error = out.splitlines()[0][:200]
+    return state
+
+class NetbirdStatus:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()                  # satu `netbird status` sekaligus; _track ikut terserialisasi
+        self.state: Optional[NetbirdState] = None
+        self.refreshing = False                               # thread background dari get() sedang jalan
+        self.changes: deque = deque(maxlen=NETBIRD_EVENTS)    # (ts, nama peer, "P2P → Relayed")
+        self.last_sample = 0.0
+
+    def refresh(self, timeout: int = NETBIRD_TIMEOUT) -> NetbirdState:
+        """Sinkron (fork `netbird`); panggil dari executor/thread, bukan langsung di event loop."""
+        t0 = time.time()
+        with self.refresh_lock:
+            if self.state is not None and self.state.ts >= t0:
+                return self.state                             # refresh lain selesai selama menunggu lock
+            out = run_cmd("netbird status --json", timeout=timeout, cls="background")
+            if out.startswith("[ERR]") and re.search(r"unknown (flag|shorthand)", out):
+                state = netbird_parse_text(run_cmd("netbird status", timeout=timeout, cls="background"))
+            else:
+                state = netbird_parse_json(out)
+            with self.lock:
+                prev = self.state
+                if state.error and prev and not state.ip:
+                    state.ip, state.fqdn = prev.ip, prev.fqdn      # daemon sibuk/mati: IP wt0 biasanya tetap
+                self.state = state
+            self._track(prev, state)
+            if state.ip:
+                settings_set("netbird_status", json.dumps({"ts": int(state.ts), "ip": state.ip, "fqdn": state.fqdn}))
+            return state
+
+    def _refresh_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"[WARN] netbird refresh: {e}")
+        finally:
+            self.refreshing = False
+
+    def get(self, max_age: float = NETBIRD_TTL) -> Optional[NetbirdState]:
+        with self.lock:
+            state = self.state
+            if state is None: state = self.state = self._load_persisted()
+            spawn = state is not None and time.time() - state.ts > max_age and not self.refreshing
+            if spawn: self.refreshing = True
+        if state is None:
+            return self.refresh() if CAPS.has_bin("netbird") else None     # start dingin: sekali blocking
+        if spawn:
+            threading.Thread(target=self._refresh_background, name="netbird-refresh", daemon=True).start()
+        return state
+
+    def _load_persisted(self) -> Optional[NetbirdState]:
+        # setelah restart: IP terakhir dari settings (ts lama → langsung direvalidasi di background)
+        with contextlib.suppress(ValueError, TypeError, AttributeError):
+            data = json.loads(settings_get("netbird_status", "") or "{}")
+            if data.get("ip"): return NetbirdState(ts=0, ip=data["ip"], fqdn=data.get("fqdn", ""))
+        return None
 
-    if not force and ts_s:
+    def _track(self, prev: Optional[NetbirdState], state: NetbirdState):
+        if prev and prev.peers:
+            before = {p.pubkey or p.ip: p for p in prev.peers}
+            for p in state.peers:
+                old = before.get(p.pubkey or p.ip)
+                if old is None: continue
+                a = old.conn_type if old.connected else old.status
+                b = p.conn_type if p.connected else p.status
+                if a and b and a != b: self.changes.append((int(state.ts), p.name, f"{a} → {b}"))
+        if state.ts - self.last_sample < NETBIRD_SAMPLE_INTERVAL * 0.8 or state.error: return
+        self.last_sample = state.ts
+        now, pts = int(state.ts), []
+        for p in state.peers:
+            if not p.ip: continue
+            pts.append((f"nb:{p.ip}:connected", now, 1.0 if p.connected else 0.0))
+            if not p.connected: continue
+            pts.append((f"nb:{p.ip}:relayed", now, 1.0 if p.relayed else 0.0))
+            if p.latency_ms is not None: pts.append((f"nb:{p.ip}:latency_ms", now, p.latency_ms))
+            if p.handshake: pts.append((f"nb:{p.ip}:handshake_age", now, max(0.0, state.ts - p.handshake)))
+        with contextlib.suppress(Exception): metrics_add(pts)
+
+    def peer(self, key: str) -> Optional[NetbirdPeer]:
+        state = self.get()
+        return next((p for p in (state.peers if state else []) if key in (p.ip, p.pubkey, p.fqdn, p.name)), None)
+
+NETBIRD = NetbirdStatus()
 
+def get_netbird_ip_cached() -> Optional[str]:
+    state = NETBIRD.get()
+    return state.ip if state and state.ip else None
+
+def _nb_age(ts: Optional[float]) -> str:
+    if not ts: return "-"
+    age = int(time.time() - ts)
+    return f"{age}s" if age < 120 else f"{age // 60}m" if age < 7200 else f"{age // 3600}j"
+
+def netbird_status_text(state: Optional[NetbirdState]) -> str:
+    if state is None: return "NetBird tidak terpasang."
+    flag = lambda v: "✓" if v else ("✗" if v is not None else "?")
+    online = sum(p.connected for p in state.peers)
+    lines = [f"NetBird {state.ip or '-'}  {state.fqdn}{('  v' + state.version) if state.version else ''}",
+             f"Mgmt {flag(state.management)}  Signal {flag(state.signal)}  Peer {online}/{len(state.peers)} terhubung"
+             f"  (data {_nb_age(state.ts)} lalu)"]
+    if state.error: lines.append(f"! {state.error}")
+    if state.peers:
+        since = int(time.time()) - 86400
+        lines += ["", f"{'peer':<14}{'ip':<16}{'tipe':<8}{'lat':>6}{'hs':>5}  relay24j  latency24j"]
+        for p in sorted(state.peers, key=lambda p: (not p.connected, p.name)):
+            kind = p.conn_type if p.connected else p.status
+            lat = f"{p.latency_ms:.0f}ms" if p.latency_ms is not None and p.connected else "-"
+            relay = [v for _, v in metrics_query(f"nb:{p.ip}:relayed", since)]
+            lats = [v for _, v in metrics_query(f"nb:{p.ip}:latency_ms", since, bucket=3600)]
+            lines.append(f"{p.name[:13]:<14}{p.ip:<16}{kind[:7]:<8}{lat:>6}{_nb_age(p.handshake):>5}  "
+                         f"{(f'{100 * sum(relay) / len(relay):.0f}%' if relay else '-'):>8}  {sparkline(lats) if lats else ''}")
+    if NETBIRD.changes:
+        lines += ["", "Perubahan koneksi terakhir:"]
+        lines += [f"  {datetime.fromtimestamp(ts, TZ).strftime('%m-%d %H:%M')} {name}: {what}"
+                  for ts, name, what in list(NETBIRD.changes)[-8:]]
+    return "\n".join(lines)
+
+async def job_netbird_status(ctx: ContextTypes.DEFAULT_TYPE):
+    # sampling berkala supaya riwayat per peer tetap terisi walau tidak ada yang membuka menu
+    if not CAPS.has_bin("netbird"): return
+    await asyncio.get_running_loop().run_in_executor(None, NETBIRD.refresh)
+
+
+# ---- Sampler WireGuard (wg show all dump) ----
+# Tiap menit: counter rx/tx & handshake terakhir per peer → metrics store, throughput dari selisih sampel.
+# NetBird mode userspace tidak terlihat di `wg`, fallback ke transfer/handshake dari NETBIRD. Endpoint loopback
+# (proxy lokal NetBird) atau connectionType "Relayed" = lewat relay. Alert untuk peer yang dipantau (site):
+# tunnel idle (handshake basi terus-menerus) & jatuh ke relay.
+WG_SAMPLE_INTERVAL = int(os.getenv("RANET_WG_SAMPLE_INTERVAL", "60"))
+WG_STALE_SECONDS = int(os.getenv("RANET_WG_STALE_SECONDS", "180"))   # rekey WireGuard tiap 2 menit saat ada trafik
+WG_IDLE_MINUTES = float(os.getenv("RANET_WG_IDLE_MINUTES", "10"))
+WG_RELAY_SAMPLES = 2                                                 # sampel relay berturut-turut sebelum alert
+WG_WATCH_DEFAULT = os.getenv("RANET_WG_WATCH", "")                  # nama/IP/pubkey peer site, pisah koma
+
+@dataclass
+class WgPeer:
+    iface: str
+    pubkey: str
+    endpoint: str = ""
+    allowed: str = ""
+    handshake: int = 0                    # epoch; 0 = belum pernah
+    rx: int = 0
+    tx: int = 0
+    ts: float = 0.0
+    rx_bps: Optional[float] = None
+    tx_bps: Optional[float] = None
+    name: str = ""
+    ip: str = ""
+    relayed: bool = False
+
+    @property
+    def sid(self) -> str:
+        return self.pubkey[:10]
+
+    @property
+    def label(self) -> str:
+        return self.name or self.ip or self.sid
+
+    def hs_age(self, now: Optional[float] = None) -> Optional[float]:
+        return max(0.0, (now or self.ts) - self.handshake) if self.handshake else None
+
+    def stale(self, now: Optional[float] = None) -> bool:
+        age = self.hs_age(now)
+        return age is None or age > WG_STALE_SECONDS
+
+def wg_parse_dump(out: str, ts: float) -> List[WgPeer]:
+    peers = []
+    for line in out.splitlines():
+        f = line.split("\t")
+        if len(f) != 9: continue              # baris interface = 5 kolom
+        with contextlib.suppress(ValueError):
+            peers.append(WgPeer(iface=f[0], pubkey=f[1], endpoint="" if f[3] == "(none)" else f[3],
+                                allowed="" if f[4] == "(none)" else f[4], handshake=int(f[5]), rx=int(f[6]), tx=int(f[7]), ts=ts))
+    return peers
+
+def _wg_endpoint_local(endpoint: str) -> bool:
+    host = endpoint.rsplit(":", 1)[0].strip("[]")
+    return host.startswith("127.") or host == "::1"
+
+def wg_watch_list() -> List[str]:
+    raw = settings_get("wg_watch", WG_WATCH_DEFAULT) or ""
+    return [w for w in re.split(r"[\s,]+", raw) if w]
+
+class WgSampler:
+    def __init__(self):
+        self.peers: Dict[Tuple[str, str], WgPeer] = {}
+        self.source = ""
+        self.last_ts = 0.0
+        self.bot = None
+        self.relay_runs: Dict[str, int] = defaultdict(int)
+
+    async def collect(self) -> List[WgPeer]:
+        now = time.time()
+        out = await run_cmd_async(["wg", "show", "all", "dump"], timeout=10, cls="background") if CAPS.has_bin("wg") else "[ERR] wg tidak ada"
+        peers = wg_parse_dump(out, now) if not out.startswith("[ERR]") else []
+        nb = await asyncio.get_running_loop().run_in_executor(None, NETBIRD.get) if CAPS.has_bin("netbird") else None
+        nb_peers = {p.pubkey: p for p in (nb.peers if nb else [])}
+        self.source = "wg"
+        if not peers and nb_peers:
+            # netbird userspace (tanpa interface kernel): angka dari status daemon
+            self.source = "netbird"
+            peers = [WgPeer(iface="netbird", pubkey=p.pubkey, endpoint=p.endpoint, handshake=int(p.handshake or 0),
+                            rx=p.rx, tx=p.tx, ts=now) for p in nb_peers.values() if p.pubkey]
+        for p in peers:
+            meta = nb_peers.get(p.pubkey)
+            if meta:
+                p.name, p.ip = meta.name, meta.ip
+                p.relayed = meta.relayed or (meta.connected and _wg_endpoint_local(p.endpoint))
+            else:
+                p.relayed = _wg_endpoint_local(p.endpoint)
+        return peers
+
+    def update(self, peers: List[WgPeer]) -> List[Tuple[str, int, float]]:
+        pts: List[Tuple[str, int, float]] = []
+        seen = {}
+        for p in peers:
+            key = (p.iface, p.pubkey)
+            prev = self.peers.get(key)
+            if prev and p.ts > prev.ts and p.rx >= prev.rx and p.tx >= prev.tx:   # counter reset → lewati satu sampel
+                dt = p.ts - prev.ts
+                p.rx_bps, p.tx_bps = (p.rx - prev.rx) * 8 / dt, (p.tx - prev.tx) * 8 / dt
+            seen[key] = p
+            ts, base = int(p.ts), f"wg:{p.sid}"
+            pts += [(f"{base}:rx", ts, p.rx), (f"{base}:tx", ts, p.tx), (f"{base}:relayed", ts, 1.0 if p.relayed else 0.0),
+                    (f"{base}:hs_age", ts, p.ts - p.handshake)]      # belum pernah handshake → umur sangat besar
+            if p.rx_bps is not None: pts += [(f"{base}:rx_bps", ts, p.rx_bps), (f"{base}:tx_bps", ts, p.tx_bps)]
+        self.peers = seen
+        self.last_ts = time.time()
+        return pts
+
+    def watched(self) -> List[WgPeer]:
+        keys = wg_watch_list()
+        return [p for p in self.peers.values() if {p.name, p.ip, p.pubkey, p.sid} & set(keys)]
+
+    async def _alerts(self):
+        for p in self.watched():
+            self.relay_runs[p.pubkey] = self.relay_runs[p.pubkey] + 1 if p.relayed else 0
+            idle = metrics_sustained(f"wg:{p.sid}:hs_age", WG_IDLE_MINUTES, lambda v: v > WG_STALE_SECONDS)
+            for kind, bad in (("idle", idle), ("relay", self.relay_runs[p.pubkey] >= WG_RELAY_SAMPLES)):
+                key = f"wg_{kind}_{p.pubkey}"
+                state = "BAD" if bad else "OK"
+                if (alert_get(key) or "OK") == state: continue
+                if not bad and (p.stale() if kind == "idle" else p.relayed): continue   # pulih hanya bila benar-benar segar/P2P
+                alert_set(key, state)
+                if self.bot is None: continue
+                if kind == "idle":
+                    msg = (f"💤 *Tunnel idle*: `{p.label}` — handshake terakhir {_nb_age(p.handshake or None)} lalu "
+                           f"(> {WG_STALE_SECONDS}s selama {WG_IDLE_MINUTES:g} menit)." if bad else
+                           f"✅ *Tunnel aktif lagi*: `{p.label}` — handshake {_nb_age(p.handshake)} lalu.")
+                else:
+                    msg = (f"🔀 *Tunnel jatuh ke relay*: `{p.label}` (endpoint `{p.endpoint or '-'}`), P2P gagal." if bad else
+                           f"✅ *Tunnel kembali P2P*: `{p.label}` (endpoint `{p.endpoint or '-'}`).")
+                with contextlib.suppress(Exception):
+                    await self.bot.send_message(chat_id=REPORT_CHAT_ID, text=msg, parse_mode="Markdown")
+
+    async def sample(self) -> List[WgPeer]:
+        pts = self.update(await self.collect())
+        with contextlib.suppress(Exception): metrics_add(pts)
+        await self._alerts()
+        return list(self.peers.values())
+
+    def report_text(self) -> str:
+        if not self.peers:
+            return (f"Belum ada sampel WireGuard (sampler jalan tiap {WG_SAMPLE_INTERVAL}s; "
+                    "wg show all dump kosong / NetBird tidak terhubung).")
+        now = time.time()
+        watch = {p.pubkey for p in self.watched()}
+        rate = lambda v: f"{v / 1e6:.2f}" if v is not None else "-"
+        lines = [f"Sumber {self.source}, sampel {_nb_age(self.last_ts)} lalu, basi bila handshake > {WG_STALE_SECONDS}s",
+                 "", f"{'peer':<14}{'jalur':<7}{'hs':>6}{'rx Mbps':>9}{'tx Mbps':>9}  total rx/tx  rx 24j"]
+        since = int(now) - 86400
+        for p in sorted(self.peers.values(), key=lambda p: (p.stale(now), p.label)):
+            hs = _nb_age(p.handshake or None) + ("!" if p.stale(now) else "")
+            spark = [v for _, v in metrics_query(f"wg:{p.sid}:rx_bps", since, bucket=3600)]
+            lines.append(f"{('*' if p.pubkey in watch else '') + p.label[:12]:<14}{'relay' if p.relayed else 'p2p':<7}{hs:>6}"
+                         f"{rate(p.rx_bps):>9}{rate(p.tx_bps):>9}  {human_bytes(p.rx)}/{human_bytes(p.tx)}  {sparkline(spark) if spark else ''}")
+        stale = [p.label for p in self.peers.values() if p.stale(now)]
+        if stale: lines += ["", f"Basi ({len(stale)}): {', '.join(stale[:10])}"]
+        lines.append(f"Dipantau (*): {', '.join(wg_watch_list()) or '- (atur lewat tombol Pantau)'}")
+        return "\n".join(lines)
+
+WG_SAMPLER = WgSampler()
+
+async def job_wg_sampler(ctx: ContextTypes.DEFAULT_TYPE):
+    if not (CAPS.has_bin("wg") or CAPS.has_bin("netbird")): return
+    WG_SAMPLER.bot = ctx.bot
+    await WG_SAMPLER.sample()
+
+
+# ------------------ UBUS --------------------------
+# Klien ubus langsung ke socket ubusd (tanpa fork `ubus call`), plus listener event/notifikasi async.
+UBUS_SOCKET = os.getenv("RANET_UBUS_SOCKET", "") or next(
+    (p for p in ("/var/run/ubus/ubus.sock", "/var/run/ubus.sock") if os.path.exists(p)), "/var/run/ubus/ubus.sock")
+UBUS_TIMEOUT = 5.0
+UBUS_EVENT_PATTERNS = ("network.interface",)
+UBUS_SUBSCRIBE_PATTERNS = ("hostapd.*",)
+UBUS_EVENT_HISTORY = 100
+
+(UBUS_MSG_HELLO, UBUS_MSG_STATUS, UBUS_MSG_DATA, UBUS_MSG_PING, UBUS_MSG_LOOKUP, UBUS_MSG_INVOKE,
+ UBUS_MSG_ADD_OBJECT, UBUS_MSG_REMOVE_OBJECT, UBUS_MSG_SUBSCRIBE, UBUS_MSG_UNSUBSCRIBE, UBUS_MSG_NOTIFY) = range(11)
+(UBUS_ATTR_STATUS, UBUS_ATTR_OBJPATH, UBUS_ATTR_OBJID, UBUS_ATTR_METHOD, UBUS_ATTR_OBJTYPE, UBUS_ATTR_SIGNATURE,
+ UBUS_ATTR_DATA, UBUS_ATTR_TARGET, UBUS_ATTR_ACTIVE, UBUS_ATTR_NO_REPLY, UBUS_ATTR_SUBSCRIBERS) = range(1, 12)
+(BLOBMSG_ARRAY, BLOBMSG_TABLE, BLOBMSG_STRING, BLOBMSG_INT64, BLOBMSG_INT32, BLOBMSG_INT16, BLOBMSG_INT8,
+ BLOBMSG_DOUBLE) = range(1, 9)
+UBUS_SYSTEM_OBJECT_EVENT = 1
+UBUS_STATUS_TEXT = ["OK", "invalid command", "invalid argument", "method not found", "not found", "no data",
+                    "permission denied", "timeout", "not supported", "unknown error", "connection failed"]
+
+class UbusError(Exception):
+    def __init__(self, status: int, what: str = ""):
+        self.status = status
+        text = UBUS_STATUS_TEXT[status] if 0 <= status < len(UBUS_STATUS_TEXT) else f"status {status}"
+        super().__init__(f"{what}: {text}" if what else text)
+
+def _pad4(n: int) -> int:
+    return (n + 3) & ~3
+
+def _blob_attr(id_: int, payload: bytes, extended: bool = False) -> bytes:
+    head = (0x80000000 if extended else 0) | ((id_ & 0x7f) << 24) | (len(payload) + 4)
+    return struct.pack(">I", head) + payload + b"\0" * (_pad4(len(payload)) - len(payload))
+
+def _blob_iter(buf: bytes):
+    off = 0
+    while off + 4 <= len(buf):
+        (head,) = struct.unpack_from(">I", buf, off)
+        ln = head & 0xffffff
+        if ln < 4 or off + ln > len(buf): break
+        yield (head >> 24) & 0x7f, bool(head & 0x80000000), buf[off + 4:off + ln]
+        off += _pad4(ln)
+
+class BlobU32(int):
+    """int yang dikirim sebagai BLOBMSG_INT32 tanpa tanda (id objek ubusd acak 32-bit, bisa ≥ 2^31).
+    blobmsg_decode membacanya balik bertanda; ambil `v & 0xffffffff` bila perlu nilai aslinya."""
+
+def blobmsg_encode(value: Any, name: str = "") -> bytes:
+    nb = name.encode()
+    hdr = struct.pack(">H", len(nb)) + nb + b"\0"
+    hdr += b"\0" * (_pad4(len(hdr)) - len(hdr))
+    if isinstance(value, bool):
+        typ, data = BLOBMSG_INT8, bytes([1 if value else 0])
+    elif isinstance(value, int):
+        # simetris dengan blobmsg_decode (INT32 bertanda); u32 eksplisit lewat BlobU32
+        if isinstance(value, BlobU32): typ, data = BLOBMSG_INT32, struct.pack(">I", value & 0xffffffff)
+        elif -2**31 <= value < 2**31: typ, data = BLOBMSG_INT32, struct.pack(">i", value)
+        else: typ, data = BLOBMSG_INT64, struct.pack(">q", value)
+    elif isinstance(value, float):
+        typ, data = BLOBMSG_DOUBLE, struct.pack(">d", value)
+    elif isinstance(value, dict):
+        typ, data = BLOBMSG_TABLE, blobmsg_encode_table(value)
+    elif isinstance(value, (list, tuple)):
+        typ, data = BLOBMSG_ARRAY, b"".join(blobmsg_encode(v) for v in value if v is not None)
+    else:
+        typ, data = BLOBMSG_STRING, str(value).encode() + b"\0"
+    return _blob_attr(typ, hdr + data, extended=True)
+
+def blobmsg_encode_table(values: Dict[str, Any]) -> bytes:
+    return b"".join(blobmsg_encode(v, str(k)) for k, v in values.items() if v is not None)
+
+def blobmsg_decode(buf: bytes, array: bool = False):
+    out: Any = [] if array else {}
+    for typ, ext, payload in _blob_iter(buf):
+        if not ext or len(payload) < 2: continue
+        (nl,) = struct.unpack_from(">H", payload, 0)
+        name = payload[2:2 + nl].decode("utf-8", "replace")
+        data = payload[_pad4(2 + nl + 1):]
+        if typ == BLOBMSG_TABLE: val = blobmsg_decode(data)
+        elif typ == BLOBMSG_ARRAY: val = blobmsg_decode(data, array=True)
+        elif typ == BLOBMSG_STRING: val = data.split(b"\0", 1)[0].decode("utf-8", "replace")
+        elif typ == BLOBMSG_INT64: val = struct.unpack(">q", data[:8])[0]
+        elif typ == BLOBMSG_INT32: val = struct.unpack(">i", data[:4])[0]
+        elif typ == BLOBMSG_INT16: val = struct.unpack(">h", data[:2])[0]
+        elif typ == BLOBMSG_INT8: val = bool(data[0]) if data else False
+        elif typ == BLOBMSG_DOUBLE: val = struct.unpack(">d", data[:8])[0]
+        else: val = None
+        if array: out.append(val)
+        else: out[name] = val
+    return out
+
+def _ubus_u32(v: int) -> bytes: return struct.pack(">I", v & 0xffffffff)
+def _ubus_str(v: str) -> bytes: return v.encode() + b"\0"
+
+def ubus_pack(mtype: int, seq: int, peer: int, attrs: List[Tuple[int, bytes]]) -> bytes:
+    body = b"".join(_blob_attr(aid, data) for aid, data in attrs)
+    return struct.pack(">BBHI", 0, mtype, seq & 0xffff, peer & 0xffffffff) + _blob_attr(0, body)
+
+def ubus_unpack(hdr: bytes, blob: bytes) -> Tuple[int, int, int, Dict[int, bytes]]:
+    _ver, mtype, seq, peer = struct.unpack(">BBHI", hdr)
+    attrs = {aid: payload for aid, _ext, payload in _blob_iter(blob[4:])}
+    return mtype, seq, peer, attrs
+
+def _attr_u32(attrs: Dict[int, bytes], aid: int, default: int = 0) -> int:
+    v = attrs.get(aid)
+    return struct.unpack(">I", v[:4])[0] if v and len(v) >= 4 else default
+
+def _attr_str(attrs: Dict[int, bytes], aid: int) -> str:
+    return attrs.get(aid, b"").split(b"\0", 1)[0].decode("utf-8", "replace")
+
+class UbusClient:
+    """Koneksi sinkron tunggal ke ubusd; dipakai helper info (aman dipanggil dari thread mana pun)."""
+
+    def __init__(self, path: Optional[str] = None, timeout: float = UBUS_TIMEOUT):
+        self.path = path or UBUS_SOCKET
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+        self.peer = 0
+        self.seq = 0
+        self.ids: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
         try:
+            sock.connect(self.path)
+            self.sock = sock
+            mtype, _seq, peer, _attrs = self._recv()
+        except Exception:
+            self.sock = None
+            sock.close()
+            raise
+        if mtype != UBUS_MSG_HELLO:
+            self.close()
+            raise UbusError(10, "hello")
+        self.peer = peer
+
+    def close(self):
+        if self.sock:
+            with contextlib.suppress(Exception): self.sock.close()
+        self.sock = None
+        self.ids.clear()
+
+    def _read(self, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk: raise ConnectionError("ubusd menutup koneksi")
+            buf.extend(chunk)
+        return bytes(buf)
+
+    def _recv(self):
+        hdr = self._read(12)
+        ln = struct.unpack(">I", hdr[8:12])[0] & 0xffffff
+        blob = hdr[8:12] + (self._read(ln - 4) if ln > 4 else b"")
+        return ubus_unpack(hdr[:8], blob)
+
+    def _request(self, mtype: int, peer: int, attrs: List[Tuple[int, bytes]]) -> List[Dict[int, bytes]]:
+        self.seq = (self.seq + 1) & 0xffff
+        seq = self.seq
+        self.sock.sendall(ubus_pack(mtype, seq, peer, attrs))
+        replies: List[Dict[int, bytes]] = []
+        while True:
+            rtype, rseq, _rpeer, rattrs = self._recv()
+            if rseq != seq: continue
+            if rtype == UBUS_MSG_DATA:
+                replies.append(rattrs)
+            elif rtype == UBUS_MSG_STATUS:
+                status = _attr_u32(rattrs, UBUS_ATTR_STATUS)
+                if status: raise UbusError(status)
+                return replies
+
+    def _with_conn(self, fn):
+        with self.lock:
+            for attempt in (1, 2):
+                try:
+                    if self.sock is None: self._connect()
+                    return fn()
+                except UbusError:
+                    raise
+                except (OSError, ConnectionError, struct.error):
+                    self.close()
+                    if attempt == 2: raise
+
+    def lookup(self, pattern: str = "") -> Dict[str, int]:
+        def _do():
+            attrs = [(UBUS_ATTR_OBJPATH, _ubus_str(pattern))] if pattern else []
+            found = {}
+            for r in self._request(UBUS_MSG_LOOKUP, 0, attrs):
+                found[_attr_str(r, UBUS_ATTR_OBJPATH)] = _attr_u32(r, UBUS_ATTR_OBJID)
+            self.ids.update(found)
+            return found
+        return self._with_conn(_do)
+
+    def list_objects(self) -> List[str]:
+        return sorted(self.lookup())
+
+    def call(self, path: str, method: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        def _do():
+            oid = self.ids.get(path)
+            if oid is None:
+                found = self._request(UBUS_MSG_LOOKUP, 0, [(UBUS_ATTR_OBJPATH, _ubus_str(path))])
+                if not found: raise UbusError(4, path)
+                oid = self.ids[path] = _attr_u32(found[0], UBUS_ATTR_OBJID)
+            try:
+                replies = self._request(UBUS_MSG_INVOKE, oid, [(UBUS_ATTR_OBJID, _ubus_u32(oid)),
+                                                               (UBUS_ATTR_METHOD, _ubus_str(method)),
+                                                               (UBUS_ATTR_DATA, blobmsg_encode_table(data or {}))])
+            except UbusError as e:
+                if e.status == 4: self.ids.pop(path, None)  # objek hilang (service restart)
+                raise
+            result: Dict[str, Any] = {}
+            for r in replies:
+                if UBUS_ATTR_DATA in r: result.update(blobmsg_decode(r[UBUS_ATTR_DATA]))
+            return result
+        return self._with_conn(_do)
 
-            ts = int(ts_s)
+UBUS = UbusClient()
 
-            if now - ts < 24*3600 and cached:
+def ubus_call(path: str, method: str, data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Panggil ubus lewat socket; None bila ubusd/objek tidak tersedia (caller boleh fallback ke CLI)."""
+    if not CAPS.has_path("ubus_sock") and not os.path.exists(UBUS.path):
+        return None
+    try:
+        return UBUS.call(path, method, data)
+    except Exception as e:
+        print(f"[WARN] ubus {path} {method}: {e}")
+        return None
 
-                return cached
+# ---- ubus events ----
+UBUS_EVENTS: deque = deque(maxlen=UBUS_EVENT_HISTORY)   # (ts, sumber, nama, data)
+UBUS_EVENT_HOOKS: List[Tuple[str, Any]] = []             # (pola fnmatch, callback(name, data))
+
+def ubus_on_event(pattern: str, callback):
+    UBUS_EVENT_HOOKS.append((pattern, callback))
+
+class UbusListener:
+    """Koneksi async terpisah: register event handler (network.interface) & subscribe notifikasi (hostapd.*)."""
+
+    def __init__(self, path: Optional[str] = None, events=UBUS_EVENT_PATTERNS, subscribe=UBUS_SUBSCRIBE_PATTERNS):
+        self.path = path or UBUS_SOCKET
+        self.events = tuple(events)
+        self.sub_patterns = tuple(subscribe)
+        self.reader = self.writer = None
+        self.seq = 0
+        self.event_obj = self.sub_obj = 0
+        self.subscribed: Dict[str, int] = {}
+        self.connected = False
+        self.task: Optional[asyncio.Task] = None
+
+    async def _recv(self):
+        hdr = await self.reader.readexactly(12)
+        ln = struct.unpack(">I", hdr[8:12])[0] & 0xffffff
+        blob = hdr[8:12] + (await self.reader.readexactly(ln - 4) if ln > 4 else b"")
+        return ubus_unpack(hdr[:8], blob)
+
+    async def _send(self, mtype: int, seq: int, peer: int, attrs):
+        self.writer.write(ubus_pack(mtype, seq, peer, attrs))
+        await self.writer.drain()
+
+    async def _request(self, mtype: int, peer: int, attrs) -> List[Dict[int, bytes]]:
+        self.seq = (self.seq + 1) & 0xffff
+        seq = self.seq
+        await self._send(mtype, seq, peer, attrs)
+        replies = []
+        while True:
+            msg = await asyncio.wait_for(self._recv(), UBUS_TIMEOUT)
+            rtype, rseq, _peer, rattrs = msg
+            if rtype == UBUS_MSG_INVOKE:
+                await self._dispatch(msg); continue
+            if rseq != seq: continue
+            if rtype == UBUS_MSG_DATA:
+                replies.append(rattrs)
+            elif rtype == UBUS_MSG_STATUS:
+                status = _attr_u32(rattrs, UBUS_ATTR_STATUS)
+                if status: raise UbusError(status)
+                return replies
+
+    async def _add_object(self) -> int:
+        replies = await self._request(UBUS_MSG_ADD_OBJECT, 0, [])
+        return _attr_u32(replies[0], UBUS_ATTR_OBJID) if replies else 0
+
+    async def _subscribe_targets(self):
+        for pattern in self.sub_patterns:
+            found = await self._request(UBUS_MSG_LOOKUP, 0, [(UBUS_ATTR_OBJPATH, _ubus_str(pattern))])
+            for r in found:
+                path, oid = _attr_str(r, UBUS_ATTR_OBJPATH), _attr_u32(r, UBUS_ATTR_OBJID)
+                if self.subscribed.get(path) == oid: continue
+                with contextlib.suppress(UbusError):
+                    await self._request(UBUS_MSG_SUBSCRIBE, 0, [(UBUS_ATTR_OBJID, _ubus_u32(self.sub_obj)),
+                                                                (UBUS_ATTR_TARGET, _ubus_u32(oid))])
+                    self.subscribed[path] = oid
+
+    async def _setup(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        mtype, _seq, _peer, _attrs = await asyncio.wait_for(self._recv(), UBUS_TIMEOUT)
+        if mtype != UBUS_MSG_HELLO: raise UbusError(10, "hello")
+        self.subscribed.clear()
+        if self.events:
+            self.event_obj = await self._add_object()
+            for pattern in self.events:
+                await self._request(UBUS_MSG_INVOKE, UBUS_SYSTEM_OBJECT_EVENT, [
+                    (UBUS_ATTR_OBJID, _ubus_u32(UBUS_SYSTEM_OBJECT_EVENT)), (UBUS_ATTR_METHOD, _ubus_str("register")),
+                    (UBUS_ATTR_DATA, blobmsg_encode_table({"object": BlobU32(self.event_obj), "pattern": pattern}))])
+        if self.sub_patterns:
+            self.sub_obj = await self._add_object()
+            await self._subscribe_targets()
+        self.connected = True
+
+    async def _dispatch(self, msg):
+        _mtype, seq, peer, attrs = msg
+        target = _attr_u32(attrs, UBUS_ATTR_OBJID)
+        name = _attr_str(attrs, UBUS_ATTR_METHOD)
+        data = blobmsg_decode(attrs.get(UBUS_ATTR_DATA, b""))
+        if target == self.sub_obj and self.sub_obj:
+            source = next((p for p, oid in self.subscribed.items() if oid == peer), "notify")
+        else:
+            source = "event"
+        UBUS_EVENTS.append((int(time.time()), source, name, data))
+        for pattern, cb in list(UBUS_EVENT_HOOKS):
+            if fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(source, pattern):
+                try:
+                    res = cb(name, data)
+                    if asyncio.iscoroutine(res): await res
+                except Exception as e:
+                    print(f"[WARN] ubus hook {pattern}: {e}")
+        if not any(attrs.get(UBUS_ATTR_NO_REPLY, b"")):
+            await self._send(UBUS_MSG_STATUS, seq, peer, [(UBUS_ATTR_STATUS, _ubus_u32(0)),
+                                                          (UBUS_ATTR_OBJID, _ubus_u32(target))])
+
+    async def run(self):
+        backoff = 2
+        while True:
+            try:
+                await self._setup()
+                backoff = 2
+                last_rescan = time.time()
+                while True:
+                    try:
+                        msg = await asyncio.wait_for(self._recv(), 60)
+                    except asyncio.TimeoutError:
+                        msg = None
+                    if msg and msg[0] == UBUS_MSG_INVOKE:
+                        await self._dispatch(msg)
+                    elif msg and msg[0] == UBUS_MSG_UNSUBSCRIBE:
+                        self.subscribed = {p: o for p, o in self.subscribed.items() if o != msg[2]}
+                    if self.sub_patterns and time.time() - last_rescan >= 60:
+                        # objek hostapd.* baru (wifi reload) ikut di-subscribe
+                        last_rescan = time.time()
+                        await self._subscribe_targets()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARN] ubus listener: {e}; ulang dalam {backoff}s")
+            finally:
+                self.connected = False
+                if self.writer:
+                    with contextlib.suppress(Exception): self.writer.close()
+                self.reader = self.writer = None
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 300)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+UBUS_LISTENER = UbusListener()
+
+def ubus_events_text(limit: int = 30) -> str:
+    state = "terhubung" if UBUS_LISTENER.connected else "tidak terhubung"
+    lines = [f"ubus listener: {state} ({UBUS_LISTENER.path})",
+             f"subscribe: {', '.join(sorted(UBUS_LISTENER.subscribed)) or '-'}", ""]
+    for ts, source, name, data in list(UBUS_EVENTS)[-limit:]:
+        t = datetime.fromtimestamp(ts, TZ).strftime("%m-%d %H:%M:%S")
+        brief = json.dumps(data, separators=(",", ":"), sort_keys=True)
+        lines.append(f"{t} [{source}] {name} {brief[:120]}")
+    if not UBUS_EVENTS: lines.append("(belum ada event)")
+    return "\n".join(lines)
+
+async def job_ubus_listener(ctx: ContextTypes.DEFAULT_TYPE):
+    # dijalankan sekali setelah start; task hidup di loop dan bertahan saat Application di-rebuild
+    if CAPS.has_path("ubus_sock") or os.path.exists(UBUS_LISTENER.path):
+        UBUS_LISTENER.start()
+
+# ---- ubusd tiruan & self-check (python3 ra-bot.py --selftest-ubus) ----
+class UbusStandIn:
+    """ubusd minimal di unix socket lokal: HELLO, LOOKUP, ADD_OBJECT, INVOKE ke objek handler, event register/emit.
+    Id objek mulai 0x90000000 (≥ 2^31 seperti ubusd asli); register menolak "object" yang bukan INT32 (status 2)."""
+
+    OBJ_BASE = 0x90000000
+
+    def __init__(self, path: str, objects: Dict[str, Any]):
+        self.path = path
+        self.objects = {p: (self.OBJ_BASE + i, fn) for i, (p, fn) in enumerate(objects.items())}
+        self.next_obj = self.OBJ_BASE + 0x100
+        self.owners: Dict[int, socket.socket] = {}          # objek ADD_OBJECT → koneksi pemiliknya
+        self.events: List[Tuple[str, int]] = []              # (pola, objek) dari event register
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(4)
+        threading.Thread(target=self._accept, name="ubus-standin", daemon=True).start()
+
+    def close(self):
+        with contextlib.suppress(OSError): self.sock.close()
+
+    def _accept(self):
+        peer = 0x100
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            peer += 1
+            threading.Thread(target=self._serve, args=(conn, peer), daemon=True).start()
+
+    @staticmethod
+    def _read(conn: socket.socket, n: int) -> bytes:
+        buf = b""
+        while len(buf) < n:
+            chunk = conn.recv(n - len(buf))
+            if not chunk: raise ConnectionError("klien menutup koneksi")
+            buf += chunk
+        return buf
+
+    def _send(self, conn: socket.socket, mtype: int, seq: int, peer: int, attrs):
+        with self.lock: conn.sendall(ubus_pack(mtype, seq, peer, attrs))
+
+    def _serve(self, conn: socket.socket, peer: int):
+        with contextlib.suppress(OSError, ConnectionError, struct.error), conn:
+            self._send(conn, UBUS_MSG_HELLO, 0, peer, [])
+            while True:
+                hdr = self._read(conn, 12)
+                ln = struct.unpack(">I", hdr[8:12])[0] & 0xffffff
+                mtype, seq, target, attrs = ubus_unpack(hdr[:8], hdr[8:12] + self._read(conn, ln - 4))
+                if mtype == UBUS_MSG_STATUS: continue                   # balasan klien atas INVOKE event
+                status = self._handle(conn, mtype, seq, target, attrs)
+                self._send(conn, UBUS_MSG_STATUS, seq, target, [(UBUS_ATTR_STATUS, _ubus_u32(status))])
+
+    def _handle(self, conn, mtype: int, seq: int, target: int, attrs: Dict[int, bytes]) -> int:
+        if mtype == UBUS_MSG_LOOKUP:
+            pattern = _attr_str(attrs, UBUS_ATTR_OBJPATH) or "*"
+            found = [(p, oid) for p, (oid, _fn) in self.objects.items() if fnmatch.fnmatchcase(p, pattern)]
+            for p, oid in found:
+                self._send(conn, UBUS_MSG_DATA, seq, 0, [(UBUS_ATTR_OBJPATH, _ubus_str(p)), (UBUS_ATTR_OBJID, _ubus_u32(oid))])
+            return 0 if found else 4
+        if mtype == UBUS_MSG_ADD_OBJECT:
+            oid, self.next_obj = self.next_obj, self.next_obj + 1
+            self.owners[oid] = conn
+            self._send(conn, UBUS_MSG_DATA, seq, 0, [(UBUS_ATTR_OBJID, _ubus_u32(oid))])
+            return 0
+        if mtype != UBUS_MSG_INVOKE:
+            return 1
+        method, raw = _attr_str(attrs, UBUS_ATTR_METHOD), attrs.get(UBUS_ATTR_DATA, b"")
+        if target == UBUS_SYSTEM_OBJECT_EVENT:
+            if method != "register": return 3
+            types = {}
+            for typ, _ext, payload in _blob_iter(raw):
+                (nl,) = struct.unpack_from(">H", payload, 0)
+                types[payload[2:2 + nl].decode()] = typ
+            if types.get("object") != BLOBMSG_INT32: return 2
+            data = blobmsg_decode(raw)
+            self.events.append((data.get("pattern", "*"), data["object"] & 0xffffffff))
+            return 0
+        handler = next((fn for oid, fn in self.objects.values() if oid == target), None)
+        if handler is None: return 4
+        result = handler(method, blobmsg_decode(raw))
+        self._send(conn, UBUS_MSG_DATA, seq, target, [(UBUS_ATTR_DATA, blobmsg_encode_table(result or {}))])
+        return 0
+
+    def emit(self, name: str, data: Dict[str, Any]) -> int:
+        sent = 0
+        for pattern, oid in list(self.events):
+            conn = self.owners.get(oid)
+            if conn is None or not fnmatch.fnmatchcase(name, pattern): continue
+            self._send(conn, UBUS_MSG_INVOKE, 0, UBUS_SYSTEM_OBJECT_EVENT, [
+                (UBUS_ATTR_OBJID, _ubus_u32(oid)), (UBUS_ATTR_METHOD, _ubus_str(name)),
+                (UBUS_ATTR_DATA, blobmsg_encode_table(data)), (UBUS_ATTR_NO_REPLY, bytes([1]))])
+            sent += 1
+        return sent
+
+def ubus_selftest() -> int:
+    """Round-trip UbusClient.call & UbusListener lewat UbusStandIn. Return 0 bila semua cek lolos."""
+    sample = {"s": "teks", "i": -5, "i32max": 2**31 - 1, "big": 3_000_000_000, "neg": -3_000_000_000,
+              "f": 1.5, "b": True, "t": {"a": [1, "2", {"x": 0}]}}
+    checks: List[Tuple[str, bool]] = []
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "ubus.sock")
+        server = UbusStandIn(path, {"ranet.echo": lambda method, data: data})
+        try:
+            client = UbusClient(path, timeout=2.0)
+            got = client.call("ranet.echo", "echo", sample)
+            checks.append(("call round-trip int/INT64/double/bool/table", got == sample))
+            got = client.call("ranet.echo", "echo", {"id": BlobU32(0x90000000)})
+            checks.append(("BlobU32 sebagai INT32", got.get("id", 0) & 0xffffffff == 0x90000000))
+            checks.append(("lookup id objek ≥ 2^31", client.lookup("ranet.*").get("ranet.echo") == 0x90000000))
+            client.close()
+
+            async def _listen() -> bool:
+                listener = UbusListener(path, events=("ranet.*",), subscribe=())
+                task = asyncio.get_running_loop().create_task(listener.run())
+                try:
+                    for _ in range(50):
+                        if listener.connected: break
+                        await asyncio.sleep(0.05)
+                    before = len(UBUS_EVENTS)
+                    if not listener.connected or not server.emit("ranet.test", {"n": 3_000_000_000, "up": True}):
+                        return False
+                    for _ in range(50):
+                        if len(UBUS_EVENTS) > before: break
+                        await asyncio.sleep(0.05)
+                    return bool(UBUS_EVENTS) and UBUS_EVENTS[-1][1:] == ("event", "ranet.test", {"n": 3_000_000_000, "up": True})
+                finally:
+                    task.cancel()
+                    with contextlib.suppress(asyncio.CancelledError): await task
+            checks.append(("listener register (objek ≥ 2^31) & event", asyncio.run(_listen())))
+        finally:
+            server.close()
+    for what, ok in checks:
+        print(f"[{'OK' if ok else 'FAIL'}] {what}")
+    return 0 if all(ok for _, ok in checks) else 1
+
+
+
+# ------------------ NETLINK -----------------------
+# Listener RTNETLINK: tabel interface/status/alamat live dari event kernel, tanpa `ip`.
+LINK_ALERT_IFACES = [p for p in os.getenv("RANET_LINK_ALERT_IFACES", "").replace(",", " ").split() if p]
+NET_EVENT_HISTORY = 100
+
+RTM_NEWLINK, RTM_DELLINK, RTM_GETLINK = 16, 17, 18
+RTM_NEWADDR, RTM_DELADDR, RTM_GETADDR = 20, 21, 22
+NLMSG_ERROR, NLMSG_DONE = 2, 3
+NLM_F_REQUEST, NLM_F_DUMP = 0x1, 0x300
+RTMGRP_LINK, RTMGRP_IPV4_IFADDR, RTMGRP_IPV6_IFADDR = 0x1, 0x10, 0x100
+IFLA_ADDRESS, IFLA_IFNAME, IFLA_MTU, IFLA_OPERSTATE, IFLA_STATS64, IFLA_CARRIER = 1, 3, 4, 16, 23, 33
+IFA_ADDRESS, IFA_LOCAL = 1, 2
+IFF_UP, IFF_LOWER_UP = 0x1, 0x10000
+IF_OPER_STATES = ["unknown", "notpresent", "down", "lowerlayerdown", "testing", "dormant", "up"]
 
-        except: pass
+@dataclass
+class NetIface:
+    index: int
+    name: str = ""
+    flags: int = 0
+    operstate: int = 0
+    carrier: Optional[int] = None
+    mtu: int = 0
+    mac: str = ""
+    addrs: Dict[str, int] = field(default_factory=dict)     # "addr/prefix" -> family
+    stats: Tuple[int, ...] = ()                             # rx_pkt, tx_pkt, rx_bytes, tx_bytes, rx_err, tx_err, rx_drop, tx_drop
+    since: float = field(default_factory=time.time)         # waktu perubahan status terakhir
+
+    @property
+    def up(self) -> bool:
+        if not self.flags & IFF_UP: return False
+        return self.operstate == 6 or (self.operstate == 0 and bool(self.flags & IFF_LOWER_UP))
+
+    @property
+    def state(self) -> str:
+        if not self.flags & IFF_UP: return "admin-down"
+        return IF_OPER_STATES[self.operstate] if self.operstate < len(IF_OPER_STATES) else str(self.operstate)
+
+def _nl_messages(buf: bytes):
+    off = 0
+    while off + 16 <= len(buf):
+        ln, mtype, _flags, _seq, _pid = struct.unpack_from("=LHHLL", buf, off)
+        if ln < 16: break
+        yield mtype, buf[off + 16:off + ln]
+        off += (ln + 3) & ~3
+
+def _nl_attrs(buf: bytes, off: int) -> Dict[int, bytes]:
+    attrs = {}
+    while off + 4 <= len(buf):
+        ln, atype = struct.unpack_from("=HH", buf, off)
+        if ln < 4: break
+        attrs[atype & 0x3FFF] = buf[off + 4:off + ln]
+        off += (ln + 3) & ~3
+    return attrs
+
+NET_EVENTS: deque = deque(maxlen=NET_EVENT_HISTORY)     # (ts, ifname, teks)
+NET_HOOKS: List[Any] = []                               # cb(iface: NetIface, event: str) — "up"/"down"/"addr"/"new"/"del"
+
+def netlink_on_change(cb):
+    NET_HOOKS.append(cb)
+    return cb
+
+class NetlinkMonitor:
+    """Tabel interface dari dump RTM_GETLINK/GETADDR, diperbarui event multicast link/addr."""
+
+    def __init__(self):
+        self.ifaces: Dict[int, NetIface] = {}
+        self.lock = threading.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.connected = False
+        self.dumped = 0.0
+        self.seq = 0
+
+    def _socket(self, groups: int = 0) -> socket.socket:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.bind((0, groups))
+        return sock
+
+    def _dump(self, sock: socket.socket, mtype: int, body: bytes) -> List[Tuple[int, bytes]]:
+        self.seq += 1
+        sock.send(struct.pack("=LHHLL", 16 + len(body), mtype, NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0) + body)
+        out = []
+        while True:
+            for rtype, payload in _nl_messages(sock.recv(1 << 16)):
+                if rtype == NLMSG_DONE: return out
+                if rtype == NLMSG_ERROR:
+                    err = struct.unpack_from("=i", payload)[0]
+                    if err: raise OSError(-err, os.strerror(-err))
+                    return out
+                out.append((rtype, payload))
+
+    def refresh(self, addrs: bool = True):
+        """Dump ulang (satu syscall round-trip, bukan proses); dipakai saat start, ENOBUFS, dan untuk counter terbaru."""
+        with contextlib.closing(self._socket()) as sock:
+            sock.settimeout(3)
+            links = self._dump(sock, RTM_GETLINK, bytes(16))
+            addr_msgs = self._dump(sock, RTM_GETADDR, bytes(8)) if addrs else []
+        with self.lock:
+            seen = set()
+            for mtype, payload in links:
+                seen.add(self._apply_link(mtype, payload, notify=False))
+            for idx in set(self.ifaces) - seen:
+                self.ifaces.pop(idx, None)
+            if addrs:
+                for iface in self.ifaces.values(): iface.addrs.clear()
+                for mtype, payload in addr_msgs:
+                    self._apply_addr(mtype, payload)
+        self.dumped = time.time()
+
+    def _apply_link(self, mtype: int, payload: bytes, notify: bool = True) -> int:
+        _fam, _type, index, flags, _change = struct.unpack_from("=BxHiII", payload)
+        if mtype == RTM_DELLINK:
+            gone = self.ifaces.pop(index, None)
+            if gone and notify: self._event(gone, "del")
+            return index
+        a = _nl_attrs(payload, 16)
+        iface = self.ifaces.get(index)
+        fresh = iface is None
+        if fresh:
+            iface = self.ifaces[index] = NetIface(index)
+        was_up = iface.up
+        iface.flags = flags
+        if IFLA_IFNAME in a: iface.name = a[IFLA_IFNAME].rstrip(b"\0").decode(errors="replace")
+        if IFLA_OPERSTATE in a: iface.operstate = a[IFLA_OPERSTATE][0]
+        if IFLA_CARRIER in a: iface.carrier = a[IFLA_CARRIER][0]
+        if IFLA_MTU in a: iface.mtu = struct.unpack_from("=I", a[IFLA_MTU])[0]
+        if IFLA_ADDRESS in a: iface.mac = ":".join(f"{b:02x}" for b in a[IFLA_ADDRESS])
+        if IFLA_STATS64 in a and len(a[IFLA_STATS64]) >= 64:
+            iface.stats = struct.unpack_from("=8Q", a[IFLA_STATS64])
+        if notify and (fresh or iface.up != was_up):
+            iface.since = time.time()
+            self._event(iface, "new" if fresh else ("up" if iface.up else "down"))
+        return index
+
+    def _apply_addr(self, mtype: int, payload: bytes, notify: bool = False):
+        family, prefix, _flags, _scope, index = struct.unpack_from("=BBBBi", payload)
+        a = _nl_attrs(payload, 8)
+        raw = a.get(IFA_LOCAL) or a.get(IFA_ADDRESS)
+        iface = self.ifaces.get(index)
+        if raw is None or iface is None: return
+        try:
+            key = f"{socket.inet_ntop(family, raw)}/{prefix}"
+        except (ValueError, OSError):
+            return
+        if mtype == RTM_DELADDR:
+            if iface.addrs.pop(key, None) is None: return
+        elif key in iface.addrs:
+            return
+        else:
+            iface.addrs[key] = family
+        if notify: self._event(iface, "addr", f"{'+' if mtype == RTM_NEWADDR else '-'}{key}")
 
-    out = run_cmd("netbird status", timeout=timeout)
+    def _event(self, iface: NetIface, kind: str, detail: str = ""):
+        NET_EVENTS.append((int(time.time()), iface.name, f"{kind} {detail}".strip()))
+        for cb in list(NET_HOOKS):
+            try:
+                res = cb(iface, kind)
+                if asyncio.iscoroutine(res): asyncio.get_running_loop().create_task(res)
+            except Exception as e:
+                print(f"[WARN] netlink hook: {e}")
+
+    def handle(self, buf: bytes):
+        with self.lock:
+            for mtype, payload in _nl_messages(buf):
+                if mtype in (RTM_NEWLINK, RTM_DELLINK):
+                    self._apply_link(mtype, payload)
+                elif mtype in (RTM_NEWADDR, RTM_DELADDR):
+                    self._apply_addr(mtype, payload, notify=True)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        backoff = 2
+        while True:
+            sock = None
+            try:
+                sock = self._socket(RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR)
+                sock.setblocking(False)
+                await loop.run_in_executor(None, self.refresh)
+                self.connected = True; backoff = 2
+                while True:
+                    try:
+                        self.handle(await loop.sock_recv(sock, 1 << 16))
+                    except OSError as e:
+                        if e.errno != errno.ENOBUFS: raise
+                        await loop.run_in_executor(None, self.refresh)   # event hilang: sinkron ulang
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARN] netlink listener: {e}")
+            finally:
+                self.connected = False
+                if sock: sock.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 300)
 
-    settings_set("netbird_status", out)
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def snapshot(self, fresh: bool = False) -> List[NetIface]:
+        # tanpa listener (atau minta counter terbaru) cukup dump sekali; tetap tanpa fork
+        if fresh or not self.connected:
+            self.refresh()
+        with self.lock:
+            return sorted(self.ifaces.values(), key=lambda i: i.index)
+
+    def by_name(self, name: str) -> Optional[NetIface]:
+        with self.lock:
+            return next((i for i in self.ifaces.values() if i.name == name), None)
+
+NETLINK = NetlinkMonitor()
+
+def link_alert_patterns() -> List[str]:
+    # default: device WAN dari /etc/config/network + modem/tethering USB
+    if LINK_ALERT_IFACES: return LINK_ALERT_IFACES
+    pats = ["usb*", "wwan*", "rndis*"]
+    pkg = uci_load("network")
+    for sec in (pkg.by_type("interface") if pkg else []):
+        if sec.name.startswith(("wan", "wwan")):
+            dev = sec.get("device") or sec.get("ifname")
+            if isinstance(dev, list): dev = dev[0] if dev else None
+            if dev and not dev.startswith("@") and dev not in pats: pats.append(dev)
+    return pats
+
+NETLINK_BOT = None
+
+@netlink_on_change
+async def _netlink_link_alert(iface: NetIface, kind: str):
+    if kind not in ("up", "down") or NETLINK_BOT is None: return
+    if not any(fnmatch.fnmatchcase(iface.name, p) for p in link_alert_patterns()): return
+    key = f"link_state_{iface.name}"
+    state = "UP" if kind == "up" else "DOWN"
+    last = alert_get(key)
+    if state == last or (last is None and state == "UP"): return
+    alert_set(key, state)
+    ts = datetime.now(TZ).strftime('%Y-%m-%d %H:%M:%S %Z')
+    msg = (f"🟢 *Link UP*: `{iface.name}`" if state == "UP" else f"🔴 *Link DOWN*: `{iface.name}` ({iface.state})") + f"\nWaktu: `{ts}`"
+    with contextlib.suppress(Exception):
+        await NETLINK_BOT.send_message(chat_id=REPORT_CHAT_ID, text=msg, parse_mode="Markdown")
+
+@netlink_on_change
+def _netlink_public_ip(iface: NetIface, kind: str):
+    if iface.name != "lo" and kind in ("up", "down", "addr", "del"):
+        public_ip_invalidate()
 
-    settings_set("netbird_ts", str(now))
+def interfaces_overview_text() -> str:
+    try:
+        ifaces = NETLINK.snapshot(fresh=True)
+    except OSError:
+        addr = run_cmd("ip -o addr show")
+        stats = run_cmd("ip -s link show")
+        return f"=== ip addr ===\n{addr}\n\n=== ip -s link ===\n{stats}"
+    lines = []
+    for i in ifaces:
+        since = f"  sejak {datetime.fromtimestamp(i.since, TZ).strftime('%m-%d %H:%M')}" if NETLINK.connected else ""
+        lines.append(f"{i.index}: {i.name}  {'🟢' if i.up else '🔴'} {i.state}  mtu {i.mtu}  {i.mac}".rstrip() + since)
+        for addr, fam in sorted(i.addrs.items(), key=lambda kv: (kv[1] != socket.AF_INET, kv[0])):
+            lines.append(f"    {'inet ' if fam == socket.AF_INET else 'inet6'} {addr}")
+        if i.stats:
+            rxp, txp, rxb, txb, rxe, txe, rxd, txd = i.stats[:8]
+            lines.append(f"    RX {human_bytes(rxb)} ({rxp} pkt, err {rxe}, drop {rxd})")
+            lines.append(f"    TX {human_bytes(txb)} ({txp} pkt, err {txe}, drop {txd})")
+    if NET_EVENTS:
+        lines += ["", "=== event terakhir ==="]
+        for ts, name, what in list(NET_EVENTS)[-10:]:
+            lines.append(f"{datetime.fromtimestamp(ts, TZ).strftime('%m-%d %H:%M:%S')} {name} {what}")
+    return "\n".join(lines) or "(tidak ada interface)"
+
+async def job_netlink_listener(ctx: ContextTypes.DEFAULT_TYPE):
+    global NETLINK_BOT
+    NETLINK_BOT = ctx.bot
+    if hasattr(socket, "AF_NETLINK"):
+        NETLINK.start()
+
+
+# ------------------ USB WATCHDOG ------------------
+# Watchdog tethering USB di dalam event loop bot (pengganti loop usb-watchdog.sh): bereaksi ke event
+# carrier dari netlink, probe beberapa host paralel, lalu pemulihan bertahap iface → rebind USB → reboot.
+USB_WD_CONF = os.getenv("USB_WD_CONF", "/etc/usb-watchdog.conf")
+USB_WD_PROBE_TIMEOUT = float(os.getenv("RANET_USBWD_PROBE_TIMEOUT", "3"))
+USB_WD_SETTLE = int(os.getenv("RANET_USBWD_SETTLE", "30"))              # jeda setelah tindakan pemulihan
+USB_WD_REBOOT_MIN_UPTIME = int(os.getenv("RANET_USBWD_REBOOT_MIN_UPTIME", "900"))
+USB_WD_STAGES = ("iface", "usb", "reboot")
+USB_WD_STAGE_LABELS = {"iface": "restart interface", "usb": "rebind USB", "reboot": "reboot"}
+SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)
 
+@dataclass
+class UsbWatchdogConfig:
+    interface: str = "usb0"
+    interval: int = 15
+    attempts: int = 3
+    log_file: str = "/var/log/usb-watchdog.log"
+    logging: bool = True
+    hosts: Tuple[str, ...] = ("1.1.1.1:443", "8.8.8.8:443", "9.9.9.9:443")
+    stages: Tuple[str, ...] = USB_WD_STAGES
+
+    def text(self) -> str:
+        return (f"Interface      : {self.interface}\nCheck Interval : {self.interval} detik\n"
+                f"Max Attempts   : {self.attempts}\nProbe host     : {' '.join(self.hosts)}\n"
+                f"Pemulihan      : {' → '.join(USB_WD_STAGE_LABELS[s] for s in self.stages)}\n"
+                f"Log File       : {self.log_file} ({'aktif' if self.logging else 'nonaktif'})\n"
+                f"Config Path    : {USB_WD_CONF}")
+
+def _wd_uint(value: Any, minimum: int, default: int) -> int:
+    try:
+        return max(minimum, int(str(value).strip()))
+    except (TypeError, ValueError):
+        return default
+
+def _wd_bool(value: Any, default: bool = True) -> bool:
+    v = str(value or "").strip().lower()
+    if v in ("yes", "y", "true", "1", "enable", "enabled"): return True
+    if v in ("no", "n", "false", "0", "disable", "disabled"): return False
+    return default
+
+def usb_watchdog_load_config() -> UsbWatchdogConfig:
+    # format KEY=VALUE yang sama dengan usb-watchdog-setup.sh; key tambahan (PING_HOSTS, RECOVERY) diabaikan script
+    cfg = UsbWatchdogConfig()
+    try:
+        with open(USB_WD_CONF, encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return cfg
+    raw = {}
+    for line in lines:
+        key, eq, value = line.partition("=")
+        if eq and not key.lstrip().startswith("#"):
+            raw[key.strip().upper()] = value.strip().strip("'\"")
+    cfg.interface = raw.get("INTERFACE") or cfg.interface
+    cfg.interval = _wd_uint(raw.get("CHECK_INTERVAL"), 3, cfg.interval)
+    cfg.attempts = _wd_uint(raw.get("MAX_ATTEMPTS"), 1, cfg.attempts)
+    cfg.log_file = raw.get("LOG_FILE") or cfg.log_file
+    cfg.logging = _wd_bool(raw.get("LOGGING_ENABLED"), cfg.logging)
+    if raw.get("PING_HOSTS"):
+        cfg.hosts = tuple(raw["PING_HOSTS"].replace(",", " ").split())
+    if raw.get("RECOVERY"):
+        stages = tuple(s for s in raw["RECOVERY"].replace(",", " ").split() if s in USB_WD_STAGES)
+        cfg.stages = stages or cfg.stages
+    return cfg
+
+def usb_watchdog_save_config(cfg: UsbWatchdogConfig) -> str:
+    body = (f"# USB Watchdog configuration\nINTERFACE={cfg.interface}\nCHECK_INTERVAL={cfg.interval}\n"
+            f"MAX_ATTEMPTS={cfg.attempts}\nLOG_FILE={cfg.log_file}\nLOGGING_ENABLED={'yes' if cfg.logging else 'no'}\n"
+            f"PING_HOSTS={' '.join(cfg.hosts)}\nRECOVERY={','.join(cfg.stages)}\n")
+    try:
+        tmp = USB_WD_CONF + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, USB_WD_CONF)
+    except OSError as e:
+        return f"[ERR] Gagal menulis {USB_WD_CONF}: {e}"
+    return f"[OK] Konfigurasi tersimpan: {USB_WD_CONF}"
+
+def usb_watchdog_configure(params: Dict[str, Optional[str]]) -> str:
+    cfg = usb_watchdog_load_config()
+    cfg.interface = params.get("interface") or cfg.interface
+    cfg.interval = _wd_uint(params.get("interval"), 3, cfg.interval) if params.get("interval") else cfg.interval
+    cfg.attempts = _wd_uint(params.get("attempts"), 1, cfg.attempts) if params.get("attempts") else cfg.attempts
+    cfg.log_file = params.get("log_file") or cfg.log_file
+    if params.get("logging"): cfg.logging = _wd_bool(params["logging"], cfg.logging)
+    out = usb_watchdog_save_config(cfg)
+    USB_WATCHDOG.wake.set()
+    return out + "\n\n" + cfg.text()
+
+def _sysfs_read(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+def _sysfs_write(path: str, value: str):
+    with open(path, "w") as f:
+        f.write(value)
+
+@dataclass
+class WatchdogEvent:
+    ts: float
+    kind: str          # start/stop/ok/fail/carrier/stage/reboot/info
+    text: str
+
+class UsbWatchdog:
+    def __init__(self):
+        self.cfg = usb_watchdog_load_config()
+        self.events: deque = deque(maxlen=200)
+        self.task: Optional[asyncio.Task] = None
+        self.wake = asyncio.Event()
+        self.bot = None
+        self.state = "off"              # off/ok/fail/recovering
+        self.fails = 0
+        self.stage = 0                  # indeks tahap pemulihan berikutnya
+        self.last_check = 0.0
+        self.last_probe: List[Tuple[str, Optional[float], str]] = []   # (host, rtt_ms, error)
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def log(self, kind: str, text: str):
+        ev = WatchdogEvent(time.time(), kind, text)
+        self.events.append(ev)
+        if self.cfg.logging and self.cfg.log_file:
+            with contextlib.suppress(OSError):
+                os.makedirs(os.path.dirname(self.cfg.log_file) or "/", exist_ok=True)
+                with open(self.cfg.log_file, "a", encoding="utf-8") as f:
+                    f.write(f"{datetime.fromtimestamp(ev.ts).strftime('%Y-%m-%d %H:%M:%S')} {text}\n")
+
+    async def notify(self, text: str):
+        if self.bot is None: return
+        with contextlib.suppress(Exception):
+            await self.bot.send_message(chat_id=REPORT_CHAT_ID, text=text, parse_mode="Markdown")
+
+    def link_state(self) -> Tuple[bool, str]:
+        iface = NETLINK.by_name(self.cfg.interface) if NETLINK.connected else None
+        if iface is None:
+            base = f"/sys/class/net/{self.cfg.interface}"
+            if not os.path.isdir(base): return False, f"Interface {self.cfg.interface} tidak ditemukan"
+            oper = _sysfs_read(f"{base}/operstate")
+            return oper in ("up", "unknown", "dormant"), f"operstate {oper or '?'}"
+        if iface.up or iface.addrs: return True, iface.state
+        return False, f"Interface {iface.name} belum aktif ({iface.state})"
+
+    async def _probe_one(self, target: str) -> Tuple[str, Optional[float], str]:
+        try:
+            ipaddress.ip_address(target)                            # IP polos (termasuk IPv6 tanpa kurung)
+            host, port = target, 443
+        except ValueError:
+            m = re.fullmatch(r"\[?([^\]]+?)\]?(?::(\d+))?", target)  # host:port atau [ipv6]:port
+            host, port = (m.group(1), int(m.group(2) or 443)) if m else (target, 443)
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(loop.getaddrinfo(host, port, type=socket.SOCK_STREAM),
+                                           USB_WD_PROBE_TIMEOUT)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            return target, None, f"resolve: {e or 'timeout'}"
+        family, stype, proto, _, addr = infos[0]
+        sock = socket.socket(family, stype, proto)
+        sock.setblocking(False)
+        try:
+            with contextlib.suppress(OSError):   # butuh CAP_NET_RAW; tanpa itu probe lewat rute default
+                sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, self.cfg.interface.encode())
+            t0 = time.monotonic()
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, addr), USB_WD_PROBE_TIMEOUT)
+            except ConnectionRefusedError:
+                pass                                # RST dari host = jalur hidup
+            return target, (time.monotonic() - t0) * 1000, ""
+        except asyncio.TimeoutError:
+            return target, None, "timeout"
+        except OSError as e:
+            return target, None, e.strerror or str(e)
+        finally:
+            sock.close()
+
+    async def check(self) -> Tuple[bool, str]:
+        self.last_check = time.time()
+        ok, detail = self.link_state()
+        if not ok:
+            self.last_probe = []
+            return False, detail
+        self.last_probe = list(await asyncio.gather(*(self._probe_one(h) for h in self.cfg.hosts)))
+        if any(rtt is not None for _, rtt, _ in self.last_probe):
+            return True, detail
+        return False, f"Probe via {self.cfg.interface} gagal ke {' '.join(self.cfg.hosts)}"
+
+    def _uci_interface(self) -> Optional[str]:
+        pkg = uci_load("network")
+        for sec in (pkg.by_type("interface") if pkg else []):
+            dev = sec.get("device") or sec.get("ifname")
+            devs = dev if isinstance(dev, list) else [dev]
+            if self.cfg.interface in devs: return sec.name
+        return None
+
+    def _usb_device(self) -> Optional[str]:
+        try:
+            path = os.path.realpath(f"/sys/class/net/{self.cfg.interface}/device")
+        except OSError:
+            return None
+        while path and path != "/":
+            if re.fullmatch(r"\d+-[\d.]+", os.path.basename(path)): return path
+            path = os.path.dirname(path)
+        return None
+
+    async def _recover(self, stage: str) -> str:
+        loop = asyncio.get_running_loop()
+        if stage == "iface":
+            # ubus_call sinkron (timeout socket 5s) → executor, jangan tahan event loop
+            logical = await loop.run_in_executor(None, self._uci_interface)
+            if logical and await loop.run_in_executor(None, ubus_call, f"network.interface.{logical}", "down") is not None:
+                await asyncio.sleep(2)
+                await loop.run_in_executor(None, ubus_call, f"network.interface.{logical}", "up")
+                return f"ifdown/ifup {logical}"
+            dev = shlex.quote(self.cfg.interface)
+            out = await loop.run_in_executor(None, run_shell, f"ip link set dev {dev} down; sleep 2; ip link set dev {dev} up")
+            return f"ip link down/up {self.cfg.interface}" + (f": {out}" if out.startswith("[ERR]") else "")
+        if stage == "usb":
+            usb = self._usb_device()
+            if usb is None: return f"perangkat USB untuk {self.cfg.interface} tidak ditemukan"
+            name = os.path.basename(usb)
+            try:
+                _sysfs_write("/sys/bus/usb/drivers/usb/unbind", name)
+                await asyncio.sleep(3)
+                _sysfs_write("/sys/bus/usb/drivers/usb/bind", name)
+            except OSError as e:
+                return f"rebind {name} gagal: {e}"
+            return f"rebind USB {name}"
+        with contextlib.suppress(OSError, ValueError):
+            with open("/proc/uptime") as f:
+                if float(f.read().split()[0]) < USB_WD_REBOOT_MIN_UPTIME:
+                    return f"reboot ditahan (uptime < {USB_WD_REBOOT_MIN_UPTIME // 60} menit)"
+        await self.notify(f"🔁 *USB Watchdog*: `{self.cfg.interface}` tetap gagal, sistem reboot.")
+        self.log("reboot", "Batas kegagalan tercapai. Sistem reboot.")
+        await loop.run_in_executor(None, run_shell, "sync; sleep 2; reboot")
+        return "reboot"
+
+    def on_link(self, iface: NetIface, kind: str):
+        if iface.name == self.cfg.interface and kind in ("up", "down", "new", "del") and self.running:
+            self.log("carrier", f"Link {iface.name} {kind} ({iface.state})")
+            self.wake.set()
+
+    async def run(self):
+        self.log("start", f"Watchdog aktif untuk {self.cfg.interface}")
+        try:
+            while True:
+                self.cfg = usb_watchdog_load_config()
+                ok, detail = await self.check()
+                if ok:
+                    if self.state != "ok":
+                        self.log("ok", f"Koneksi interface {self.cfg.interface} normal")
+                        if self.stage:
+                            await self.notify(f"✅ *USB Watchdog*: `{self.cfg.interface}` pulih.")
+                    self.state, self.fails, self.stage = "ok", 0, 0
+                else:
+                    self.fails += 1
+                    self.state = "fail"
+                    self.log("fail", f"Deteksi kegagalan ({self.fails}/{self.cfg.attempts}) pada {self.cfg.interface}: {detail}")
+                    if self.fails >= self.cfg.attempts and self.cfg.stages:
+                        stage = self.cfg.stages[min(self.stage, len(self.cfg.stages) - 1)]
+                        self.state = "recovering"
+                        result = await self._recover(stage)
+                        self.log("stage", f"Pemulihan tahap {self.stage + 1} ({USB_WD_STAGE_LABELS[stage]}): {result}")
+                        if stage != "reboot":
+                            await self.notify(f"🛠️ *USB Watchdog*: `{self.cfg.interface}` gagal {self.fails}x → {result}")
+                        self.stage = min(self.stage + 1, len(self.cfg.stages) - 1)
+                        self.fails = 0
+                        await asyncio.sleep(USB_WD_SETTLE)
+                        continue
+                self.wake.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.wake.wait(), self.cfg.interval)
+        finally:
+            self.state = "off"
+            self.log("stop", "Watchdog berhenti")
+
+    def start(self, bot=None) -> str:
+        if bot is not None: self.bot = bot
+        if self.running: return "USB Watchdog sudah berjalan."
+        msg = ""
+        if usb_watchdog_available():
+            out = run_usb_watchdog_cmd("stop-service")   # jangan sampai dua watchdog me-reboot bersamaan
+            msg = "\nService script lama dihentikan." if "[ERR]" not in out else ""
+        self.wake = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        settings_set("usbwd_enabled", "1")
+        return f"▶️ USB Watchdog dimulai ({self.cfg.interface}).{msg}"
+
+    async def restart(self, bot=None) -> str:
+        if self.running:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+        self.fails = self.stage = 0
+        return self.start(bot)
+
+    def stop(self) -> str:
+        settings_set("usbwd_enabled", "0")
+        if not self.running: return "USB Watchdog tidak berjalan."
+        self.task.cancel()
+        return "⏹️ USB Watchdog dihentikan."
+
+    def status_text(self) -> str:
+        ok, detail = self.link_state()
+        lines = [f"Status : {self.state if self.running else 'off'}",
+                 f"Link   : {'🟢' if ok else '🔴'} {detail}",
+                 f"Gagal  : {self.fails}/{self.cfg.attempts}  | tahap berikut: "
+                 f"{USB_WD_STAGE_LABELS[self.cfg.stages[min(self.stage, len(self.cfg.stages) - 1)]] if self.cfg.stages else '-'}"]
+        if self.last_check:
+            lines.append(f"Cek    : {datetime.fromtimestamp(self.last_check, TZ).strftime('%H:%M:%S')}")
+            for host, rtt, err in self.last_probe:
+                lines.append(f"  {host:<22} " + (f"{rtt:.0f} ms" if rtt is not None else f"❌ {err}"))
+        return "\n".join(lines) + "\n\n" + self.cfg.text()
+
+    def events_text(self, limit: int = 30) -> str:
+        icons = {"start": "▶️", "stop": "⏹️", "ok": "✅", "fail": "❌", "carrier": "🔌", "stage": "🛠️", "reboot": "🔁"}
+        rows = [f"{datetime.fromtimestamp(e.ts, TZ).strftime('%m-%d %H:%M:%S')} {icons.get(e.kind, '•')} {e.text}"
+                for e in list(self.events)[-limit:]]
+        return "\n".join(rows) or "(belum ada event)"
+
+USB_WATCHDOG = UsbWatchdog()
+netlink_on_change(USB_WATCHDOG.on_link)
+
+def usb_watchdog_interfaces_text() -> str:
+    try:
+        ifaces = NETLINK.snapshot()
+    except OSError:
+        return run_usb_watchdog_cmd("list-if")
+    return "\n".join(f"{i.name:<16} {'🟢' if i.up else '🔴'} {i.state}" for i in ifaces if i.name != "lo")
+
+async def job_usb_watchdog(ctx: ContextTypes.DEFAULT_TYPE):
+    USB_WATCHDOG.bot = ctx.bot
+    if settings_get("usbwd_enabled") == "1" and not USB_WATCHDOG.running:
+        USB_WATCHDOG.start()
+
+
+# ------------------ LATENCY PROBER ----------------
+# Probe kontinu (default 1/s) ke beberapa target lewat satu socket ICMP bersama; fallback TCP connect bila
+# ICMP tidak diizinkan. RTT disimpan di ring buffer array: per detik 15 menit + histogram per menit 24 jam.
+PROBE_TARGETS_DEFAULT = os.getenv("RANET_PROBE_TARGETS", "1.1.1.1,8.8.8.8")
+PROBE_INTERVAL = max(1.0, float(os.getenv("RANET_PROBE_INTERVAL", "1")))
+PROBE_TIMEOUT = float(os.getenv("RANET_PROBE_TIMEOUT", "1.5"))
+PROBE_MODE = os.getenv("RANET_PROBE_MODE", "auto")              # auto | icmp | tcp
+PROBE_BURST_LOSS = int(os.getenv("RANET_PROBE_BURST_LOSS", "5"))   # probe hilang berturut-turut → alert
+PROBE_RAW_SLOTS = 900                                            # detik (15 menit)
+PROBE_MIN_SLOTS = 1440                                           # menit (24 jam)
+PROBE_HIST_EDGES = (1, 2, 3, 5, 7, 10, 15, 20, 30, 40, 50, 70, 100, 150, 200, 300, 500, 700, 1000, 2000, 5000)
+PROBE_WINDOWS = (("1m", 60), ("15m", 900), ("24h", 86400))
+
+def _pctl(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals: return float("nan")
+    k = (len(sorted_vals) - 1) * q
+    lo = int(k); hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+class ProbeWindow:
+    """Ring buffer ringkas satu target. Semua array dialokasikan sekali; record() O(1)."""
+    NB = len(PROBE_HIST_EDGES) + 1
+
+    def __init__(self):
+        self.raw_ts = array.array("l", [0]) * PROBE_RAW_SLOTS
+        self.raw_rtt = array.array("f", [0.0]) * PROBE_RAW_SLOTS      # NaN = hilang
+        self.min_key = array.array("l", [-1]) * PROBE_MIN_SLOTS
+        self.min_sent = array.array("H", [0]) * PROBE_MIN_SLOTS
+        self.min_lost = array.array("H", [0]) * PROBE_MIN_SLOTS
+        self.min_jit = array.array("f", [0.0]) * PROBE_MIN_SLOTS       # jumlah |Δrtt|
+        self.min_jitn = array.array("H", [0]) * PROBE_MIN_SLOTS
+        self.min_hist = array.array("H", [0]) * (PROBE_MIN_SLOTS * self.NB)
+        self.last_rtt: Optional[float] = None
+        self.lost_run = 0
+        self.ok_run = 0
+
+    def record(self, ts: int, rtt: Optional[float]):
+        slot = ts % PROBE_RAW_SLOTS
+        self.raw_ts[slot] = ts
+        self.raw_rtt[slot] = float("nan") if rtt is None else rtt
+        minute = ts // 60
+        m = minute % PROBE_MIN_SLOTS
+        if self.min_key[m] != minute:
+            self.min_key[m] = minute
+            self.min_sent[m] = self.min_lost[m] = self.min_jitn[m] = 0
+            self.min_jit[m] = 0.0
+            base = m * self.NB
+            for i in range(self.NB): self.min_hist[base + i] = 0
+        self.min_sent[m] = min(self.min_sent[m] + 1, 65535)
+        if rtt is None:
+            self.min_lost[m] = min(self.min_lost[m] + 1, 65535)
+            self.lost_run += 1; self.ok_run = 0
+            self.last_rtt = None
+            return
+        self.lost_run = 0; self.ok_run += 1
+        idx = next((i for i, edge in enumerate(PROBE_HIST_EDGES) if rtt <= edge), self.NB - 1)
+        h = m * self.NB + idx
+        self.min_hist[h] = min(self.min_hist[h] + 1, 65535)
+        if self.last_rtt is not None:
+            self.min_jit[m] += abs(rtt - self.last_rtt)
+            self.min_jitn[m] = min(self.min_jitn[m] + 1, 65535)
+        self.last_rtt = rtt
+
+    def stats(self, seconds: int, now: Optional[int] = None) -> Dict[str, float]:
+        now = int(now or time.time())
+        if seconds <= PROBE_RAW_SLOTS:
+            # sampel mentah: persentil eksak
+            vals, sent, prev, jit, jn = [], 0, None, 0.0, 0
+            for k in range(now - seconds + 1, now + 1):
+                slot = k % PROBE_RAW_SLOTS
+                if self.raw_ts[slot] != k: continue
+                sent += 1
+                v = self.raw_rtt[slot]
+                if v != v: prev = None; continue
+                vals.append(v)
+                if prev is not None: jit += abs(v - prev); jn += 1
+                prev = v
+            vals.sort()
+            return {"sent": sent, "lost": sent - len(vals), "p50": _pctl(vals, .5), "p95": _pctl(vals, .95),
+                    "p99": _pctl(vals, .99), "jitter": jit / jn if jn else float("nan"), "exact": 1}
+        # histogram per menit: persentil perkiraan (interpolasi di dalam bucket)
+        first = now // 60 - min(seconds // 60, PROBE_MIN_SLOTS) + 1
+        hist = [0] * self.NB
+        sent = lost = jn = 0; jit = 0.0
+        for minute in range(first, now // 60 + 1):
+            m = minute % PROBE_MIN_SLOTS
+            if self.min_key[m] != minute: continue
+            sent += self.min_sent[m]; lost += self.min_lost[m]
+            jit += self.min_jit[m]; jn += self.min_jitn[m]
+            base = m * self.NB
+            for i in range(self.NB): hist[i] += self.min_hist[base + i]
+        total = sum(hist)
+
+        def pct(q: float) -> float:
+            if not total: return float("nan")
+            target, acc = q * total, 0
+            for i, c in enumerate(hist):
+                if c and acc + c >= target:
+                    lo = PROBE_HIST_EDGES[i - 1] if i else 0.0
+                    hi = PROBE_HIST_EDGES[i] if i < len(PROBE_HIST_EDGES) else PROBE_HIST_EDGES[-1] * 2
+                    return lo + (hi - lo) * (target - acc) / c
+                acc += c
+            return float("nan")
+        return {"sent": sent, "lost": lost, "p50": pct(.5), "p95": pct(.95), "p99": pct(.99),
+                "jitter": jit / jn if jn else float("nan"), "exact": 0}
+
+@dataclass
+class ProbeTarget:
+    spec: str
+    host: str
+    port: Optional[int] = None          # diisi → probe TCP connect
+    addr: Optional[str] = None
+    resolved: float = 0.0
+    window: ProbeWindow = field(default_factory=ProbeWindow)
+    last_minute: int = 0
+
+def _icmp_checksum(data: bytes) -> int:
+    if len(data) % 2: data += b"\0"
+    s = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    s = (s >> 16) + (s & 0xFFFF); s += s >> 16
+    return ~s & 0xFFFF
+
+def probe_parse_targets(text: str) -> List[ProbeTarget]:
+    out = []
+    for spec in text.replace(",", " ").split():
+        m = re.fullmatch(r"(?:tcp://)?\[?([^\]\s]+?)\]?(?::(\d+))?", spec)
+        if not m: continue
+        port = int(m.group(2)) if m.group(2) else (443 if spec.startswith("tcp://") else None)
+        out.append(ProbeTarget(spec, m.group(1), port))
     return out
 
+class LatencyProber:
+    def __init__(self):
+        self.targets: Dict[str, ProbeTarget] = {}
+        self.sock: Optional[socket.socket] = None
+        self.raw = False
+        self.mode = "off"
+        self.ident = os.getpid() & 0xFFFF
+        self.seq = 0
+        self.pending: Dict[Tuple[str, int], Tuple[ProbeTarget, float, int]] = {}   # (addr, seq) -> target, mono, detik kirim
+        self.task: Optional[asyncio.Task] = None
+        self.bot = None
+        self.set_targets(settings_get("probe_targets") or PROBE_TARGETS_DEFAULT, save=False)
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def set_targets(self, text: str, save: bool = True) -> List[str]:
+        parsed = probe_parse_targets(text)
+        # target lama dipertahankan beserta riwayatnya
+        self.targets = {t.spec: self.targets.get(t.spec, t) for t in parsed}
+        if save: settings_set("probe_targets", " ".join(self.targets))
+        return list(self.targets)
+
+    def _open_icmp(self) -> Optional[str]:
+        if PROBE_MODE == "tcp": return None
+        for stype, raw in ((socket.SOCK_DGRAM, False), (socket.SOCK_RAW, True)):
+            try:
+                self.sock = socket.socket(socket.AF_INET, stype, socket.IPPROTO_ICMP)
+            except OSError:
+                continue
+            self.sock.setblocking(False)
+            self.raw = raw
+            return "icmp-raw" if raw else "icmp"
+        return None
 
+    def _on_readable(self):
+        while True:
+            try:
+                data, (src, _port) = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            now = time.monotonic()
+            if self.raw:
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8 or data[0] != 0: continue          # hanya echo reply
+            ident, seq = struct.unpack_from("!HH", data, 4)
+            if self.raw and ident != self.ident: continue
+            hit = self.pending.pop((src, seq), None)
+            if hit:
+                target, sent, ts = hit
+                self._record(target, (now - sent) * 1000, ts)
+
+    def _send_icmp(self, target: ProbeTarget, ts: int):
+        self.seq = (self.seq + 1) & 0xFFFF
+        try:
+            self.sock.sendto(icmp_echo_packet(self.ident, self.seq), (target.addr, 0))
+        except OSError:
+            self._record(target, None, ts); return
+        self.pending[(target.addr, self.seq)] = (target, time.monotonic(), ts)
+
+    async def _tcp_probe(self, target: ProbeTarget, ts: int):
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        t0 = time.monotonic()
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (target.addr, target.port or 443)), PROBE_TIMEOUT)
+            rtt: Optional[float] = (time.monotonic() - t0) * 1000
+        except ConnectionRefusedError:
+            rtt = (time.monotonic() - t0) * 1000       # RST juga jawaban
+        except (OSError, asyncio.TimeoutError):
+            rtt = None
+        finally:
+            sock.close()
+        self._record(target, rtt, ts)
+
+    def _record(self, target: ProbeTarget, rtt: Optional[float], ts: int):
+        # dicatat pada detik pengiriman, jadi satu slot per probe walau jawaban/timeout datang belakangan
+        target.window.record(ts, rtt)
+        w = target.window
+        if w.lost_run == PROBE_BURST_LOSS or (w.ok_run == PROBE_BURST_LOSS and alert_get(f"probe_loss_{target.spec}") == "BURST"):
+            asyncio.get_running_loop().create_task(self._burst_alert(target, w.lost_run >= PROBE_BURST_LOSS))
+        minute = ts // 60
+        if minute != target.last_minute:
+            # ringkasan menit sebelumnya ke metrics store untuk grafik jangka panjang
+            if target.last_minute:
+                st = w.stats(60, target.last_minute * 60 + 59)
+                if st["sent"]:
+                    pts = [(f"probe:{target.spec}:loss", target.last_minute * 60, 100.0 * st["lost"] / st["sent"])]
+                    if st["p50"] == st["p50"]: pts.append((f"probe:{target.spec}:p50", target.last_minute * 60, st["p50"]))
+                    with contextlib.suppress(Exception): metrics_add(pts)
+            target.last_minute = minute
+
+    async def _burst_alert(self, target: ProbeTarget, burst: bool):
+        key = f"probe_loss_{target.spec}"
+        state = "BURST" if burst else "OK"
+        if (alert_get(key) or "OK") == state: return
+        alert_set(key, state)
+        if self.bot is None: return
+        if burst:
+            msg = f"📉 *Packet loss*: `{target.spec}` — {PROBE_BURST_LOSS}+ probe berturut-turut hilang."
+        else:
+            st = target.window.stats(300)
+            msg = f"📈 *Pulih*: `{target.spec}` menjawab lagi (loss 5m {100.0 * st['lost'] / max(st['sent'], 1):.0f}%)."
+        with contextlib.suppress(Exception):
+            await self.bot.send_message(chat_id=REPORT_CHAT_ID, text=msg, parse_mode="Markdown")
 
-def get_netbird_ip_cached() -> Optional[str]:
+    async def _resolve(self, target: ProbeTarget):
+        if target.addr and time.time() - target.resolved < 600: return
+        try:
+            infos = await asyncio.wait_for(asyncio.get_running_loop().getaddrinfo(target.host, None, family=socket.AF_INET), 5)
+            target.addr, target.resolved = infos[0][4][0], time.time()
+        except (OSError, asyncio.TimeoutError):
+            target.resolved = time.time() - 540     # coba lagi ~1 menit lagi
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.mode = self._open_icmp() or "tcp"
+        if self.sock is not None:
+            loop.add_reader(self.sock.fileno(), self._on_readable)
+        try:
+            next_t = loop.time()
+            while True:
+                mono = time.monotonic()
+                for key, (target, sent, ts) in list(self.pending.items()):
+                    if mono - sent > PROBE_TIMEOUT:
+                        del self.pending[key]; self._record(target, None, ts)
+                now = int(time.time())
+                for target in list(self.targets.values()):
+                    await self._resolve(target)
+                    if not target.addr:
+                        self._record(target, None, now)
+                    elif self.sock is None or target.port:
+                        loop.create_task(self._tcp_probe(target, now))
+                    else:
+                        self._send_icmp(target, now)
+                next_t += PROBE_INTERVAL
+                await asyncio.sleep(max(0.0, next_t - loop.time()))
+        finally:
+            if self.sock is not None:
+                with contextlib.suppress(Exception): loop.remove_reader(self.sock.fileno())
+                self.sock.close(); self.sock = None
+            self.pending.clear()
+            self.mode = "off"
+
+    def start(self, bot=None) -> str:
+        if bot is not None: self.bot = bot
+        settings_set("probe_enabled", "1")
+        if self.running: return "Latency monitor sudah berjalan."
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        return f"▶️ Latency monitor aktif ({', '.join(self.targets) or '-'})."
+
+    def stop(self) -> str:
+        settings_set("probe_enabled", "0")
+        if not self.running: return "Latency monitor tidak berjalan."
+        self.task.cancel()
+        return "⏹️ Latency monitor dihentikan."
+
+    def report_text(self) -> str:
+        fmt = lambda v: f"{v:.1f}" if v == v else "-"
+        lines = [f"Mode: {self.mode}  | interval {PROBE_INTERVAL:g}s  | timeout {PROBE_TIMEOUT:g}s"]
+        for target in self.targets.values():
+            lines += ["", f"🎯 {target.spec}" + (f" ({target.addr})" if target.addr and target.addr != target.host else "")]
+            lines.append(f"{'':4}{'p50':>7}{'p95':>7}{'p99':>7}{'jit':>6}{'loss':>7}{'n':>7}")
+            for label, seconds in PROBE_WINDOWS:
+                st = target.window.stats(seconds)
+                loss = f"{100.0 * st['lost'] / st['sent']:.1f}%" if st["sent"] else "-"
+                pct = lambda v: ("" if st["exact"] or v != v else "≈") + fmt(v)
+                lines.append(f"{label:<4}{pct(st['p50']):>7}{pct(st['p95']):>7}{pct(st['p99']):>7}"
+                             f"{fmt(st['jitter']):>6}{loss:>7}{st['sent']:>7}")
+        return "\n".join(lines)
+
+LATENCY_PROBER = LatencyProber()
+
+async def job_latency_prober(ctx: ContextTypes.DEFAULT_TYPE):
+    LATENCY_PROBER.bot = ctx.bot
+    if (settings_get("probe_enabled") or os.getenv("RANET_PROBE_ENABLED", "1")) == "1" and not LATENCY_PROBER.running:
+        LATENCY_PROBER.start()
+
+
+# ---- ICMP tools (ping / trace / mtr) ----
+# Tanpa fork: echo ICMP dengan TTL per probe, jawaban & Time Exceeded dicocokkan lewat seq. Trace/MTR butuh
+# socket raw (root) untuk menerima error ICMP; tanpa itu /ping pakai socket datagram dan /trace jatuh ke traceroute.
+NETTOOLS_MAX_HOPS = 20
+NETTOOLS_PROBE_TIMEOUT = 2.0
+MTR_CYCLES_DEFAULT = int(os.getenv("RANET_MTR_CYCLES", "20"))
+_ICMP_IDS = itertools.count(1)
+
+def icmp_echo_packet(ident: int, seq: int) -> bytes:
+    payload = struct.pack("!d", time.time())
+    hdr = struct.pack("!BBHHH", 8, 0, 0, ident, seq)
+    return struct.pack("!BBHHH", 8, 0, _icmp_checksum(hdr + payload), ident, seq) + payload
+
+class IcmpSocket:
+    def __init__(self, need_errors: bool = False):
+        self.need_errors = need_errors
+        self.sock: Optional[socket.socket] = None
+        self.raw = False
+        self.ident = (os.getpid() + 0x8000 + next(_ICMP_IDS)) & 0xFFFF   # beda dari ident LatencyProber
+        self.seq = 0
+        self.waiting: Dict[int, asyncio.Future] = {}
+
+    def open(self) -> bool:
+        kinds = ((socket.SOCK_RAW, True),) if self.need_errors else ((socket.SOCK_DGRAM, False), (socket.SOCK_RAW, True))
+        for stype, raw in kinds:
+            try:
+                self.sock = socket.socket(socket.AF_INET, stype, socket.IPPROTO_ICMP)
+            except OSError:
+                continue
+            self.sock.setblocking(False)
+            self.raw = raw
+            asyncio.get_running_loop().add_reader(self.sock.fileno(), self._on_readable)
+            return True
+        return False
+
+    def close(self):
+        if self.sock is None: return
+        with contextlib.suppress(Exception): asyncio.get_running_loop().remove_reader(self.sock.fileno())
+        self.sock.close(); self.sock = None
+        for fut in self.waiting.values():
+            if not fut.done(): fut.cancel()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+
+    def _on_readable(self):
+        while self.sock is not None:
+            try:
+                data, (src, _port) = self.sock.recvfrom(2048)
+            except OSError:
+                return
+            now = time.monotonic()
+            if self.raw: data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8: continue
+            kind = {0: "reply", 11: "ttl", 3: "unreach"}.get(data[0])
+            if kind == "reply":
+                ident, seq = struct.unpack_from("!HH", data, 4)
+            elif kind and self.raw and len(data) >= 36:
+                inner = data[8:]                           # header IP + 8 byte ICMP asli kita
+                inner = inner[(inner[0] & 0x0F) * 4:]
+                if len(inner) < 8 or inner[0] != 8: continue
+                ident, seq = struct.unpack_from("!HH", inner, 4)
+            else:
+                continue
+            if self.raw and ident != self.ident: continue
+            fut = self.waiting.get(seq)
+            if fut and not fut.done(): fut.set_result((kind, src, now))
+
+    async def probe(self, addr: str, ttl: int = 64, timeout: float = NETTOOLS_PROBE_TIMEOUT) -> Tuple[str, Optional[str], Optional[float]]:
+        """Return (kind, responder, rtt_ms); kind: reply | ttl | unreach | timeout | error."""
+        self.seq = (self.seq + 1) & 0xFFFF
+        seq = self.seq
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting[seq] = fut
+        try:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+            t0 = time.monotonic()
+            self.sock.sendto(icmp_echo_packet(self.ident, seq), (addr, 0))
+            kind, src, t1 = await asyncio.wait_for(fut, timeout)
+            return kind, src, (t1 - t0) * 1000
+        except asyncio.TimeoutError:
+            return "timeout", None, None
+        except OSError as e:
+            return "error", e.strerror or str(e), None
+        finally:
+            self.waiting.pop(seq, None)
+
+async def resolve_ipv4(host: str) -> Optional[str]:
+    try:
+        infos = await asyncio.wait_for(asyncio.get_running_loop().getaddrinfo(host, None, family=socket.AF_INET), 5)
+        return infos[0][4][0]
+    except (OSError, asyncio.TimeoutError):
+        return None
+
+async def ping_stream(message, host: str, count: int = 5) -> str:
+    addr = await resolve_ipv4(host)
+    if addr is None:
+        await message.reply_text(f"❌ Host tidak bisa di-resolve: {host}"); return "resolve gagal"
+    isock = IcmpSocket()
+    if not isock.open():
+        out, code = await stream_command(message, f"ping {host}", ["ping", "-c", str(count), "-W", "2", host], 10 + count * 3)
+        return f"exit {code}"
+    live = LiveOutput(message, f"ping {host} ({addr})")
+    await live.start()
+    rtts: List[float] = []
+    loop = asyncio.get_running_loop()
+    try:
+        with isock:
+            for i in range(1, count + 1):
+                due = loop.time() + 1
+                kind, src, rtt = await isock.probe(addr)
+                if kind == "reply":
+                    rtts.append(rtt); live.feed(f"seq={i} dari {src}: time={rtt:.1f} ms\n")
+                else:
+                    live.feed(f"seq={i} {kind}{(' ' + src) if src else ''}\n")
+                await live.flush()
+                if i < count: await asyncio.sleep(max(0.0, due - loop.time()))
+    except asyncio.CancelledError:
+        await live.finish(ok=False, note="[dibatalkan]"); raise
+    loss = 100.0 * (count - len(rtts)) / count
+    summary = f"--- {count} dikirim, {len(rtts)} diterima, loss {loss:.0f}% ---"
+    if rtts:
+        avg = sum(rtts) / len(rtts)
+        mdev = math.sqrt(sum((r - avg) ** 2 for r in rtts) / len(rtts))
+        summary += f"\nrtt min/avg/max/mdev = {min(rtts):.1f}/{avg:.1f}/{max(rtts):.1f}/{mdev:.1f} ms"
+    live.feed(summary + "\n")
+    await live.finish(ok=bool(rtts))
+    return f"loss {loss:.0f}%"
+
+async def trace_stream(message, host: str, max_hops: int = NETTOOLS_MAX_HOPS) -> str:
+    addr = await resolve_ipv4(host)
+    if addr is None:
+        await message.reply_text(f"❌ Host tidak bisa di-resolve: {host}"); return "resolve gagal"
+    isock = IcmpSocket(need_errors=True)
+    if not isock.open():
+        if not which("traceroute"):
+            await message.reply_text("Traceroute tidak tersedia. Install: opkg install traceroute"); return "tidak tersedia"
+        _, code = await stream_command(message, f"traceroute {host}", ["traceroute", "-m", "15", host], 40, cls="interactive")
+        return f"exit {code}"
+    live = LiveOutput(message, f"trace {host} ({addr})")
+    await live.start()
+    reached = False
+    try:
+        with isock:
+            for ttl in range(1, max_hops + 1):
+                # 3 probe per hop dikirim bersamaan
+                res = await asyncio.gather(*(isock.probe(addr, ttl) for _ in range(3)))
+                hops = [src for _, src, _ in res if src]
+                times = "  ".join(f"{rtt:.1f} ms" if rtt is not None else "*" for _, _, rtt in res)
+                live.feed(f"{ttl:>2}  {hops[0] if hops else '*':<15}  {times}\n")
+                await live.flush()
+                if any(kind in ("reply", "unreach") for kind, _, _ in res):
+                    reached = True; break
+    except asyncio.CancelledError:
+        await live.finish(ok=False, note="[dibatalkan]"); raise
+    await live.finish(ok=reached, note="" if reached else f"[tujuan tidak tercapai dalam {max_hops} hop]")
+    return "sampai" if reached else "tidak sampai"
+
+@dataclass
+class MtrHop:
+    ttl: int
+    addrs: List[str] = field(default_factory=list)
+    sent: int = 0
+    rtts: List[float] = field(default_factory=list)
+    last: Optional[float] = None
+
+def mtr_table(host: str, hops: List[MtrHop], cycle: int, cycles: int) -> str:
+    fmt = lambda v: f"{v:.1f}" if v is not None and v == v else "-"
+    lines = [f"MTR {host}  siklus {cycle}/{cycles}",
+             f"{'hop':>3} {'host':<15} {'loss':>5} {'snt':>4} {'last':>6} {'p50':>6} {'p95':>6} {'worst':>6}"]
+    for h in hops:
+        s = sorted(h.rtts)
+        loss = 100.0 * (h.sent - len(h.rtts)) / h.sent if h.sent else 0.0
+        lines.append(f"{h.ttl:>3} {(h.addrs[0] if h.addrs else '???'):<15} {loss:>4.0f}% {h.sent:>4} {fmt(h.last):>6} "
+                     f"{fmt(_pctl(s, .5) if s else None):>6} {fmt(_pctl(s, .95) if s else None):>6} {fmt(s[-1] if s else None):>6}")
+        for extra in h.addrs[1:3]:
+            lines.append(f"{'':>3} {extra:<15}")
+    return "\n".join(lines)
+
+async def mtr_stream(message, host: str, cycles: int = MTR_CYCLES_DEFAULT, max_hops: int = NETTOOLS_MAX_HOPS) -> str:
+    addr = await resolve_ipv4(host)
+    if addr is None:
+        await message.reply_text(f"❌ Host tidak bisa di-resolve: {host}"); return "resolve gagal"
+    isock = IcmpSocket(need_errors=True)
+    if not isock.open():
+        await message.reply_text("❌ MTR butuh socket ICMP raw (jalankan bot sebagai root)."); return "tanpa raw socket"
+    live = LiveOutput(message, f"mtr {host} ({addr})")
+    await live.start()
+    loop = asyncio.get_running_loop()
+    hops: List[MtrHop] = []
+    try:
+        with isock:
+            last_edit = 0.0
+            for cycle in range(1, cycles + 1):
+                due = loop.time() + 1
+                n = len(hops) or max_hops      # siklus pertama: semua TTL, lalu dipangkas sampai tujuan
+                res = await asyncio.gather(*(isock.probe(addr, ttl, 1.5) for ttl in range(1, n + 1)))
+                if not hops:
+                    dest = next((i for i, (kind, _, _) in enumerate(res) if kind in ("reply", "unreach")), n - 1)
+                    hops = [MtrHop(ttl) for ttl in range(1, dest + 2)]
+                for hop, (kind, src, rtt) in zip(hops, res):
+                    hop.sent += 1
+                    hop.last = rtt if kind in ("reply", "ttl", "unreach") else None
+                    if hop.last is not None: hop.rtts.append(rtt)
+                    if src and kind != "error" and src not in hop.addrs: hop.addrs.append(src)
+                if loop.time() - last_edit >= STREAM_EDIT_INTERVAL or cycle == cycles:
+                    await live.show(mtr_table(host, hops, cycle, cycles)); last_edit = loop.time()
+                await asyncio.sleep(max(0.0, due - loop.time()))
+    except asyncio.CancelledError:
+        await live.finish(ok=False, note="[dibatalkan]"); raise
+    await live.finish(ok=True)
+    return f"{len(hops)} hop"
+
+async def nettools_start(message, application, tool: str, host: str, arg: Optional[int] = None):
+    # lewat registry operasi: berjalan di background (handler tidak menunggu) dan bisa dibatalkan dari /jobs
+    if not re.fullmatch(r"[A-Za-z0-9.:_-]{1,253}", host):
+        await message.reply_text("❌ Host tidak valid."); return
+    if tool == "ping":
+        factory = lambda op: ping_stream(message, host, max(1, min(arg or 5, 50)))
+    elif tool == "trace":
+        factory = lambda op: trace_stream(message, host)
+    else:
+        factory = lambda op: mtr_stream(message, host, max(1, min(arg or MTR_CYCLES_DEFAULT, 300)))
+    await op_start(message, application, "nettools", f"{tool} {host}", f"{tool} {host}", factory)
+
+
+# ------------------ HTTP CHECKER ------------------
+# Cek sintetis endpoint HTTP(S) per URL: DNS, TCP connect, TLS handshake, TTFB & total. Klien HTTP/1.1 asyncio
+# kecil dengan pool keep-alive per (scheme, host, port) — koneksi yang dipakai ulang tidak punya fase DNS/TCP/TLS.
+# Hasil ke metrics store (series http:<url>:<fase>), alert bila SLO dilanggar beberapa putaran berturut-turut.
+HTTPCHECK_TARGETS_DEFAULT = os.getenv("RANET_HTTPCHECK_TARGETS", "")
+HTTPCHECK_INTERVAL = max(30, int(os.getenv("RANET_HTTPCHECK_INTERVAL", "300")))
+HTTPCHECK_TIMEOUT = float(os.getenv("RANET_HTTPCHECK_TIMEOUT", "10"))
+HTTPCHECK_CONCURRENCY = max(1, int(os.getenv("RANET_HTTPCHECK_CONCURRENCY", "4")))
+HTTPCHECK_SLO_MS = int(os.getenv("RANET_HTTPCHECK_SLO_MS", "1500"))          # default SLO total per URL
+HTTPCHECK_SLO_BREACHES = int(os.getenv("RANET_HTTPCHECK_SLO_BREACHES", "3"))  # pelanggaran berturut-turut → alert
+HTTPCHECK_KEEPALIVE = int(os.getenv("RANET_HTTPCHECK_KEEPALIVE", "90"))       # detik koneksi idle disimpan di pool
+HTTPCHECK_MAX_BODY = 256 * 1024
+HTTPCHECK_HISTORY = 288
+HTTPCHECK_PHASES = ("dns", "connect", "tls", "ttfb", "total")
+_HTTP_SSL: Dict[bool, Any] = {}
+
+@dataclass
+class HttpResult:
+    ts: int
+    status: int = 0
+    dns: Optional[float] = None          # ms; None = tidak ada fase ini (koneksi dipakai ulang / http biasa)
+    connect: Optional[float] = None
+    tls: Optional[float] = None
+    ttfb: Optional[float] = None         # dari request terkirim sampai byte pertama jawaban
+    total: Optional[float] = None
+    nbytes: int = 0
+    reused: bool = False
+    error: str = ""
+
+@dataclass
+class HttpTarget:
+    url: str
+    scheme: str
+    host: str
+    port: int
+    netloc: str
+    path: str
+    slo_ms: int = HTTPCHECK_SLO_MS
+    expect: str = ""                     # "" = status < 400; atau "200", "2xx,301", ...
+    insecure: bool = False               # tanpa verifikasi sertifikat (captive portal / server uji lokal)
+    history: deque = field(default_factory=lambda: deque(maxlen=HTTPCHECK_HISTORY))
+    fails: int = 0
+
+    @property
+    def spec(self) -> str:
+        opts = [self.url]
+        if self.slo_ms != HTTPCHECK_SLO_MS: opts.append(f"slo={self.slo_ms}")
+        if self.expect: opts.append(f"expect={self.expect}")
+        if self.insecure: opts.append("insecure")
+        return " ".join(opts)
+
+    def status_ok(self, status: int) -> bool:
+        if not self.expect: return 200 <= status < 400
+        for tok in self.expect.split(","):
+            tok = tok.strip().lower()
+            if tok.endswith("xx") and tok[:1].isdigit() and status // 100 == int(tok[0]): return True
+            if tok.isdigit() and status == int(tok): return True
+        return False
+
+    def up(self, res: HttpResult) -> bool:
+        return not res.error and self.status_ok(res.status)
+
+    def breach(self, res: HttpResult) -> Optional[str]:
+        if res.error: return res.error
+        if not self.status_ok(res.status): return f"status {res.status}"
+        if res.total is not None and res.total > self.slo_ms: return f"{res.total:.0f}ms > {self.slo_ms}ms"
+        return None
+
+def httpcheck_parse_targets(text: str) -> List[HttpTarget]:
+    """Satu target per baris: `URL [slo=ms] [expect=200,3xx] [insecure]`."""
+    out, seen = [], set()
+    for line in text.replace(";", "\n").splitlines():
+        words = line.split()
+        if not words: continue
+        parts = urllib.parse.urlsplit(words[0])
+        if parts.scheme not in ("http", "https") or not parts.hostname: continue
+        try:
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+        except ValueError:
+            continue
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        t = HttpTarget(words[0], parts.scheme, parts.hostname, port, parts.netloc.rpartition("@")[2], path)
+        for opt in words[1:]:
+            key, _, val = opt.partition("=")
+            if key == "slo" and val.isdigit(): t.slo_ms = int(val)
+            elif key == "expect" and val: t.expect = val
+            elif key == "insecure": t.insecure = True
+        if t.url not in seen:
+            seen.add(t.url); out.append(t)
+    return out
+
+def _http_ssl_context(insecure: bool):
+    if insecure not in _HTTP_SSL:
+        import ssl
+        ctx = ssl.create_default_context()
+        if insecure:
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        _HTTP_SSL[insecure] = ctx
+    return _HTTP_SSL[insecure]
+
+class HttpPool:
+    """Koneksi keep-alive idle per (scheme, host, port, insecure)."""
+    MAX_IDLE = 4
+
+    def __init__(self):
+        self.idle: Dict[Tuple[str, str, int, bool], List[Tuple[Any, Any, float]]] = defaultdict(list)
+
+    def get(self, key):
+        conns = self.idle.get(key) or []
+        while conns:
+            reader, writer, since = conns.pop()
+            if not writer.is_closing() and not reader.at_eof() and time.monotonic() - since < HTTPCHECK_KEEPALIVE:
+                return reader, writer
+            writer.close()
+        return None
+
+    def put(self, key, reader, writer):
+        conns = self.idle[key]
+        if len(conns) >= self.MAX_IDLE:
+            writer.close(); return
+        conns.append((reader, writer, time.monotonic()))
+
+    def close_all(self):
+        for conns in self.idle.values():
+            for _, writer, _ in conns: writer.close()
+        self.idle.clear()
+
+async def _http_read_body(reader, headers: Dict[str, str], step) -> Tuple[int, bool]:
+    """Baca (dan buang) body; return (bytes, selesai-rapi) — hanya yang rapi boleh dipakai ulang."""
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        n = 0
+        while True:
+            size = int((await step(reader.readline())).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                while (await step(reader.readline())) not in (b"\r\n", b"\n", b""): pass
+                return n, True
+            if n + size > HTTPCHECK_MAX_BODY: return n, False
+            await step(reader.readexactly(size + 2)); n += size
+    if "content-length" in headers:
+        left = int(headers["content-length"])
+        if left > HTTPCHECK_MAX_BODY:
+            await step(reader.readexactly(HTTPCHECK_MAX_BODY)); return HTTPCHECK_MAX_BODY, False
+        await step(reader.readexactly(left)); return left, True
+    data = await step(reader.read(HTTPCHECK_MAX_BODY))    # tanpa panjang: sampai koneksi ditutup
+    return len(data), False
+
+async def http_fetch(target: HttpTarget, pool: Optional[HttpPool] = None, timeout: float = HTTPCHECK_TIMEOUT) -> HttpResult:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    step = lambda aw: asyncio.wait_for(aw, max(0.001, deadline - loop.time()))
+    ms = lambda a, b: (b - a) * 1000
+    key = (target.scheme, target.host, target.port, target.insecure)
+    res = HttpResult(ts=int(time.time()))
+    t_start = loop.time()
+    for attempt in (0, 1):
+        conn = pool.get(key) if pool is not None and attempt == 0 else None
+        res.reused = conn is not None
+        writer = None
+        phase = "DNS"
+        try:
+            if conn is None:
+                t0 = loop.time()
+                infos = await step(loop.getaddrinfo(target.host, target.port, type=socket.SOCK_STREAM))
+                t1 = loop.time(); res.dns = ms(t0, t1)
+                family, stype, proto, _, addr = infos[0]
+                sock = socket.socket(family, stype, proto)
+                sock.setblocking(False)
+                phase = "connect"
+                try:
+                    await step(loop.sock_connect(sock, addr))
+                except BaseException:
+                    sock.close(); raise
+                t2 = loop.time(); res.connect = ms(t1, t2)
+                phase = "TLS"
+                ctx = _http_ssl_context(target.insecure) if target.scheme == "https" else None
+                reader, writer = await step(asyncio.open_connection(sock=sock, ssl=ctx, server_hostname=target.host if ctx else None))
+                if ctx: res.tls = ms(t2, loop.time())
+            else:
+                reader, writer = conn
+            phase = "request"
+            writer.write((f"GET {target.path} HTTP/1.1\r\nHost: {target.netloc}\r\nUser-Agent: RANetBot-HTTPCheck\r\n"
+                          "Accept: */*\r\nAccept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n").encode("latin-1"))
+            t_req = loop.time()
+            await step(writer.drain())
+            status_line = await step(reader.readline())
+            if not status_line:
+                raise ConnectionResetError("koneksi ditutup server")
+            res.ttfb = ms(t_req, loop.time())
+            phase = "response"
+            proto_ver, _, rest = status_line.decode("latin-1").partition(" ")
+            res.status = int(rest[:3])
+            headers: Dict[str, str] = {}
+            while True:
+                line = await step(reader.readline())
+                if line in (b"\r\n", b"\n", b""): break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if res.status in (204, 304) or 100 <= res.status < 200:
+                clean = True
+            else:
+                res.nbytes, clean = await _http_read_body(reader, headers, step)
+            res.total = ms(t_start, loop.time())
+            if (pool is not None and clean and proto_ver == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"):
+                pool.put(key, reader, writer)
+            else:
+                writer.close()
+            return res
+        except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError) as e:
+            if writer is not None: writer.close()
+            if res.reused and attempt == 0 and res.ttfb is None:
+                continue              # koneksi keep-alive basi: ulang sekali dengan koneksi baru
+            res.error = f"{phase}: {e.__class__.__name__}"
+        except asyncio.TimeoutError:
+            if writer is not None: writer.close()
+            res.error = f"{phase}: timeout"
+        except (OSError, ValueError) as e:
+            if writer is not None: writer.close()
+            detail = getattr(e, "verify_message", None) or getattr(e, "reason", None)     # ssl.SSLError
+            if not detail and isinstance(e, OSError) and e.errno: detail = os.strerror(e.errno)
+            res.error = f"{phase}: {detail or e}"
+        res.total = ms(t_start, loop.time())
+        return res
+    return res
+
+class HttpChecker:
+    def __init__(self):
+        self.targets: Dict[str, HttpTarget] = {}
+        self.pool = HttpPool()
+        self.sem = asyncio.Semaphore(HTTPCHECK_CONCURRENCY)
+        self.task: Optional[asyncio.Task] = None
+        self.bot = None
+        self.last_round = 0
+        self.set_targets(settings_get("httpcheck_targets") or HTTPCHECK_TARGETS_DEFAULT, save=False)
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def set_targets(self, text: str, save: bool = True) -> List[str]:
+        parsed = httpcheck_parse_targets(text)
+        for t in parsed:
+            old = self.targets.get(t.url)
+            if old: t.history, t.fails = old.history, old.fails
+        self.targets = {t.url: t for t in parsed}
+        if save: settings_set("httpcheck_targets", "\n".join(t.spec for t in parsed))
+        return [t.spec for t in parsed]
+
+    async def check(self, target: HttpTarget) -> HttpResult:
+        async with self.sem:
+            res = await http_fetch(target, self.pool)
+        target.history.append(res)
+        pts = [(f"http:{target.url}:{p}", res.ts, getattr(res, p)) for p in HTTPCHECK_PHASES]
+        pts.append((f"http:{target.url}:up", res.ts, 1.0 if target.up(res) else 0.0))
+        with contextlib.suppress(Exception): metrics_add(pts)
+        await self._slo(target, res)
+        return res
+
+    async def _slo(self, target: HttpTarget, res: HttpResult):
+        why = target.breach(res)
+        target.fails = target.fails + 1 if why else 0
+        key = f"httpcheck_{target.url}"
+        if why and target.fails < HTTPCHECK_SLO_BREACHES: return
+        state = "BREACH" if why else "OK"
+        if (alert_get(key) or "OK") == state: return
+        alert_set(key, state)
+        if self.bot is None: return
+        if why:
+            msg = f"🚨 *SLO HTTP dilanggar*: `{target.url}` — {target.fails} cek berturut-turut (`{why}`)."
+        else:
+            msg = f"✅ *SLO HTTP pulih*: `{target.url}` — {res.status} dalam {res.total:.0f}ms."
+        with contextlib.suppress(Exception):
+            await self.bot.send_message(chat_id=REPORT_CHAT_ID, text=msg, parse_mode="Markdown")
+
+    async def run_once(self) -> List[HttpResult]:
+        self.last_round = int(time.time())
+        return await asyncio.gather(*(self.check(t) for t in list(self.targets.values())))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            next_t = loop.time()
+            while True:
+                if self.targets: await self.run_once()
+                next_t += HTTPCHECK_INTERVAL
+                await asyncio.sleep(max(0.0, next_t - loop.time()))
+        finally:
+            self.pool.close_all()
+
+    def start(self, bot=None) -> str:
+        if bot is not None: self.bot = bot
+        settings_set("httpcheck_enabled", "1")
+        if self.running: return "HTTP checker sudah berjalan."
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        return f"▶️ HTTP checker aktif ({len(self.targets)} URL, tiap {HTTPCHECK_INTERVAL}s)."
+
+    def stop(self) -> str:
+        settings_set("httpcheck_enabled", "0")
+        if not self.running: return "HTTP checker tidak berjalan."
+        self.task.cancel()
+        return "⏹️ HTTP checker dihentikan."
+
+    def report_text(self) -> str:
+        fmt = lambda v: "-" if v is None or v != v else f"{v:.0f}"
+        state = "aktif" if self.running else "mati"
+        lines = [f"HTTP checker {state} | interval {HTTPCHECK_INTERVAL}s | paralel {HTTPCHECK_CONCURRENCY} | timeout {HTTPCHECK_TIMEOUT:g}s"]
+        if not self.targets:
+            lines.append("(belum ada URL)")
+        for t in self.targets.values():
+            lines += ["", f"🌐 {t.url}", f"   SLO {t.slo_ms}ms" + (f"  expect {t.expect}" if t.expect else "")
+                      + ("  (tanpa verifikasi TLS)" if t.insecure else "")]
+            if not t.history:
+                lines.append("   (belum dicek)"); continue
+            r = t.history[-1]
+            when = datetime.fromtimestamp(r.ts, TZ).strftime("%H:%M:%S")
+            head = r.error or f"HTTP {r.status}"
+            lines.append(f"   {when} {head}" + ("  ⚠️" if t.breach(r) else "") + ("  (reuse)" if r.reused else ""))
+            lines.append(f"   dns {fmt(r.dns)}  tcp {fmt(r.connect)}  tls {fmt(r.tls)}  ttfb {fmt(r.ttfb)}  total {fmt(r.total)} ms")
+            totals = sorted(x.total for x in t.history if not x.error and x.total is not None)
+            up = sum(1 for x in t.history if t.up(x))
+            lines.append(f"   {len(t.history)} cek: up {100.0 * up / len(t.history):.1f}%  "
+                         f"p50 {fmt(_pctl(totals, 0.5))}  p95 {fmt(_pctl(totals, 0.95))} ms  "
+                         f"SLO ok {100.0 * sum(1 for x in t.history if not t.breach(x)) / len(t.history):.1f}%")
+        return "\n".join(lines)
+
+HTTP_CHECKER = HttpChecker()
+
+async def job_http_checker(ctx: ContextTypes.DEFAULT_TYPE):
+    HTTP_CHECKER.bot = ctx.bot
+    if (settings_get("httpcheck_enabled") or os.getenv("RANET_HTTPCHECK_ENABLED", "1")) == "1" and not HTTP_CHECKER.running:
+        HTTP_CHECKER.start()
+
+
+# ------------------ DNS BENCHMARK -----------------
+# Query UDP paralel ke beberapa resolver (dnsmasq lokal, DNS ISP dari resolv.conf.auto, publik) lewat satu
+# socket per family; jawaban dicocokkan dengan (resolver, id). Statistik cache dnsmasq via TXT CHAOS *.bind,
+# fallback SIGUSR1 + logread. Counter cache disimpan berkala ke metrics store.
+DNS_PUBLIC_RESOLVERS = os.getenv("RANET_DNS_RESOLVERS", "1.1.1.1=Cloudflare,8.8.8.8=Google,9.9.9.9=Quad9")
+DNS_BENCH_NAMES = os.getenv("RANET_DNS_BENCH_NAMES",
+                            "google.com,youtube.com,facebook.com,whatsapp.net,instagram.com,tiktok.com,"
+                            "shopee.co.id,tokopedia.com,detik.com,kompas.com,netflix.com,cloudflare.com").split(",")
+DNS_BENCH_ROUNDS = int(os.getenv("RANET_DNS_BENCH_ROUNDS", "3"))
+DNS_BENCH_TIMEOUT = float(os.getenv("RANET_DNS_BENCH_TIMEOUT", "2"))
+DNS_BENCH_CONCURRENCY = 64
+DNS_STATS_INTERVAL = int(os.getenv("RANET_DNS_STATS_INTERVAL", "900"))
+DNS_RESOLV_AUTO = ("/tmp/resolv.conf.d/resolv.conf.auto", "/tmp/resolv.conf.auto")
+DNS_CACHE_KEYS = ("cachesize", "insertions", "evictions", "misses", "hits")
+DNS_RCODES = {0: "NOERROR", 1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN", 4: "NOTIMP", 5: "REFUSED"}
+
+def dns_query_packet(qid: int, name: str, qtype: int = 1, qclass: int = 1) -> bytes:
+    qname = b"".join(bytes([len(p)]) + p for p in name.strip(".").encode("idna").split(b".") if p) + b"\0"
+    return struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack("!HH", qtype, qclass)
+
+def _dns_skip_name(data: bytes, off: int) -> int:
+    while True:
+        n = data[off]
+        if n & 0xC0 == 0xC0: return off + 2
+        if n == 0: return off + 1
+        off += n + 1
+
+def dns_parse_response(data: bytes) -> Tuple[int, int, List[Tuple[int, bytes]]]:
+    """Return (id, rcode, [(type, rdata)]) bagian answer."""
+    qid, flags, qd, an = struct.unpack_from("!HHHH", data)
+    off = 12
+    for _ in range(qd):
+        off = _dns_skip_name(data, off) + 4
+    answers = []
+    for _ in range(an):
+        off = _dns_skip_name(data, off)
+        rtype, _cls, _ttl, rdlen = struct.unpack_from("!HHIH", data, off)
+        off += 10
+        answers.append((rtype, data[off:off + rdlen]))
+        off += rdlen
+    return qid, flags & 0x0F, answers
+
+def dns_txt_strings(rdata: bytes) -> List[str]:
+    out, off = [], 0
+    while off < len(rdata):
+        n = rdata[off]
+        out.append(rdata[off + 1:off + 1 + n].decode("utf-8", errors="replace")); off += n + 1
+    return out
+
+class DnsUdp:
+    """Klien UDP bersama: satu socket per address family, banyak query paralel."""
+
+    def __init__(self):
+        self.socks: Dict[int, socket.socket] = {}
+        self.waiting: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.qid = int.from_bytes(os.urandom(2), "big")
+
+    def _sock(self, family: int) -> socket.socket:
+        sock = self.socks.get(family)
+        if sock is None:
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable, sock)
+            self.socks[family] = sock
+        return sock
+
+    def close(self):
+        loop = asyncio.get_running_loop()
+        for sock in self.socks.values():
+            with contextlib.suppress(Exception): loop.remove_reader(sock.fileno())
+            sock.close()
+        self.socks.clear()
+        for fut in self.waiting.values():
+            if not fut.done(): fut.cancel()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+
+    def _on_readable(self, sock: socket.socket):
+        while True:
+            try:
+                data, src = sock.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if len(data) < 12: continue
+            fut = self.waiting.pop((src[0], struct.unpack_from("!H", data)[0]), None)
+            if fut and not fut.done(): fut.set_result((time.monotonic(), data))
+
+    async def query(self, server: str, name: str, qtype: int = 1, qclass: int = 1,
+                    timeout: float = DNS_BENCH_TIMEOUT) -> Tuple[str, Optional[float], List[Tuple[int, bytes]]]:
+        """Return (rcode|'timeout'|'error', rtt_ms, answers)."""
+        family = socket.AF_INET6 if ":" in server else socket.AF_INET
+        self.qid = (self.qid + 1) & 0xFFFF
+        key = (server, self.qid)
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting[key] = fut
+        sent = time.monotonic()
+        try:
+            self._sock(family).sendto(dns_query_packet(self.qid, name, qtype, qclass), (server, 53))
+            got, data = await asyncio.wait_for(fut, timeout)
+            _qid, rcode, answers = dns_parse_response(data)
+            return DNS_RCODES.get(rcode, f"RCODE{rcode}"), (got - sent) * 1000, answers
+        except asyncio.TimeoutError:
+            return "timeout", None, []
+        except (OSError, struct.error, IndexError):
+            return "error", None, []
+        finally:
+            self.waiting.pop(key, None)
+
+def dns_resolvers() -> List[Tuple[str, str]]:
+    """[(ip, label)]: dnsmasq lokal, upstream ISP (resolv.conf.auto), lalu resolver publik."""
+    out: List[Tuple[str, str]] = [("127.0.0.1", "dnsmasq")]
+    for path in DNS_RESOLV_AUTO:
+        try:
+            text = Path(path).read_text()
+        except OSError:
+            continue
+        for m in re.finditer(r"^nameserver\s+(\S+)", text, re.M):
+            out.append((m.group(1).split("%")[0], "ISP"))
+        break
+    for spec in DNS_PUBLIC_RESOLVERS.split(","):
+        ip, _, label = spec.strip().partition("=")
+        if ip: out.append((ip, label or ip))
+    seen, uniq = set(), []
+    for ip, label in out:
+        if ip not in seen:
+            seen.add(ip); uniq.append((ip, label))
+    return uniq
+
+def dns_bench_table(stats: Dict[str, Dict[str, Any]], done: int, total: int) -> str:
+    fmt = lambda v: f"{v:.0f}" if v == v else "-"
+    lines = [f"DNS benchmark  {done}/{total} query",
+             f"{'resolver':<20}{'p50':>6}{'p95':>6}{'p99':>6}{'unc50':>7}{'fail':>7}"]
+    for (ip, label), st in sorted(stats.items(), key=lambda kv: _pctl(sorted(kv[1]["rtt"]), 0.5) if kv[1]["rtt"] else 1e9):
+        rtts = sorted(st["rtt"]); unc = sorted(st["uncached"])
+        n = st["sent"]
+        fail = f"{100.0 * st['fail'] / n:.0f}%" if n else "-"
+        lines.append(f"{(label + ' ' + ip)[:19]:<20}{fmt(_pctl(rtts, 0.5)):>6}{fmt(_pctl(rtts, 0.95)):>6}"
+                     f"{fmt(_pctl(rtts, 0.99)):>6}{fmt(_pctl(unc, 0.5)):>7}{fail:>7}")
+    lines.append("ms; unc50 = p50 nama acak (tidak ter-cache); fail = timeout/SERVFAIL/REFUSED")
+    return "\n".join(lines)
+
+async def dns_bench(resolvers: List[Tuple[str, str]], names: List[str], rounds: int = DNS_BENCH_ROUNDS,
+                    on_progress=None) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    stats = {r: {"sent": 0, "fail": 0, "rtt": [], "uncached": []} for r in resolvers}
+    sem = asyncio.Semaphore(DNS_BENCH_CONCURRENCY)
+    total = len(resolvers) * (len(names) + 1) * rounds
+    done = 0
+
+    async def one(client: DnsUdp, res: Tuple[str, str], name: str, uncached: bool):
+        nonlocal done
+        async with sem:
+            rcode, rtt, _ = await client.query(res[0], name)
+        st = stats[res]
+        st["sent"] += 1; done += 1
+        # NXDOMAIN untuk nama acak tetap jawaban sah
+        if rtt is None or rcode not in ("NOERROR", "NXDOMAIN"):
+            st["fail"] += 1
+        else:
+            st["uncached" if uncached else "rtt"].append(rtt)
+
+    with DnsUdp() as client:
+        for rnd in range(rounds):
+            jobs = []
+            for res in resolvers:
+                jobs += [one(client, res, name, False) for name in names]
+                jobs.append(one(client, res, f"rb-{uuid.uuid4().hex[:10]}.{names[rnd % len(names)]}", True))
+            await asyncio.gather(*jobs)
+            if on_progress: await on_progress(dns_bench_table(stats, done, total))
+    return stats
+
+async def dns_bench_stream(message) -> str:
+    resolvers = dns_resolvers()
+    names = [n.strip() for n in DNS_BENCH_NAMES if n.strip()]
+    live = LiveOutput(message, f"DNS benchmark ({len(resolvers)} resolver × {len(names)} nama × {DNS_BENCH_ROUNDS})")
+    await live.start()
+    try:
+        stats = await dns_bench(resolvers, names, on_progress=live.show)
+    except asyncio.CancelledError:
+        await live.finish(ok=False, note="[dibatalkan]"); raise
+    await live.finish(ok=True)
+    best = min((r for r in stats if stats[r]["rtt"]), key=lambda r: _pctl(sorted(stats[r]["rtt"]), 0.5), default=None)
+    return f"tercepat {best[1]} {best[0]}" if best else "semua resolver gagal"
+
+# ---- dnsmasq cache stats ----
+
+async def dnsmasq_cache_stats_chaos(server: str = "127.0.0.1") -> Dict[str, Any]:
+    """TXT CHAOS {cachesize,insertions,evictions,misses,hits,servers}.bind — tanpa fork, tanpa log."""
+    out: Dict[str, Any] = {}
+    with DnsUdp() as client:
+        keys = DNS_CACHE_KEYS + ("servers",)
+        res = await asyncio.gather(*(client.query(server, f"{k}.bind", qtype=16, qclass=3, timeout=1.5) for k in keys))
+    for key, (rcode, _rtt, answers) in zip(keys, res):
+        txt = [s for rtype, rdata in answers if rtype == 16 for s in dns_txt_strings(rdata)]
+        if rcode != "NOERROR" or not txt: continue
+        if key == "servers":
+            out["servers"] = txt            # "ip#port queries failed" per upstream
+        elif txt[0].isdigit():
+            out[key] = int(txt[0])
+    return out
+
+def _dnsmasq_pids() -> List[int]:
+    pids = []
+    for comm in glob.glob("/proc/[0-9]*/comm"):
+        with contextlib.suppress(OSError):
+            if Path(comm).read_text().strip() == "dnsmasq": pids.append(int(comm.split("/")[2]))
+    return pids
+
+async def dnsmasq_cache_stats_log() -> Dict[str, Any]:
+    """Fallback: SIGUSR1 membuat dnsmasq menulis statistik ke syslog, lalu dibaca dari logread."""
+    pids = _dnsmasq_pids()
+    if not pids or not which("logread"): return {}
+    for pid in pids:
+        with contextlib.suppress(OSError): os.kill(pid, signal.SIGUSR1)
+    await asyncio.sleep(0.5)
+    stats: Dict[str, Any] = {}
+    with await run_streaming_capture(["logread", "-l", "200", "-e", "dnsmasq"], timeout=10) as res:
+        if not res.ok: return {}
+        for line in res.iter_lines():       # baris terakhir menang (dump terbaru)
+            m = re.search(r"cache size (\d+), (\d+)/(\d+) cache insertions re-used unexpired", line)
+            if m: stats.update(cachesize=int(m.group(1)), evictions=int(m.group(2)), insertions=int(m.group(3)))
+            m = re.search(r"queries forwarded (\d+), queries answered locally (\d+)", line)
+            if m: stats.update(misses=int(m.group(1)), hits=int(m.group(2)))
+            m = re.search(r"server (\S+): queries sent (\d+), retried(?: or failed)? (\d+)", line)
+            if m: stats.setdefault("_servers", {})[m.group(1)] = f"{m.group(1)} {m.group(2)} {m.group(3)}"
+    if "_servers" in stats: stats["servers"] = list(stats.pop("_servers").values())
+    return stats
+
+async def dnsmasq_cache_stats() -> Dict[str, Any]:
+    stats = await dnsmasq_cache_stats_chaos()
+    if "hits" not in stats:
+        stats = {**stats, **await dnsmasq_cache_stats_log()}
+    return stats
+
+def dnsmasq_stats_text(stats: Dict[str, Any]) -> str:
+    if not stats: return "Statistik cache dnsmasq tidak tersedia (CHAOS *.bind & logread gagal)."
+    hits, misses = stats.get("hits"), stats.get("misses")
+    lines = ["dnsmasq cache"]
+    lines.append(f"  size {stats.get('cachesize', '-')}  insert {stats.get('insertions', '-')}  evict {stats.get('evictions', '-')}")
+    if hits is not None and misses is not None:
+        lines.append(f"  hit {hits}  miss {misses}  hit-rate {100.0 * hits / max(hits + misses, 1):.1f}% (sejak start)")
+    now = int(time.time())
+    for label, span in (("1h", 3600), ("24h", 86400)):
+        dh = metrics_counter_delta("dns:dnsmasq:hits", now - span)
+        dm = metrics_counter_delta("dns:dnsmasq:misses", now - span)
+        de = metrics_counter_delta("dns:dnsmasq:evictions", now - span)
+        if dh + dm:
+            lines.append(f"  {label}: hit-rate {100.0 * dh / (dh + dm):.1f}%  ({int(dh + dm)} query, {int(de)} evict)")
+    if stats.get("servers"):
+        lines.append("  upstream (ip#port sent failed):")
+        lines += [f"    {s}" for s in stats["servers"][:8]]
+    return "\n".join(lines)
+
+async def job_dnsmasq_stats(ctx: ContextTypes.DEFAULT_TYPE):
+    if not _dnsmasq_pids(): return
+    stats = await dnsmasq_cache_stats()
+    now = int(time.time())
+    pts = [(f"dns:dnsmasq:{k}", now, stats[k]) for k in DNS_CACHE_KEYS if k in stats]
+    with contextlib.suppress(Exception): metrics_add(pts)
+
+
+# ------------------ PERF (iperf-lite) -------------
+# Uji throughput & latency antar router (mis. lewat NetBird) tanpa iperf3. Protokol sendiri: baris JSON di awal
+# tiap koneksi TCP. TCP multi-stream (up = klien kirim, down = server kirim; byte dihitung di sisi penerima);
+# UDP laju tetap → loss, jitter (RFC 3550) & out-of-order dihitung penerima.
+PERF_PORT = int(os.getenv("RANET_PERF_PORT", "5301"))
+PERF_TOKEN = os.getenv("RANET_PERF_TOKEN", "")                      # bila diisi, wajib sama di kedua sisi
+PERF_BIND = os.getenv("RANET_PERF_BIND", "")                       # alamat listen eksplisit (mis. 0.0.0.0); default IP NetBird
+PERF_SERVER_TTL = int(os.getenv("RANET_PERF_SERVER_TTL", "900"))   # server berhenti sendiri setelah idle (detik)
+PERF_MAX_SECONDS = 30
+PERF_MAX_STREAMS = 8
+PERF_MAX_UDP_MBPS = 1000.0
+PERF_UDP_SIZE = 1200                  # muat di MTU wt0 NetBird (1280)
+PERF_CHUNK = 128 * 1024
+PERF_UDP_TICK = 0.005
+_PERF_HDR = struct.Struct("!Id")      # seq, waktu kirim (epoch)
+_PERF_ZEROS = bytes(PERF_CHUNK)
+
+def _perf_line(obj: Dict[str, Any]) -> bytes:
+    return (json.dumps(obj) + "\n").encode()
+
+async def _perf_read_line(reader, timeout: float) -> Dict[str, Any]:
+    line = await asyncio.wait_for(reader.readline(), timeout)
+    if not line: raise ConnectionError("koneksi kontrol ditutup")
+    return json.loads(line)
+
+class UdpRecvStats:
+    """Statistik penerima UDP: loss, jitter RFC 3550, out-of-order."""
+
+    def __init__(self):
+        self.received = 0
+        self.nbytes = 0
+        self.max_seq = -1
+        self.ooo = 0
+        self.jitter = 0.0
+        self.last_transit: Optional[float] = None
+        self.first: Optional[float] = None
+        self.last = 0.0
+
+    def add(self, data: bytes, now: float):
+        if len(data) < _PERF_HDR.size: return
+        seq, sent = _PERF_HDR.unpack_from(data)
+        self.received += 1; self.nbytes += len(data)
+        if self.first is None: self.first = now
+        self.last = now
+        if seq < self.max_seq: self.ooo += 1
+        else: self.max_seq = seq
+        transit = now - sent                    # offset jam kedua host saling menghapus di selisihnya
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+        self.last_transit = transit
+
+    def result(self, sent: int) -> Dict[str, Any]:
+        sent = max(sent, self.max_seq + 1)
+        span = max(self.last - (self.first or self.last), 1e-3)
+        lost = max(0, sent - self.received)
+        return {"sent": sent, "received": self.received, "lost": lost, "loss_pct": 100.0 * lost / sent if sent else 0.0,
+                "jitter_ms": self.jitter * 1000, "ooo": self.ooo, "mbps": self.nbytes * 8 / span / 1e6}
+
+async def _udp_send_paced(sock: socket.socket, rate_mbps: float, seconds: float, counter: List[int]) -> int:
+    """Kirim datagram ke socket ter-connect dengan laju tetap; return jumlah paket terkirim."""
+    loop = asyncio.get_running_loop()
+    pkt = bytearray(PERF_UDP_SIZE)
+    pps = rate_mbps * 1e6 / 8 / PERF_UDP_SIZE
+    seq = 0
+    t0 = loop.time()
+    while True:
+        elapsed = loop.time() - t0
+        if elapsed >= seconds: break
+        due = int(pps * elapsed) + 1
+        while seq < due:
+            _PERF_HDR.pack_into(pkt, 0, seq, time.time())
+            try:
+                sock.send(pkt)
+            except (BlockingIOError, InterruptedError):
+                break                              # buffer penuh: sisanya terhitung hilang
+            except OSError:
+                pass
+            seq += 1; counter[0] += PERF_UDP_SIZE
+        await asyncio.sleep(PERF_UDP_TICK)
+    return seq
+
+def _perf_udp_socket(family: int, bind_host: str = "") -> socket.socket:
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    with contextlib.suppress(OSError): sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind((bind_host, 0))
+    return sock
+
+async def _udp_wait_hello(sock: socket.socket, timeout: float):
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    def _on_readable():
+        with contextlib.suppress(BlockingIOError, InterruptedError):
+            _data, addr = sock.recvfrom(64)
+            if not fut.done(): fut.set_result(addr)
+    loop.add_reader(sock.fileno(), _on_readable)
+    try:
+        return await asyncio.wait_for(fut, timeout)
+    finally:
+        loop.remove_reader(sock.fileno())
+
+class PerfServer:
+    def __init__(self):
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.host = ""
+        self.port = PERF_PORT
+        self.last_activity = 0.0
+        self.tests = 0
+        self.active = 0
+        self.owner = ""                     # host klien yang sedang diuji; satu uji (≤ PERF_MAX_STREAMS koneksi) sekaligus
+        self.watch: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.server is not None
+
+    async def start(self, host: str = "", port: int = PERF_PORT) -> str:
+        if self.running: return f"Perf server sudah aktif di {self.host or '*'}:{self.port}."
+        try:
+            self.server = await asyncio.start_server(self._handle, host or None, port, reuse_address=True)
+        except OSError as e:
+            return f"[ERR] Perf server gagal listen di {host or '*'}:{port}: {e.strerror or e}"
+        self.host, self.port, self.tests = host, port, 0
+        self.last_activity = time.time()
+        self.watch = asyncio.get_running_loop().create_task(self._idle_watch())
+        return f"▶️ Perf server aktif di {host or '*'}:{port} (berhenti sendiri setelah idle {PERF_SERVER_TTL // 60} menit)."
+
+    def stop(self) -> str:
+        if not self.running: return "Perf server tidak berjalan."
+        self.server.close(); self.server = None
+        if self.watch and self.watch is not asyncio.current_task(): self.watch.cancel()
+        return "⏹️ Perf server dihentikan."
+
+    async def _idle_watch(self):
+        while self.running:
+            await asyncio.sleep(30)
+            if not self.active and time.time() - self.last_activity > PERF_SERVER_TTL:
+                self.stop()
+
+    async def _handle(self, reader, writer):
+        host = (writer.get_extra_info("peername") or ("",))[0]
+        if self.active >= PERF_MAX_STREAMS + 1 or (self.active and self.owner != host):
+            writer.write(_perf_line({"error": "server sibuk, uji lain sedang berjalan"}))
+            with contextlib.suppress(Exception): await writer.drain()
+            writer.close(); return
+        self.active += 1
+        self.owner = host
+        try:
+            hdr = await _perf_read_line(reader, 5)
+            if PERF_TOKEN and hdr.get("token") != PERF_TOKEN:
+                writer.write(_perf_line({"error": "token salah"})); return
+            seconds = min(float(hdr.get("seconds", 10)), PERF_MAX_SECONDS)
+            mode, direction = hdr.get("mode"), hdr.get("dir")
+            if hdr.get("hello"):
+                writer.write(_perf_line({"ok": True}))          # probe latency / cek versi
+            elif mode == "tcp" and direction == "up":
+                await self._tcp_sink(reader, writer, seconds)
+            elif mode == "tcp" and direction == "down":
+                await self._tcp_source(writer, seconds)
+            elif mode == "udp":
+                await self._udp(reader, writer, hdr, seconds)
+            else:
+                writer.write(_perf_line({"error": "mode tidak dikenal"}))
+            with contextlib.suppress(Exception): await writer.drain()
+        except (OSError, ValueError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self.active -= 1
+            self.last_activity = time.time()
+            writer.close()
+
+    async def _tcp_sink(self, reader, writer, seconds: float):
+        self.tests += 1
+        n, t0 = 0, time.monotonic()
+        deadline = asyncio.get_running_loop().time() + seconds + 5
+        while True:
+            chunk = await asyncio.wait_for(reader.read(256 * 1024), max(0.1, deadline - asyncio.get_running_loop().time()))
+            if not chunk: break                      # klien selesai (write_eof)
+            n += len(chunk)
+        writer.write(_perf_line({"bytes": n, "seconds": time.monotonic() - t0}))
+
+    async def _tcp_source(self, writer, seconds: float):
+        self.tests += 1
+        loop = asyncio.get_running_loop()
+        end = loop.time() + seconds
+        while loop.time() < end:
+            writer.write(_PERF_ZEROS)
+            await writer.drain()
+
+    async def _udp(self, reader, writer, hdr: Dict[str, Any], seconds: float):
+        self.tests += 1
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info("peername")
+        local = writer.get_extra_info("sockname")
+        sock = _perf_udp_socket(socket.AF_INET6 if ":" in local[0] else socket.AF_INET, local[0])
+        try:
+            writer.write(_perf_line({"port": sock.getsockname()[1]})); await writer.drain()
+            if hdr.get("dir") == "up":
+                stats = UdpRecvStats()
+
+                def _on_readable():
+                    while True:
+                        try:
+                            data = sock.recv(2048)
+                        except (BlockingIOError, InterruptedError, OSError):
+                            return
+                        stats.add(data, time.time())
+                loop.add_reader(sock.fileno(), _on_readable)
+                try:
+                    done = await _perf_read_line(reader, seconds + 10)
+                    await asyncio.sleep(0.3)               # datagram terakhir yang masih di jalan
+                finally:
+                    loop.remove_reader(sock.fileno())
+                writer.write(_perf_line(stats.result(int(done.get("sent", 0)))))
+            else:
+                rate = min(float(hdr.get("rate", 10)), PERF_MAX_UDP_MBPS)
+                addr = await _udp_wait_hello(sock, 5)      # alamat asal hello klien (lolos NAT)
+                if addr[0] != peer[0]: raise ConnectionError("hello dari alamat lain")
+                sock.connect(addr)
+                sent = await _udp_send_paced(sock, rate, seconds, [0])
+                writer.write(_perf_line({"sent": sent}))
+        finally:
+            sock.close()
+
+    def status_text(self) -> str:
+        if not self.running: return "Perf server: mati"
+        idle = int(time.time() - self.last_activity)
+        return f"Perf server: aktif di {self.host or '*'}:{self.port}  | stream uji {self.tests}  | idle {idle}s"
+
+PERF_SERVER = PerfServer()
+
+async def perf_client(host: str, port: int = PERF_PORT, mode: str = "tcp", direction: str = "up", streams: int = 4,
+                      seconds: float = 10, rate_mbps: float = 10, on_interval=None) -> Dict[str, Any]:
+    """Jalankan satu tes; on_interval(detik_ke, Mbps) dipanggil tiap detik dari sisi klien."""
+    base = {"v": 1, "token": PERF_TOKEN, "seconds": seconds}
+    # latency: median RTT TCP connect (5x); sekaligus cek token/versi lewat baris hello
+    rtts, err = [], ""
+    for _ in range(5):
+        t0 = time.monotonic()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 3)
+        except (OSError, asyncio.TimeoutError) as e:
+            err = os.strerror(e.errno) if getattr(e, "errno", None) else e.__class__.__name__; continue
+        rtts.append((time.monotonic() - t0) * 1000)
+        try:
+            writer.write(_perf_line({**base, "hello": True}))
+            reply = await _perf_read_line(reader, 3)
+        finally:
+            writer.close()
+        if reply.get("error"): raise ConnectionError(f"server: {reply['error']}")
+    if not rtts: raise ConnectionError(f"tidak bisa konek ke {host}:{port} ({err}); perf server sudah jalan di peer?")
+    out: Dict[str, Any] = {"host": host, "mode": mode, "dir": direction, "seconds": seconds,
+                           "rtt_ms": _pctl(sorted(rtts), 0.5), "intervals": []}
+    counter = [0]
+    loop = asyncio.get_running_loop()
+
+    async def _ticker():
+        last, i = 0, 0
+        while True:
+            await asyncio.sleep(1)
+            i += 1
+            mbps = (counter[0] - last) * 8 / 1e6
+            last = counter[0]
+            out["intervals"].append(mbps)
+            if on_interval: await on_interval(i, mbps)
+
+    ticker = loop.create_task(_ticker())
+    try:
+        if mode == "tcp":
+            async def _stream():
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 5)
+                try:
+                    writer.write(_perf_line({**base, "mode": "tcp", "dir": direction}))
+                    if direction == "up":
+                        end = loop.time() + seconds
+                        while loop.time() < end:
+                            writer.write(_PERF_ZEROS); await writer.drain(); counter[0] += PERF_CHUNK
+                        writer.write_eof()
+                        return (await _perf_read_line(reader, 15)).get("bytes", 0)
+                    n = 0
+                    while True:
+                        chunk = await asyncio.wait_for(reader.read(256 * 1024), seconds + 10)
+                        if not chunk: return n
+                        n += len(chunk); counter[0] += len(chunk)
+                finally:
+                    writer.close()
+            t0 = loop.time()
+            totals = await asyncio.gather(*(_stream() for _ in range(streams)))
+            elapsed = loop.time() - t0 if direction == "down" else seconds
+            out.update(streams=streams, bytes=sum(totals), mbps=sum(totals) * 8 / max(elapsed, 1e-3) / 1e6,
+                       per_stream=[b * 8 / max(elapsed, 1e-3) / 1e6 for b in totals])
+        else:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 5)
+            try:
+                writer.write(_perf_line({**base, "mode": "udp", "dir": direction, "rate": rate_mbps}))
+                reply = await _perf_read_line(reader, 5)
+                if "port" not in reply: raise ConnectionError(reply.get("error", "server menolak"))
+                family = socket.AF_INET6 if ":" in writer.get_extra_info("peername")[0] else socket.AF_INET
+                sock = _perf_udp_socket(family)
+                try:
+                    sock.connect((host, reply["port"]))
+                    if direction == "up":
+                        sent = await _udp_send_paced(sock, rate_mbps, seconds, counter)
+                        writer.write(_perf_line({"sent": sent}))
+                        out.update(await _perf_read_line(reader, 10))
+                    else:
+                        stats = UdpRecvStats()
+
+                        def _on_readable():
+                            while True:
+                                try:
+                                    data = sock.recv(2048)
+                                except (BlockingIOError, InterruptedError, OSError):
+                                    return
+                                stats.add(data, time.time()); counter[0] += len(data)
+                        loop.add_reader(sock.fileno(), _on_readable)
+                        try:
+                            for _ in range(3): sock.send(b"hello")
+                            done = await _perf_read_line(reader, seconds + 10)
+                            await asyncio.sleep(0.3)
+                        finally:
+                            loop.remove_reader(sock.fileno())
+                        out.update(stats.result(int(done.get("sent", 0))))
+                finally:
+                    sock.close()
+                out["rate"] = rate_mbps
+            finally:
+                writer.close()
+    finally:
+        ticker.cancel()
+    return out
+
+def perf_result_text(res: Dict[str, Any]) -> str:
+    arrow = "⬆️ kirim" if res["dir"] == "up" else "⬇️ terima"
+    lines = [f"Peer   : {res['host']}  RTT {res['rtt_ms']:.1f} ms",
+             f"Mode   : {res['mode'].upper()} {arrow}, {res['seconds']:g}s" + (f", {res['streams']} stream" if res["mode"] == "tcp" else f", {res['rate']:g} Mbps")]
+    if res["mode"] == "tcp":
+        lines.append(f"Hasil  : {res['mbps']:.2f} Mbps ({human_bytes(res['bytes'])})")
+        if len(res["per_stream"]) > 1:
+            lines.append("Stream : " + " ".join(f"{m:.1f}" for m in res["per_stream"]))
+    else:
+        lines.append(f"Hasil  : {res['mbps']:.2f} Mbps diterima, loss {res['lost']}/{res['sent']} ({res['loss_pct']:.2f}%)")
+        lines.append(f"Jitter : {res['jitter_ms']:.2f} ms  | out-of-order {res['ooo']}")
+    return "\n".join(lines)
+
+def perf_parse_args(args: List[str]) -> Dict[str, Any]:
+    """`<host> [tcp|udp] [up|down|-R] [-P stream] [-t detik] [-b Mbps] [-p port]` (mirip iperf3)."""
+    opts: Dict[str, Any] = {"mode": "tcp", "direction": "up", "streams": 4, "seconds": 10.0, "rate_mbps": 10.0, "port": PERF_PORT}
+    flags = {"-P": "streams", "-t": "seconds", "-b": "rate_mbps", "-p": "port"}
+    it = iter(args)
+    for a in it:
+        if a in ("tcp", "udp"): opts["mode"] = a
+        elif a in ("up", "down"): opts["direction"] = a
+        elif a == "-R": opts["direction"] = "down"
+        elif a in flags:
+            val = next(it, "")
+            try:
+                opts[flags[a]] = int(val) if a in ("-P", "-p") else float(val)
+            except ValueError:
+                raise ValueError(f"nilai {a} tidak valid: {val or '(kosong)'}")
+        elif "host" not in opts and not a.startswith("-"): opts["host"] = a
+        else: raise ValueError(f"argumen tidak dikenal: {a}")
+    if "host" not in opts: raise ValueError("IP peer belum diisi")
+    if not re.fullmatch(r"[A-Za-z0-9.:_-]{1,253}", opts["host"]): raise ValueError("host tidak valid")
+    opts["streams"] = max(1, min(opts["streams"], PERF_MAX_STREAMS))
+    opts["seconds"] = max(1.0, min(opts["seconds"], PERF_MAX_SECONDS))
+    opts["rate_mbps"] = max(0.1, min(opts["rate_mbps"], PERF_MAX_UDP_MBPS))
+    return opts
+
+async def perf_stream(message, opts: Dict[str, Any]) -> str:
+    live = LiveOutput(message, f"perf {opts['host']} {opts['mode']} {opts['direction']}")
+    await live.start()
+
+    async def on_interval(i: int, mbps: float):
+        live.feed(f"{f'{i - 1}-{i}s':>7} {mbps:9.2f} Mbps\n")
+
+    try:
+        res = await perf_client(opts["host"], opts["port"], opts["mode"], opts["direction"], opts["streams"],
+                                opts["seconds"], opts["rate_mbps"], on_interval)
+    except asyncio.CancelledError:
+        await live.finish(ok=False, note="[dibatalkan]"); raise
+    except (OSError, ValueError, ConnectionError, asyncio.TimeoutError) as e:
+        live.feed(f"[ERR] {e}\n")
+        await live.finish(ok=False); return f"gagal: {e}"
+    live.feed("\n" + perf_result_text(res) + "\n")
+    await live.finish(ok=True)
+    with contextlib.suppress(Exception):
+        metrics_add([(f"perf:{opts['host']}:{opts['mode']}_{opts['direction']}", int(time.time()), res["mbps"])])
+    return f"{res['mbps']:.1f} Mbps"
+
+async def perf_server_start(bind: str = "") -> str:
+    # default listen di IP NetBird saja supaya tidak terbuka ke WAN; semua interface hanya bila diminta eksplisit
+    bind = bind or PERF_BIND
+    if not bind:
+        ip = await asyncio.get_running_loop().run_in_executor(None, get_netbird_ip_cached)
+        bind = (ip or "").split("/")[0]
+    if not bind:
+        return ("[ERR] IP NetBird belum diketahui, perf server tidak dijalankan. Hubungkan NetBird dulu, "
+                "atau beri alamat eksplisit: /perf server <alamat> (0.0.0.0 = semua interface).")
+    return await PERF_SERVER.start("" if bind in ("0.0.0.0", "*") else bind)
+
+PERF_USAGE = ("Usage: /perf <ip_peer> [tcp|udp] [up|down] [-P stream] [-t detik] [-b Mbps] [-p port]\n"
+              "       /perf server [stop|<alamat_bind>]\n"
+              f"Peer harus menjalankan /perf server dan firewall-nya membuka TCP+UDP {PERF_PORT} dari zona NetBird.")
+
+async def perf_start(message, application, args: List[str]):
+    if args and args[0] == "server":
+        if args[1:2] == ["stop"]: text = PERF_SERVER.stop()
+        elif PERF_SERVER.running: text = PERF_SERVER.status_text()
+        else: text = await perf_server_start(args[1] if len(args) > 1 else "")
+        await message.reply_text(text); return
+    try:
+        opts = perf_parse_args(args)
+    except ValueError as e:
+        await message.reply_text(f"❌ {e}\n{PERF_USAGE}"); return
+    key = f"perf {opts['host']}"
+    await op_start(message, application, "nettools", key, f"{key} {opts['mode']} {opts['direction']}",
+                   lambda op: perf_stream(message, opts))
 
-    text = netbird_status_update(force=False)
 
-    m = re.search(r"NetBird IP:\s*([0-9./]+)", text)
+# ------------------ UCI ---------------------------
+# Parser native /etc/config/* + delta /tmp/.uci (perubahan belum di-commit), tanpa fork `uci`.
+UCI_CONFIG_DIR = os.getenv("RANET_UCI_CONFIG_DIR", "/etc/config")
+UCI_DELTA_DIR = os.getenv("RANET_UCI_DELTA_DIR", "/tmp/.uci")
+UCI_TABLE_WIDTH = 18     # lebar maksimal kolom tabel
 
-    return m.group(1) if m else None
+@dataclass
+class UciSection:
+    type: str
+    name: str
+    anonymous: bool = False
+    options: Dict[str, Any] = field(default_factory=dict)   # str atau List[str] (list)
+    index: int = 0                                          # posisi di antara section bertipe sama
+
+    def get(self, option: str, default: Any = None) -> Any:
+        return self.options.get(option, default)
+
+    def ref(self) -> str:
+        return f"@{self.type}[{self.index}]" if self.anonymous else self.name
+
+@dataclass
+class UciPackage:
+    name: str
+    sections: List[UciSection] = field(default_factory=list)
+    n_section: int = 0                      # seperti libuci: setiap section yang dibuat (bernama/anonim) menambah 1
+
+    def section(self, name: str) -> Optional[UciSection]:
+        m = re.fullmatch(r"@([\w-]+)\[(-?\d+)\]", name)
+        if m:
+            of_type = self.by_type(m.group(1))
+            try: return of_type[int(m.group(2))]
+            except IndexError: return None
+        return next((s for s in self.sections if s.name == name), None)
+
+    def by_type(self, stype: str) -> List[UciSection]:
+        return [s for s in self.sections if s.type == stype]
+
+    def reindex(self):
+        seen: Dict[str, int] = defaultdict(int)
+        for s in self.sections:
+            s.index = seen[s.type]; seen[s.type] += 1
+
+def _uci_djbhash(h: int, text: str) -> int:
+    if h == 0xFFFFFFFF: h = 5381
+    for b in text.encode():
+        if b > 127: b -= 256          # char bertanda (mips/x86), sama seperti libuci
+        h = ((h << 5) + h + b) & 0xFFFFFFFF
+    return h & 0x7FFFFFFF
+
+def _uci_anon_name(stype: str, seq: int) -> str:
+    # nama cfgXXXXXX identik dengan libuci: n_section package (semua section, termasuk bernama) + hash djb dari type
+    return f"cfg{seq:02x}{_uci_djbhash(0xFFFFFFFF, stype) % (1 << 16):04x}"
+
+def uci_parse(text: str, package: str) -> UciPackage:
+    pkg = UciPackage(package)
+    cur: Optional[UciSection] = None
+    for line in text.splitlines():
+        try:
+            toks = shlex.split(line, comments=True)
+        except ValueError:
+            continue
+        if not toks: continue
+        kw = toks[0]
+        if kw == "config" and len(toks) >= 2:
+            name = toks[2] if len(toks) > 2 else ""
+            cur = next((s for s in pkg.sections if name and s.name == name), None)
+            if cur is None:
+                pkg.n_section += 1
+                cur = UciSection(toks[1], name or _uci_anon_name(toks[1], pkg.n_section), anonymous=not name)
+                pkg.sections.append(cur)
+        elif kw in ("option", "list") and cur is not None and len(toks) >= 2:
+            value = toks[2] if len(toks) > 2 else ""
+            if kw == "option":
+                cur.options[toks[1]] = value
+            else:
+                prev = cur.options.get(toks[1])
+                cur.options[toks[1]] = (prev if isinstance(prev, list) else []) + [value]
+    pkg.reindex()
+    return pkg
+
+def uci_apply_delta(pkg: UciPackage, text: str):
+    # format savedir libuci: [+-@^|~]pkg.section[.option][=value]
+    for line in text.splitlines():
+        if not line.strip(): continue
+        cmd = line[0] if line[0] in "+-@^|~" else ""
+        path, eq, raw = line[len(cmd):].partition("=")
+        try:
+            value = "".join(shlex.split(raw)) if eq else ""
+        except ValueError:
+            continue
+        parts = path.split(".", 2)
+        if len(parts) < 2 or parts[0] != pkg.name: continue
+        sname, opt = parts[1], (parts[2] if len(parts) > 2 else None)
+        sec = pkg.section(sname)
+        if cmd == "-":
+            if sec is None: continue
+            if opt is None: pkg.sections.remove(sec)
+            else: sec.options.pop(opt, None)
+        elif cmd == "@":
+            if sec is None: continue
+            if opt is None: sec.name = value; sec.anonymous = False
+            elif opt in sec.options: sec.options[value] = sec.options.pop(opt)
+        elif cmd == "^":
+            if sec is None or not value.isdigit(): continue
+            pkg.sections.remove(sec); pkg.sections.insert(int(value), sec)
+        elif cmd in ("+", "") and opt is None:
+            if sec is None:
+                anon = bool(re.fullmatch(r"cfg[0-9a-f]{6}", sname))
+                pkg.n_section += 1
+                pkg.sections.append(UciSection(value, sname, anonymous=anon))
+            else:
+                sec.type = value
+        elif sec is None:
+            continue
+        elif cmd == "|":
+            prev = sec.options.get(opt)
+            sec.options[opt] = (prev if isinstance(prev, list) else []) + [value]
+        elif cmd == "~":
+            prev = sec.options.get(opt)
+            if isinstance(prev, list):
+                sec.options[opt] = [v for v in prev if v != value]
+        else:
+            sec.options[opt] = value
+    pkg.reindex()
+
+UCI_CACHE: Dict[str, Tuple[tuple, UciPackage]] = {}
+
+def _uci_stamp(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+def uci_load(package: str) -> Optional[UciPackage]:
+    # cache per (inode, mtime, size) file config + delta; dipakai ulang selama keduanya tidak berubah
+    if not re.fullmatch(r"[\w-]+", package): return None
+    cfg = os.path.join(UCI_CONFIG_DIR, package)
+    delta = os.path.join(UCI_DELTA_DIR, package)
+    key = (_uci_stamp(cfg), _uci_stamp(delta))
+    if key[0] is None: return None
+    hit = UCI_CACHE.get(package)
+    if hit and hit[0] == key: return hit[1]
+    try:
+        with open(cfg, encoding="utf-8", errors="replace") as f:
+            pkg = uci_parse(f.read(), package)
+        if key[1] is not None:
+            with open(delta, encoding="utf-8", errors="replace") as f:
+                uci_apply_delta(pkg, f.read())
+    except OSError:
+        return None
+    UCI_CACHE[package] = (key, pkg)
+    return pkg
+
+def uci_get(package: str, section: str, option: Optional[str] = None, default: Any = None) -> Any:
+    pkg = uci_load(package)
+    sec = pkg.section(section) if pkg else None
+    if sec is None: return default
+    return sec.type if option is None else sec.options.get(option, default)
+
+def _uci_cell(v: Any) -> str:
+    if isinstance(v, list): v = ",".join(v)
+    v = str(v) if v not in (None, "") else "-"
+    return v if len(v) <= UCI_TABLE_WIDTH else v[:UCI_TABLE_WIDTH - 1] + "…"
+
+def uci_table(sections: List[UciSection], columns: List[Tuple[str, Any]], filt: str = "") -> str:
+    # columns: (judul, nama opsi atau fungsi(section)); filt: kata kunci (semua harus cocok, tanpa beda huruf)
+    rows = []
+    words = filt.lower().split()
+    for s in sections:
+        cells = [_uci_cell(s.ref())] + [_uci_cell(c(s) if callable(c) else s.get(c)) for _, c in columns]
+        hay = " ".join([s.name, s.type] + [" ".join(v) if isinstance(v, list) else str(v) for v in s.options.values()]).lower()
+        if all(w in hay for w in words):
+            rows.append(cells)
+    if not rows:
+        return "(tidak ada yang cocok)" if words else "(kosong)"
+    head = ["ref"] + [h for h, _ in columns]
+    widths = [max(len(r[i]) for r in rows + [head]) for i in range(len(head))]
+    fmt = lambda r: "  ".join(c.ljust(w) for c, w in zip(r, widths)).rstrip()
+    return "\n".join([fmt(head), fmt(["-" * w for w in widths])] + [fmt(r) for r in rows])
+
+def _uci_enabled(s: UciSection) -> str:
+    return "off" if s.get("enabled") == "0" or s.get("disabled") == "1" else "on"
+
+def uci_missing(package: str) -> str:
+    return f"[ERR] {os.path.join(UCI_CONFIG_DIR, package)} tidak ditemukan."
+
+def uci_changes_pending(package: str) -> bool:
+    return _uci_stamp(os.path.join(UCI_DELTA_DIR, package)) is not None
+
+def firewall_rules_table(filt: str = "") -> str:
+    pkg = uci_load("firewall")
+    if pkg is None: return uci_missing("firewall")
+    zones = uci_table(pkg.by_type("zone"), [("name", "name"), ("in", "input"), ("out", "output"),
+                                            ("fwd", "forward"), ("network", "network"), ("masq", "masq")], filt)
+    rules = uci_table(pkg.by_type("rule"), [("name", "name"), ("src", "src"), ("dest", "dest"), ("proto", "proto"),
+                                            ("port", "dest_port"), ("target", "target"), ("on", _uci_enabled)], filt)
+    fwds = uci_table(pkg.by_type("forwarding"), [("src", "src"), ("dest", "dest")], filt)
+    note = f"\n\n⚠️ ada perubahan belum di-commit ({os.path.join(UCI_DELTA_DIR, 'firewall')})" if uci_changes_pending("firewall") else ""
+    return f"=== zone ===\n{zones}\n\n=== forwarding ===\n{fwds}\n\n=== rule ===\n{rules}{note}"
+
+def port_forward_table(filt: str = "") -> str:
+    pkg = uci_load("firewall")
+    if pkg is None: return uci_missing("firewall")
+    dest = lambda s: f"{s.get('dest_ip', '-')}:{s.get('dest_port') or s.get('src_dport') or '*'}"
+    return uci_table(pkg.by_type("redirect"), [("name", "name"), ("proto", "proto"), ("src", "src"),
+                                               ("dport", "src_dport"), ("ke", dest), ("on", _uci_enabled)], filt)
+
+def wifi_config_table(filt: str = "") -> str:
+    pkg = uci_load("wireless")
+    if pkg is None: return uci_missing("wireless")
+    radios = uci_table(pkg.by_type("wifi-device"), [("band", lambda s: s.get("band") or s.get("hwmode")),
+                                                   ("ch", "channel"), ("htmode", "htmode"), ("country", "country"),
+                                                   ("on", _uci_enabled)], filt)
+    ifaces = uci_table(pkg.by_type("wifi-iface"), [("ssid", "ssid"), ("radio", "device"), ("mode", "mode"),
+                                                  ("net", "network"), ("enc", "encryption"), ("on", _uci_enabled)], filt)
+    return f"=== radio ===\n{radios}\n\n=== interface ===\n{ifaces}"
+
+def system_config_table(filt: str = "") -> str:
+    pkg = uci_load("system")
+    if pkg is None: return uci_missing("system")
+    system = uci_table(pkg.by_type("system"), [("hostname", "hostname"), ("zone", "zonename"),
+                                              ("tz", "timezone"), ("log", "log_size")], filt)
+    ntp = uci_table(pkg.by_type("timeserver"), [("on", lambda s: "on" if s.get("enabled", "1") == "1" else "off"),
+                                               ("server", "server")], filt)
+    return f"=== system ===\n{system}\n\n=== ntp ===\n{ntp}"
+
+UCI_VIEWS = {
+    "fw": ("🛡️ Firewall", firewall_rules_table),
+    "pf": ("🚪 Port Forward", port_forward_table),
+    "wifi": ("📡 WiFi", wifi_config_table),
+    "sys": ("🖥️ System", system_config_table),
+}
+
+async def reply_uci_view(message, view: str, filt: str = ""):
+    if view not in UCI_VIEWS:
+        await message.reply_text("[ERR] View tidak dikenal."); return
+    title, fn = UCI_VIEWS[view]
+    out = fn(filt)
+    chunks = list(split_chunks(out))
+    head = f"{title}" + (f" — filter: {filt}" if filt else "")
+    await message.reply_text(head)
+    for i, chunk in enumerate(chunks):
+        markup = uci_view_keyboard(view, filt) if i == len(chunks) - 1 and not out.startswith("[ERR]") else None
+        await message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2, reply_markup=markup)
+
+
+# ---- Staged UCI changes ----
+# Perubahan dikumpulkan per chat sebagai baris `uci batch`, disimulasikan di memori untuk preview,
+# lalu di-commit sekali; reload service digabung (debounce) supaya wifi/firewall tidak restart berkali-kali.
+UCI_STAGE_MAX = 200
+UCI_BATCH_CMDS = {"set", "add", "add_list", "del_list", "delete", "rename", "reorder"}
+UCI_RELOAD_SERVICES = {"wireless": "wifi", "firewall": "firewall", "network": "network", "dhcp": "dnsmasq",
+                       "system": "system"}
+UCI_RELOAD_ORDER = ("network", "firewall", "dnsmasq", "wifi")
+RELOAD_DEBOUNCE = float(os.getenv("RANET_RELOAD_DEBOUNCE", "5"))   # detik tenang sebelum reload dijalankan
+
+@dataclass
+class UciStage:
+    commands: List[str] = field(default_factory=list)    # baris `uci batch` ternormalisasi
+    packages: List[str] = field(default_factory=list)
+    created: float = field(default_factory=time.time)
+
+UCI_STAGES: Dict[int, UciStage] = {}
+
+def uci_clone(pkg: UciPackage) -> UciPackage:
+    return UciPackage(pkg.name, [UciSection(s.type, s.name, s.anonymous,
+                                            {k: list(v) if isinstance(v, list) else v for k, v in s.options.items()},
+                                            s.index) for s in pkg.sections], pkg.n_section)
+
+def uci_show_lines(pkg: UciPackage) -> List[str]:
+    # format `uci show`
+    out = []
+    for s in pkg.sections:
+        out.append(f"{pkg.name}.{s.name}={s.type}")
+        for k, v in s.options.items():
+            vals = v if isinstance(v, list) else [v]
+            out.append(f"{pkg.name}.{s.name}.{k}=" + " ".join("'" + x.replace("'", "'\\''") + "'" for x in vals))
+    return out
+
+def uci_split_commands(text: str) -> List[List[str]]:
+    # pisah per baris dan `;`/`&&`, buang prefix `uci` dan `commit`/`changes` (commit dilakukan sekali di akhir)
+    cmds = []
+    for line in text.splitlines():
+        lex = shlex.shlex(line, posix=True, punctuation_chars=";&")
+        lex.whitespace_split = True
+        cur: List[str] = []
+        for tok in list(lex) + [";"]:
+            if tok in (";", "&&", "&"):
+                if cur and cur[0] == "uci": cur = cur[1:]
+                if cur and cur[0] not in ("commit", "changes", "show"): cmds.append(cur)
+                cur = []
+            else:
+                cur.append(tok)
+    return cmds
+
+def _uci_stage_apply(pkgs: Dict[str, UciPackage], argv: List[str]) -> str:
+    """Terapkan satu perintah batch ke salinan di memori; kembalikan baris batch ternormalisasi. ValueError bila gagal."""
+    cmd, args = argv[0], argv[1:]
+    if cmd not in UCI_BATCH_CMDS:
+        raise ValueError(f"perintah tidak didukung: {cmd} (hanya {', '.join(sorted(UCI_BATCH_CMDS))})")
+    if not args:
+        raise ValueError(f"{cmd}: argumen kosong")
+
+    def package(name: str) -> UciPackage:
+        if name not in pkgs:
+            base = uci_load(name)
+            if base is None: raise ValueError(f"package tidak ada: {name}")
+            pkgs[name] = uci_clone(base)
+        return pkgs[name]
+
+    if cmd == "add":
+        if len(args) != 2: raise ValueError("add: format `add <package> <type>`")
+        pkg = package(args[0])
+        name = _uci_anon_name(args[1], pkg.n_section + 1)
+        uci_apply_delta(pkg, f"+{pkg.name}.{name}={args[1]}")
+        return f"add {pkg.name} {args[1]}"
+    path, eq, value = " ".join(args).partition("=")
+    parts = path.split(".", 2)
+    if len(parts) < 2 or not all(parts):
+        raise ValueError(f"{cmd}: path tidak valid: {path}")
+    pkg = package(parts[0])
+    opt = parts[2] if len(parts) > 2 else None
+    sec = pkg.section(parts[1])
+    if sec is None and not (cmd == "set" and opt is None and not parts[1].startswith("@")):
+        raise ValueError(f"section tidak ada: {pkg.name}.{parts[1]}")
+    if cmd != "delete" and not eq:
+        raise ValueError(f"{cmd}: nilai kosong (`{path}=...`)")
+    if cmd == "reorder" and not value.isdigit():
+        raise ValueError("reorder: posisi harus angka")
+    prefix = {"set": "", "delete": "-", "rename": "@", "reorder": "^", "add_list": "|", "del_list": "~"}[cmd]
+    target = f"{pkg.name}.{sec.name if sec else parts[1]}" + (f".{opt}" if opt else "")
+    uci_apply_delta(pkg, prefix + target + (f"={shlex.quote(value)}" if eq and cmd != "delete" else ""))
+    return f"{cmd} {path}" + (f"={shlex.quote(value)}" if eq and cmd != "delete" else "")
+
+def uci_stage_simulate(commands: List[str]) -> Tuple[Dict[str, UciPackage], List[str]]:
+    pkgs: Dict[str, UciPackage] = {}
+    errors = []
+    for line in commands:
+        try:
+            _uci_stage_apply(pkgs, shlex.split(line))
+        except ValueError as e:
+            errors.append(f"{line}: {e}")
+    return pkgs, errors
+
+def uci_stage_add(chat_id: int, text: str) -> Tuple[int, List[str]]:
+    """Tambahkan perintah ke stage chat. Perintah yang gagal disimulasikan ditolak. Return (jumlah diterima, error)."""
+    stage = UCI_STAGES.setdefault(chat_id, UciStage())
+    pkgs, _ = uci_stage_simulate(stage.commands)
+    accepted, errors = 0, []
+    for argv in uci_split_commands(text):
+        if len(stage.commands) >= UCI_STAGE_MAX:
+            errors.append(f"stage penuh ({UCI_STAGE_MAX} perintah), commit atau buang dulu"); break
+        try:
+            line = _uci_stage_apply(pkgs, argv)
+        except ValueError as e:
+            errors.append(f"{' '.join(argv)}: {e}"); continue
+        stage.commands.append(line); accepted += 1
+        pkg = line.split()[1].split(".", 1)[0]
+        if pkg not in stage.packages: stage.packages.append(pkg)
+    if not stage.commands: UCI_STAGES.pop(chat_id, None)
+    return accepted, errors
+
+def uci_stage_preview(chat_id: int) -> str:
+    stage = UCI_STAGES.get(chat_id)
+    if not stage: return "(tidak ada perubahan di stage)"
+    pkgs, errors = uci_stage_simulate(stage.commands)
+    out = [f"📝 {len(stage.commands)} perintah di stage:"] + [f"  {c}" for c in stage.commands]
+    for name in stage.packages:
+        base = uci_load(name)
+        after = pkgs.get(name)
+        if base is None or after is None: continue
+        diff = [l for l in difflib.unified_diff(uci_show_lines(base), uci_show_lines(after), lineterm="", n=0)
+                if l[:1] in "+-" and not l.startswith(("+++", "---"))]
+        out += ["", f"=== {name} ==="] + (diff or ["(tidak ada perubahan efektif)"])
+        if uci_changes_pending(name):
+            out.append(f"ℹ️ {os.path.join(UCI_DELTA_DIR, name)} berisi perubahan lain; tidak ikut di-commit")
+    if errors:
+        out += ["", "⚠️ tidak lagi valid terhadap config saat ini:"] + errors
+    return "\n".join(out)
+
+def uci_stage_discard(chat_id: int) -> bool:
+    return UCI_STAGES.pop(chat_id, None) is not None
+
+def uci_stage_commit(chat_id: int) -> Tuple[str, List[str]]:
+    """Jalankan stage sebagai satu `uci batch` di savedir privat lalu commit. Return (output, service yang perlu reload)."""
+    stage = UCI_STAGES.get(chat_id)
+    if not stage: return "[ERR] Tidak ada perubahan di stage.", []
+    _, errors = uci_stage_simulate(stage.commands)
+    if errors: return "[ERR] Stage tidak valid terhadap config saat ini:\n" + "\n".join(errors), []
+    if not CAPS.has_bin("uci"): return "[ERR] uci tidak tersedia.", []
+    savedir = tempfile.mkdtemp(prefix="ranet-uci.")
+    try:
+        script = (f"uci -t {shlex.quote(savedir)} batch <<'RANET_UCI_EOF'\n" + "\n".join(stage.commands)
+                  + "\nRANET_UCI_EOF\n")
+        with run_capture(script, 60, "background", shell=True) as res:
+            out = res.text()
+            if res.error or res.timed_out or res.returncode != 0 or "uci: " in out:
+                return f"[ERR] uci batch gagal, tidak ada yang di-commit:\n{res.error or out}", []
+        out = run_cmd(f"uci -t {shlex.quote(savedir)} commit " + " ".join(stage.packages), timeout=60, cls="background")
+        if out.startswith("[ERR]"): return out, []
+    finally:
+        shutil.rmtree(savedir, ignore_errors=True)
+    UCI_STAGES.pop(chat_id, None)
+    services = []
+    for name in stage.packages:
+        svc = UCI_RELOAD_SERVICES.get(name) or (name if CAPS.has_init(name) else None)
+        if svc and svc not in services: services.append(svc)
+    return f"✅ {len(stage.commands)} perintah di-commit ke {', '.join(stage.packages)}.", services
+
+def service_reload(svc: str) -> str:
+    if svc == "wifi":
+        return run_wifi_reload()
+    if svc == "firewall":
+        out = run_cmd("fw4 reload", cls="background")
+        if out.startswith("[ERR]"):
+            out = run_cmd("fw3 reload", cls="background")
+        return out
+    return run_cmd(f"/etc/init.d/{shlex.quote(svc)} reload", cls="background")
+
+RELOAD_PENDING: Dict[str, set] = {}     # service -> chat id yang menunggu hasil
+RELOAD_DUE = 0.0
+RELOAD_TASK: Optional[asyncio.Task] = None
+
+def schedule_reload(bot, services: List[str], chat_id: Optional[int] = None, delay: Optional[float] = None):
+    # setiap permintaan baru menggeser tenggat; satu worker menjalankan tiap service sekali
+    global RELOAD_DUE, RELOAD_TASK
+    if not services: return
+    for svc in services:
+        RELOAD_PENDING.setdefault(svc, set()).update([chat_id] if chat_id else [])
+    RELOAD_DUE = time.monotonic() + (RELOAD_DEBOUNCE if delay is None else delay)
+    if RELOAD_TASK is None or RELOAD_TASK.done():
+        RELOAD_TASK = asyncio.get_running_loop().create_task(_reload_worker(bot))
+
+async def _reload_worker(bot):
+    loop = asyncio.get_running_loop()
+    while RELOAD_PENDING:
+        wait = RELOAD_DUE - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait); continue
+        batch = dict(RELOAD_PENDING); RELOAD_PENDING.clear()
+        order = sorted(batch, key=lambda s: UCI_RELOAD_ORDER.index(s) if s in UCI_RELOAD_ORDER else len(UCI_RELOAD_ORDER))
+        for svc in order:
+            out = await loop.run_in_executor(None, service_reload, svc)
+            ok = not out.startswith("[ERR]")
+            if not ok: print(f"[WARN] reload {svc}: {out[:200]}")
+            for chat_id in batch[svc]:
+                text = f"🔄 Reload {svc}: {'OK' if ok else 'gagal'}" + ("" if ok else "\n" + out[:1000])
+                with contextlib.suppress(Exception):
+                    await bot.send_message(chat_id, text)
+
+async def stage_uci_text(message, chat_id: int, text: str):
+    accepted, errors = uci_stage_add(chat_id, text)
+    head = f"📥 {accepted} perintah masuk stage." + ("\n❌ Ditolak:\n" + "\n".join(errors) if errors else "")
+    await reply_uci_stage(message, chat_id, head)
+
+async def reply_uci_stage(message, chat_id: int, head: str = ""):
+    out = uci_stage_preview(chat_id)
+    chunks = list(split_chunks(out))
+    if head: await message.reply_text(head)
+    for i, chunk in enumerate(chunks):
+        markup = uci_stage_keyboard() if i == len(chunks) - 1 and chat_id in UCI_STAGES else None
+        await message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2, reply_markup=markup)
+
+
+# ------------------ CLI SHELL ---------------------
+# Shell persisten per chat: cwd/variabel bertahan antar perintah.
+CLI_IDLE_TIMEOUT = int(os.getenv("RANET_CLI_IDLE_TIMEOUT", "900"))       # detik
+CLI_MEM_LIMIT_MB = int(os.getenv("RANET_CLI_MEM_LIMIT_MB", "64"))        # 0 = tanpa batas
+CLI_OUTPUT_MAX = int(os.getenv("RANET_CLI_OUTPUT_MAX", str(64 * 1024)))  # byte per perintah
+CLI_HISTORY_SIZE = int(os.getenv("RANET_CLI_HISTORY_SIZE", "50"))
+
+def _cli_limit(pid: int):
+    # dipasang dari parent (prlimit) sebelum perintah pertama dikirim; batas memori diwarisi semua perintah
+    if CLI_MEM_LIMIT_MB <= 0 or resource is None: return
+    lim = CLI_MEM_LIMIT_MB * 1024 * 1024
+    with contextlib.suppress(OSError, ValueError): resource.prlimit(pid, resource.RLIMIT_AS, (lim, lim))
+
+class CliShell:
+    """/bin/sh persisten; batas output tiap perintah ditandai sentinel unik."""
+
+    def __init__(self, cwd: Optional[str] = None):
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.lock = asyncio.Lock()
+        self.cwd = cwd or os.path.expanduser("~")
+        self.last_used = time.time()
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def _spawn(self):
+        env = dict(os.environ, TERM="dumb", PS1="", PS2="")
+        cwd = self.cwd if os.path.isdir(self.cwd) else "/"
+        self.proc = await asyncio.create_subprocess_exec(
+            "/bin/sh", stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT, cwd=cwd, env=env,
+            start_new_session=True)
+        _cli_limit(self.proc.pid)
+
+    def kill(self):
+        if not self.alive: return
+        with contextlib.suppress(Exception):
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        with contextlib.suppress(Exception):
+            self.proc.kill()
+
+    async def close(self):
+        if self.proc is None: return
+        if self.alive:
+            with contextlib.suppress(Exception):
+                self.proc.stdin.write(b"exit\n")
+                await self.proc.stdin.drain()
+            try:
+                await asyncio.wait_for(self.proc.wait(), 2)
+            except Exception:
+                self.kill()
+                with contextlib.suppress(Exception):
+                    await asyncio.wait_for(self.proc.wait(), 2)
+        self.proc = None
+
+    async def run(self, command: str, timeout: Optional[int] = None, on_output=None) -> Tuple[str, Optional[int]]:
+        """Jalankan satu perintah. Return (output, exit_code); exit_code None bila shell mati/timeout.
+        on_output(text) dipanggil untuk tiap potongan output selagi perintah berjalan."""
+        async with self.lock:
+            self.last_used = time.time()
+            if not self.alive:
+                await self._spawn()
+            sentinel = "__RANET_%s__" % uuid.uuid4().hex
+            marker = ("\n%s:" % sentinel).encode()
+            # `command eval` agar syntax error tidak mematikan shell
+            line = "command eval %s </dev/null 2>&1; printf '\\n%%s:%%s:%%s\\n' %s \"$?\" \"$PWD\"\n" % (
+                shlex.quote(command), sentinel)
+            try:
+                self.proc.stdin.write(line.encode())
+                await self.proc.stdin.drain()
+            except Exception as e:
+                self.kill(); self.proc = None
+                return f"[ERR] Shell tidak bisa dipakai: {e}", None
+            head = bytearray(); tail = b""; dropped = 0; code: Optional[int] = None
+            keep = len(marker) - 1
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+            def _take(chunk: bytes):
+                nonlocal dropped
+                room = CLI_OUTPUT_MAX - len(head)
+                if room > 0:
+                    head.extend(chunk[:room])
+                    if on_output: on_output(decoder.decode(chunk[:room]))
+                dropped += max(0, len(chunk) - max(room, 0))
+
+            async def _read_until_marker():
+                nonlocal tail, code
+                while True:
+                    chunk = await self.proc.stdout.read(4096)
+                    if not chunk:
+                        _take(tail); tail = b""
+                        return False
+                    data = tail + chunk
+                    idx = data.find(marker)
+                    if idx >= 0:
+                        _take(data[:idx])
+                        rest = data[idx + len(marker):]
+                        while b"\n" not in rest:
+                            more = await self.proc.stdout.read(256)
+                            if not more: break
+                            rest += more
+                        status, _, cwd = rest.split(b"\n", 1)[0].decode("utf-8", "replace").partition(":")
+                        with contextlib.suppress(ValueError): code = int(status)
+                        if cwd: self.cwd = cwd
+                        return True
+                    if len(data) > keep:
+                        _take(data[:-keep]); tail = data[-keep:]
+                    else:
+                        tail = data
+
+            try:
+                finished = await asyncio.wait_for(_read_until_marker(), timeout or CMD_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.kill(); self.proc = None
+                out = head.decode("utf-8", "replace").rstrip()
+                return (out + "\n" if out else "") + f"[ERR] Timeout setelah {timeout or CMD_TIMEOUT}s, shell di-reset", None
+            finally:
+                self.last_used = time.time()
+            out = head.decode("utf-8", "replace").rstrip()
+            if dropped:
+                out += f"\n... (output dipotong, {dropped} byte dibuang)"
+            if not finished:
+                self.proc = None
+                out = (out + "\n" if out else "") + "(shell keluar, sesi baru dibuat pada perintah berikutnya)"
+            return out, code
+
+CLI_SHELLS: Dict[int, CliShell] = {}
+
+def cli_shell_get(chat_id: int) -> CliShell:
+    sh = CLI_SHELLS.get(chat_id)
+    if sh is None:
+        sh = CLI_SHELLS[chat_id] = CliShell()
+    return sh
+
+async def cli_shell_close(chat_id: int):
+    sh = CLI_SHELLS.pop(chat_id, None)
+    if sh: await sh.close()
+
+def cli_history_load() -> Dict[int, deque]:
+    hist: Dict[int, deque] = defaultdict(lambda: deque(maxlen=CLI_HISTORY_SIZE))
+    try:
+        raw = json.loads(settings_get("cli_history", "{}") or "{}")
+        for cid, cmds in raw.items():
+            hist[int(cid)].extend(str(c) for c in cmds)
+    except Exception:
+        pass
+    return hist
+
+def cli_history_add(chat_id: int, command: str):
+    CLI_HISTORY[chat_id].append(command)
+    try:
+        settings_set("cli_history", json.dumps({str(k): list(v) for k, v in CLI_HISTORY.items() if v}))
+    except Exception:
+        pass
+
+def cli_result_text(out: str, code: Optional[int], cwd: str) -> str:
+    footer = f"[exit {code}] {cwd}" if code is not None else f"[{cwd}]"
+    return f"{out or '(no output)'}\n{footer}"
+
+async def job_cli_reaper(ctx: ContextTypes.DEFAULT_TYPE):
+    now = time.time()
+    for chat_id, sh in list(CLI_SHELLS.items()):
+        if sh.lock.locked() or now - sh.last_used < CLI_IDLE_TIMEOUT: continue
+        await cli_shell_close(chat_id)
+        if CLI_SESSIONS.get(chat_id):
+            CLI_SESSIONS[chat_id] = False
+            with contextlib.suppress(Exception):
+                await ctx.bot.send_message(chat_id, f"⌛ CLI ditutup (idle {CLI_IDLE_TIMEOUT // 60} menit).",
+                                           reply_markup=cli_menu_keyboard(False))
 
 
 
@@ -3436,7 +8606,7 @@ def db_init_once():
 db_init_once()  # init DB dulu, sebelum akses settings
 CURRENT_IFACE = init_current_iface()
 CLI_SESSIONS: Dict[int, bool] = {}
-CLI_HISTORY: Dict[int, List[str]] = defaultdict(list)
+CLI_HISTORY: Dict[int, deque] = cli_history_load()
 NB_WAIT_SETUP_KEY = set()   # chat_id waiting for netbird setup key input
 POWER_TASKS: Dict[int, asyncio.Task] = {}
 
@@ -3461,6 +8631,13 @@ PROMPT_KEYS_BOOL = {
     "await_scheduler_action",
     "await_power_custom",
     "await_usbwd_config",
+    "await_android_rotate_sched",
+    "await_uci_filter",
+    "await_probe_targets",
+    "await_httpcheck_targets",
+    "await_speedtest_sched",
+    "await_perf_target",
+    "await_wg_watch",
 }
 
 PROMPT_KEYS_VALUE = {
@@ -3475,6 +8652,8 @@ PROMPT_KEYS_VALUE = {
     "process_action",
     "scheduler_action",
     "power_action",
+    "android_rotate_serial",
+    "uci_filter_view",
 }
 
 def reset_user_state(state: Dict):
@@ -3519,17 +8698,33 @@ def android_menu_keyboard(has_device: bool) -> InlineKeyboardMarkup:
 
         rows.append([
 
-            InlineKeyboardButton("ℹ️ Ringkasan", callback_data="ANDROID_SUMMARY"),
+            InlineKeyboardButton("ℹ️ Ringkasan", callback_data="ANDROID_SUMMARY"),
+
+            InlineKeyboardButton("📨 5 SMS Terakhir", callback_data="ANDROID_SMS_5"),
+
+        ])
+
+        rows.append([
+
+            InlineKeyboardButton("📡 Monitor Sinyal", callback_data="ANDROID_SIGNAL_MONITOR"),
+
+            InlineKeyboardButton("📝 Export Report", callback_data="ANDROID_EXPORT"),
+
+        ])
+
+        rows.append([
+
+            InlineKeyboardButton("🔁 Rotasi IP", callback_data="ANDROID_ROTATE"),
 
-            InlineKeyboardButton("📨 5 SMS Terakhir", callback_data="ANDROID_SMS_5"),
+            InlineKeyboardButton("⏰ Jadwal Rotasi", callback_data="ANDROID_ROTATE_SCHED"),
 
         ])
 
         rows.append([
 
-            InlineKeyboardButton("📡 Monitor Sinyal", callback_data="ANDROID_SIGNAL_MONITOR"),
+            InlineKeyboardButton("📜 Riwayat Rotasi", callback_data="ANDROID_ROTATE_HIST"),
 
-            InlineKeyboardButton("📝 Export Report", callback_data="ANDROID_EXPORT"),
+            InlineKeyboardButton("📈 Telemetri", callback_data="ANDROID_TELEM:1h"),
 
         ])
 
@@ -3552,6 +8747,14 @@ def android_menu_keyboard(has_device: bool) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+def android_telemetry_keyboard(current: str) -> InlineKeyboardMarkup:
+
+    row = [InlineKeyboardButton(f"{'✅ ' if key == current else ''}{key}", callback_data=f"ANDROID_TELEM:{key}")
+           for key in ANDROID_TELEMETRY_WINDOWS]
+
+    return InlineKeyboardMarkup([row, [InlineKeyboardButton("📱 Menu Android", callback_data="MENU_ANDROID")]])
+
+
 def android_device_select_keyboard(devices: List[AndroidDevice]) -> InlineKeyboardMarkup:
 
     rows: List[List[InlineKeyboardButton]] = []
@@ -3671,6 +8874,7 @@ def network_root_menu() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("🧾 DHCP Leases", callback_data="NET_DHCP")],
         [InlineKeyboardButton("🛡️ Firewall", callback_data="MENU_FIREWALL")],
         [InlineKeyboardButton("🚪 Port Forwarding", callback_data="MENU_PORTFWD")],
+        [InlineKeyboardButton("🖥️ Config System", callback_data="UCI_VIEW:sys")],
         [InlineKeyboardButton("📱 Menu Utama", callback_data="SHOW_MAIN_MENU")],
     ])
 
@@ -3679,6 +8883,7 @@ def wifi_menu_keyboard() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("🔎 Scan WiFi", callback_data="WIFI_SCAN")],
         [InlineKeyboardButton("📊 Status", callback_data="WIFI_STATUS")],
         [InlineKeyboardButton("👥 Clients", callback_data="WIFI_CLIENTS")],
+        [InlineKeyboardButton("🗂️ Config (UCI)", callback_data="UCI_VIEW:wifi")],
         [InlineKeyboardButton("⚙️ Konfigurasi", callback_data="WIFI_CONFIG")],
         [InlineKeyboardButton("🔁 Restart WiFi", callback_data="QA_WIFI_RESTART")],
         [InlineKeyboardButton("🔙 Menu Network", callback_data="MENU_NETWORK_ROOT")],
@@ -3686,7 +8891,8 @@ def wifi_menu_keyboard() -> InlineKeyboardMarkup:
 
 def firewall_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📃 Lihat Rules", callback_data="FW_LIST")],
+        [InlineKeyboardButton("📃 Lihat Rules", callback_data="FW_LIST"),
+         InlineKeyboardButton("🔎 Filter", callback_data="UCI_FILTER:fw")],
         [InlineKeyboardButton("➕ Tambah Rule", callback_data="FW_ADD")],
         [InlineKeyboardButton("➖ Hapus Rule", callback_data="FW_DELETE")],
         [InlineKeyboardButton("🔄 Reload Firewall", callback_data="FW_RELOAD")],
@@ -3695,13 +8901,27 @@ def firewall_menu_keyboard() -> InlineKeyboardMarkup:
 
 def port_forward_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📃 Lihat Port Forward", callback_data="PF_LIST")],
+        [InlineKeyboardButton("📃 Lihat Port Forward", callback_data="PF_LIST"),
+         InlineKeyboardButton("🔎 Filter", callback_data="UCI_FILTER:pf")],
         [InlineKeyboardButton("➕ Tambah Port Forward", callback_data="PF_ADD")],
         [InlineKeyboardButton("➖ Hapus Port Forward", callback_data="PF_DELETE")],
         [InlineKeyboardButton("🔄 Reload Firewall", callback_data="FW_RELOAD")],
         [InlineKeyboardButton("🔙 Menu Network", callback_data="MENU_NETWORK_ROOT")],
     ])
 
+def uci_view_keyboard(view: str, filt: str = "") -> InlineKeyboardMarkup:
+    row = [InlineKeyboardButton("🔎 Filter", callback_data=f"UCI_FILTER:{view}")]
+    if filt:
+        row.append(InlineKeyboardButton("✖️ Semua", callback_data=f"UCI_VIEW:{view}"))
+    return InlineKeyboardMarkup([row])
+
+def uci_stage_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Commit & Reload", callback_data="UCI_COMMIT"),
+         InlineKeyboardButton("🗑️ Buang", callback_data="UCI_DISCARD")],
+        [InlineKeyboardButton("👁️ Preview", callback_data="UCI_PREVIEW")],
+    ])
+
 def monitoring_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("📊 VNStat", callback_data="MENU_VNSTAT")],
@@ -3724,10 +8944,31 @@ def speedtest_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("⚡ Speedtest Now", callback_data="SPD_NOW"),
          InlineKeyboardButton("⚙️ Pilih Server", callback_data="SPD_SERVER")],
+        [InlineKeyboardButton("🗓 Terjadwal", callback_data="SPD_SCHED"),
+         InlineKeyboardButton("🫧 Bufferbloat", callback_data="SPD_BLOAT")],
         [InlineKeyboardButton("📱 Menu Utama", callback_data="SHOW_MAIN_MENU")],
     ])
 
 
+def bufferbloat_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("▶️ Tes (HTTP)", callback_data="SPD_BLOAT_RUN:http"),
+         InlineKeyboardButton("▶️ Tes (speedtest)", callback_data="SPD_BLOAT_RUN:speedtest")],
+        [InlineKeyboardButton("🔄 Refresh", callback_data="SPD_BLOAT"),
+         InlineKeyboardButton("🔙 Kembali", callback_data="MENU_SPEEDTEST")],
+    ])
+
+
+def speedtest_sched_keyboard() -> InlineKeyboardMarkup:
+    enabled = settings_get("speedtest_sched_enabled", os.getenv("RANET_SPEEDTEST_SCHED", "0")) == "1"
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("⏹️ Matikan" if enabled else "▶️ Aktifkan", callback_data="SPD_SCHED_TOGGLE"),
+         InlineKeyboardButton("⚙️ Atur", callback_data="SPD_SCHED_CFG")],
+        [InlineKeyboardButton("🔄 Refresh", callback_data="SPD_SCHED"),
+         InlineKeyboardButton("🔙 Kembali", callback_data="MENU_SPEEDTEST")],
+    ])
+
+
 def speedtest_server_keyboard(current: Optional[str]) -> InlineKeyboardMarkup:
 
     rows = []
@@ -3738,6 +8979,8 @@ def speedtest_server_keyboard(current: Optional[str]) -> InlineKeyboardMarkup:
 
         rows.append([InlineKeyboardButton(label, callback_data=f"SPD_SET_SERVER:{sid}")])
 
+    rows.append([InlineKeyboardButton("🎯 Auto: Probe Latency", callback_data="SPD_PROBE")])
+
     rows.append([InlineKeyboardButton("❌ Hapus Pilihan Server", callback_data="SPD_CLR_SERVER")])
 
     rows.append([InlineKeyboardButton("🔙 Kembali", callback_data="MENU_SPEEDTEST")])
@@ -3752,13 +8995,40 @@ def nettools_menu() -> InlineKeyboardMarkup:
          InlineKeyboardButton("🏓 Ping 1.1.1.1", callback_data="NT_PING:1.1.1.1")],
         [InlineKeyboardButton("🧭 Traceroute 8.8.8.8", callback_data="NT_TR:8.8.8.8"),
          InlineKeyboardButton("🧭 Traceroute 1.1.1.1", callback_data="NT_TR:1.1.1.1")],
+        [InlineKeyboardButton("📶 MTR 8.8.8.8", callback_data="NT_MTR:8.8.8.8"),
+         InlineKeyboardButton("📶 MTR 1.1.1.1", callback_data="NT_MTR:1.1.1.1")],
+        [InlineKeyboardButton("📈 Latency Monitor", callback_data="PROBE_REPORT"),
+         InlineKeyboardButton("🌐 HTTP Check", callback_data="HTTPC_REPORT")],
+        [InlineKeyboardButton("🧬 DNS Benchmark", callback_data="DNS_BENCH"),
+         InlineKeyboardButton("📦 Cache dnsmasq", callback_data="DNS_CACHE")],
         [InlineKeyboardButton("ℹ️ /ping <host>", callback_data="NT_INFO")],
         [InlineKeyboardButton("🔙 Menu Tools", callback_data="MENU_TOOLS_ROOT")],
     ])
 
+def latency_keyboard() -> InlineKeyboardMarkup:
+    running = LATENCY_PROBER.running
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data="PROBE_REPORT"),
+         InlineKeyboardButton("⏹️ Stop" if running else "▶️ Start", callback_data="PROBE_TOGGLE")],
+        [InlineKeyboardButton("🎯 Ubah Target", callback_data="PROBE_TARGETS")],
+        [InlineKeyboardButton("🔙 Network Tools", callback_data="MENU_NETTOOLS")],
+    ])
+
+def httpcheck_keyboard() -> InlineKeyboardMarkup:
+    running = HTTP_CHECKER.running
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data="HTTPC_REPORT"),
+         InlineKeyboardButton("▶️ Cek Sekarang", callback_data="HTTPC_RUN")],
+        [InlineKeyboardButton("⏹️ Stop" if running else "▶️ Start", callback_data="HTTPC_TOGGLE"),
+         InlineKeyboardButton("🎯 Ubah URL", callback_data="HTTPC_TARGETS")],
+        [InlineKeyboardButton("🔙 Network Tools", callback_data="MENU_NETTOOLS")],
+    ])
+
 def diag_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("📊 Top & Load & Temp", callback_data="DIAG_TOP")],
+        [InlineKeyboardButton("🧩 Capabilities", callback_data="DIAG_CAPS")],
+        [InlineKeyboardButton("📡 ubus Events", callback_data="DIAG_UBUS")],
         [InlineKeyboardButton("🔙 Menu Tools", callback_data="MENU_TOOLS_ROOT")],
     ])
 
@@ -3767,6 +9037,7 @@ def cli_menu_keyboard(active: bool) -> InlineKeyboardMarkup:
         return InlineKeyboardMarkup([
             [InlineKeyboardButton("❌ Keluar", callback_data="CLI_EXIT"),
              InlineKeyboardButton("📜 History", callback_data="CLI_HISTORY")],
+            [InlineKeyboardButton("♻️ Reset Shell", callback_data="CLI_RESET")],
             [InlineKeyboardButton("🔙 Menu Tools", callback_data="MENU_TOOLS_ROOT")],
         ])
     else:
@@ -3784,9 +9055,19 @@ def netbird_menu_keyboard() -> InlineKeyboardMarkup:
          InlineKeyboardButton("🔑 Setup Key", callback_data="NB_SETUPKEY")],
         [InlineKeyboardButton("🗑️ Deregister", callback_data="NB_DEREG"),
          InlineKeyboardButton("🛠️ Setup", callback_data="MENU_NB_SETUP")],
+        [InlineKeyboardButton("🚀 Tes ke Peer", callback_data="NB_PERF"),
+         InlineKeyboardButton("📡 Perf Server", callback_data="NB_PERF_SERVER")],
+        [InlineKeyboardButton("📈 Tunnel (wg)", callback_data="NB_WG")],
         [InlineKeyboardButton("🔙 Menu Monitoring", callback_data="MENU_MONITORING")],
     ])
 
+def wg_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data="NB_WG"),
+         InlineKeyboardButton("👁️ Pantau", callback_data="NB_WG_WATCH")],
+        [InlineKeyboardButton("🔙 NetBird", callback_data="MENU_NETBIRD")],
+    ])
+
 def backup_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("📦 Backup Now", callback_data="BK_DO")],
@@ -3830,6 +9111,7 @@ def tools_menu_keyboard() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("🩺 Diagnostics", callback_data="MENU_DIAG")],
         [InlineKeyboardButton("🖥️ Remote Terminal", callback_data="MENU_CLI")],
         [InlineKeyboardButton("⏰ Scheduler", callback_data="MENU_SCHEDULER")],
+        [InlineKeyboardButton("🧵 Jobs", callback_data="JOBS")],
         [InlineKeyboardButton("🧩 Update BOT", callback_data="MENU_UPDATE")],
         [InlineKeyboardButton("📱 Menu Utama", callback_data="SHOW_MAIN_MENU")],
     ])
@@ -3843,6 +9125,8 @@ def usb_watchdog_menu_keyboard() -> InlineKeyboardMarkup:
          InlineKeyboardButton("⏹️ Stop", callback_data="USBWD_STOP")],
         [InlineKeyboardButton("🔁 Restart", callback_data="USBWD_RESTART"),
          InlineKeyboardButton("🧾 Lihat Config", callback_data="USBWD_SHOW")],
+        [InlineKeyboardButton("📜 Event Log", callback_data="USBWD_EVENTS"),
+         InlineKeyboardButton("🔍 Cek Sekarang", callback_data="USBWD_CHECK")],
         [InlineKeyboardButton("📡 List Interface", callback_data="USBWD_LIST_IF")],
         [InlineKeyboardButton("🔙 Menu Tools", callback_data="MENU_TOOLS_ROOT")],
     ])
@@ -3872,14 +9156,19 @@ def run_wifi_reload() -> str:
             return out or f"Perintah '{cmd}' dieksekusi."
     return out
 
-def get_wifi_interfaces() -> List[str]:
+def wifi_status_data() -> Optional[Dict[str, Any]]:
+    # `wifi status` hanyalah `ubus call network.wireless status`; CLI dipakai bila socket ubus tidak ada
+    data = ubus_call("network.wireless", "status")
+    if data is not None:
+        return data
     out = run_cmd("wifi status")
-    if out.startswith("[ERR]"):
-        return []
     try:
-        data = json.loads(out)
+        return json.loads(out)
     except Exception:
-        data = {}
+        return None
+
+def get_wifi_interfaces() -> List[str]:
+    data = wifi_status_data() or {}
     ifaces = []
     if isinstance(data, dict):
         for radio in data.values():
@@ -3890,12 +9179,10 @@ def get_wifi_interfaces() -> List[str]:
     return sorted(set(ifaces))
 
 def wifi_status_text() -> str:
-    out = run_cmd("wifi status")
-    try:
-        data = json.loads(out)
-        return json.dumps(data, indent=2, sort_keys=True)
-    except Exception:
-        return out
+    data = wifi_status_data()
+    if data is None:
+        return run_cmd("wifi status")
+    return json.dumps(data, indent=2, sort_keys=True)
 
 def wifi_clients_text() -> str:
     ifaces = get_wifi_interfaces()
@@ -3935,54 +9222,38 @@ def dhcp_leases_text() -> str:
             rows.append(f"{ip:>15}  {mac:17}  {host or '-':20}  exp:{expire_ts}")
     return "\n".join(rows) or "(tidak ada lease)"
 
-def firewall_rules_text() -> str:
-    return run_cmd("uci show firewall")
-
-def port_forward_rules_text() -> str:
-    out = run_cmd("uci show firewall | grep -E 'redirect|rule' -n")
-    if "[ERR]" in out:
-        out = run_cmd("uci show firewall")
-    return out
-
-def apply_shell_commands(commands: str) -> str:
-    script = "\n".join(c for c in commands.splitlines() if c.strip())
-    if not script:
-        return "[ERR] Tidak ada perintah."
-    return run_shell(script)
-
-def interfaces_overview_text() -> str:
-    addr = run_cmd("ip -o addr show")
-    stats = run_cmd("ip -s link show")
-    return f"=== ip addr ===\n{addr}\n\n=== ip -s link ===\n{stats}"
-
-def opkg_update_text() -> str:
-    return run_cmd("opkg update", timeout=180)
-
-def opkg_upgrade_text() -> str:
-    return run_cmd("opkg upgrade", timeout=240)
-
-def opkg_install(packages: str) -> str:
-    pkgs = " ".join(shlex.split(packages))
+async def opkg_package_start(message, application, action: str, packages: str):
+    """install/remove sebagai job opkg: antre slot exec (install = heavy) alih-alih gagal saat slot penuh."""
+    try:
+        pkgs = shlex.split(packages)
+    except ValueError as e:
+        await message.reply_text(f"[ERR] Nama paket tidak valid: {e}"); return
     if not pkgs:
-        return "[ERR] Paket tidak diberikan."
-    return run_cmd(f"opkg install {pkgs}", timeout=240)
+        await message.reply_text("[ERR] Paket tidak diberikan."); return
 
-def opkg_remove(packages: str) -> str:
-    pkgs = " ".join(shlex.split(packages))
-    if not pkgs:
-        return "[ERR] Paket tidak diberikan."
-    return run_cmd(f"opkg remove {pkgs}")
+    async def _opkg_op(op: Operation):
+        _out, code = await stream_command(message, f"opkg {action}", ["opkg", action] + pkgs,
+                                          240 if action == "install" else None,
+                                          cls="heavy" if action == "install" else "background")
+        await asyncio.get_running_loop().run_in_executor(None, caps_rescan)
+        if code != 0: op.status = "failed"
+        return f"exit {code}"
+
+    await op_start(message, application, "opkg", f"opkg {action} {' '.join(pkgs)}", f"opkg {action}", _opkg_op)
 
 def opkg_list_installed() -> str:
-    return run_cmd("opkg list-installed")
+    return run_cmd("opkg list-installed", cls="background")
 
 def opkg_search(term: str) -> str:
     if not term:
         return "[ERR] Kata kunci kosong."
-    return run_cmd(f"opkg list | grep -i {shlex.quote(term)}")
+    needle = term.lower()
+    out = cmd_filter_lines("opkg list", lambda ln: needle in ln.lower(), limit=300, keep="head",
+                           timeout=120, cls="background")
+    return out or f"(tidak ada paket cocok dengan '{term}')"
 
-def process_list_text() -> str:
-    return run_cmd("ps -w")
+def process_list_lines():
+    return iter_cmd_lines("ps -w")
 
 def process_top_text() -> str:
     out = run_cmd("top -bn1 | head -n 20")
@@ -4001,21 +9272,22 @@ def restart_service(name: str) -> str:
     return run_cmd(f"/etc/init.d/{shlex.quote(name)} restart")
 
 def log_syslog_tail() -> str:
-    return run_cmd("logread | tail -n 200")
+    return cmd_filter_lines("logread")
 
 def log_kernel_tail() -> str:
-    out = run_cmd("logread -k | tail -n 200")
+    out = cmd_filter_lines("logread -k")
     if out.startswith("[ERR]"):
-        out = run_cmd("dmesg | tail -n 200")
+        out = cmd_filter_lines("dmesg")
     return out
 
 def log_dmesg_tail() -> str:
-    return run_cmd("dmesg | tail -n 200")
+    return cmd_filter_lines("dmesg")
 
 def log_search(term: str) -> str:
     if not term:
         return "[ERR] Kata kunci kosong."
-    return run_cmd(f"logread | grep -i {shlex.quote(term)} | tail -n 200")
+    needle = term.lower()
+    return cmd_filter_lines("logread", lambda ln: needle in ln.lower()) or f"(tidak ada log cocok dengan '{term}')"
 
 def resolve_user_path(raw: str, base: str) -> Path:
     base_path = Path(base or "/").expanduser()
@@ -4092,11 +9364,12 @@ def human_bytes(value: float) -> str:
     return f"{value:.2f} {units[idx]}"
 
 def bandwidth_monitor_text(limit: int = 10) -> str:
-    if which("ubus"):
-        payload = json.dumps({"limit": limit, "order": "bytes", "direction": "both"})
-        out = run_cmd(f"ubus call nlbwmon get_stats '{payload}'")
+    if CAPS.has_ubus("nlbwmon"):
+        args = {"limit": limit, "order": "bytes", "direction": "both"}
+        data = ubus_call("nlbwmon", "get_stats", args)
         try:
-            data = json.loads(out)
+            if data is None:
+                data = json.loads(run_cmd(f"ubus call nlbwmon get_stats {shlex.quote(json.dumps(args))}"))
             hosts = data.get("hosts", [])
             rows = []
             for idx, host in enumerate(hosts[:limit], 1):
@@ -4172,10 +9445,9 @@ def cron_delete_line(pattern: str) -> str:
     return "OK"
 
 def cron_restart() -> str:
-    out = run_cmd("/etc/init.d/cron restart")
-    if out.startswith("[ERR]"):
-        out = run_cmd("service cron restart")
-    return out
+    if CAPS.has_init("cron"):
+        return run_cmd("/etc/init.d/cron restart")
+    return run_cmd("service cron restart")
 
 def schedule_power(ctx: ContextTypes.DEFAULT_TYPE, chat_id: int, action: str, delay: int) -> None:
     task = POWER_TASKS.get(chat_id)
@@ -4369,27 +9641,142 @@ def build_system_info(iface_for_bw: str) -> str:
 
 # ------------------ SPEEDTEST ---------------------
 
-def run_speedtest_and_parse(server_id: Optional[str] = None) -> Tuple[float,float,float,float,float,str,str]:
+SPEEDTEST_MISSING_MSG = ("[ERR] speedtest tidak ditemukan.\n"
 
-    bin_name, mode = find_speedtest_bin()
+                         "- Install Ookla CLI (x86_64/aarch64), atau\n"
 
-    if not bin_name:
+                         "- Install Python speedtest-cli: pip3 install --break-system-packages speedtest-cli")
 
-        msg = ("[ERR] speedtest tidak ditemukan.\n"
 
-               "- Install Ookla CLI (x86_64/aarch64), atau\n"
 
-               "- Install Python speedtest-cli: pip3 install --break-system-packages speedtest-cli")
+def speedtest_argv(bin_name: str, mode: str, server_id: Optional[str] = None) -> List[str]:
 
-        return 0.0, 0.0, 0.0, 0.0, 0.0, "", msg
+    if mode == "ookla" and server_id:
 
-    if mode == "ookla":
+        return [bin_name, "--server-id", str(server_id)]
+
+    if mode == "cli" and server_id:
+
+        return [bin_name, "--server", str(server_id)]
+
+    return [bin_name]
+
+
+
+# ---- Auto-pilih server (probe latency paralel) ----
+# Tanpa server dipilih: probe TCP connect paralel ke preset (+ daftar terdekat Ookla CLI), server dengan median RTT
+# terendah dipakai. Hasil di-cache per IP WAN; host:port tiap server ID di-cache permanen di settings.
+SPEEDTEST_AUTO_TTL = int(os.getenv("RANET_SPEEDTEST_AUTO_TTL", "86400"))
+SPEEDTEST_PROBE_NEAREST = os.getenv("RANET_SPEEDTEST_PROBE_NEAREST", "1") == "1"
+SPEEDTEST_PROBE_SAMPLES = 4
+SPEEDTEST_PROBE_TIMEOUT = 2.0
+SPEEDTEST_SERVERS_API = "https://www.speedtest.net/api/js/servers?engine=js&limit=50&search={q}"
+
+def _split_hostport(hostport: str, default_port: int = 8080) -> Tuple[str, int]:
+    host, sep, port = hostport.rpartition(":")
+    return (host, int(port)) if sep and port.isdigit() else (hostport, default_port)
 
-        cmd = bin_name
+async def speedtest_preset_hosts() -> Dict[str, str]:
+    """{server_id: host:port} untuk SPEEDTEST_PRESETS; yang belum dikenal dicari lewat API server Ookla."""
+    hosts: Dict[str, str] = json.loads(settings_get("speedtest_hosts", "{}") or "{}")
+    missing = [(name, sid) for name, sid in SPEEDTEST_PRESETS if sid not in hosts]
+    if missing:
+        loop = asyncio.get_running_loop()
+        queries = {name.split(" - ")[0].strip() for name, _ in missing}
+        bodies = await asyncio.gather(*(loop.run_in_executor(None, _http_get, SPEEDTEST_SERVERS_API.format(q=urllib.parse.quote(q)), 6)
+                                        for q in queries))
+        for body in bodies:
+            with contextlib.suppress(ValueError, TypeError):
+                for srv in json.loads(body or "[]"):
+                    if str(srv.get("id")) and srv.get("host"): hosts[str(srv["id"])] = srv["host"]
+        settings_set("speedtest_hosts", json.dumps(hosts))
+    return hosts
 
-        if server_id: cmd = f"{bin_name} --server-id {server_id}"
+async def speedtest_nearest_servers() -> List[Tuple[str, str, str]]:
+    bin_name, mode = find_speedtest_bin()
+    if mode != "ookla" or not SPEEDTEST_PROBE_NEAREST: return []
+    out = await run_cmd_async([bin_name, "--servers", "--format=json", "--accept-license", "--accept-gdpr"], timeout=30)
+    if out.startswith("[ERR]"): return []
+    try:
+        servers = json.loads(out[out.index("{"):]).get("servers", [])
+    except ValueError:
+        return []
+    return [(str(s["id"]), f"{s.get('name', '')} - {s.get('location', '')}", f"{s['host']}:{s.get('port', 8080)}")
+            for s in servers if s.get("id") and s.get("host")]
+
+async def speedtest_candidates() -> List[Tuple[str, str, str]]:
+    """[(server_id, nama, host:port)] preset + terdekat, tanpa duplikat."""
+    hosts, nearest = await asyncio.gather(speedtest_preset_hosts(), speedtest_nearest_servers())
+    out = [(sid, name, hosts[sid]) for name, sid in SPEEDTEST_PRESETS if sid in hosts]
+    seen = {sid for sid, _, _ in out}
+    out += [c for c in nearest if c[0] not in seen]
+    return out
+
+async def tcp_connect_rtt(host: str, port: int, timeout: float = SPEEDTEST_PROBE_TIMEOUT) -> Optional[float]:
+    t0 = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    rtt = (time.monotonic() - t0) * 1000
+    writer.close()
+    return rtt
+
+async def speedtest_probe(candidates: List[Tuple[str, str, str]]) -> List[Tuple[str, str, str, Optional[float]]]:
+    """Median RTT TCP connect per server, semua server paralel; terurut dari yang tercepat."""
+    async def one(sid: str, name: str, hostport: str):
+        host, port = _split_hostport(hostport)
+        try:
+            # resolve sekali supaya sampel hanya mengukur connect
+            infos = await asyncio.wait_for(asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM), 5)
+            addr = infos[0][4][0]
+        except (OSError, asyncio.TimeoutError):
+            return sid, name, hostport, None
+        rtts = []
+        for _ in range(SPEEDTEST_PROBE_SAMPLES):
+            rtt = await tcp_connect_rtt(addr, port)
+            if rtt is not None: rtts.append(rtt)
+        return sid, name, hostport, (_pctl(sorted(rtts), 0.5) if rtts else None)
+    res = await asyncio.gather(*(one(*c) for c in candidates))
+    return sorted(res, key=lambda r: r[3] if r[3] is not None else float("inf"))
+
+async def speedtest_auto_server(fresh: bool = False) -> Tuple[Optional[Dict[str, Any]], List[Tuple[str, str, str, Optional[float]]]]:
+    """Server tercepat untuk IP WAN saat ini: (entry cache {id,name,ms,ts} | None, hasil probe bila baru di-probe)."""
+    wan = await asyncio.get_running_loop().run_in_executor(None, get_public_ip)
+    cache: Dict[str, Any] = json.loads(settings_get("speedtest_auto", "{}") or "{}")
+    entry = cache.get(wan)
+    if entry and not fresh and time.time() - entry.get("ts", 0) < SPEEDTEST_AUTO_TTL:
+        return entry, []
+    results = await speedtest_probe(await speedtest_candidates())
+    best = next((r for r in results if r[3] is not None), None)
+    if best is None:
+        return None, results
+    entry = {"id": best[0], "name": best[1], "ms": round(best[3], 1), "ts": int(time.time())}
+    cache[wan] = entry
+    # simpan beberapa IP WAN terakhir saja
+    cache = dict(sorted(cache.items(), key=lambda kv: kv[1].get("ts", 0))[-8:])
+    settings_set("speedtest_auto", json.dumps(cache))
+    return entry, results
+
+def speedtest_probe_text(entry: Optional[Dict[str, Any]], results: List[Tuple[str, str, str, Optional[float]]]) -> str:
+    lines = []
+    if results:
+        lines.append(f"{'ID':>6}  {'RTT':>7}  Server")
+        for sid, name, hostport, ms in results[:12]:
+            lines.append(f"{sid:>6}  {(f'{ms:.1f}ms' if ms is not None else 'gagal'):>7}  {name[:28]}")
+        lines.append("")
+    if entry:
+        when = datetime.fromtimestamp(entry["ts"], TZ).strftime("%Y-%m-%d %H:%M")
+        lines.append(f"Auto: {entry['name']} (#{entry['id']}, {entry['ms']}ms, probe {when})")
+    else:
+        lines.append("Auto: tidak ada server yang menjawab; speedtest memilih server sendiri.")
+    return "\n".join(lines)
 
-        out = run_cmd(cmd, timeout=120)
+
+
+def parse_speedtest_output(mode: str, out: str) -> Tuple[float,float,float,float,float,str,str]:
+
+    if mode == "ookla":
 
         lat_pat = re.search(r"(?:Idle\s+)?Latency:\s*([0-9.]+)\s*ms\s*\(jitter:\s*([0-9.]+)ms", out)
 
@@ -4423,8 +9810,6 @@ def run_speedtest_and_parse(server_id: Optional[str] = None) -> Tuple[float,floa
 
     else:
 
-        out = run_cmd(bin_name, timeout=180)
-
         lat_pat = re.search(r"Latency:\s*([0-9.]+)\s*ms", out) or re.search(r"Ping:\s*([0-9.]+)\s*ms", out)
 
         jitter = 0.0
@@ -4451,11 +9836,631 @@ def run_speedtest_and_parse(server_id: Optional[str] = None) -> Tuple[float,floa
 
 
 async def run_speedtest_and_parse_async(server_id: Optional[str] = None) -> Tuple[float,float,float,float,float,str,str]:
+    # subprocess async agar bisa dibatalkan lewat /jobs (kill process group)
+    loop = asyncio.get_running_loop()
+    bin_name, mode = await loop.run_in_executor(None, find_speedtest_bin)
+    if not bin_name:
+        return 0.0, 0.0, 0.0, 0.0, 0.0, "", SPEEDTEST_MISSING_MSG
+    out = await run_cmd_async(speedtest_argv(bin_name, mode, server_id), timeout=120 if mode == "ookla" else 180, cls="heavy")
+    return parse_speedtest_output(mode, out)
+
+
+# ---- Output terstruktur (Ookla --format=jsonl / speedtest-cli --json) ----
+# Ookla mengirim event JSON per baris (testStart/ping/download/upload/result) → progres live di satu pesan.
+# speedtest-cli hanya mengeluarkan satu JSON di akhir. Mode teks + regex tinggal sebagai fallback binary lama.
+SPEEDTEST_BAR = 12
+
+@dataclass
+class SpeedtestResult:
+    ts: int
+    latency: float = 0.0
+    jitter: float = 0.0
+    down: float = 0.0                      # Mbps
+    up: float = 0.0
+    loss: float = 0.0
+    url: str = ""
+    server_id: str = ""
+    server_name: str = ""
+    isp: str = ""
+    bytes_down: Optional[int] = None
+    bytes_up: Optional[int] = None
+    latency_down: Optional[float] = None   # latency saat download/upload (loaded, IQM)
+    latency_up: Optional[float] = None
+    raw: str = ""
+    error: str = ""
+
+    def db_args(self) -> Dict[str, Any]:
+        return dict(server_id=self.server_id, server_name=self.server_name, isp=self.isp, bytes_down=self.bytes_down,
+                    bytes_up=self.bytes_up, latency_down=self.latency_down, latency_up=self.latency_up)
+
+def _speedtest_server_label(server: Dict[str, Any]) -> str:
+    name = server.get("name") or server.get("sponsor") or ""
+    loc = server.get("location") or server.get("country") or ""
+    return f"{name} - {loc}" if name and loc and loc not in name else name
+
+def speedtest_result_from_ookla(ev: Dict[str, Any]) -> SpeedtestResult:
+    ping, dl, ul = ev.get("ping") or {}, ev.get("download") or {}, ev.get("upload") or {}
+    server = ev.get("server") or {}
+    return SpeedtestResult(
+        ts=int(time.time()), latency=float(ping.get("latency") or 0.0), jitter=float(ping.get("jitter") or 0.0),
+        down=(dl.get("bandwidth") or 0) * 8 / 1e6, up=(ul.get("bandwidth") or 0) * 8 / 1e6,
+        loss=float(ev.get("packetLoss") or 0.0), url=(ev.get("result") or {}).get("url", ""),
+        server_id=str(server.get("id") or ""), server_name=_speedtest_server_label(server), isp=ev.get("isp") or "",
+        bytes_down=dl.get("bytes"), bytes_up=ul.get("bytes"),
+        latency_down=(dl.get("latency") or {}).get("iqm"), latency_up=(ul.get("latency") or {}).get("iqm"))
+
+def speedtest_result_from_cli(data: Dict[str, Any]) -> SpeedtestResult:
+    server = data.get("server") or {}
+    return SpeedtestResult(
+        ts=int(time.time()), latency=float(data.get("ping") or 0.0),
+        down=float(data.get("download") or 0.0) / 1e6, up=float(data.get("upload") or 0.0) / 1e6,
+        url=data.get("share") or "", server_id=str(server.get("id") or ""), server_name=_speedtest_server_label(server),
+        isp=(data.get("client") or {}).get("isp", ""), bytes_down=data.get("bytes_received"), bytes_up=data.get("bytes_sent"))
+
+class SpeedtestProgress:
+    """Parser output JSON inkremental: potongan stdout → state progres + hasil akhir."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.buf = ""
+        self.server = ""
+        self.isp = ""
+        self.phase = "mulai"
+        self.ping: Optional[Tuple[float, float]] = None
+        self.rates: Dict[str, Tuple[float, float]] = {}      # phase -> (progress 0..1, Mbps)
+        self.errors: List[str] = []
+        self.result: Optional[SpeedtestResult] = None
+        self.events = 0
+
+    def feed(self, chunk: str) -> bool:
+        """Return True bila state berubah."""
+        self.buf += chunk
+        *lines, self.buf = self.buf.split("\n")
+        changed = False
+        for line in lines:
+            line = line.strip()
+            if not line.startswith("{"): continue
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                continue
+            self.events += 1
+            changed = True
+            self._event(ev)
+        return changed
+
+    def close(self):
+        # speedtest-cli: satu objek JSON tanpa newline penutup
+        if self.buf.strip(): self.feed("\n")
+
+    def _event(self, ev: Dict[str, Any]):
+        if self.mode == "cli":
+            res = self.result = speedtest_result_from_cli(ev)
+            self.phase, self.server, self.isp, self.ping = "selesai", res.server_name, res.isp, (res.latency, res.jitter)
+            self.rates = {"download": (1.0, res.down), "upload": (1.0, res.up)}
+            return
+        kind = ev.get("type")
+        if kind == "testStart":
+            self.server = _speedtest_server_label(ev.get("server") or {})
+            self.isp = ev.get("isp") or ""
+        elif kind == "ping":
+            p = ev.get("ping") or {}
+            self.phase, self.ping = "ping", (float(p.get("latency") or 0.0), float(p.get("jitter") or 0.0))
+        elif kind in ("download", "upload"):
+            d = ev.get(kind) or {}
+            self.phase = kind
+            self.rates[kind] = (float(d.get("progress") or 0.0), (d.get("bandwidth") or 0) * 8 / 1e6)
+        elif kind == "result":
+            res = self.result = speedtest_result_from_ookla(ev)
+            self.phase, self.ping = "selesai", (res.latency, res.jitter)
+            self.rates = {"download": (1.0, res.down), "upload": (1.0, res.up)}
+        elif kind == "log" and ev.get("level") in ("error", "warning"):
+            self.errors.append(str(ev.get("message", "")))
+
+    def text(self) -> str:
+        bar = lambda p: "#" * int(round(p * SPEEDTEST_BAR)) + "-" * (SPEEDTEST_BAR - int(round(p * SPEEDTEST_BAR)))
+        lines = []
+        if self.server: lines.append(f"Server : {self.server}")
+        if self.isp: lines.append(f"ISP    : {self.isp}")
+        if self.ping: lines.append(f"Ping   : {self.ping[0]:.1f} ms (jitter {self.ping[1]:.1f})")
+        for phase, label in (("download", "Down"), ("upload", "Up")):
+            if phase in self.rates:
+                prog, mbps = self.rates[phase]
+                lines.append(f"{label:<7}: [{bar(prog)}] {prog * 100:3.0f}% {mbps:8.2f} Mbps")
+        if self.mode == "cli" and not self.result:
+            lines.append("speedtest-cli --json: menunggu hasil (tanpa progres)...")
+        lines += [f"! {e}" for e in self.errors[-2:]]
+        return "\n".join(lines) or "(menunggu speedtest...)"
+
+def speedtest_json_argv(bin_name: str, mode: str, server_id: Optional[str] = None) -> List[str]:
+    argv = speedtest_argv(bin_name, mode, server_id)
+    if mode == "ookla":
+        return argv + ["--format=jsonl", "--progress=yes", "--accept-license", "--accept-gdpr"]
+    return argv + ["--json"]
+
+async def run_speedtest_live(message, server_id: Optional[str] = None, on_progress=None) -> SpeedtestResult:
+    """Speedtest dengan progres live (bila message diberikan); fallback mode teks bila binary tidak mengeluarkan JSON.
+    on_progress(prog) dipanggil tiap state SpeedtestProgress berubah (mis. fase download/upload untuk bufferbloat)."""
+    loop = asyncio.get_running_loop()
+    bin_name, mode = await loop.run_in_executor(None, find_speedtest_bin)
+    if not bin_name:
+        return SpeedtestResult(ts=int(time.time()), error=SPEEDTEST_MISSING_MSG)
+    prog = SpeedtestProgress(mode)
+    live = LiveOutput(message, "Speedtest") if message is not None else None
+
+    def on_output(chunk: str):
+        if not prog.feed(chunk): return
+        if live: live.set(prog.text())
+        if on_progress: on_progress(prog)
+
+    if live:
+        await live.start(); live.set(prog.text())
+    try:
+        out, code = await run_streaming(speedtest_json_argv(bin_name, mode, server_id),
+                                        120 if mode == "ookla" else 180, on_output=on_output, cls="heavy")
+    except asyncio.CancelledError:
+        if live: await live.finish(ok=False, note="[dibatalkan]")
+        raise
+    prog.close()
+    res = prog.result
+    if res is None and not prog.events and code is not None and (code == 0 or re.search(r"unrecognized|unknown option|invalid option|usage:", out, re.I)):
+        # binary lama tanpa --format/--json
+        if live: live.set(prog.text() + "\nOutput JSON tidak didukung, ulang mode teks...")
+        lat, jit, down, up, loss, url, out = await run_speedtest_and_parse_async(server_id)
+        res = SpeedtestResult(ts=int(time.time()), latency=lat, jitter=jit, down=down, up=up, loss=loss, url=url)
+        if out.startswith("[ERR]") or (down == 0.0 and up == 0.0): res.error = out.strip()[:1500]
+        prog.ping, prog.rates = (lat, jit), {"download": (1.0, down), "upload": (1.0, up)}
+    elif res is None:
+        res = SpeedtestResult(ts=int(time.time()), error="; ".join(prog.errors) or (out.strip()[-1500:] or "[ERR] Speedtest gagal"))
+    res.raw = out
+    if res.error and not res.error.startswith("[ERR]"): res.error = f"[ERR] {res.error}"
+    if live:
+        live.set(prog.text() + ("\n" + res.error.splitlines()[0] if res.error else ""))
+        await live.finish(ok=not res.error)
+    return res
+
+
+# ---- Speedtest terjadwal ----
+# Baseline berkala (default tiap 6 jam ± jitter). Dilewati bila WAN sedang dipakai (counter sysfs interface
+# default route), dibatasi budget data bulanan; alert bila p50 download tes terjadwal terakhir turun di bawah ambang.
+SPEEDTEST_HISTORY_KEEP = int(os.getenv("RANET_SPEEDTEST_HISTORY_KEEP", "1000"))
+SPEEDTEST_SCHED_HOURS = float(os.getenv("RANET_SPEEDTEST_SCHED_HOURS", "6"))
+SPEEDTEST_SCHED_JITTER = int(os.getenv("RANET_SPEEDTEST_SCHED_JITTER", "1800"))
+SPEEDTEST_SCHED_RETRY = 1800                 # detik; ditunda bila WAN sibuk / speedtest lain berjalan
+SPEEDTEST_BUSY_MBPS = float(os.getenv("RANET_SPEEDTEST_BUSY_MBPS", "2"))
+SPEEDTEST_BUSY_SAMPLE = 10                   # detik sampling counter WAN
+SPEEDTEST_BUDGET_MB = float(os.getenv("RANET_SPEEDTEST_BUDGET_MB", "5000"))
+SPEEDTEST_MIN_DOWN = float(os.getenv("RANET_SPEEDTEST_MIN_DOWN", "0"))     # Mbps; 0 = relatif ke baseline 30 hari
+SPEEDTEST_REGRESSION_RATIO = 0.6
+SPEEDTEST_REGRESSION_WINDOW = 4              # jumlah tes terjadwal terakhir untuk p50
+SPEEDTEST_EST_BYTES = 200 * 1024 * 1024      # perkiraan pemakaian bila belum ada data
+
+def speedtest_sched_config() -> Dict[str, float]:
+    cfg = {"hours": SPEEDTEST_SCHED_HOURS, "budget_mb": SPEEDTEST_BUDGET_MB, "min_down": SPEEDTEST_MIN_DOWN}
+    with contextlib.suppress(ValueError, TypeError):
+        cfg.update({k: float(v) for k, v in json.loads(settings_get("speedtest_sched", "{}") or "{}").items() if k in cfg})
+    return cfg
+
+def wan_default_iface() -> Optional[str]:
+    try:
+        with open("/proc/net/route") as f:
+            next(f)
+            for line in f:
+                cols = line.split()
+                if len(cols) > 7 and cols[1] == "00000000" and cols[7] == "00000000": return cols[0]
+    except (OSError, StopIteration):
+        pass
+    return None
+
+async def wan_throughput_mbps(iface: str, seconds: float = SPEEDTEST_BUSY_SAMPLE) -> Optional[Tuple[float, float]]:
+    """(rx, tx) Mbps rata-rata selama `seconds` dari counter /sys/class/net/<iface>/statistics."""
+    base = f"/sys/class/net/{iface}/statistics"
+    read = lambda: (_sysfs_read(f"{base}/rx_bytes"), _sysfs_read(f"{base}/tx_bytes"))
+    a = read(); t0 = time.monotonic()
+    await asyncio.sleep(seconds)
+    b = read(); dt = time.monotonic() - t0
+    if not all(x.isdigit() for x in a + b): return None
+    return (int(b[0]) - int(a[0])) * 8 / dt / 1e6, (int(b[1]) - int(a[1])) * 8 / dt / 1e6
+
+def _speedtest_bytes(down: float, up: float, bdown: Optional[int], bup: Optional[int]) -> int:
+    if bdown is not None or bup is not None: return (bdown or 0) + (bup or 0)
+    return int((down + up) * 1e6 / 8 * 10)     # hasil mode teks: ±10 detik per arah
+
+def speedtest_month_usage() -> Tuple[int, int, int]:
+    """(bytes, jumlah tes, rata-rata bytes per tes) bulan ini, semua sumber."""
+    start = datetime.now(TZ).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    conn = db_connect(); cur = conn.cursor()
+    cur.execute("SELECT download_mbps,upload_mbps,bytes_down,bytes_up FROM results WHERE ts>=?", (int(start.timestamp()),))
+    sizes = [_speedtest_bytes(d or 0.0, u or 0.0, bd, bu) for d, u, bd, bu in cur.fetchall()]
+    conn.close()
+    return sum(sizes), len(sizes), (sum(sizes) // len(sizes) if sizes else SPEEDTEST_EST_BYTES)
+
+def speedtest_sched_downloads(since_ts: int) -> List[Tuple[int, float]]:
+    conn = db_connect(); cur = conn.cursor()
+    cur.execute("SELECT ts,download_mbps FROM results WHERE source='sched' AND ts>=? ORDER BY ts", (since_ts,))
+    rows = cur.fetchall(); conn.close(); return rows
+
+def speedtest_regression() -> Optional[Tuple[bool, float, float]]:
+    """(regresi?, p50 terbaru, ambang) atau None bila data belum cukup."""
+    rows = speedtest_sched_downloads(int(time.time()) - 30 * 86400)
+    if len(rows) < SPEEDTEST_REGRESSION_WINDOW: return None
+    recent = sorted(d for _, d in rows[-SPEEDTEST_REGRESSION_WINDOW:])
+    threshold = speedtest_sched_config()["min_down"]
+    if threshold <= 0:
+        base = sorted(d for _, d in rows[:-SPEEDTEST_REGRESSION_WINDOW])
+        if len(base) < 2 * SPEEDTEST_REGRESSION_WINDOW: return None
+        threshold = _pctl(base, 0.5) * SPEEDTEST_REGRESSION_RATIO
+    p50 = _pctl(recent, 0.5)
+    return p50 < threshold, p50, threshold
+
+async def speedtest_regression_alert(bot):
+    reg = speedtest_regression()
+    if reg is None: return
+    bad, p50, threshold = reg
+    state = "LOW" if bad else "OK"
+    if (alert_get("speedtest_regression") or "OK") == state: return
+    alert_set("speedtest_regression", state)
+    if bad:
+        msg = (f"🐢 *Speedtest turun*: p50 download {SPEEDTEST_REGRESSION_WINDOW} tes terjadwal terakhir "
+               f"{p50:.1f} Mbps < ambang {threshold:.1f} Mbps.")
+    else:
+        msg = f"🚀 *Speedtest pulih*: p50 download {p50:.1f} Mbps (ambang {threshold:.1f} Mbps)."
+    with contextlib.suppress(Exception):
+        await bot.send_message(chat_id=REPORT_CHAT_ID, text=msg, parse_mode="Markdown")
+
+def _speedtest_sched_next(delay: float):
+    settings_set("speedtest_sched_next", str(int(time.time() + delay)))
+
+def _speedtest_sched_note(note: str) -> str:
+    settings_set("speedtest_sched_last", f"{datetime.now(TZ).strftime('%m-%d %H:%M')} {note}")
+    return note
+
+async def speedtest_sched_tick(application, bot) -> str:
+    """Satu pengecekan penjadwal; return alasan (untuk status/log)."""
+    cfg = speedtest_sched_config()
+    next_ts = int(settings_get("speedtest_sched_next", "0") or 0)
+    if not next_ts:
+        _speedtest_sched_next(random.uniform(0, SPEEDTEST_SCHED_JITTER)); return "dijadwalkan"
+    if time.time() < next_ts: return "belum waktunya"
+    used, _n, avg = speedtest_month_usage()
+    if used + avg > cfg["budget_mb"] * 1024 * 1024:
+        now = datetime.now(TZ)
+        first = (now.replace(day=1, hour=0, minute=0, second=0, microsecond=0) + timedelta(days=32)).replace(day=1)
+        _speedtest_sched_next((first - now).total_seconds() + random.uniform(0, SPEEDTEST_SCHED_JITTER))
+        return _speedtest_sched_note(f"budget habis ({human_bytes(used)} bulan ini)")
+    iface = wan_default_iface()
+    if iface:
+        rate = await wan_throughput_mbps(iface)
+        if rate and max(rate) > SPEEDTEST_BUSY_MBPS:
+            _speedtest_sched_next(SPEEDTEST_SCHED_RETRY)
+            return _speedtest_sched_note(f"dilewati: {iface} sibuk (⬇️ {rate[0]:.1f} / ⬆️ {rate[1]:.1f} Mbps)")
+
+    async def _sched_op(op: Operation):
+        sid = settings_get("speedtest_server_id", "")
+        if not sid:
+            auto, _ = await speedtest_auto_server()
+            sid = auto["id"] if auto else ""
+        res = await run_speedtest_live(None, sid or None)
+        if res.error:
+            _speedtest_sched_note(res.error.splitlines()[0])
+            op.status, op.note = "failed", res.error.splitlines()[0]
+            return
+        db_insert_result(res.ts, res.latency, res.jitter, res.down, res.up, res.loss, res.url, source="sched", **res.db_args())
+        db_prune_keep_latest(SPEEDTEST_HISTORY_KEEP)
+        await speedtest_regression_alert(bot)
+        return _speedtest_sched_note(f"⬇️ {res.down:.2f} / ⬆️ {res.up:.2f} Mbps")
+
+    _op, state = op_launch(application, "speedtest", "sched", "Speedtest terjadwal", None, _sched_op)
+    if state != "started":
+        _speedtest_sched_next(SPEEDTEST_SCHED_RETRY)
+        return "ditunda: speedtest lain berjalan"
+    hours = max(0.5, cfg["hours"])
+    _speedtest_sched_next(hours * 3600 + random.uniform(-SPEEDTEST_SCHED_JITTER, SPEEDTEST_SCHED_JITTER))
+    return "berjalan"
+
+async def job_speedtest_sched(ctx: ContextTypes.DEFAULT_TYPE):
+    if settings_get("speedtest_sched_enabled", os.getenv("RANET_SPEEDTEST_SCHED", "0")) != "1": return
+    await speedtest_sched_tick(ctx.application, ctx.bot)
+
+def speedtest_sched_status_text() -> str:
+    cfg = speedtest_sched_config()
+    enabled = settings_get("speedtest_sched_enabled", os.getenv("RANET_SPEEDTEST_SCHED", "0")) == "1"
+    used, n, _avg = speedtest_month_usage()
+    next_ts = int(settings_get("speedtest_sched_next", "0") or 0)
+    lines = [f"Status   : {'aktif' if enabled else 'mati'} (tiap {cfg['hours']:g} jam ± {SPEEDTEST_SCHED_JITTER // 60} menit)",
+             f"Berikut  : {datetime.fromtimestamp(next_ts, TZ).strftime('%Y-%m-%d %H:%M') if enabled and next_ts else '-'}",
+             f"Budget   : {human_bytes(used)} / {human_bytes(cfg['budget_mb'] * 1024 * 1024)} bulan ini ({n} tes)",
+             f"Lewati   : WAN > {SPEEDTEST_BUSY_MBPS:g} Mbps ({wan_default_iface() or 'iface default route tidak ada'})",
+             f"Terakhir : {settings_get('speedtest_sched_last', '-') or '-'}"]
+    rows = speedtest_sched_downloads(int(time.time()) - 30 * 86400)
+    if rows:
+        downs = [d for _, d in rows]
+        lines.append(f"30 hari  : {len(rows)} tes, p50 ⬇️ {_pctl(sorted(downs), 0.5):.1f} Mbps  {sparkline(downs[-30:])}")
+    reg = speedtest_regression()
+    if reg:
+        lines.append(f"Regresi  : p50 {SPEEDTEST_REGRESSION_WINDOW} terakhir {reg[1]:.1f} Mbps, ambang {reg[2]:.1f}"
+                     + (" ⚠️" if reg[0] else " ✓"))
+    elif cfg["min_down"] > 0:
+        lines.append(f"Regresi  : ambang {cfg['min_down']:g} Mbps (data belum cukup)")
+    return "\n".join(lines)
+
+
+# ---- Bufferbloat ----
+# Latency diukur terus (ICMP, fallback TCP connect) saat idle, lalu saat download & upload dijenuhkan. Beban dari
+# HTTP bulk multi-stream (default Cloudflare) atau engine speedtest (fase dibaca dari progres JSON-nya).
+# Kenaikan latency (p50 loaded - p50 idle) → grade; riwayat disimpan beserta label SQM untuk membandingkan setting.
+BLOAT_DOWN_URL = os.getenv("RANET_BLOAT_DOWN_URL", "https://speed.cloudflare.com/__down?bytes=250000000")
+BLOAT_UP_URL = os.getenv("RANET_BLOAT_UP_URL", "https://speed.cloudflare.com/__up")
+BLOAT_PROBE_HOST = os.getenv("RANET_BLOAT_PROBE_HOST", "1.1.1.1")
+BLOAT_STREAMS = int(os.getenv("RANET_BLOAT_STREAMS", "4"))
+BLOAT_SECONDS = int(os.getenv("RANET_BLOAT_SECONDS", "12"))      # per arah
+BLOAT_IDLE_SECONDS = 5
+BLOAT_WARMUP = 2.0                     # detik awal tiap arah tidak dihitung (TCP slow start, antrian belum penuh)
+BLOAT_PROBE_INTERVAL = 0.2
+BLOAT_PROBE_TIMEOUT = 2.0
+BLOAT_UP_BYTES = 25 * 1024 * 1024      # ukuran body per request POST
+BLOAT_HISTORY = 50
+BLOAT_GRADES = ((5, "A+"), (30, "A"), (60, "B"), (200, "C"), (400, "D"))
+
+def bloat_grade(increase_ms: Optional[float]) -> str:
+    if increase_ms is None: return "?"
+    return next((g for limit, g in BLOAT_GRADES if increase_ms < limit), "F")
+
+class BloatProbe:
+    """Ping berkala ke satu host; tiap sampel diberi label fase yang sedang aktif."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.addr: Optional[str] = None
+        self.method = "icmp"
+        self.phase = "idle"
+        self.counting = True
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.lost: Dict[str, int] = defaultdict(int)
+
+    async def run(self):
+        self.addr = await resolve_ipv4(self.host) or self.host
+        loop = asyncio.get_running_loop()
+        isock = IcmpSocket()
+        if not isock.open(): self.method = "tcp"
+        try:
+            while True:
+                due = loop.time() + BLOAT_PROBE_INTERVAL
+                phase, counting = self.phase, self.counting
+                if self.method == "icmp":
+                    kind, _src, rtt = await isock.probe(self.addr, timeout=BLOAT_PROBE_TIMEOUT)
+                    rtt = rtt if kind == "reply" else None
+                else:
+                    rtt = await tcp_connect_rtt(self.addr, 443, BLOAT_PROBE_TIMEOUT)
+                if counting and phase == self.phase:
+                    if rtt is None: self.lost[phase] += 1
+                    else: self.samples[phase].append(rtt)
+                await asyncio.sleep(max(0.0, due - loop.time()))
+        finally:
+            isock.close()
+
+    def stats(self, phase: str) -> Dict[str, Any]:
+        rtts = sorted(self.samples.get(phase, []))
+        n = len(rtts) + self.lost.get(phase, 0)
+        if not rtts: return {"n": n, "loss": 100.0 if n else 0.0}
+        return {"n": n, "p50": _pctl(rtts, 0.5), "p95": _pctl(rtts, 0.95), "max": rtts[-1],
+                "loss": 100.0 * self.lost.get(phase, 0) / n}
+
+    def live_line(self, phase: str) -> str:
+        rtts = self.samples.get(phase, [])[-25:]
+        if not rtts: return f"{phase:<8} (menunggu sampel)"
+        return f"{phase:<8} {_pctl(sorted(rtts), 0.5):6.1f} ms  {sparkline(rtts)}"
+
+async def _bloat_http_stream(url: str, direction: str, deadline: float, counter: List[int], errors: List[str]):
+    """Satu stream bulk: GET/POST diulang sampai deadline; byte ditambahkan ke counter[0]."""
+    loop = asyncio.get_running_loop()
+    u = urllib.parse.urlsplit(url)
+    tls = u.scheme == "https"
+    port = u.port or (443 if tls else 80)
+    path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+    while loop.time() < deadline:
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(
+                u.hostname, port, ssl=_http_ssl_context(False) if tls else None,
+                server_hostname=u.hostname if tls else None), max(0.1, deadline - loop.time()))
+            if direction == "download":
+                writer.write(f"GET {path} HTTP/1.1\r\nHost: {u.netloc}\r\nUser-Agent: ranet-bot\r\n"
+                             "Accept-Encoding: identity\r\nConnection: close\r\n\r\n".encode())
+                while loop.time() < deadline:
+                    chunk = await asyncio.wait_for(reader.read(256 * 1024), max(0.1, deadline - loop.time()))
+                    if not chunk: break
+                    counter[0] += len(chunk)
+            else:
+                writer.write(f"POST {path} HTTP/1.1\r\nHost: {u.netloc}\r\nUser-Agent: ranet-bot\r\n"
+                             f"Content-Type: application/octet-stream\r\nContent-Length: {BLOAT_UP_BYTES}\r\n"
+                             "Connection: close\r\n\r\n".encode())
+                left = BLOAT_UP_BYTES
+                while left and loop.time() < deadline:
+                    n = min(left, PERF_CHUNK)
+                    writer.write(_PERF_ZEROS[:n])
+                    await asyncio.wait_for(writer.drain(), max(0.1, deadline - loop.time()))
+                    left -= n; counter[0] += n
+                if not left:
+                    await asyncio.wait_for(reader.read(4096), max(0.1, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            pass
+        except (OSError, ValueError) as e:
+            err = f"{direction}: {os.strerror(e.errno) if getattr(e, 'errno', None) else e}"
+            if err not in errors: errors.append(err)
+            await asyncio.sleep(1)
+        finally:
+            if writer is not None: writer.close()
+
+async def bloat_http_load(probe: BloatProbe, direction: str, on_tick) -> Tuple[Optional[float], List[str]]:
+    """Jenuhkan satu arah selama BLOAT_SECONDS; return (Mbps rata-rata setelah warmup, error)."""
+    loop = asyncio.get_running_loop()
+    counter, errors = [0], []
+    t0 = loop.time()
+    probe.phase, probe.counting = direction, False
+    url = BLOAT_DOWN_URL if direction == "download" else BLOAT_UP_URL
+    tasks = [loop.create_task(_bloat_http_stream(url, direction, t0 + BLOAT_SECONDS, counter, errors))
+             for _ in range(max(1, BLOAT_STREAMS))]
+    mark = None
+    try:
+        while not all(t.done() for t in tasks):
+            await asyncio.sleep(1)
+            if mark is None and loop.time() - t0 >= BLOAT_WARMUP:
+                probe.counting, mark = True, (loop.time(), counter[0])
+            await on_tick()
+    finally:
+        for t in tasks: t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if mark is None or not counter[0]: return None, errors
+    return (counter[0] - mark[1]) * 8 / max(loop.time() - mark[0], 1e-3) / 1e6, errors
+
+def sqm_label() -> str:
+    """Ringkasan SQM aktif (uci sqm) untuk dibandingkan antar tes."""
+    pkg = uci_load("sqm")
+    queues = [q for q in (pkg.by_type("queue") if pkg else []) if q.get("enabled") == "1"]
+    if not queues: return "sqm off"
+    return ", ".join(f"{q.get('interface', '?')} {q.get('qdisc', '?')}/{q.get('script', '?')} "
+                     f"{q.get('download', '?')}/{q.get('upload', '?')}k" for q in queues)
+
+def bloat_history() -> List[Dict[str, Any]]:
+    with contextlib.suppress(ValueError, TypeError):
+        return json.loads(settings_get("bufferbloat_history", "[]") or "[]")
+    return []
+
+def bloat_record(entry: Dict[str, Any]):
+    hist = (bloat_history() + [entry])[-BLOAT_HISTORY:]
+    settings_set("bufferbloat_history", json.dumps(hist))
+    pts = [(f"bloat:{k}_ms", entry["ts"], entry.get(k)) for k in ("idle", "download", "upload")]
+    with contextlib.suppress(Exception): metrics_add(pts)
+
+def bloat_result_text(entry: Dict[str, Any]) -> str:
+    fmt = lambda v: f"{v:.1f}" if v is not None else "-"
+    lines = [f"Grade   : {entry['grade']}  (kenaikan latency ⬇️ +{fmt(entry.get('down_inc'))} / ⬆️ +{fmt(entry.get('up_inc'))} ms)",
+             f"Probe   : {entry['probe']} ({entry['method']}), engine {entry['engine']}",
+             f"SQM     : {entry['sqm']}" + (f"  | {entry['note']}" if entry.get("note") else ""),
+             "", f"{'fase':<9}{'p50':>7}{'p95':>8}{'max':>8}{'loss':>7}{'Mbps':>9}"]
+    for phase, label in (("idle", "idle"), ("download", "⬇️ down"), ("upload", "⬆️ up")):
+        st = entry["stats"].get(phase) or {}
+        mbps = entry.get(f"{phase}_mbps")
+        lines.append(f"{label:<9}{fmt(st.get('p50')):>7}{fmt(st.get('p95')):>8}{fmt(st.get('max')):>8}"
+                     f"{st.get('loss', 0):>6.0f}%{fmt(mbps) if phase != 'idle' else '':>9}")
+    lines += [f"! {e}" for e in entry.get("errors", [])]
+    return "\n".join(lines)
+
+def bloat_history_text(limit: int = 10) -> str:
+    hist = bloat_history()
+    if not hist: return "Belum ada riwayat tes bufferbloat."
+    fmt = lambda v: f"{v:.0f}" if v is not None else "-"
+    lines = ["waktu        grade  idle  +⬇️   +⬆️  SQM"]
+    for e in hist[-limit:][::-1]:
+        lines.append(f"{datetime.fromtimestamp(e['ts'], TZ).strftime('%m-%d %H:%M')}  {e['grade']:<5}{fmt(e['idle']):>5}"
+                     f"{fmt(e.get('down_inc')):>5}{fmt(e.get('up_inc')):>5}  {e['sqm']}{(' | ' + e['note']) if e.get('note') else ''}")
+    # ringkasan per konfigurasi SQM: median kenaikan terburuk per tes
+    groups: Dict[str, List[float]] = defaultdict(list)
+    for e in hist:
+        worst = max((v for v in (e.get("down_inc"), e.get("up_inc")) if v is not None), default=None)
+        if worst is not None: groups[e["sqm"]].append(worst)
+    if len(groups) > 1:
+        lines += ["", "Per konfigurasi SQM (median kenaikan terburuk):"]
+        for label, vals in sorted(groups.items(), key=lambda kv: _pctl(sorted(kv[1]), 0.5)):
+            med = _pctl(sorted(vals), 0.5)
+            lines.append(f"  {bloat_grade(med):<3}{med:6.0f} ms  ({len(vals)} tes)  {label}")
+    return "\n".join(lines)
+
+async def bufferbloat_test(message, engine: str = "http", note: str = "") -> Dict[str, Any]:
+    probe = BloatProbe(BLOAT_PROBE_HOST)
+    live = LiveOutput(message, f"Bufferbloat ({engine}, probe {BLOAT_PROBE_HOST})")
+    await live.start()
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, run_speedtest_and_parse, server_id)
+    prober = loop.create_task(probe.run())
+    rates: Dict[str, Optional[float]] = {}
+    errors: List[str] = []
+    status = [""]
+
+    def render() -> str:
+        return "\n".join([probe.live_line(p) for p in ("idle", "download", "upload") if p in probe.samples or p == probe.phase]
+                         + [f"beban: {status[0]}" if status[0] else ""]).rstrip()
+
+    async def on_tick():
+        live.set(render())
+
+    try:
+        t_end = loop.time() + BLOAT_IDLE_SECONDS
+        while loop.time() < t_end:
+            await asyncio.sleep(1); await on_tick()
+        if engine == "speedtest":
+            sid = settings_get("speedtest_server_id", "") or None
+
+            def on_progress(prog: SpeedtestProgress):
+                if prog.phase in ("download", "upload"):
+                    if probe.phase != prog.phase: probe.phase, probe.counting = prog.phase, True
+                    pct, mbps = prog.rates.get(prog.phase, (0.0, 0.0))
+                    status[0] = f"{prog.phase} {pct * 100:.0f}% {mbps:.1f} Mbps"
+                elif prog.phase == "selesai":
+                    probe.counting = False
+                live.set(render())
+
+            probe.counting = False           # fase ping speedtest bukan idle & bukan beban
+            res = await run_speedtest_live(None, sid, on_progress=on_progress)
+            if res.error: errors.append(res.error.splitlines()[0])
+            else: rates = {"download": res.down, "upload": res.up}
+        else:
+            for direction in ("download", "upload"):
+                status[0] = f"{direction} {BLOAT_STREAMS} stream HTTP"
+                rates[direction], errs = await bloat_http_load(probe, direction, on_tick)
+                errors += errs
+        probe.counting = False
+    except asyncio.CancelledError:
+        await live.finish(ok=False, note="[dibatalkan]"); raise
+    finally:
+        prober.cancel()
+        await asyncio.gather(prober, return_exceptions=True)
+    stats = {p: probe.stats(p) for p in ("idle", "download", "upload")}
+    idle = stats["idle"].get("p50")
+    # arah tanpa throughput (beban gagal) tidak dinilai: latency-nya bukan latency loaded
+    inc = lambda p: (max(0.0, stats[p]["p50"] - idle) if idle is not None and stats[p].get("p50") is not None
+                     and rates.get(p) else None)
+    entry = {"ts": int(time.time()), "engine": engine, "probe": BLOAT_PROBE_HOST, "method": probe.method,
+             "idle": idle, "download": stats["download"].get("p50"), "upload": stats["upload"].get("p50"),
+             "down_inc": inc("download"), "up_inc": inc("upload"),
+             "download_mbps": rates.get("download"), "upload_mbps": rates.get("upload"),
+             "sqm": sqm_label(), "note": note[:40], "stats": stats, "errors": errors[:3]}
+    worst = max((v for v in (entry["down_inc"], entry["up_inc"]) if v is not None), default=None)
+    entry["grade"] = bloat_grade(worst)
+    ok = worst is not None and not (entry["download_mbps"] is None and entry["upload_mbps"] is None)
+    live.set(bloat_result_text(entry))
+    await live.finish(ok=ok)
+    if ok:
+        bloat_record({k: v for k, v in entry.items() if k not in ("stats", "errors")})
+    return entry
+
+async def bufferbloat_start(message, application, engine: str = "http", note: str = ""):
+    # kind "speedtest": tidak pernah bersamaan dengan speedtest manual/terjadwal (saling mengganggu)
+    async def _bloat_op(op: Operation):
+        entry = await bufferbloat_test(message, engine, note)
+        if entry["grade"] == "?": op.status = "failed"
+        return f"grade {entry['grade']}"
+    await op_start(message, application, "speedtest", "bloat", f"Bufferbloat ({engine})", _bloat_op)
+
+
+def _md_plain(text: str) -> str:
+
+    return re.sub(r"[_*`\[\]]", "", text or "")
+
+
 
+def _loaded_latency_line(lat_down: Optional[float], lat_up: Optional[float]) -> str:
 
-def format_speedtest_entry(idx:int, ts:int, lat:float, jit:float, down:float, up:float, loss:float, url:str) -> str:
+    if lat_down is None and lat_up is None: return ""
+
+    fmt = lambda v: f"{v:.0f}" if v is not None else "-"
+
+    return f"   📶 Loaded : ⬇️ {fmt(lat_down)} / ⬆️ {fmt(lat_up)} ms\n"
+
+
+
+def format_speedtest_entry(idx:int, ts:int, lat:float, jit:float, down:float, up:float, loss:float, url:str,
+                           server:str="", lat_down:Optional[float]=None, lat_up:Optional[float]=None) -> str:
 
     dt = datetime.fromtimestamp(ts, TZ).strftime("%Y-%m-%d %H:%M:%S %Z")
 
@@ -4465,8 +10470,12 @@ def format_speedtest_entry(idx:int, ts:int, lat:float, jit:float, down:float, up
 
         f"{idx}. {dt}\n"
 
+        + (f"   🛰 Server : {_md_plain(server)}\n" if server else "") +
+
         f"   ⏱ Latency : {lat:.2f} ms  ~ jitter {jit:.2f} ms\n"
 
+        + _loaded_latency_line(lat_down, lat_up) +
+
         f"   ⬇️ Download : {down:.2f} Mbps\n"
 
         f"   ⬆️ Upload : {up:.2f} Mbps\n"
@@ -4485,9 +10494,9 @@ def build_speedtest_history_text(rows) -> str:
 
     lines = ["🚀 Riwayat Speedtest (5 Terbaru)", ""]
 
-    for idx, (ts, lat, jit, down, up, loss, url) in enumerate(rows, 1):
+    for idx, (ts, lat, jit, down, up, loss, url, server, lat_down, lat_up) in enumerate(rows, 1):
 
-        lines.append(format_speedtest_entry(idx, ts, lat, jit or 0.0, down, up, loss, url))
+        lines.append(format_speedtest_entry(idx, ts, lat, jit or 0.0, down, up, loss, url, server or "", lat_down, lat_up))
 
         lines.append("")
 
@@ -4497,18 +10506,37 @@ def build_speedtest_history_text(rows) -> str:
 
 
 
-def build_speedtest_result_text(ts:int, lat:float, jit:float, down:float, up:float, loss:float, url:str) -> str:
+def build_speedtest_result_text(ts:int, lat:float, jit:float, down:float, up:float, loss:float, url:str,
+                                res:Optional[SpeedtestResult]=None) -> str:
 
     dt = datetime.fromtimestamp(ts, TZ).strftime("%Y-%m-%d %H:%M:%S %Z")
 
     link_md = f"[LINK]({url})" if url else "LINK"
 
+    extra_top, extra = "", ""
+
+    if res is not None:
+
+        if res.server_name: extra_top += f"   🛰 Server : {_md_plain(res.server_name)}" + (f" (#{res.server_id})" if res.server_id else "") + "\n"
+
+        if res.isp: extra_top += f"   🏢 ISP : {_md_plain(res.isp)}\n"
+
+        extra = _loaded_latency_line(res.latency_down, res.latency_up)
+
+        if res.bytes_down is not None or res.bytes_up is not None:
+
+            extra += f"   📦 Data : ⬇️ {human_bytes(res.bytes_down or 0)} / ⬆️ {human_bytes(res.bytes_up or 0)}\n"
+
     return (
 
         f"⚡ Speedtest — {dt}\n\n"
 
+        + extra_top +
+
         f"   ⏱ Latency : {lat:.2f} ms  ~ jitter {jit:.2f} ms\n"
 
+        + extra +
+
         f"   ⬇️ Download : {down:.2f} Mbps\n"
 
         f"   ⬆️ Upload : {up:.2f} Mbps\n"
@@ -4560,13 +10588,11 @@ async def ping_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     if len(args) < 2:
 
-        await update.message.reply_text("Usage: /ping <host>"); return
+        await update.message.reply_text("Usage: /ping <host> [jumlah]"); return
 
-    host = args[1]
+    count = int(args[2]) if len(args) > 2 and args[2].isdigit() else 5
 
-    out = run_cmd(f"ping -c 5 -W 2 {shlex.quote(host)}", timeout=20)
-
-    await update.message.reply_text(code_block(out), parse_mode=ParseMode.MARKDOWN_V2)
+    await nettools_start(update.message, ctx.application, "ping", args[1], count)
 
 
 
@@ -4582,15 +10608,90 @@ async def trace_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
         await update.message.reply_text("Usage: /trace <host>"); return
 
-    host = args[1]
+    await nettools_start(update.message, ctx.application, "trace", args[1])
+
+
+
+async def mtr_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+
+    if not allowed(update):
+
+        await update.message.reply_text("Maaf, akses ditolak."); return
+
+    args = update.message.text.split()
+
+    if len(args) < 2:
+
+        await update.message.reply_text("Usage: /mtr <host> [siklus]"); return
+
+    cycles = int(args[2]) if len(args) > 2 and args[2].isdigit() else None
+
+    await nettools_start(update.message, ctx.application, "mtr", args[1], cycles)
+
+
+
+async def latency_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not allowed(update):
+        await update.message.reply_text("Maaf, akses ditolak."); return
+    await update.message.reply_text(code_block(LATENCY_PROBER.report_text()), parse_mode=ParseMode.MARKDOWN_V2,
+                                    reply_markup=latency_keyboard())
+
+
+
+async def httpcheck_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not allowed(update):
+        await update.message.reply_text("Maaf, akses ditolak."); return
+    await update.message.reply_text(code_block(HTTP_CHECKER.report_text()), parse_mode=ParseMode.MARKDOWN_V2,
+                                    reply_markup=httpcheck_keyboard())
+
+
+
+async def dnsbench_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not allowed(update):
+        await update.message.reply_text("Maaf, akses ditolak."); return
+    await op_start(update.message, ctx.application, "nettools", "dnsbench", "DNS benchmark",
+                   lambda op: dns_bench_stream(update.message))
+
+
+
+async def perf_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not allowed(update):
+        await update.message.reply_text("Maaf, akses ditolak."); return
+    args = update.message.text.split()[1:]
+    if not args:
+        await update.message.reply_text(f"{PERF_SERVER.status_text()}\n\n{PERF_USAGE}"); return
+    await perf_start(update.message, ctx.application, args)
+
+
+
+async def bufferbloat_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not allowed(update):
+        await update.message.reply_text("Maaf, akses ditolak."); return
+    args = update.message.text.split()[1:]
+    if args[:1] in (["history"], ["riwayat"]):
+        await update.message.reply_text(code_block(bloat_history_text(20)), parse_mode=ParseMode.MARKDOWN_V2,
+                                        reply_markup=bufferbloat_keyboard()); return
+    engine = args.pop(0) if args[:1] in (["http"], ["speedtest"]) else "http"
+    await bufferbloat_start(update.message, ctx.application, engine, " ".join(args))
 
-    if not which("traceroute"):
 
-        await update.message.reply_text("Traceroute tidak tersedia. Install: opkg install traceroute"); return
 
-    out = run_cmd(f"traceroute -m 15 {shlex.quote(host)}", timeout=40)
+async def wg_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    if not allowed(update):
+        await update.message.reply_text("Maaf, akses ditolak."); return
+    # hanya menampilkan sampel terakhir job_wg_sampler: sampel manual akan ikut menghitung run relay & mengisi metrics
+    await update.message.reply_text(code_block(WG_SAMPLER.report_text()), parse_mode=ParseMode.MARKDOWN_V2,
+                                    reply_markup=wg_keyboard())
+
+
+
+async def jobs_cmd(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+
+    if not allowed(update):
+
+        await update.message.reply_text("Maaf, akses ditolak."); return
 
-    await update.message.reply_text(code_block(out), parse_mode=ParseMode.MARKDOWN_V2)
+    await update.message.reply_text(jobs_text(), reply_markup=jobs_keyboard())
 
 
 
@@ -4644,7 +10745,7 @@ async def handle_document(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
         size_b = os.path.getsize(dst) if os.path.exists(dst) else 0
 
-        listing = run_shell(f"tar -tzf {shlex.quote(dst)} | head -n 50")
+        listing = run_shell(f"tar -tzf {shlex.quote(dst)} | head -n 50", cls="background")
 
         state["restore_path"] = dst
 
@@ -4895,22 +10996,113 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         if not android_device_ready(device):
             await query.message.reply_text("❌ Device tidak siap. Buka Menu Android dan lakukan refresh.")
             return
-        info = android_collect_info(device)
-        sms_text, error = android_sms_text(device, info.get("sdk_int"))
-        try:
-            path = android_export_report(device, info, sms_text)
-            caption = "✅ Report Android berhasil dibuat."
-            if error:
-                caption += f"\n⚠️ {error}"
-            with open(path, "rb") as fh:
-                await query.message.reply_document(fh, filename=os.path.basename(path), caption=caption)
-        except Exception as exc:
-            await query.message.reply_text(f"❌ Gagal mengirim report: {exc}")
+        if device in ANDROID_EXPORT_RUNNING:
+            await query.message.reply_text("⏳ Export untuk device ini masih berjalan.")
+            return
+        ANDROID_EXPORT_RUNNING.add(device)
+        progress_msg = await query.message.reply_text("📝 Menyiapkan export…")
+        label = android_selected_label(ctx)
+
+        async def _progress(text: str) -> None:
+            await progress_msg.edit_text(text)
+
+        async def _runner() -> None:
+            try:
+                path, error, counts = await android_export_archive(device, label, progress=_progress)
+                caption = (f"✅ Report Android berhasil dibuat.\n"
+                           f"SMS: {counts['sms']} | Telemetri: {counts['telemetry']} titik | Rotasi: {counts['rotations']}")
+                if error:
+                    caption += f"\n⚠️ {error}"
+                await progress_msg.edit_text(f"📤 Mengunggah {path.name} ({human_bytes(path.stat().st_size)})…")
+                with open(path, "rb") as fh:
+                    await query.message.reply_document(fh, filename=path.name, caption=caption)
+                with contextlib.suppress(Exception):
+                    await progress_msg.delete()
+            except Exception as exc:
+                with contextlib.suppress(Exception):
+                    await progress_msg.edit_text(f"❌ Gagal membuat/mengirim report: {exc}")
+            finally:
+                ANDROID_EXPORT_RUNNING.discard(device)
+
+        if ctx.application:
+            ctx.application.create_task(_runner())
+        else:
+            asyncio.create_task(_runner())
+        return
+
+    if data == "ANDROID_ROTATE":
+        device = android_selected_device(ctx)
+        if not device:
+            await query.message.reply_text("❌ Pilih device terlebih dahulu melalui Menu Android.")
+            return
+        if not android_device_ready(device):
+            await query.message.reply_text("❌ Device tidak siap. Buka Menu Android dan lakukan refresh.")
+            return
+        lock = ANDROID_ROTATE_LOCKS.get(device)
+        if lock is not None and lock.locked():
+            await query.message.reply_text("⏳ Rotasi IP untuk device ini masih berjalan.")
+            return
+        progress_msg = await query.message.reply_text("🔁 Memulai rotasi IP…")
+
+        async def _progress(text: str) -> None:
+            await progress_msg.edit_text(text)
+
+        async def _runner() -> None:
+            rot = await android_rotate_ip(device, progress=_progress)
+            with contextlib.suppress(Exception):
+                await progress_msg.edit_text(android_rotation_text(rot))
+
+        if ctx.application:
+            ctx.application.create_task(_runner())
+        else:
+            asyncio.create_task(_runner())
+        return
+
+    if data == "ANDROID_ROTATE_HIST":
+        device = android_selected_device(ctx)
+        if not device:
+            await query.message.reply_text("❌ Pilih device terlebih dahulu melalui Menu Android.")
+            return
+        text = f"Riwayat rotasi IP {device}\n\n{android_rotation_history_text(device)}"
+        await query.message.reply_text(code_block(text), parse_mode=ParseMode.MARKDOWN_V2)
+        return
+
+    if data.startswith("ANDROID_TELEM:"):
+        device = android_selected_device(ctx)
+        if not device:
+            await query.message.reply_text("❌ Pilih device terlebih dahulu melalui Menu Android.")
+            return
+        window = data.split(":", 1)[1]
+        if window not in ANDROID_TELEMETRY_WINDOWS:
+            window = "1h"
+        text = code_block(android_telemetry_text(device, window))
+        if query.message.text and query.message.text.startswith("Telemetri"):
+            with contextlib.suppress(Exception):
+                await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN_V2,
+                                              reply_markup=android_telemetry_keyboard(window))
+            return
+        await query.message.reply_text(text, parse_mode=ParseMode.MARKDOWN_V2,
+                                       reply_markup=android_telemetry_keyboard(window))
+        return
+
+    if data == "ANDROID_ROTATE_SCHED":
+        device = android_selected_device(ctx)
+        if not device:
+            await query.message.reply_text("❌ Pilih device terlebih dahulu melalui Menu Android.")
+            return
+        current = android_rotate_schedule_load().get(device, 0)
+        ctx.user_data["await_android_rotate_sched"] = True
+        ctx.user_data["android_rotate_serial"] = device
+        status = f"setiap {current} menit" if current else "nonaktif"
+        await query.message.reply_text(
+            f"⏰ Jadwal rotasi saat ini: {status}.\n"
+            "Masukkan interval rotasi dalam menit (contoh: 60), atau 0 untuk menonaktifkan."
+        )
         return
 
     if data == "QA_WIFI_RESTART":
-        out = run_wifi_reload()
-        await query.message.reply_text(code_block(out), parse_mode=ParseMode.MARKDOWN_V2)
+        schedule_reload(ctx.bot, ["wifi"], query.message.chat_id, delay=0)
+        await query.message.reply_text("🔄 Reload WiFi dijalankan…")
         return
     if data == "QA_VNSTAT_HOURLY":
         out = vnstat_hourly(CURRENT_IFACE)
@@ -4960,9 +11152,7 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if data == "MENU_PROCESS":
         await query.edit_message_text("🧠 *Process Manager*", parse_mode="Markdown", reply_markup=process_menu_keyboard()); return
     if data == "PROC_LIST":
-        out = process_list_text()
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+        await reply_line_chunks(query.message, process_list_lines())
         return
     if data == "PROC_TOP":
         out = process_top_text()
@@ -5000,23 +11190,25 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("Masukkan kata kunci pencarian log:")
         return
     if data == "NB_REFRESH":
-        waiting = await query.message.reply_text("🧹 Memperbarui cache NetBird…")
-        _ = netbird_status_update(force=True, timeout=90)
+        waiting = await query.message.reply_text("🧹 Memperbarui status NetBird…")
+        state = await asyncio.get_running_loop().run_in_executor(None, NETBIRD.refresh)
         await waiting.delete()
-        ip = get_netbird_ip_cached()
-        await query.message.reply_text(f"✅ NetBird cache diupdate.\nIP: `{ip or '-'}`", parse_mode="Markdown"); return
+        await query.message.reply_text(f"✅ Status NetBird diperbarui.\nIP: `{state.ip or '-'}`", parse_mode="Markdown"); return
 
     if data == "MENU_PACKAGES":
         await query.edit_message_text("📦 *Package Management*", parse_mode="Markdown", reply_markup=packages_menu_keyboard()); return
-    if data == "OPKG_UPDATE":
-        out = opkg_update_text()
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
-        return
-    if data == "OPKG_UPGRADE":
-        out = opkg_upgrade_text()
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+    if data in ("OPKG_UPDATE", "OPKG_UPGRADE"):
+        sub = "update" if data == "OPKG_UPDATE" else "upgrade"
+
+        async def _opkg_op(op: Operation):
+            _out, code = await stream_command(query.message, f"opkg {sub}", ["opkg", sub], 180 if sub == "update" else 240,
+                                              cls="background" if sub == "update" else "heavy")
+            if sub == "upgrade":
+                await asyncio.get_running_loop().run_in_executor(None, caps_rescan)
+            if code != 0: op.status = "failed"
+            return f"exit {code}"
+
+        await op_start(query.message, ctx.application, "opkg", f"opkg {sub}", f"opkg {sub}", _opkg_op)
         return
     if data == "OPKG_INSTALL":
         ctx.user_data["await_opkg_action"] = True
@@ -5060,9 +11252,7 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "SETTINGS_FIX_TIME":
-        out = fix_system_time()
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+        await stream_command(query.message, "Fix Jam (NTP Sync)", ["/bin/sh", "-c", fix_system_time_script()], 120, cls="background")
         return
 
     if data == "SETTINGS_VIEW_CRED":
@@ -5121,7 +11311,7 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return
     if data == "WIFI_CONFIG":
         ctx.user_data["await_wifi_config"] = True
-        await query.message.reply_text("Kirim perintah konfigurasi WiFi (misal: `uci set ...`), satu atau beberapa baris. Kirim 'apply' jika ingin menjalankan `wifi reload` setelahnya.")
+        await query.message.reply_text("Kirim perintah UCI WiFi (misal: `uci set wireless.@wifi-iface[0].ssid=Rumah`), satu atau beberapa baris. Perubahan masuk stage; kirim 'apply' untuk commit + `wifi reload`.")
         return
     if data == "NET_DHCP":
         out = dhcp_leases_text()
@@ -5130,14 +11320,11 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if data == "MENU_FIREWALL":
         await query.edit_message_text("🛡️ *Firewall Manager*", parse_mode="Markdown", reply_markup=firewall_menu_keyboard()); return
     if data == "FW_LIST":
-        out = firewall_rules_text()
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
-        return
+        await reply_uci_view(query.message, "fw"); return
     if data == "FW_ADD":
         ctx.user_data["await_firewall_action"] = True
         ctx.user_data["firewall_action"] = "add"
-        await query.message.reply_text("Masukkan perintah UCI untuk menambah rule (contoh: `uci add firewall rule; ...`). Akhiri dengan `uci commit firewall`.")
+        await query.message.reply_text("Masukkan perintah UCI untuk menambah rule (contoh: `uci add firewall rule; uci set firewall.@rule[-1].name=X`). Perubahan masuk stage dan di-commit lewat tombol.")
         return
     if data == "FW_DELETE":
         ctx.user_data["await_firewall_action"] = True
@@ -5145,17 +11332,36 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("Masukkan perintah untuk menghapus rule (contoh: `uci delete firewall.@rule[2]`).")
         return
     if data == "FW_RELOAD":
-        out = run_cmd("fw4 reload")
-        if out.startswith("[ERR]"):
-            out = run_cmd("fw3 reload")
-        await query.message.reply_text(code_block(out), parse_mode=ParseMode.MARKDOWN_V2)
+        schedule_reload(ctx.bot, ["firewall"], query.message.chat_id, delay=0)
+        await query.message.reply_text("🔄 Reload firewall dijalankan…")
+        return
+    if data == "UCI_PREVIEW":
+        await reply_uci_stage(query.message, query.message.chat_id); return
+    if data == "UCI_DISCARD":
+        dropped = uci_stage_discard(query.message.chat_id)
+        await query.message.reply_text("🗑️ Stage dibuang." if dropped else "(tidak ada perubahan di stage)"); return
+    if data == "UCI_COMMIT":
+        chat_id = query.message.chat_id
+        out, services = await asyncio.get_running_loop().run_in_executor(None, uci_stage_commit, chat_id)
+        if services:
+            schedule_reload(ctx.bot, services, chat_id)
+            out += f"\n🔄 Reload {', '.join(services)} dalam {RELOAD_DEBOUNCE:g}s."
+        for chunk in split_chunks(out):
+            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
         return
     if data == "MENU_PORTFWD":
         await query.edit_message_text("🚪 *Port Forwarding*", parse_mode="Markdown", reply_markup=port_forward_menu_keyboard()); return
     if data == "PF_LIST":
-        out = port_forward_rules_text()
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+        await reply_uci_view(query.message, "pf"); return
+    if data.startswith("UCI_VIEW:"):
+        await reply_uci_view(query.message, data.split(":", 1)[1]); return
+    if data.startswith("UCI_FILTER:"):
+        view = data.split(":", 1)[1]
+        if view not in UCI_VIEWS:
+            await query.message.reply_text("[ERR] View tidak dikenal."); return
+        ctx.user_data["await_uci_filter"] = True
+        ctx.user_data["uci_filter_view"] = view
+        await query.message.reply_text(f"Kirim kata kunci filter {UCI_VIEWS[view][0]} (misal: `wan tcp 443`). Semua kata harus cocok.", parse_mode="Markdown")
         return
     if data == "PF_ADD":
         ctx.user_data["await_portfwd_action"] = True
@@ -5300,121 +11506,145 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
         settings_set("speedtest_server_id", "")
 
-        await query.edit_message_text("Pilihan server dihapus. Gunakan auto server.", reply_markup=speedtest_server_keyboard("")); return
+        await query.edit_message_text("Pilihan server dihapus. Server dipilih otomatis (latency terendah).", reply_markup=speedtest_server_keyboard("")); return
 
-    if data == "SPD_NOW":
+    if data == "SPD_SCHED":
 
-        waiting = None
+        await query.edit_message_text(code_block(speedtest_sched_status_text()), parse_mode=ParseMode.MARKDOWN_V2,
 
-        try:
+                                      reply_markup=speedtest_sched_keyboard()); return
 
-            waiting = await telegram_call_with_retry(
+    if data == "SPD_BLOAT":
+        await query.edit_message_text(code_block(bloat_history_text()), parse_mode=ParseMode.MARKDOWN_V2,
+                                      reply_markup=bufferbloat_keyboard()); return
+    if data.startswith("SPD_BLOAT_RUN:"):
+        await bufferbloat_start(query.message, ctx.application, data.split(":", 1)[1]); return
 
-                query.message.reply_text,
+    if data == "SPD_SCHED_TOGGLE":
 
-                "Menjalankan speedtest... mohon tunggu ±20–90 detik.",
+        enabled = settings_get("speedtest_sched_enabled", os.getenv("RANET_SPEEDTEST_SCHED", "0")) == "1"
 
-            )
+        settings_set("speedtest_sched_enabled", "0" if enabled else "1")
 
-        except (TimedOut, NetworkError) as exc:
+        if not enabled: settings_set("speedtest_sched_next", "0")     # tes pertama dalam rentang jitter
 
-            print(f"[WARN] Gagal mengirim pesan awal speedtest: {exc}")
+        await query.edit_message_text(code_block(speedtest_sched_status_text()), parse_mode=ParseMode.MARKDOWN_V2,
 
-        except Exception as exc:
+                                      reply_markup=speedtest_sched_keyboard()); return
 
-            print(f"[WARN] Gagal mengirim pesan awal speedtest: {exc}")
+    if data == "SPD_SCHED_CFG":
 
-        sid = settings_get("speedtest_server_id", "")
+        ctx.user_data["await_speedtest_sched"] = True
 
-        error_msg = None
+        cfg = speedtest_sched_config()
 
-        try:
+        await query.message.reply_text(
 
-            lat, jit, down, up, loss, url, _raw = await run_speedtest_and_parse_async(sid if sid else None)
+            f"Kirim: `<interval_jam> <budget_MB_per_bulan> <ambang_download_Mbps>`\n"
 
-        except Exception as exc:
+            f"Saat ini: `{cfg['hours']:g} {cfg['budget_mb']:g} {cfg['min_down']:g}`\n"
 
-            error_msg = f"[ERR] Speedtest gagal: {exc}"
+            "Ambang 0 = alert bila p50 turun di bawah 60% baseline 30 hari.", parse_mode="Markdown")
 
-        finally:
+        return
 
-            if waiting is not None:
+    if data == "SPD_PROBE":
 
-                with contextlib.suppress(Exception):
+        async def _probe_op(op: Operation):
 
-                    await waiting.delete()
+            msg = await query.message.reply_text("⏳ Mengukur latency ke server speedtest...")
 
-        if error_msg:
+            entry, results = await speedtest_auto_server(fresh=True)
 
-            try:
+            await msg.edit_text(code_block(speedtest_probe_text(entry, results)), parse_mode=ParseMode.MARKDOWN_V2,
 
-                await telegram_call_with_retry(
+                                reply_markup=speedtest_server_keyboard(settings_get("speedtest_server_id", "")))
 
-                    query.message.reply_text,
+            return f"{entry['name']} {entry['ms']}ms" if entry else "tidak ada server menjawab"
 
-                    error_msg,
+        await op_start(query.message, ctx.application, "speedtest", "probe", "Probe server speedtest", _probe_op)
 
-                    reply_markup=speedtest_menu_keyboard(),
+        return
 
-                )
+    if data == "SPD_NOW":
 
-            except Exception as exc:
+        async def _speedtest_op(op: Operation):
 
-                print(f"[WARN] Gagal mengirim pesan error speedtest: {exc}")
+            sid = settings_get("speedtest_server_id", "")
 
-            return
+            if not sid:
+
+                try:
 
-        raw_clean = _raw.strip()
+                    auto, _ = await speedtest_auto_server()
 
-        if raw_clean.startswith("[ERR]"):
+                except Exception as exc:
+
+                    auto = None; print(f"[WARN] Auto-pilih server speedtest gagal: {exc}")
+
+                if auto: sid = auto["id"]
 
             try:
 
-                await telegram_call_with_retry(
+                res = await run_speedtest_live(query.message, sid or None)
 
-                    query.message.reply_text,
+            except asyncio.CancelledError:
 
-                    raw_clean,
+                with contextlib.suppress(Exception):
 
-                    reply_markup=speedtest_menu_keyboard(),
+                    await query.message.reply_text(f"🛑 Speedtest dibatalkan (job #{op.id}).", reply_markup=speedtest_menu_keyboard())
 
-                )
+                raise
 
             except Exception as exc:
 
-                print(f"[WARN] Gagal mengirim hasil error speedtest: {exc}")
+                res = SpeedtestResult(ts=int(time.time()), error=f"[ERR] Speedtest gagal: {exc}")
 
-            return
+            if res.error:
 
-        ts = int(time.time())
+                try:
 
-        try:
+                    await telegram_call_with_retry(query.message.reply_text, res.error[:3500], reply_markup=speedtest_menu_keyboard())
 
-            db_insert_result(ts, lat, jit, down, up, loss, url); db_prune_keep_latest(5)
+                except Exception as exc:
 
-        except Exception:
+                    print(f"[WARN] Gagal mengirim hasil error speedtest: {exc}")
 
-            pass
+                op.status, op.note = "failed", res.error.splitlines()[0]
 
-        result_text = build_speedtest_result_text(ts, lat, jit, down, up, loss, url)
+                return
 
-        try:
+            try:
 
-            await telegram_call_with_retry(
+                db_insert_result(res.ts, res.latency, res.jitter, res.down, res.up, res.loss, res.url, **res.db_args()); db_prune_keep_latest(SPEEDTEST_HISTORY_KEEP)
 
-                query.message.reply_text,
+            except Exception as exc:
 
-                result_text,
+                print(f"[WARN] Gagal menyimpan hasil speedtest: {exc}")
 
-                parse_mode="Markdown",
+            result_text = build_speedtest_result_text(res.ts, res.latency, res.jitter, res.down, res.up, res.loss, res.url, res=res)
 
-                reply_markup=speedtest_menu_keyboard(),
+            try:
 
-            )
+                await telegram_call_with_retry(
 
-        except Exception as exc:
+                    query.message.reply_text,
+
+                    result_text,
+
+                    parse_mode="Markdown",
+
+                    reply_markup=speedtest_menu_keyboard(),
+
+                )
+
+            except Exception as exc:
+
+                print(f"[WARN] Gagal mengirim hasil speedtest: {exc}")
 
-            print(f"[WARN] Gagal mengirim hasil speedtest: {exc}")
+            return f"⬇️ {res.down:.2f} / ⬆️ {res.up:.2f} Mbps"
+
+        await op_start(query.message, ctx.application, "speedtest", "speedtest", "Speedtest", _speedtest_op)
 
         return
 
@@ -5430,9 +11660,12 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     if data == "NB_UP":
 
-        out = run_cmd("netbird up", timeout=90)
+        async def _nb_up_op(op: Operation):
+            _out, code = await stream_command(query.message, "netbird up", ["netbird", "up"], 90, cls="background")
+            if code != 0: op.status = "failed"
+            return f"exit {code}"
 
-        await query.message.reply_text(code_block(out), parse_mode=ParseMode.MARKDOWN_V2); return
+        await op_start(query.message, ctx.application, "netbird", "netbird up", "netbird up", _nb_up_op); return
 
     if data == "NB_DOWN":
 
@@ -5442,13 +11675,9 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     if data == "NB_STATUS":
 
-        out = run_cmd("netbird status", timeout=120)
+        state = await asyncio.get_running_loop().run_in_executor(None, NETBIRD.refresh)
 
-        settings_set("netbird_status", out)
-
-        settings_set("netbird_ts", str(int(time.time())))
-
-        for chunk in split_chunks(out):
+        for chunk in split_chunks(netbird_status_text(state)):
 
             await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
 
@@ -5462,6 +11691,26 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
         return
 
+    if data == "NB_PERF":
+        ctx.user_data["await_perf_target"] = True
+        await query.message.reply_text(
+            "Kirim IP NetBird peer + opsi, contoh:\n`100.92.1.7` atau `100.92.1.7 udp down -b 20`\n"
+            f"Peer harus menjalankan Perf Server (port {PERF_PORT}).", parse_mode="Markdown")
+        return
+    if data == "NB_WG":
+        await query.message.reply_text(code_block(WG_SAMPLER.report_text()), parse_mode=ParseMode.MARKDOWN_V2,
+                                       reply_markup=wg_keyboard()); return
+    if data == "NB_WG_WATCH":
+        ctx.user_data["await_wg_watch"] = True
+        await query.message.reply_text(
+            f"Peer dipantau saat ini: `{', '.join(wg_watch_list()) or '-'}`\n"
+            "Kirim nama/IP NetBird/pubkey peer site (pisah koma atau spasi), atau `-` untuk mengosongkan.\n"
+            f"Alert: tunnel idle > {WG_IDLE_MINUTES:g} menit atau jatuh ke relay.", parse_mode="Markdown")
+        return
+    if data == "NB_PERF_SERVER":
+        text = PERF_SERVER.stop() if PERF_SERVER.running else await perf_server_start()
+        await query.message.reply_text(text); return
+
     if data == "NB_DEREG":
 
         out = run_cmd("netbird deregister", timeout=90)
@@ -5496,7 +11745,7 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     if data == "NB_SETUP_RUN":
 
-        out = run_cmd(f"{SETUP_NB_SH} setup")
+        out = run_cmd(f"{SETUP_NB_SH} setup", cls="background")
 
         await query.message.reply_text(code_block(out), parse_mode=ParseMode.MARKDOWN_V2)
 
@@ -5523,46 +11772,43 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     # NETWORK TOOLS
     if data == "MENU_TOOLS_ROOT":
         await query.edit_message_text("🛠️ *Tools & Utilities*", parse_mode="Markdown", reply_markup=tools_menu_keyboard()); return
-    if data == "MENU_USB_WD":
-        if usb_watchdog_available():
-            await query.edit_message_text("🛡️ *USB Watchdog*", parse_mode="Markdown", reply_markup=usb_watchdog_menu_keyboard())
-        else:
-            await query.message.reply_text("❌ Script usb-watchdog-setup.sh tidak ditemukan. Jalankan update installer agar fitur tersedia.")
-        return
-    if data == "USBWD_STATUS":
-        out = run_usb_watchdog_cmd("status")
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
-        return
-    if data == "USBWD_SHOW":
-        out = run_usb_watchdog_cmd("show-config")
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
-        return
-    if data == "USBWD_LIST_IF":
-        out = run_usb_watchdog_cmd("list-if")
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+    if data == "JOBS":
+        with contextlib.suppress(Exception):
+            await query.edit_message_text(jobs_text(), reply_markup=jobs_keyboard())
         return
-    if data == "USBWD_START":
-        out = run_usb_watchdog_cmd("start-service")
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+    if data.startswith("JOB_CANCEL:"):
+        try:
+            op_id = int(data.split(":", 1)[1])
+        except ValueError:
+            return
+        await query.message.reply_text(op_cancel(op_id))
         return
-    if data == "USBWD_STOP":
-        out = run_usb_watchdog_cmd("stop-service")
-        for chunk in split_chunks(out):
-            await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+    if data == "MENU_USB_WD":
+        await query.edit_message_text("🛡️ *USB Watchdog*", parse_mode="Markdown", reply_markup=usb_watchdog_menu_keyboard())
         return
-    if data == "USBWD_RESTART":
-        out = run_usb_watchdog_cmd("restart-service")
+    if data in ("USBWD_STATUS", "USBWD_SHOW", "USBWD_LIST_IF", "USBWD_EVENTS", "USBWD_START", "USBWD_STOP",
+                "USBWD_RESTART", "USBWD_CHECK"):
+        if data == "USBWD_STATUS":
+            out = USB_WATCHDOG.status_text()
+        elif data == "USBWD_SHOW":
+            out = usb_watchdog_load_config().text()
+        elif data == "USBWD_LIST_IF":
+            out = usb_watchdog_interfaces_text()
+        elif data == "USBWD_EVENTS":
+            out = USB_WATCHDOG.events_text()
+        elif data == "USBWD_START":
+            out = USB_WATCHDOG.start(ctx.bot)
+        elif data == "USBWD_STOP":
+            out = USB_WATCHDOG.stop()
+        elif data == "USBWD_RESTART":
+            out = await USB_WATCHDOG.restart(ctx.bot)
+        else:
+            ok, detail = await USB_WATCHDOG.check()
+            out = f"{'✅ OK' if ok else '❌ GAGAL'}: {detail}\n\n" + USB_WATCHDOG.status_text()
         for chunk in split_chunks(out):
             await query.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
         return
     if data == "USBWD_SETUP":
-        if not usb_watchdog_available():
-            await query.message.reply_text("❌ Script usb-watchdog-setup.sh tidak ditemukan. Update installer terlebih dahulu.")
-            return
         ctx.user_data["await_usbwd_config"] = True
         prompt = (
             "Kirim konfigurasi USB Watchdog dengan format:\n"
@@ -5574,27 +11820,57 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text(prompt, parse_mode="Markdown")
         return
     if data == "MENU_NETTOOLS":
-        await query.edit_message_text("🧪 *Network Tools*\nGunakan tombol di bawah atau perintah /ping <host> dan /trace <host>.",
+        await query.edit_message_text("🧪 *Network Tools*\nGunakan tombol di bawah atau perintah /ping <host>, /trace <host>, /mtr <host>, /dnsbench dan /perf <ip\_peer>.",
                                       parse_mode="Markdown", reply_markup=nettools_menu()); return
-    if data.startswith("NT_PING:"):
-
-        host = data.split(":", 1)[1]
-
-        out = run_cmd(f"ping -c 5 -W 2 {shlex.quote(host)}", timeout=20)
-
-        await query.message.reply_text(code_block(out), parse_mode=ParseMode.MARKDOWN_V2); return
-
-    if data.startswith("NT_TR:"):
-
-        host = data.split(":", 1)[1]
-
-        if not which("traceroute"):
-
-            await query.message.reply_text("Traceroute tidak tersedia. Install: opkg install traceroute"); return
+    if data == "PROBE_REPORT":
+        await query.message.reply_text(code_block(LATENCY_PROBER.report_text()), parse_mode=ParseMode.MARKDOWN_V2,
+                                       reply_markup=latency_keyboard())
+        return
+    if data == "PROBE_TOGGLE":
+        out = LATENCY_PROBER.stop() if LATENCY_PROBER.running else LATENCY_PROBER.start(ctx.bot)
+        await query.message.reply_text(out, reply_markup=latency_keyboard()); return
+    if data == "PROBE_TARGETS":
+        ctx.user_data["await_probe_targets"] = True
+        await query.message.reply_text(
+            f"Target saat ini: `{' '.join(LATENCY_PROBER.targets) or '-'}`\n"
+            "Kirim daftar target dipisah spasi/koma. `host` = ICMP, `host:port` = TCP connect.\n"
+            "Contoh: `1.1.1.1 8.8.8.8 google.com:443`", parse_mode="Markdown")
+        return
+    if data == "HTTPC_REPORT":
+        await query.message.reply_text(code_block(HTTP_CHECKER.report_text()), parse_mode=ParseMode.MARKDOWN_V2,
+                                       reply_markup=httpcheck_keyboard())
+        return
+    if data == "HTTPC_RUN":
+        if not HTTP_CHECKER.targets:
+            await query.message.reply_text("Belum ada URL. Tekan 🎯 Ubah URL.", reply_markup=httpcheck_keyboard()); return
+        HTTP_CHECKER.bot = ctx.bot
+        await HTTP_CHECKER.run_once()
+        await query.message.reply_text(code_block(HTTP_CHECKER.report_text()), parse_mode=ParseMode.MARKDOWN_V2,
+                                       reply_markup=httpcheck_keyboard())
+        return
+    if data == "HTTPC_TOGGLE":
+        out = HTTP_CHECKER.stop() if HTTP_CHECKER.running else HTTP_CHECKER.start(ctx.bot)
+        await query.message.reply_text(out, reply_markup=httpcheck_keyboard()); return
+    if data == "HTTPC_TARGETS":
+        ctx.user_data["await_httpcheck_targets"] = True
+        current = "\n".join(t.spec for t in HTTP_CHECKER.targets.values()) or "-"
+        await query.message.reply_text(
+            f"URL saat ini:\n```\n{current}\n```\n"
+            "Kirim satu URL per baris, opsi: `slo=<ms>` `expect=200,3xx` `insecure` (tanpa verifikasi TLS).\n"
+            "Contoh: `https://example.com/health slo=800`", parse_mode="Markdown")
+        return
+    if data == "DNS_BENCH":
+        await op_start(query.message, ctx.application, "nettools", "dnsbench", "DNS benchmark",
+                       lambda op: dns_bench_stream(query.message))
+        return
+    if data == "DNS_CACHE":
+        text = dnsmasq_stats_text(await dnsmasq_cache_stats())
+        await query.message.reply_text(code_block(text), parse_mode=ParseMode.MARKDOWN_V2); return
+    if data.startswith(("NT_PING:", "NT_TR:", "NT_MTR:")):
 
-        out = run_cmd(f"traceroute -m 15 {shlex.quote(host)}", timeout=40)
+        tool, host = data.split(":", 1)
 
-        await query.message.reply_text(code_block(out), parse_mode=ParseMode.MARKDOWN_V2); return
+        await nettools_start(query.message, ctx.application, {"NT_PING": "ping", "NT_TR": "trace", "NT_MTR": "mtr"}[tool], host); return
 
 
 
@@ -5604,6 +11880,22 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
         await query.edit_message_text("🧪 *Diagnostics*\nPilih aksi:", parse_mode="Markdown", reply_markup=diag_menu()); return
 
+    if data == "DIAG_UBUS":
+        kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Refresh", callback_data="DIAG_UBUS"),
+                                    InlineKeyboardButton("🔙 Diagnostics", callback_data="MENU_DIAG")]])
+        with contextlib.suppress(Exception):
+            await query.edit_message_text(code_block(ubus_events_text()[-3800:]), parse_mode=ParseMode.MARKDOWN_V2, reply_markup=kb)
+        return
+
+    if data in ("DIAG_CAPS", "DIAG_CAPS_RESCAN"):
+        if data == "DIAG_CAPS_RESCAN":
+            await asyncio.get_running_loop().run_in_executor(None, caps_rescan)
+        kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Rescan", callback_data="DIAG_CAPS_RESCAN"),
+                                    InlineKeyboardButton("🔙 Diagnostics", callback_data="MENU_DIAG")]])
+        with contextlib.suppress(Exception):
+            await query.edit_message_text(code_block(CAPS.summary_text()), parse_mode=ParseMode.MARKDOWN_V2, reply_markup=kb)
+        return
+
     if data == "DIAG_TOP":
         cpu = run_cmd("ps -eo pid,comm,%cpu,%mem --sort=-%cpu | head -n 6")
         mem = run_cmd("ps -eo pid,comm,%mem,%cpu --sort=-%mem | head -n 6")
@@ -5758,27 +12050,51 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     if data == "BK_DO":
 
-        waiting = await query.message.reply_text("⏳ Membuat backup…")
+        async def _backup_op(op: Operation):
 
-        path, log = create_full_backup()
+            waiting = await query.message.reply_text(f"⏳ Membuat backup… (job #{op.id})", reply_markup=op_cancel_keyboard(op))
 
-        try:
+            fut = asyncio.get_running_loop().run_in_executor(None, call_in_class, "heavy", create_full_backup)
 
-            await query.message.reply_document(open(path, "rb"), filename=os.path.basename(path),
+            try:
 
-                                               caption=f"✅ Backup selesai.\n{log}")
+                path, log = await asyncio.shield(fut)
 
-        except Exception as e:
+            except asyncio.CancelledError:
 
-            await query.message.reply_text(f"❌ Gagal kirim file: {e}")
+                # thread tar tidak bisa dihentikan; hapus arsipnya begitu selesai
 
-        finally:
+                fut.add_done_callback(_discard_backup_result)
 
-            try: os.remove(path)
+                with contextlib.suppress(Exception):
 
-            except: pass
+                    await waiting.edit_text(f"🛑 Backup dibatalkan (job #{op.id}).")
 
-        await waiting.delete()
+                raise
+
+            try:
+
+                await query.message.reply_document(open(path, "rb"), filename=os.path.basename(path),
+
+                                                   caption=f"✅ Backup selesai.\n{log}")
+
+            except Exception as e:
+
+                await query.message.reply_text(f"❌ Gagal kirim file: {e}")
+
+            finally:
+
+                try: os.remove(path)
+
+                except: pass
+
+            with contextlib.suppress(Exception):
+
+                await waiting.delete()
+
+            return os.path.basename(path)
+
+        await op_start(query.message, ctx.application, "backup", "backup", "Backup", _backup_op)
 
         return
 
@@ -5808,14 +12124,24 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
             return
 
-        final_log = await restore_with_progress(ctx, query.message, rp)
-
-        await query.message.reply_text(code_block(final_log or "(no log)"), parse_mode=ParseMode.MARKDOWN_V2)
-
         ctx.user_data["restore_path"] = None
 
         ctx.user_data["await_restore"] = False
 
+        async def _restore_op(op: Operation):
+
+            final_log = await restore_with_progress(ctx, query.message, rp)
+
+            await query.message.reply_text(code_block(final_log or "(no log)"), parse_mode=ParseMode.MARKDOWN_V2)
+
+            if (final_log or "").startswith("[ERR]"): op.status = "failed"
+
+            return os.path.basename(rp)
+
+        if not await op_start(query.message, ctx.application, "backup", f"restore {rp}", "Restore", _restore_op, cancellable=False):
+
+            ctx.user_data["restore_path"] = rp
+
         return
 
 
@@ -5848,6 +12174,8 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         txt = ("🖥️ *CLI Mode*\n"
                "Kirim perintah shell di chat ini, dan hasilnya akan dibalas.\n"
                "• Ketik `exit` atau tekan *Keluar CLI* untuk menonaktifkan.\n"
+               "• Shell persisten: `cd`/variabel bertahan antar perintah.\n"
+               f"• Sesi ditutup otomatis setelah idle {CLI_IDLE_TIMEOUT // 60} menit.\n"
                "• Perintah dijalankan sebagai user bot (OpenWrt).")
         await query.edit_message_text(txt, parse_mode="Markdown", reply_markup=cli_menu_keyboard(active))
         return
@@ -5858,10 +12186,16 @@ async def on_callback(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return
     if data == "CLI_EXIT":
         CLI_SESSIONS[update.effective_chat.id] = False
+        await cli_shell_close(update.effective_chat.id)
         await query.edit_message_text("❌ CLI nonaktif.", reply_markup=cli_menu_keyboard(False))
         return
+    if data == "CLI_RESET":
+        await cli_shell_close(update.effective_chat.id)
+        await query.edit_message_text("♻️ Shell di-reset. Perintah berikutnya memakai sesi baru.",
+                                      reply_markup=cli_menu_keyboard(CLI_SESSIONS.get(update.effective_chat.id, False)))
+        return
     if data == "CLI_HISTORY":
-        hist = CLI_HISTORY.get(update.effective_chat.id, [])
+        hist = list(CLI_HISTORY.get(update.effective_chat.id, ()))
         if not hist:
             await query.message.reply_text("(history kosong)")
         else:
@@ -5898,19 +12232,24 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
         await update.message.reply_text(f"▶️ Menjalankan:\n`{cmd}`", parse_mode="Markdown")
 
-        out = run_cmd(cmd, timeout=120)
+        async def _nb_setup_op(op: Operation):
 
-        try:
+            _out, code = await stream_command(update.message, "netbird up --setup-key", ["netbird", "up", "--setup-key", key], 120,
+                                              cls="background")
 
-            netbird_status_update(force=True, timeout=90)
+            try:
 
-        except Exception:
+                await asyncio.get_running_loop().run_in_executor(None, NETBIRD.refresh)
 
-            pass
+            except Exception:
 
-        for chunk in split_chunks(out):
+                pass
 
-            await update.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+            if code != 0: op.status = "failed"
+
+            return f"exit {code}"
+
+        await op_start(update.message, ctx.application, "netbird", f"netbird setup {key}", "netbird setup", _nb_setup_op)
 
         return
 
@@ -6020,15 +12359,34 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         ctx.user_data["power_action"] = None
         return
 
+    if ctx.user_data.get("await_android_rotate_sched"):
+        ctx.user_data["await_android_rotate_sched"] = False
+        serial = ctx.user_data.pop("android_rotate_serial", None)
+        value = parse_float_from_text(text)
+        if not serial or value is None or value < 0:
+            await update.message.reply_text("❌ Nilai interval tidak valid.")
+            return
+        minutes = int(value)
+        if 0 < minutes < 5:
+            await update.message.reply_text("❌ Interval minimal 5 menit.")
+            return
+        android_rotate_schedule_apply(ctx.job_queue, serial, minutes)
+        if minutes:
+            note = "" if ctx.job_queue else " (JobQueue tidak tersedia, jadwal aktif setelah restart dengan job-queue)"
+            await update.message.reply_text(f"✅ Rotasi IP {serial} dijadwalkan setiap {minutes} menit.{note}")
+        else:
+            await update.message.reply_text(f"✅ Jadwal rotasi IP {serial} dinonaktifkan.")
+        return
+
     if ctx.user_data.get("await_opkg_action"):
         action = ctx.user_data.get("opkg_action")
         ctx.user_data["await_opkg_action"] = False
-        if action == "install":
-            out = opkg_install(text)
-        elif action == "remove":
-            out = opkg_remove(text)
-        elif action == "search":
-            out = opkg_search(text)
+        if action in ("install", "remove"):
+            ctx.user_data["opkg_action"] = None
+            await opkg_package_start(update.message, ctx.application, action, text)
+            return
+        if action == "search":
+            out = await asyncio.get_running_loop().run_in_executor(None, opkg_search, text)
         else:
             out = "[ERR] Aksi opkg tidak dikenal."
         ctx.user_data["opkg_action"] = None
@@ -6038,12 +12396,16 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     if ctx.user_data.get("await_wifi_config"):
         ctx.user_data["await_wifi_config"] = False
-        if text.strip().lower() == "apply":
-            out = run_wifi_reload()
+        if text.strip().lower() != "apply":
+            await stage_uci_text(update.message, chat_id, text)
+            return
+        if chat_id in UCI_STAGES:
+            out, services = await asyncio.get_running_loop().run_in_executor(None, uci_stage_commit, chat_id)
         else:
-            out = apply_shell_commands(text)
-        for chunk in split_chunks(out):
-            await update.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+            out, services = "Tidak ada perubahan di stage.", ["wifi"]
+        schedule_reload(ctx.bot, services, chat_id)
+        if services: out += f"\n🔄 Reload {', '.join(services)} dalam {RELOAD_DEBOUNCE:g}s."
+        await update.message.reply_text(code_block(out), parse_mode=ParseMode.MARKDOWN_V2)
         return
 
     if ctx.user_data.get("await_file_browse"):
@@ -6119,24 +12481,62 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             return
 
     if ctx.user_data.get("await_firewall_action"):
-        action = ctx.user_data.get("firewall_action")
         ctx.user_data["await_firewall_action"] = False
-        out = apply_shell_commands(text)
-        for chunk in split_chunks(out):
-            await update.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
-        if action in {"add", "delete"} and not out.startswith("[ERR]"):
-            await update.message.reply_text(code_block(run_cmd("uci commit firewall")), parse_mode=ParseMode.MARKDOWN_V2)
         ctx.user_data["firewall_action"] = None
+        await stage_uci_text(update.message, chat_id, text)
+        return
+
+    if ctx.user_data.get("await_probe_targets"):
+        ctx.user_data["await_probe_targets"] = False
+        if not probe_parse_targets(text):
+            await update.message.reply_text("❌ Tidak ada target valid."); return
+        targets = LATENCY_PROBER.set_targets(text)
+        await update.message.reply_text(f"✅ Target latency monitor: {', '.join(targets)}", reply_markup=latency_keyboard())
+        return
+
+    if ctx.user_data.get("await_speedtest_sched"):
+        ctx.user_data["await_speedtest_sched"] = False
+        try:
+            hours, budget, min_down = (float(x) for x in text.replace(",", ".").split())
+        except ValueError:
+            await update.message.reply_text("❌ Format: <interval_jam> <budget_MB> <ambang_Mbps>, contoh: 6 5000 0"); return
+        if hours < 0.5 or budget <= 0 or min_down < 0:
+            await update.message.reply_text("❌ Interval minimal 0.5 jam, budget > 0, ambang ≥ 0."); return
+        settings_set("speedtest_sched", json.dumps({"hours": hours, "budget_mb": budget, "min_down": min_down}))
+        await update.message.reply_text(code_block(speedtest_sched_status_text()), parse_mode=ParseMode.MARKDOWN_V2,
+                                        reply_markup=speedtest_sched_keyboard())
+        return
+
+    if ctx.user_data.get("await_wg_watch"):
+        ctx.user_data["await_wg_watch"] = False
+        watch = [] if text.strip() == "-" else [w for w in re.split(r"[\s,]+", text) if w]
+        settings_set("wg_watch", ",".join(watch))
+        await update.message.reply_text(f"✅ Peer dipantau: {', '.join(watch) or '-'}", reply_markup=wg_keyboard())
+        return
+
+    if ctx.user_data.get("await_perf_target"):
+        ctx.user_data["await_perf_target"] = False
+        await perf_start(update.message, ctx.application, text.split())
+        return
+
+    if ctx.user_data.get("await_httpcheck_targets"):
+        ctx.user_data["await_httpcheck_targets"] = False
+        if not httpcheck_parse_targets(text):
+            await update.message.reply_text("❌ Tidak ada URL http(s) valid."); return
+        specs = HTTP_CHECKER.set_targets(text)
+        await update.message.reply_text("✅ URL HTTP checker:\n" + "\n".join(specs), reply_markup=httpcheck_keyboard())
+        return
+
+    if ctx.user_data.get("await_uci_filter"):
+        ctx.user_data["await_uci_filter"] = False
+        view = ctx.user_data.pop("uci_filter_view", None) or "fw"
+        await reply_uci_view(update.message, view, text.strip())
         return
 
     if ctx.user_data.get("await_portfwd_action"):
         ctx.user_data["await_portfwd_action"] = False
-        out = apply_shell_commands(text)
-        for chunk in split_chunks(out):
-            await update.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
         ctx.user_data["portfwd_action"] = None
-        if not out.startswith("[ERR]"):
-            await update.message.reply_text(code_block(run_cmd("uci commit firewall")), parse_mode=ParseMode.MARKDOWN_V2)
+        await stage_uci_text(update.message, chat_id, text)
         return
 
     if ctx.user_data.get("await_process_action"):
@@ -6170,10 +12570,6 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             ctx.user_data["await_usbwd_config"] = False
             await update.message.reply_text("❌ Konfigurasi USB Watchdog dibatalkan.")
             return
-        if not usb_watchdog_available():
-            ctx.user_data["await_usbwd_config"] = False
-            await update.message.reply_text("❌ Script usb-watchdog-setup.sh tidak ditemukan. Update installer terlebih dahulu.")
-            return
         ok, msg, params = parse_usb_watchdog_input(text)
         if not ok:
             await update.message.reply_text(msg)
@@ -6182,7 +12578,7 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         result = usb_watchdog_configure(params)
         for chunk in split_chunks(result):
             await update.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
-        status = run_usb_watchdog_cmd("status")
+        status = USB_WATCHDOG.status_text() if USB_WATCHDOG.running else "ℹ️ Watchdog belum berjalan, tekan ▶️ Start."
         for chunk in split_chunks(status):
             await update.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
         return
@@ -6199,19 +12595,17 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return
     if text.lower() in ("exit","quit","keluar"):
         CLI_SESSIONS[chat_id] = False
+        await cli_shell_close(chat_id)
         await update.message.reply_text("❌ CLI nonaktif.", reply_markup=cli_menu_keyboard(False))
         return
-    hist = CLI_HISTORY[chat_id]
-    hist.append(text)
-    if len(hist) > 50:
-        del hist[0]
-    await update.message.reply_text(f"▶️ Menjalankan:\n`{text}`", parse_mode="Markdown")
-    out = run_shell(text, timeout=CMD_TIMEOUT)
-    if not out: out = "(no output)"
-
-    for chunk in split_chunks(out):
-
-        await update.message.reply_text(code_block(chunk), parse_mode=ParseMode.MARKDOWN_V2)
+    cli_history_add(chat_id, text)
+    shell = cli_shell_get(chat_id)
+    live = LiveOutput(update.message, f"$ {text}")
+    await live.start()
+    out, code = await shell.run(text, timeout=CMD_TIMEOUT, on_output=live.feed)
+    # output final memakai hasil run() (sudah berisi catatan potong/timeout) + exit code & cwd
+    live.parts, live.truncated = [cli_result_text(out, code, shell.cwd)], False
+    await live.finish(ok=(code == 0), note=f"[exit {code}]" if code is not None else "")
 
 
 
@@ -6219,12 +12613,6 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
 async def job_daily_report(ctx: ContextTypes.DEFAULT_TYPE):
 
-    try: netbird_status_update(force=True, timeout=90)
-
-    except Exception: pass
-
-
-
     iface = CURRENT_IFACE
 
     overview = build_overview_text(iface)
@@ -6295,6 +12683,10 @@ async def job_cpu_watch(ctx: ContextTypes.DEFAULT_TYPE):
 
     state = "HIGH" if ratio >= CPU_LOAD_THRESH else "OK"
 
+    if state == "HIGH" and exec_heavy_recent():
+
+        return  # load dari job heavy (speedtest/opkg/tar) milik bot sendiri, bukan alarm
+
     if state != last:
 
         alert_set(key, state)
@@ -6407,6 +12799,64 @@ async def job_temp_watch(ctx: ContextTypes.DEFAULT_TYPE):
 
 
 
+async def job_android_telemetry(ctx: ContextTypes.DEFAULT_TYPE):
+    if not android_adb_available():
+        return
+    loop = asyncio.get_running_loop()
+    devices = await loop.run_in_executor(None, android_list_devices)
+    serials = [dev.serial for dev in devices if dev.status == "device"]
+    if not serials:
+        return
+    samples = await asyncio.gather(*(android_telemetry_sample(s) for s in serials), return_exceptions=True)
+    points = [p for batch in samples if isinstance(batch, list) for p in batch]
+    try:
+        metrics_add(points)
+    except Exception as exc:
+        print(f"[WARN] Gagal menyimpan telemetri Android: {exc}")
+        return
+    for serial in serials:
+        with contextlib.suppress(Exception):
+            await android_telemetry_alerts(ctx, serial)
+
+
+
+async def job_metrics_flush(ctx: ContextTypes.DEFAULT_TYPE):
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, metrics_flush)
+    except Exception as exc:
+        print(f"[WARN] Gagal menulis metrics: {exc}")
+
+
+
+async def job_metrics_prune(ctx: ContextTypes.DEFAULT_TYPE):
+    # tabel metrics diisi banyak job (prober, checker, NetBird, wg, ...) → pangkas terpisah dari telemetri Android
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, metrics_prune)
+    except Exception as exc:
+        print(f"[WARN] Gagal memangkas metrics: {exc}")
+
+
+
+async def job_android_rotate(ctx: ContextTypes.DEFAULT_TYPE):
+    serial = (ctx.job.data or {}).get("serial") if ctx.job else None
+    if not serial or not android_adb_available():
+        return
+    lock = ANDROID_ROTATE_LOCKS.get(serial)
+    if lock is not None and lock.locked():
+        return
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, android_device_ready, serial):
+        return
+    rot = await android_rotate_ip(serial)
+    try:
+        await ctx.bot.send_message(chat_id=REPORT_CHAT_ID, text=f"⏰ Rotasi terjadwal\n{android_rotation_text(rot)}")
+    except Exception:
+        pass
+
+
+
 # ------------------ ERROR HANDLER -----------------
 
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -6455,6 +12905,8 @@ def build_application():
 
     app = ApplicationBuilder().token(BOT_TOKEN).build()
 
+    caps_rescan()
+
 
 
     # Handlers
@@ -6467,6 +12919,22 @@ def build_application():
 
     app.add_handler(CommandHandler("trace", trace_cmd))
 
+    app.add_handler(CommandHandler("mtr", mtr_cmd))
+
+    app.add_handler(CommandHandler("jobs", jobs_cmd))
+
+    app.add_handler(CommandHandler("latency", latency_cmd))
+
+    app.add_handler(CommandHandler("httpcheck", httpcheck_cmd))
+
+    app.add_handler(CommandHandler("dnsbench", dnsbench_cmd))
+
+    app.add_handler(CommandHandler("perf", perf_cmd))
+
+    app.add_handler(CommandHandler("bufferbloat", bufferbloat_cmd))
+
+    app.add_handler(CommandHandler("wg", wg_cmd))
+
     # command manual lama (/setquota, /settemp) sengaja dimatikan karena sudah ada tombol
 
     app.add_handler(CallbackQueryHandler(on_callback))
@@ -6505,6 +12973,27 @@ def build_application():
 
         jq.run_repeating(job_temp_watch,   interval=180,  first=40,  name="temp_watch")     # 3 menit
 
+        jq.run_repeating(job_android_telemetry, interval=ANDROID_TELEMETRY_INTERVAL, first=45, name="android_telemetry")
+        jq.run_repeating(job_metrics_flush, interval=METRICS_FLUSH_INTERVAL, first=METRICS_FLUSH_INTERVAL,
+                         name="metrics_flush")
+        jq.run_repeating(job_metrics_prune, interval=3600, first=300, name="metrics_prune")      # 1 jam
+        jq.run_repeating(job_cli_reaper, interval=60, first=60, name="cli_reaper")
+        jq.run_repeating(job_speedtest_sched, interval=600, first=120, name="speedtest_sched")
+        jq.run_repeating(job_dnsmasq_stats, interval=DNS_STATS_INTERVAL, first=90, name="dnsmasq_stats")
+        jq.run_repeating(job_netbird_status, interval=NETBIRD_SAMPLE_INTERVAL, first=50, name="netbird_status")
+        jq.run_repeating(job_wg_sampler, interval=WG_SAMPLE_INTERVAL, first=70, name="wg_sampler")
+        jq.run_once(job_ubus_listener, when=5, name="ubus_listener")
+        jq.run_once(job_netlink_listener, when=3, name="netlink_listener")
+        jq.run_once(job_usb_watchdog, when=10, name="usb_watchdog")
+        jq.run_once(job_latency_prober, when=15, name="latency_prober")
+        jq.run_once(job_http_checker, when=25, name="http_checker")
+
+        for serial, minutes in android_rotate_schedule_load().items():
+
+            jq.run_repeating(job_android_rotate, interval=minutes * 60, first=minutes * 60,
+
+                             name=f"android_rotate:{serial}", data={"serial": serial})
+
 
 
     return app
@@ -6556,6 +13045,8 @@ async def run_bot_forever():
             if initialized:
                 with contextlib.suppress(Exception):
                     await app.shutdown()
+            with contextlib.suppress(Exception):
+                metrics_flush()       # buffer metrics jangan hilang saat bot berhenti
 
 
 
@@ -6569,6 +13060,9 @@ def main():
 
 if __name__ == "__main__":
 
+    if sys.argv[1:] == ["--selftest-ubus"]:
+        sys.exit(ubus_selftest())
+
     # DB init harus sebelum akses settings/init iface
 
     db_init_once()